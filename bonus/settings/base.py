@@ -189,4 +189,94 @@ ABRA_DOCQUEUE_ID = os.environ.get('ABRA_DOCQUEUE_ID', 'RO00000101')
 ABRA_PERIOD_ID   = os.environ.get('ABRA_PERIOD_ID', '4FI0000101')
 ABRA_STORE_ID    = os.environ.get('ABRA_STORE_ID', 'C000000101')
 ABRA_DIVISION_ID = os.environ.get('ABRA_DIVISION_ID', '6000000101')
-ABRA_VATRATE_ID  = os.environ.get('ABRA_VATRATE_ID', '02100X0000')
\ No newline at end of file
+ABRA_VATRATE_ID  = os.environ.get('ABRA_VATRATE_ID', '02100X0000')
+# =============================================================================
+# Batch mailer (pa_bonus.services.mailer)
+# =============================================================================
+# Notifications are sent in batches over one SMTP connection each. Lower
+# EMAIL_RATE_LIMIT (emails per second, 0 = no limit) if the mail provider
+# throttles; transient SMTP errors are retried EMAIL_MAX_RETRIES times, waiting
+# EMAIL_RETRY_BACKOFF seconds before the first retry and doubling it after.
+# A batch left SENDING by a worker that died is sent again after
+# EMAIL_CLAIM_TIMEOUT seconds.
+# =============================================================================
+
+EMAIL_BATCH_SIZE    = int(os.environ.get('EMAIL_BATCH_SIZE', '100'))
+EMAIL_RATE_LIMIT    = float(os.environ.get('EMAIL_RATE_LIMIT', '0'))
+EMAIL_MAX_RETRIES   = int(os.environ.get('EMAIL_MAX_RETRIES', '3'))
+EMAIL_RETRY_BACKOFF = float(os.environ.get('EMAIL_RETRY_BACKOFF', '2'))
+EMAIL_CLAIM_TIMEOUT = int(os.environ.get('EMAIL_CLAIM_TIMEOUT', '3600'))
+
+# =============================================================================
+# User activity tracking (pa_bonus.services.activity)
+# =============================================================================
+# Visits are buffered per process and written to UserActivity in bulk every
+# USER_ACTIVITY_FLUSH_SECONDS, or sooner once USER_ACTIVITY_MAX_PENDING
+# user-days are buffered. Requests under USER_ACTIVITY_SKIP_PREFIXES (static
+# files and the endpoints polled by JavaScript) are not counted.
+# =============================================================================
+
+USER_ACTIVITY_FLUSH_SECONDS = int(os.environ.get('USER_ACTIVITY_FLUSH_SECONDS', '60'))
+USER_ACTIVITY_MAX_PENDING   = int(os.environ.get('USER_ACTIVITY_MAX_PENDING', '500'))
+USER_ACTIVITY_SKIP_PREFIXES = (
+    STATIC_URL,
+    MEDIA_URL,
+    '/manager/check-invoices/',
+    '/manager/upload_history/progress/',
+    '/manager/reports/jobs/',
+    '/manager/transactions/approve/jobs/',
+)
+
+# =============================================================================
+# Cache (pa_bonus.services.cache)
+# =============================================================================
+# Balances, expiring totals, the reward catalogue and the dashboard aggregates
+# are cached. The web and qcluster processes must share the cache, since a
+# write in one has to invalidate the figures cached by the other, so it is
+# Redis (REDIS_URL, e.g. redis://localhost:6379/1) or nothing: without
+# REDIS_URL the dummy backend is used and every figure is recomputed.
+# production.py always uses Redis. Entries live at most PA_BONUS_CACHE_TIMEOUT
+# seconds.
+# =============================================================================
+
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'bonus',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+    }
+
+PA_BONUS_CACHE_TIMEOUT = int(os.environ.get('PA_BONUS_CACHE_TIMEOUT', '300'))
+
+# =============================================================================
+# Background jobs (django-q)
+# =============================================================================
+# The cluster-wide Q_CLUSTER timeout is sized for short tasks; the long jobs
+# are queued with their own timeout instead. The broker re-delivers a task not
+# acknowledged within Q_CLUSTER['retry'] seconds, so that has to exceed the
+# longest of these (see LONGEST_TASK_TIMEOUT).
+#
+# An upload commits its work in chunks; one still PROCESSING whose checkpoint
+# has not moved for UPLOAD_STALL_MINUTES lost its worker and can be resumed.
+# A report or approval job still pending or running after its timeout is
+# marked failed and never reused. Finished report jobs are deleted with their
+# files REPORT_JOB_RETENTION_SECONDS after they stop being reused.
+# =============================================================================
+
+UPLOAD_TASK_TIMEOUT  = int(os.environ.get('UPLOAD_TASK_TIMEOUT', '3600'))
+UPLOAD_STALL_MINUTES = int(os.environ.get('UPLOAD_STALL_MINUTES', '15'))
+REPORT_TASK_TIMEOUT  = int(os.environ.get('REPORT_TASK_TIMEOUT', '1800'))
+APPROVAL_TASK_TIMEOUT = int(os.environ.get('APPROVAL_TASK_TIMEOUT', '1800'))
+REPORT_JOB_RETENTION_SECONDS = int(os.environ.get('REPORT_JOB_RETENTION_SECONDS', '86400'))
+
+LONGEST_TASK_TIMEOUT = max(UPLOAD_TASK_TIMEOUT, REPORT_TASK_TIMEOUT, APPROVAL_TASK_TIMEOUT)
@@ -48,6 +48,7 @@ Q_CLUSTER = {
     'workers': 4,
     'recycle': 500,
     'timeout': 60,
+    'retry': LONGEST_TASK_TIMEOUT + 60,  # long jobs pass their own timeout, see base.py
     'compress': True,
     'save_limit': 250,
     'queue_limit': 500,
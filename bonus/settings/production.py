@@ -44,12 +44,24 @@ SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
 X_FRAME_OPTIONS = 'DENY'
 
+# Cache shared by the web and qcluster processes, on the broker's Redis server
+# unless REDIS_URL points elsewhere; see the cache section of base.py
+REDIS_URL = os.environ.get('REDIS_URL', f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:6379/1")
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'bonus',
+    }
+}
+
 # Django Q settings - adjust workers based on server capacity
 Q_CLUSTER = {
     'name': 'bonus',
     'workers': 2,
     'recycle': 500,
     'timeout': 60,
+    'retry': LONGEST_TASK_TIMEOUT + 60,  # long jobs pass their own timeout, see base.py
     'compress': True,
     'save_limit': 250,
     'queue_limit': 500,
@@ -63,6 +63,8 @@ urlpatterns.extend([
     path('manager/', vm.ManagerDashboardView.as_view(), name='manager_dashboard'),
     path('manager/upload/', vm.upload_file, name='upload_file'),
     path('manager/upload_history/', vm.UploadHistoryView.as_view(), name='upload_history'),
+    path('manager/upload_history/progress/<int:upload_id>/', vm.UploadProgressView.as_view(), name='upload_progress'),
+    path('manager/upload_history/<int:upload_id>/resume/', vm.UploadResumeView.as_view(), name='upload_resume'),
     path('manager/reward-requests/', vm.ManagerRewardRequestListView.as_view(), name="manager_reward_requests"),
     path('manager/reward-requests/<int:pk>/', vm.ManagerRewardRequestDetailView.as_view(), name='manager_reward_request_detail'),
     path('manager/reward-requests/<int:pk>/export/', vm.ExportTelemarketingFileView.as_view(), name='export_telemarketing_file'),
@@ -72,6 +74,8 @@ urlpatterns.extend([
         name='submit_reward_request_to_abra',
     ),
     path('manager/transactions/approve/', vm.TransactionApprovalView.as_view(), name='transaction_approval'),
+    path('manager/transactions/approve/jobs/<int:job_id>/status/', vm.TransactionApprovalJobStatusView.as_view(),
+         name='transaction_approval_job_status'),
     path('manager/sms-export/', vm.SMSExportView.as_view(), name='sms_export'),
     path('manager/clients/create/', vm.ClientCreateView.as_view(), name='manager_client_create'),
     path('manager/clients/', vm.ClientListView.as_view(), name='manager_clients'),
@@ -92,6 +96,8 @@ urlpatterns.extend([
          name='reward_request_batch_save'),
     path('manager/reports/', vr.ReportsHubView.as_view(), name='reports_hub'),
     path('manager/reports/download/', vr.ReportDownloadView.as_view(), name='report_download'),
+    path('manager/reports/jobs/<int:job_id>/status/', vr.ReportJobStatusView.as_view(), name='report_job_status'),
+    path('manager/reports/jobs/<int:job_id>/download/', vr.ReportJobFileView.as_view(), name='report_job_file'),
     path('manager/check-invoices/', vm.UnpaidInvoicesCheckView.as_view(), name='check_invoices'),
 ])
 
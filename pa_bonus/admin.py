@@ -7,12 +7,17 @@ from import_export import resources, fields, widgets
 from import_export.widgets import DateWidget
 from import_export.admin import ExportMixin, ImportExportMixin
 from django.forms.models import BaseInlineFormSet
+from django.db import transaction
 from pa_bonus.models import (
     User, Brand, UserContract, UserContractGoal, PointsTransaction, PointAllocation, BrandBonus,
-    FileUpload, Reward, RewardRequest, RewardRequestItem, EmailNotification, Invoice, InvoiceBrandTurnover,
+    FileUpload, Reward, RewardRequest, RewardRequestItem, EmailNotification, EmailBatch, Invoice, InvoiceBrandTurnover,
     Region, RegionRep, UserActivity, GoalEvaluation,
 )
 from .resources import UserResource, UserContractResource, UserContractGoalResource, RewardResource, OptimizedUserResource
+from .services.balances import refresh_balances
+from .services.cache import invalidate_catalogue, invalidate_users
+from .services.goals import rebuild_goal_candidates
+from .services.turnover import brand_turnover_matrix, refresh_turnover_rollup
 
 
 logger = logging.getLogger(__name__)
@@ -56,36 +61,101 @@ class InvoiceBrandTurnoverInline(admin.TabularInline):
     extra = 0
     
 
+class TurnoverRollupAdminMixin:
+    """
+    Keeps MonthlyBrandTurnover and the goal candidates in step with invoices
+    changed through the admin. The upload pipeline maintains them itself; here
+    the (client, month) cells of the affected invoices, as they were before and
+    after the change, are recomputed once the object and its inlines are saved,
+    or after the delete.
+    """
+    refresh_on_save = True
+
+    def rollup_cells(self, queryset):
+        """The (client_number, invoice_date) of every invoice the objects cover."""
+        raise NotImplementedError
+
+    def refresh_rollup(self, cells):
+        refresh_turnover_rollup(cells)
+        rebuild_goal_candidates({client_number for client_number, _ in cells})
+
+    def save_model(self, request, obj, form, change):
+        if self.refresh_on_save:
+            form.rollup_cells_before = self.rollup_cells(self.model.objects.filter(pk=obj.pk)) if change else set()
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if self.refresh_on_save:
+            self.refresh_rollup(
+                form.rollup_cells_before | self.rollup_cells(self.model.objects.filter(pk=form.instance.pk))
+            )
+
+    def delete_model(self, request, obj):
+        cells = self.rollup_cells(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        self.refresh_rollup(cells)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        cells = self.rollup_cells(queryset)
+        super().delete_queryset(request, queryset)
+        self.refresh_rollup(cells)
+
+
 # CUSTOM ACTIONS
+@transaction.atomic
+def set_request_status(queryset, status):
+    # update() bypasses reward_request_saved_cache; read the users first, the
+    # changelist may filter on status
+    user_ids = list(queryset.values_list('user_id', flat=True))
+    queryset.update(status=status)
+    invalidate_users(user_ids)
+
 def approve_requests(modeladmin, request, queryset):
-    queryset.update(status='ACCEPTED')
+    set_request_status(queryset, 'ACCEPTED')
 
 def reject_requests(modeladmin, request, queryset):
-    queryset.update(status='REJECTED')
+    set_request_status(queryset, 'REJECTED')
+
+@transaction.atomic
+def set_transaction_status(queryset, status):
+    # Read the users first: the changelist may filter on status, and after the
+    # update the queryset no longer matches the rows it changed
+    user_ids = list(queryset.values_list('user_id', flat=True))
+    queryset.update(status=status)
+    refresh_balances(user_ids)
 
 def confirm_transactions(modeladmin, request, queryset):
-    queryset.update(status='CONFIRMED')
+    set_transaction_status(queryset, 'CONFIRMED')
 
 def pending_transactions(modeladmin, request, queryset):
-    queryset.update(status='PENDING')
+    set_transaction_status(queryset, 'PENDING')
 
 def cancel_transactions(modeladmin, request, queryset):
-    queryset.update(status='CANCELLED')
+    set_transaction_status(queryset, 'CANCELLED')
+
+@transaction.atomic
+def update_rewards(queryset, **values):
+    # update() bypasses reward_changed_cache
+    brand_ids = set(queryset.values_list('brand_id', flat=True))
+    queryset.update(**values)
+    invalidate_catalogue(brand_ids)
 
 def reward_availability_set_available(modeladmin, request, queryset):
-    queryset.update(availability='AVAILABLE')
+    update_rewards(queryset, availability='AVAILABLE')
 
 def reward_availability_set_on_demand(modeladmin, request, queryset):
-    queryset.update(availability='ON_DEMAND')
+    update_rewards(queryset, availability='ON_DEMAND')
 
 def reward_availability_set_unavailable(modeladmin, request, queryset):
-    queryset.update(availability='UNAVAILABLE')
+    update_rewards(queryset, availability='UNAVAILABLE')
 
 def reward_set_active(modeladmin, request, queryset):
-    queryset.update(is_active=True)
+    update_rewards(queryset, is_active=True)
 
 def reward_set_inactive(modeladmin, request, queryset):
-    queryset.update(is_active=False)
+    update_rewards(queryset, is_active=False)
 
 
 
@@ -232,10 +302,17 @@ class BrandBonusAdmin(ExportMixin, admin.ModelAdmin):
     search_fields = ('name', 'brand_id__name')
 
 @admin.register(FileUpload)
-class FileUploadAdmin(admin.ModelAdmin):
+class FileUploadAdmin(TurnoverRollupAdminMixin, admin.ModelAdmin):
     list_display = ('status', 'uploaded_at', 'file', 'processed_at', 'uploaded_by')
     list_filter = ('status', 'uploaded_at', 'uploaded_by')
     readonly_fields = ('uploaded_at', 'processed_at', 'status', 'error_message')
+    refresh_on_save = False  # editing an upload does not touch its invoices
+
+    def rollup_cells(self, queryset):
+        return set(
+            Invoice.objects.filter(file_upload__in=queryset)
+            .values_list('client_number', 'invoice_date').distinct()
+        )
 
 @admin.register(Reward)
 class RewardAdmin(ImportExportMixin, admin.ModelAdmin):
@@ -293,31 +370,41 @@ class RewardRequestItemAdmin(admin.ModelAdmin):
 
 @admin.register(EmailNotification)
 class EmailNotificationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'subject', 'status', 'created_at', 'sent_at')
+    list_display = ('user', 'subject', 'status', 'attempts', 'created_at', 'sent_at')
     list_filter = ('status', 'created_at', 'sent_at')
     search_fields = ('user__username', 'user__email', 'subject')
-    readonly_fields = ('created_at', 'sent_at')
+    readonly_fields = ('created_at', 'sent_at', 'claimed_at', 'attempts', 'last_error')
+
+@admin.register(EmailBatch)
+class EmailBatchAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'size', 'sent', 'failed', 'retries', 'duration', 'messages_per_second')
+    date_hierarchy = 'started_at'
+    readonly_fields = ('started_at', 'finished_at', 'size', 'sent', 'failed', 'retries', 'duration')
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(TurnoverRollupAdminMixin, admin.ModelAdmin):
     list_display = ('invoice_number', 'client_number', 'invoice_date', 'invoice_type', 'total_amount')
     list_filter = ('invoice_type', 'invoice_date')
     search_fields = ('invoice_number', 'client_number')
     date_hierarchy = 'invoice_date'
     inlines = [InvoiceBrandTurnoverInline]
 
+    def rollup_cells(self, queryset):
+        return set(queryset.values_list('client_number', 'invoice_date'))
+
 @admin.register(InvoiceBrandTurnover)
-class InvoiceBrandTurnoverAdmin(admin.ModelAdmin):
+class InvoiceBrandTurnoverAdmin(TurnoverRollupAdminMixin, admin.ModelAdmin):
     list_display = ('invoice', 'brand', 'amount')
     list_filter = ('brand',)
     search_fields = ('invoice__invoice_number', 'invoice__client_number', 'brand__name')
 
+    def rollup_cells(self, queryset):
+        return set(queryset.values_list('invoice__client_number', 'invoice__invoice_date'))
+
 # TEST ADDITION, A BIT MESSY
 import csv
 import datetime
 from django.http import HttpResponse
-from django.db.models import Sum, Value, DecimalField
-from django.db.models.functions import Coalesce
 
 def export_turnover_action(modeladmin, request, queryset):
     """
@@ -357,34 +444,12 @@ def export_turnover_action(modeladmin, request, queryset):
             writer.writerow([user.user_number, user.username, user.email, '0.00', 'No contracted brands'])
             continue
         
-        total_net_turnover = 0
-        
-        # Calculate turnover for each contracted brand
-        for brand in contract_brands:
-            # Invoice turnover
-            invoice_turnover = InvoiceBrandTurnover.objects.filter(
-                invoice__client_number=user.user_number,
-                invoice__invoice_date__gte=date_from,
-                invoice__invoice_date__lte=date_to,
-                invoice__invoice_type='INVOICE',
-                brand=brand
-            ).aggregate(
-                total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField()))
-            )['total']
-            
-            # Credit note turnover
-            credit_turnover = InvoiceBrandTurnover.objects.filter(
-                invoice__client_number=user.user_number,
-                invoice__invoice_date__gte=date_from,
-                invoice__invoice_date__lte=date_to,
-                invoice__invoice_type='CREDIT_NOTE',
-                brand=brand
-            ).aggregate(
-                total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField()))
-            )['total']
-            
-            # Add to total
-            total_net_turnover += (invoice_turnover - credit_turnover)
+        # Net turnover of the contracted brands
+        total_net_turnover = sum(
+            (row['net_turnover'] for row in brand_turnover_matrix(user, date_from, date_to, contract_brands)
+             if row['in_contract']),
+            0,
+        )
         
         # Write row to CSV
         writer.writerow([
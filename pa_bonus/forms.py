@@ -10,6 +10,7 @@ from pa_bonus.models import (
     User, UserContract, UserContractGoal, Brand, BrandBonus, Region,
     Invoice, InvoiceBrandTurnover, PointsTransaction
 )
+from pa_bonus.services.bulk import points_bulk_mode
 from pa_bonus.tasks import recalculate_points_for_user
 import datetime
 from decimal import Decimal
@@ -485,7 +486,8 @@ class ClientCreationForm(forms.Form):
             # Process historical transactions if requested
             transaction_stats = None
             if self.cleaned_data.get('process_historical_transactions'):
-                transaction_stats = self._process_retroactive_transactions(user, contract)
+                with points_bulk_mode():
+                    transaction_stats = self._process_retroactive_transactions(user, contract)
 
         return user, transaction_stats
 
@@ -0,0 +1,40 @@
+"""
+Management command to show how often the cached dashboard figures were served
+from the cache, per cached value, since the counters were last reset:
+
+    python manage.py cache_stats
+    python manage.py cache_stats --reset   # show, then start counting afresh
+
+The counters are kept in the cache itself, so they cover every process sharing
+it. Without REDIS_URL outside production nothing is cached (the dummy backend)
+and every counter stays at zero.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pa_bonus.services.cache import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show the hits and misses of the pa_bonus cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help="Reset the counters after showing them.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Cache backend: {settings.CACHES['default']['BACKEND']}")
+        stats = cache_stats()
+        for name, values in stats.items():
+            self.stdout.write(
+                f"  {name:<20} {values['hits']:>8} hits {values['misses']:>8} misses {values['hit_rate']:>6}%"
+            )
+        hits = sum(values['hits'] for values in stats.values())
+        misses = sum(values['misses'] for values in stats.values())
+        self.stdout.write(self.style.SUCCESS(f"{hits} hit(s), {misses} miss(es) in total."))
+
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write("Counters reset.")
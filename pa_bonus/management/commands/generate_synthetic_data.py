@@ -0,0 +1,100 @@
+"""
+Management command to generate a synthetic, production-scale dataset for
+benchmarks, and ABRA-style invoice files to benchmark uploads with.
+
+The data is reproducible from --seed and everything it creates is prefixed
+(--prefix, "SYN" by default), so it can sit next to real data on a staging
+database and be removed again:
+
+    python manage.py generate_synthetic_data --clients 20000 --seed 1
+    python manage.py generate_synthetic_data --invoice-file /tmp/invoices.csv --file-invoices 50000 --no-db
+    python manage.py generate_synthetic_data --delete
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pa_bonus.models import Brand, User
+from pa_bonus.services.synthetic import (
+    DEFAULT_PREFIX, SYNTHETIC_BATCH_SIZE, delete_synthetic_data, generate_synthetic_data, write_invoice_file,
+)
+
+
+class Command(BaseCommand):
+    help = "Generate reproducible synthetic clients, invoices, points and reward requests, and invoice upload files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help="Number of clients (default 1000).")
+        parser.add_argument('--regions', type=int, default=5, help="Number of regions, one sales rep each.")
+        parser.add_argument('--brands', type=int, default=6, help="Number of brands with a brand bonus.")
+        parser.add_argument('--months', type=int, default=24, help="Months of invoice history.")
+        parser.add_argument('--invoices-per-month', type=int, default=2, help="Average invoices per client and month.")
+        parser.add_argument('--credit-note-ratio', type=float, default=0.05, help="Share of invoices with a credit note.")
+        parser.add_argument('--reward-requests', type=int, default=2, help="Reward requests per client.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data.")
+        parser.add_argument('--prefix', default=DEFAULT_PREFIX, help=f"Prefix of all generated identifiers (default {DEFAULT_PREFIX}).")
+        parser.add_argument('--batch-size', type=int, default=SYNTHETIC_BATCH_SIZE, help="Clients per transaction.")
+        parser.add_argument('--no-db', action='store_true', help="Do not create database rows (only write files).")
+        parser.add_argument(
+            '--invoice-file', metavar='PATH',
+            help="Also write an ABRA invoice export for the generated clients (.csv or .xlsx).",
+        )
+        parser.add_argument('--file-invoices', type=int, default=1000, help="Invoices in the invoice file.")
+        parser.add_argument('--credit-notes', action='store_true', help="Write a credit note file instead of invoices.")
+        parser.add_argument('--delete', action='store_true', help="Delete the data generated with --prefix and exit.")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+
+        if options['delete']:
+            deleted = delete_synthetic_data(prefix)
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} row(s) with prefix {prefix}."))
+            return
+
+        if not options['no_db']:
+            if User.objects.filter(user_number__startswith=prefix).exists():
+                raise CommandError(
+                    f"Synthetic data with prefix {prefix} already exists. "
+                    f"Delete it with --delete or choose another --prefix."
+                )
+            started = time.monotonic()
+            counts = generate_synthetic_data(
+                clients=options['clients'],
+                regions=options['regions'],
+                brands=options['brands'],
+                months=options['months'],
+                invoices_per_month=options['invoices_per_month'],
+                credit_note_ratio=options['credit_note_ratio'],
+                reward_requests_per_client=options['reward_requests'],
+                prefix=prefix,
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+                progress=lambda done, total: self.stdout.write(f"  {done}/{total} clients"),
+            )
+            for model, count in counts.items():
+                self.stdout.write(f"{model:24} {count:>10}")
+            self.stdout.write(self.style.SUCCESS(
+                f"Generated {sum(counts.values())} row(s) in {time.monotonic() - started:.1f}s."
+            ))
+
+        if options['invoice_file']:
+            client_numbers = list(
+                User.objects.filter(user_number__startswith=prefix, region__isnull=False)
+                .order_by('user_number').values_list('user_number', flat=True)
+            )
+            brand_prefixes = list(
+                Brand.objects.filter(name__startswith=f"{prefix} Brand ").values_list('prefix', flat=True)
+            )
+            if options['no_db'] and not client_numbers:
+                # Files only: invent the clients and brands the generator would have made
+                client_numbers = [f"{prefix}{n + 1:07d}" for n in range(options['clients'])]
+                brand_prefixes = [f"{prefix}{n + 1:02d}" for n in range(options['brands'])]
+            if not client_numbers or not brand_prefixes:
+                raise CommandError(f"No synthetic clients or brands with prefix {prefix} to write invoices for.")
+
+            rows = write_invoice_file(
+                options['invoice_file'], client_numbers, brand_prefixes,
+                invoices=options['file_invoices'], credit_notes=options['credit_notes'],
+                prefix=prefix, seed=options['seed'],
+            )
+            self.stdout.write(self.style.SUCCESS(f"Wrote {rows} line(s) to {options['invoice_file']}."))
@@ -0,0 +1,77 @@
+"""
+Management command to verify the materialised points figures against the
+points ledger and repair any drift: first each credit's stored
+remaining_points against its allocations, then the PointsBalance rows.
+
+Both are kept current by every write path, so this should normally find
+nothing. Run it after deploying the balance table, after manual database
+fixes, or periodically as a safety net:
+
+    python manage.py rebuild_balances --check   # report drift only
+    python manage.py rebuild_balances           # report and repair
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from django.core.management.base import BaseCommand
+
+from pa_bonus.models import User
+from pa_bonus.services.balances import BALANCE_BATCH_SIZE, find_balance_drift, refresh_balances
+from pa_bonus.services.points import find_remaining_drift, repair_remaining
+
+
+class Command(BaseCommand):
+    help = "Verify credits' remaining points and materialised balances against the ledger and repair drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report users whose stored balance differs; write nothing.",
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Recompute every balance, not just the ones that drifted.",
+        )
+
+    def handle(self, *args, **options):
+        check_only = options['check']
+
+        # Balances read the credits' remaining points, so those are fixed first
+        credit_drift = find_remaining_drift()
+        for pk, stored, expected in credit_drift:
+            self.stdout.write(f"  transaction #{pk}: remaining {stored}, allocations say {expected}")
+        self.stdout.write(f"{len(credit_drift)} credit remainder(s) out of date.")
+        if credit_drift and not check_only:
+            repair_remaining(credit_drift)
+
+        user_ids = list(
+            User.objects
+            .filter(Q(pointstransaction__isnull=False) | Q(points_balance__isnull=False))
+            .distinct()
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+
+        drifted = 0
+        for start in range(0, len(user_ids), BALANCE_BATCH_SIZE):
+            batch = user_ids[start:start + BALANCE_BATCH_SIZE]
+            drift = find_balance_drift(batch)
+            drifted += len(drift)
+
+            for user_id, expected, stored in drift:
+                self.stdout.write(f"  user {user_id}: stored {stored}, ledger {expected}")
+
+            if check_only:
+                continue
+            to_refresh = batch if options['all'] else [user_id for user_id, _, _ in drift]
+            with transaction.atomic():
+                refresh_balances(to_refresh)
+
+        self.stdout.write(f"Checked {len(user_ids)} users, {drifted} balance(s) out of date.")
+        if check_only:
+            style = self.style.WARNING if drifted or credit_drift else self.style.SUCCESS
+            self.stdout.write(style("Check only, nothing written."))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Repaired {len(credit_drift)} credit remainder(s) and {drifted} balance(s)."
+            ))
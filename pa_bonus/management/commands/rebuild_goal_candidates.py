@@ -0,0 +1,29 @@
+"""
+Management command to regenerate the goal evaluation candidates
+(GoalEvaluationCandidate) from the goals, their evaluations and the turnover
+rollup.
+
+Goal edits, evaluations and uploads keep the table current, so this is only
+needed once after migrating, after bulk-loading goals, or after changing
+invoices outside the upload pipeline (run it after rebuild_turnover_rollup):
+
+    python manage.py rebuild_goal_candidates                    # everything
+    python manage.py rebuild_goal_candidates --client 1234 5678 # some clients
+"""
+from django.core.management.base import BaseCommand
+
+from pa_bonus.services.goals import rebuild_goal_candidates
+
+
+class Command(BaseCommand):
+    help = "Regenerate the goal evaluation candidates from the goals and turnovers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--client', nargs='+', default=None, metavar='CLIENT_NUMBER',
+            help="Only rebuild the goals of these client numbers.",
+        )
+
+    def handle(self, *args, **options):
+        written = rebuild_goal_candidates(options['client'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} goal evaluation candidate row(s)."))
@@ -0,0 +1,28 @@
+"""
+Management command to regenerate the monthly turnover rollup
+(MonthlyBrandTurnover) from the raw invoices.
+
+Uploads keep the rollup current, so this is only needed after changing
+invoices outside the upload pipeline (e.g. deleting an upload, fixing data by
+hand):
+
+    python manage.py rebuild_turnover_rollup                    # everything
+    python manage.py rebuild_turnover_rollup --client 1234 5678 # some clients
+"""
+from django.core.management.base import BaseCommand
+
+from pa_bonus.services.turnover import rebuild_turnover_rollup
+
+
+class Command(BaseCommand):
+    help = "Regenerate the monthly turnover rollup from the invoices."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--client', nargs='+', default=None, metavar='CLIENT_NUMBER',
+            help="Only rebuild these client numbers.",
+        )
+
+    def handle(self, *args, **options):
+        written = rebuild_turnover_rollup(options['client'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} monthly turnover row(s)."))
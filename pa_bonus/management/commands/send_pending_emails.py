@@ -0,0 +1,45 @@
+"""
+Management command to send every pending email notification with the batch
+mailer, one SMTP connection per batch.
+
+Notifications are normally sent by the job queued when they are created; run
+this (or schedule pa_bonus.tasks.send_pending_notifications_task) to pick up
+any left pending, e.g. after the mail server was down:
+
+    python manage.py send_pending_emails
+    python manage.py send_pending_emails --batch-size 50 --rate 5
+"""
+from django.core.management.base import BaseCommand
+
+from pa_bonus.services.mailer import BatchMailer
+
+
+class Command(BaseCommand):
+    help = "Send the pending email notifications in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help="Notifications per batch and SMTP connection. Defaults to EMAIL_BATCH_SIZE.",
+        )
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Emails per second, 0 for no limit. Defaults to EMAIL_RATE_LIMIT.",
+        )
+
+    def handle(self, *args, **options):
+        mailer = BatchMailer(batch_size=options['batch_size'], rate_limit=options['rate'])
+        batches = mailer.drain()
+        if not batches:
+            self.stdout.write(self.style.SUCCESS("No pending notifications."))
+            return
+
+        for batch in batches:
+            self.stdout.write(
+                f"  batch {batch.id}: {batch.sent}/{batch.size} sent, {batch.failed} failed, "
+                f"{batch.retries} retries, {batch.messages_per_second}/s"
+            )
+        sent = sum(batch.sent for batch in batches)
+        failed = sum(batch.failed for batch in batches)
+        style = self.style.WARNING if failed else self.style.SUCCESS
+        self.stdout.write(style(f"Sent {sent} email(s) in {len(batches)} batch(es), {failed} failed."))
@@ -1,32 +1,25 @@
-from django.utils import timezone
-from pa_bonus.models import UserActivity
+from pa_bonus.services.activity import activity_recorder, is_tracked
 import logging
 
 logger = logging.getLogger(__name__)
 
 class UserActivityMiddleware:
+    """
+    Counts the authenticated user's visits for UserActivity. The visits are
+    buffered by activity_recorder and written in bulk, so most requests run
+    no activity queries at all.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
         # Code executed before the view
-        if request.user.is_authenticated:
-            # Get or create activity record for today
+        if is_tracked(request.path) and request.user.is_authenticated:
             try:
-                UserActivity.objects.update_or_create(
-                    user=request.user,
-                    date=timezone.now().date(),
-                    defaults={
-                        'last_activity': timezone.now(),
-                        'visit_count': UserActivity.objects.filter(
-                            user=request.user,
-                            date=timezone.now().date()
-                        ).values_list('visit_count', flat=True).first() or 0 + 1
-                    }
-                )
+                activity_recorder.record(request.user.pk)
             except Exception as e:
                 # Don't break the site if tracking fails
                 logger.error(f"Error tracking user activity: {str(e)}")
-                
+
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
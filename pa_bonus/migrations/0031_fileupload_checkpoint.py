@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0030_rewardrequestitem_updates_abrasubmission'),
+    ]
+
+    operations = [
+        # Resumable, chunked upload processing
+        migrations.AddField(
+            model_name='fileupload',
+            name='processing_stage',
+            field=models.CharField(
+                blank=True,
+                choices=[('INVOICES', 'Importing invoices'), ('POINTS', 'Creating points')],
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='checkpoint',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def clear_balances(apps, schema_editor):
+    # The old stub table was never written to by the app; start empty, 0040
+    # fills it from the ledger.
+    apps.get_model('pa_bonus', 'PointsBalance').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0031_fileupload_checkpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_balances, migrations.RunPython.noop),
+        # One materialised balance row per user
+        migrations.AlterField(
+            model_name='pointsbalance',
+            name='user_id',
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='points_balance',
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name='pointsbalance',
+            name='points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pointsbalance',
+            name='pending_points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pointsbalance',
+            name='expiring_points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pointsbalance',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_remaining_points(apps, schema_editor):
+    PointsTransaction = apps.get_model('pa_bonus', 'PointsTransaction')
+    PointAllocation = apps.get_model('pa_bonus', 'PointAllocation')
+    allocated = (
+        PointAllocation.objects
+        .filter(credit=OuterRef('pk'))
+        .values('credit')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    PointsTransaction.objects.filter(value__gt=0).update(
+        remaining_points=F('value') - Coalesce(Subquery(allocated), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0032_pointsbalance_materialised'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pointstransaction',
+            name='remaining_points',
+            field=models.IntegerField(default=0, help_text='Points of a credit not yet drawn by any debit: value minus the sum of its allocations out. Maintained by the allocation engine; always 0 for debits.'),
+        ),
+        migrations.RunPython(fill_remaining_points, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(condition=models.Q(('remaining_points__gt', 0), ('status', 'CONFIRMED')), fields=['user', 'expires_at', 'date'], name='pointstxn_open_credits_idx'),
+        ),
+    ]
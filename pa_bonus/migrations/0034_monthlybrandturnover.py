@@ -0,0 +1,55 @@
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def fill_rollup(apps, schema_editor):
+    InvoiceBrandTurnover = apps.get_model('pa_bonus', 'InvoiceBrandTurnover')
+    MonthlyBrandTurnover = apps.get_model('pa_bonus', 'MonthlyBrandTurnover')
+    rows = (
+        InvoiceBrandTurnover.objects
+        .annotate(month=TruncMonth('invoice__invoice_date'))
+        .values('invoice__client_number', 'brand_id', 'month', 'invoice__invoice_type')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    MonthlyBrandTurnover.objects.bulk_create(
+        (
+            MonthlyBrandTurnover(
+                client_number=row['invoice__client_number'],
+                brand_id=row['brand_id'],
+                month=row['month'],
+                invoice_type=row['invoice__invoice_type'],
+                amount=row['total'],
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0033_pointstransaction_remaining_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyBrandTurnover',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_number', models.CharField(max_length=20)),
+                ('month', models.DateField()),
+                ('invoice_type', models.CharField(choices=[('INVOICE', 'Standard invoice'), ('CREDIT_NOTE', 'Credit note')], max_length=15)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_turnovers', to='pa_bonus.brand')),
+            ],
+            options={
+                'ordering': ['-month', 'client_number'],
+                'constraints': [models.UniqueConstraint(fields=('client_number', 'month', 'brand', 'invoice_type'), name='monthlybrandturnover_unique_cell')],
+            },
+        ),
+        migrations.RunPython(fill_rollup, migrations.RunPython.noop),
+    ]
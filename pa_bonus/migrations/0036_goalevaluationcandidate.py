@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0035_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoalEvaluationCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('period_end', models.DateField()),
+                ('is_final', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('EVALUATED', 'Evaluated')], default='PENDING', max_length=10)),
+                ('actual_turnover', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('potential_points', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('goal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='evaluation_candidates', to='pa_bonus.usercontractgoal')),
+            ],
+            options={
+                'ordering': ['period_end'],
+                'indexes': [models.Index(fields=['status', 'period_end'], name='pa_bonus_go_status_ac0274_idx')],
+                'constraints': [models.UniqueConstraint(fields=('goal', 'period_end'), name='goalevaluationcandidate_unique_period')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0037_transactionapprovaljob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('size', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('retries', models.IntegerField(default=0)),
+                ('duration', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Email batches',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='emailnotification',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='emailnotification',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0038_emailbatch_emailnotification_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='progress_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,65 @@
+from dateutil.relativedelta import relativedelta
+from django.db import migrations
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def fill_balances(apps, schema_editor):
+    # One row per user with transactions, computed like
+    # pa_bonus.services.balances.calculate_balances; users without a row read
+    # as a zero balance.
+    PointsTransaction = apps.get_model('pa_bonus', 'PointsTransaction')
+    PointsBalance = apps.get_model('pa_bonus', 'PointsBalance')
+    today = timezone.now().date()
+    horizon = today + relativedelta(months=3)
+
+    balances = {}
+    totals = (
+        PointsTransaction.objects
+        .filter(status__in=['CONFIRMED', 'PENDING'])
+        .values('user_id', 'status')
+        .annotate(total=Sum('value'))
+        .order_by()
+    )
+    for row in totals:
+        field = 'points' if row['status'] == 'CONFIRMED' else 'pending_points'
+        balances.setdefault(row['user_id'], {})[field] = row['total'] or 0
+    expiring = (
+        PointsTransaction.objects
+        .filter(
+            status='CONFIRMED', value__gt=0, remaining_points__gt=0,
+            expires_at__isnull=False, expires_at__lte=horizon,
+        )
+        .values('user_id')
+        .annotate(total=Sum('remaining_points'))
+        .order_by()
+    )
+    for row in expiring:
+        balances.setdefault(row['user_id'], {})['expiring_points'] = row['total']
+
+    PointsBalance.objects.bulk_create(
+        (
+            PointsBalance(
+                user_id_id=user_id, date=today,
+                points=values.get('points', 0),
+                pending_points=values.get('pending_points', 0),
+                expiring_points=values.get('expiring_points', 0),
+            )
+            for user_id, values in balances.items()
+        ),
+        batch_size=2000,
+        update_conflicts=True,
+        unique_fields=['user_id'],
+        update_fields=['date', 'updated_at', 'points', 'pending_points', 'expiring_points'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pa_bonus', '0039_fileupload_progress_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
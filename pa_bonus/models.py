@@ -1,9 +1,12 @@
+from django.conf import settings
 from django.db import models
-from django.db.models import Sum
+from django.db.models import F, Sum, Value
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from dateutil.relativedelta import relativedelta
+from datetime import timedelta
 import os
 import logging
 
@@ -135,16 +138,14 @@ class User(AbstractUser):
         """
         Returns the customers current point balance.
 
+        Reads the stored points of the materialised PointsBalance row, a
+        single-row lookup, rather than summing transactions.
+
         Returns:
             int: Current point balance, 0 if there are no transactions
         """
-        total_points = PointsTransaction.objects.filter(
-            user = self.id,
-            status = 'CONFIRMED'
-        ).aggregate(
-            total = Sum('value')
-        )
-        return total_points['total'] if total_points['total'] is not None else 0
+        from pa_bonus.services.balances import get_points_balance
+        return get_points_balance(self).points
     
     def get_sales_rep(self):
         """
@@ -376,6 +377,52 @@ class GoalEvaluation(models.Model):
         return f"Evaluation for {self.goal} on {self.evaluation_date}"
 
 
+class GoalEvaluationCandidate(models.Model):
+    """
+    One evaluation period of a UserContractGoal, with the figures the manager
+    dashboard and the goal evaluation page list it by.
+
+    A derived table: pa_bonus.services.goals rebuilds a goal's rows whenever the
+    goal, its brands or its evaluations change, and the rows of the clients an
+    upload touched when the upload completes. The rebuild_goal_candidates
+    command regenerates the whole table.
+
+    Attributes:
+        goal (UserContractGoal): The goal the period belongs to.
+        period_start (Date): First day of the evaluation period.
+        period_end (Date): End of the evaluation period.
+        is_final (bool): Whether the period ends with the goal.
+        status (str): Whether the period has a GoalEvaluation yet.
+        actual_turnover (Decimal): Net turnover in the goal's brands over the period.
+        potential_points (int): Rough bonus estimate if the period target is exceeded.
+        updated_at (DateTime): When the row was last recomputed.
+    """
+    CANDIDATE_STATUS = (
+        ('PENDING', _('Pending')),
+        ('EVALUATED', _('Evaluated')),
+    )
+    goal = models.ForeignKey(UserContractGoal, on_delete=models.CASCADE, related_name='evaluation_candidates')
+    period_start = models.DateField()
+    period_end = models.DateField()
+    is_final = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=CANDIDATE_STATUS, default='PENDING')
+    actual_turnover = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    potential_points = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['goal', 'period_end'], name='goalevaluationcandidate_unique_period'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'period_end']),
+        ]
+        ordering = ['period_end']
+
+    def __str__(self):
+        return f"{self.goal_id} | {self.period_start} - {self.period_end} | {self.status}"
+
+
 # Extra (goal) points aren't tied to a single brand — a goal can span several —
 # so they can't use a per-brand validity window. Instead they use this fixed
 # window, measured from the end of the goal period they reward (which is the
@@ -419,6 +466,8 @@ class PointsTransaction(models.Model):
         brand (Brand): Brand the transaction relates to (optional).
         invoice (Invoice): Invoice the transaction relates to (optional).
         reward_request (RewardRequest): The reward request the transaction relates to (optional).
+        expires_at (Date): When the points of a credit expire (optional).
+        remaining_points (int): Unspent points of a credit, kept by the allocation engine.
         created_at (DateTime): The datetime the transaction was created.
 
     """
@@ -454,10 +503,26 @@ class PointsTransaction(models.Model):
             "Null means the points never expire."
         ),
     )
+    remaining_points = models.IntegerField(
+        default=0,
+        help_text=(
+            "Points of a credit not yet drawn by any debit: value minus the sum of "
+            "its allocations out. Maintained by the allocation engine; always 0 "
+            "for debits."
+        ),
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-date', '-created_at']
+        indexes = [
+            # Only credits that can still be drawn from, in allocation order
+            models.Index(
+                fields=['user', 'expires_at', 'date'],
+                condition=models.Q(status='CONFIRMED', remaining_points__gt=0),
+                name='pointstxn_open_credits_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} | {self.date} | {self.type} | {self.value}'
@@ -476,42 +541,68 @@ class PointsTransaction(models.Model):
     def allocated(self):
         """
         Points already drawn from this credit by debits (reward claims, credit
-        notes, expirations). Derived from PointAllocation rows, never stored, so
-        it is always an accurate, auditable reflection of where points went.
+        notes, expirations). The PointAllocation rows say where they went; this
+        is derived from the stored remainder.
 
         Returns:
             int: Total points allocated away from this credit (0 for debits).
         """
-        return self.allocations_out.aggregate(total=Sum('amount'))['total'] or 0
+        if not self.is_credit:
+            return 0
+        return self.value - self.remaining
 
     @property
     def remaining(self):
         """
         Unspent points still available in this credit.
 
+        The stored remaining_points, as loaded. The allocation engine updates it
+        in the database, not on instances other code may hold, so refresh an
+        instance held across an allocation before reading it.
+
         Returns:
             int: value minus everything allocated away (0 for debits).
         """
         if not self.is_credit:
             return 0
-        return self.value - self.allocated
+        return self.remaining_points
 
     def save(self, *args, **kwargs):
         """
-        Materialise expires_at for credits at creation time.
+        Materialise expires_at for credits at creation time, and keep
+        remaining_points in step with value.
 
         The expiry is computed once and never recomputed; changing a policy later
         does not move the goalposts on points already granted. Branded credits use
         their brand's window; extra (goal) points use the fixed EXTRA_POINTS window
         measured from their period end (the transaction date). Debits and other
         brand-less credits get no expiry.
+
+        A new credit starts with all its points remaining. Saving an existing
+        credit moves the stored remainder by the change in value, computed in the
+        UPDATE itself from the stored columns, so editing the value by hand cannot
+        leave it stale and a stale copy on the instance is never written back.
         """
         if self.expires_at is None and self.value > 0 and self.date:
             if self.brand_id:
                 self.expires_at = self.brand.expiry_for(self.date)
             elif self.type == 'EXTRA_POINTS':
                 self.expires_at = extra_points_expiry(self.date)
+
+        update_fields = kwargs.get('update_fields')
+        if self.value <= 0:
+            self.remaining_points = 0
+        elif self._state.adding:
+            self.remaining_points = self.value
+        elif update_fields is None or 'value' in update_fields:
+            # new value - (stored value - stored remainder), i.e. minus what is allocated
+            self.remaining_points = Value(self.value) - F('value') + F('remaining_points')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'remaining_points'}
         super().save(*args, **kwargs)
+        if not isinstance(self.remaining_points, int):
+            # Reloaded from the database on first access
+            del self.remaining_points
 
 class PointAllocation(models.Model):
     """
@@ -519,10 +610,10 @@ class PointAllocation(models.Model):
 
     This is the traceability core of the points ledger. Every reward claim, credit
     note and expiration draws points from one or more credit transactions (oldest
-    to expire first), and each such draw is one PointAllocation row. Because of
-    this, a credit's "remaining" balance is always derived (value minus the sum of
-    allocations out), never an overwritten counter, so we can always say exactly
-    where each point came from and where it went.
+    to expire first), and each such draw is one PointAllocation row, so we can
+    always say exactly where each point came from and where it went. The credit's
+    stored remaining_points must always equal its value minus the sum of its
+    allocations out; find_remaining_drift checks exactly that.
 
     Attributes:
         credit (PointsTransaction): The positive transaction points are drawn from.
@@ -554,18 +645,29 @@ class PointAllocation(models.Model):
 
 class PointsBalance(models.Model):
     """
-    Represents a current points balance for the user. Currently not implemented. The idea
-    is caching the balance to avoid counting it every time, but that likely won't be needed
-    anytime soon.
+    Represents the current, materialised points balance of a user.
+
+    One row per user, recomputed from the ledger by pa_bonus.services.balances
+    whenever the user's transactions or allocations change, so reading a balance
+    never has to sum the whole transaction history.
 
     Attributes:
         user_id (User): The user this balance belongs to
-        date (Date): Date this balance was calculated
-        points (int): The balance of points
+        date (Date): Date this balance was calculated (the expiring figure is relative to it)
+        points (int): Confirmed balance of points
+        pending_points (int): Points in transactions still waiting for confirmation
+        expiring_points (int): Unspent confirmed points expiring within the next 3 months
+        updated_at (DateTime): When the balance was last recomputed
     """
-    user_id = models.ForeignKey(User, on_delete=models.CASCADE)
+    user_id = models.OneToOneField(User, on_delete=models.CASCADE, related_name='points_balance')
     date = models.DateField()
-    points = models.IntegerField()
+    points = models.IntegerField(default=0)
+    pending_points = models.IntegerField(default=0)
+    expiring_points = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id_id} | {self.date} | {self.points}'
 
 class BrandBonus(models.Model):
     """
@@ -583,6 +685,127 @@ class BrandBonus(models.Model):
     def __str__(self):
         return f'{self.name} | {self.brand_id} | {self.points_ratio} points per '
 
+class ReportJob(models.Model):
+    """
+    One request for an Excel report, generated in the background by django-q.
+
+    The finished file is stored under MEDIA and downloaded from the Reports Hub.
+    A request for the same report with the same parameters reuses a running job,
+    or one that finished within REPORT_JOB_REUSE_SECONDS, instead of generating
+    the file again.
+
+    Attributes:
+        report_id (str): The registered BaseReport to run.
+        parameters (dict): Keyword arguments for the report class.
+        status (str): Current status of the job.
+        requested_by (User): The manager who asked for the report.
+        requested_at (DateTime): When the job was queued.
+        started_at (DateTime): When generation started.
+        finished_at (DateTime): When generation completed or failed.
+        row_count (int): Data rows written to the file.
+        file (File): The generated .xlsx file.
+        error_message (str): Why generation failed.
+    """
+    JOB_STATUS = (
+        ('PENDING', _('Pending')),
+        ('RUNNING', _('Running')),
+        ('COMPLETED', _('Completed')),
+        ('FAILED', _('Failed')),
+    )
+    report_id = models.CharField(max_length=50)
+    parameters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default='PENDING')
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_jobs')
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    row_count = models.IntegerField(null=True, blank=True)
+    file = models.FileField(upload_to="reports/%Y/%m/%d/", blank=True)
+    error_message = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-requested_at']
+        indexes = [
+            models.Index(fields=['report_id', 'status', 'finished_at']),
+        ]
+
+    def __str__(self):
+        return f'Report {self.report_id} | {self.requested_at} | {self.status}'
+
+    @property
+    def is_running(self):
+        return self.status in ('PENDING', 'RUNNING')
+
+    @property
+    def duration(self):
+        """Generation time as a timedelta, or None until the job has finished."""
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return None
+
+
+class TransactionApprovalJob(models.Model):
+    """
+    One monthly approval of pending points transactions, run in the background
+    by django-q.
+
+    The job confirms the month's pending transactions in one update, records
+    what it approved, creates one notification per client and then sends them,
+    counting the sent emails as it goes so the approval page can show progress.
+
+    Attributes:
+        year (int): Year of the approved month.
+        month (int): The approved month (1-12).
+        status (str): Current status of the job.
+        requested_by (User): The manager who approved the month.
+        requested_at (DateTime): When the job was queued.
+        started_at (DateTime): When the approval started.
+        finished_at (DateTime): When the job completed or failed.
+        transaction_count (int): Transactions confirmed.
+        points_total (int): Points in the confirmed transactions.
+        user_count (int): Clients with confirmed transactions, one notification each.
+        notifications_sent (int): Notifications sent so far.
+        error_message (str): Why the job failed.
+    """
+    JOB_STATUS = (
+        ('PENDING', _('Pending')),
+        ('RUNNING', _('Running')),
+        ('COMPLETED', _('Completed')),
+        ('FAILED', _('Failed')),
+    )
+    year = models.IntegerField()
+    month = models.IntegerField()
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default='PENDING')
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='approval_jobs')
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    transaction_count = models.IntegerField(default=0)
+    points_total = models.IntegerField(default=0)
+    user_count = models.IntegerField(default=0)
+    notifications_sent = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-requested_at']
+
+    def __str__(self):
+        return f'Approval {self.year}-{self.month:02d} | {self.requested_at} | {self.status}'
+
+    @property
+    def is_running(self):
+        return self.status in ('PENDING', 'RUNNING')
+
+    @property
+    def progress(self):
+        """Share of the notifications sent, as a whole percentage."""
+        if self.status == 'COMPLETED':
+            return 100
+        if not self.user_count:
+            return 0
+        return int(100 * self.notifications_sent / self.user_count)
+
+
 class FileUpload(models.Model):
     """
     Represents an uploaded file with invoice data. Includes a special permission can_manage.
@@ -594,6 +817,14 @@ class FileUpload(models.Model):
         status (str): Current status of the uploaded file's processing.
         error_message (str): Any error messages encountered while processing.
         uploaded_by (User): The User object the file was uploaded by.
+        processed_rows (int): Number of invoices imported so far.
+        total_rows (int): Number of invoices in the file.
+        processing_stage (str): The processing pass the upload is in (or stopped in).
+        checkpoint (int): Invoices committed so far in the current stage. A failed
+            upload resumes from here instead of starting over.
+        progress_at (DateTime): When processing last started or committed a chunk.
+            A PROCESSING upload whose progress stops for UPLOAD_STALL_MINUTES lost
+            its worker and can be resumed like a failed one.
     """
     PROCESSING_STATUS = (
         ('PENDING', _('Pending')),
@@ -601,6 +832,10 @@ class FileUpload(models.Model):
         ('COMPLETED', _('Completed')),
         ('FAILED', _('Failed')),
     )
+    PROCESSING_STAGES = (
+        ('INVOICES', _('Importing invoices')),
+        ('POINTS', _('Creating points')),
+    )
     file = models.FileField(upload_to="uploads/%Y/%m/%d/")
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
@@ -609,6 +844,9 @@ class FileUpload(models.Model):
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     processed_rows = models.IntegerField(default=0)
     total_rows = models.IntegerField(default=0)
+    processing_stage = models.CharField(max_length=20, choices=PROCESSING_STAGES, blank=True)
+    checkpoint = models.IntegerField(default=0)
+    progress_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-uploaded_at']
@@ -618,6 +856,42 @@ class FileUpload(models.Model):
 
     def __str__(self):
         return f'Upload {self.id} | {self.uploaded_at} | {self.status} | by {self.uploaded_by}'
+
+    @property
+    def is_stalled(self):
+        """True for a PROCESSING upload whose checkpoint has not moved for UPLOAD_STALL_MINUTES."""
+        if self.status != 'PROCESSING':
+            return False
+        stall_after = timedelta(minutes=getattr(settings, 'UPLOAD_STALL_MINUTES', 15))
+        return (self.progress_at or self.uploaded_at) < timezone.now() - stall_after
+
+    @property
+    def can_resume(self):
+        """
+        True for a failed or stalled upload that has committed at least part of
+        its work. A worker killed by the task timeout never marks its upload
+        FAILED, so a stalled one is treated the same way.
+        """
+        return (self.status == 'FAILED' or self.is_stalled) and bool(self.processing_stage)
+
+    @property
+    def progress_percent(self):
+        """
+        Overall progress of both processing passes, as a whole percentage.
+
+        The invoice pass counts for the first half, the points pass for the second.
+        """
+        if self.status == 'COMPLETED':
+            return 100
+        if not self.total_rows:
+            return 0
+        if self.processing_stage == 'POINTS':
+            done = self.total_rows + self.checkpoint
+        elif self.processing_stage == 'INVOICES':
+            done = self.checkpoint
+        else:
+            done = 0
+        return min(100, int(done * 50 / self.total_rows))
     
 class Reward(models.Model):
     """
@@ -778,6 +1052,7 @@ class AbraSubmission(models.Model):
 class EmailNotification(models.Model):
     NOTIFICATION_STATUS = (
         ('PENDING', 'Pending'),
+        ('SENDING', 'Sending'),
         ('SENT', 'Sent'),
         ('FAILED', 'Failed'),
     )
@@ -788,12 +1063,52 @@ class EmailNotification(models.Model):
     status = models.CharField(max_length=10, choices=NOTIFICATION_STATUS, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
     sent_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
     
     class Meta:
         ordering = ['-created_at']
         
     def __str__(self):
         return f"{self.subject} to {self.user.email} ({self.status})"
+
+
+class EmailBatch(models.Model):
+    """
+    Throughput of one chunk of notifications sent by the batch mailer over a
+    single SMTP connection.
+
+    Attributes:
+        started_at (DateTime): When the chunk was claimed.
+        finished_at (DateTime): When its last email was handled.
+        size (int): Notifications in the chunk.
+        sent (int): Emails sent.
+        failed (int): Notifications marked FAILED.
+        retries (int): Send attempts repeated after a transient error.
+        duration (float): Seconds spent sending, including rate-limit and
+            backoff waits.
+    """
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    size = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+    duration = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['-started_at']
+        verbose_name_plural = 'Email batches'
+
+    def __str__(self):
+        return f'Email batch {self.started_at} | {self.sent}/{self.size} sent'
+
+    @property
+    def messages_per_second(self):
+        if not self.duration:
+            return 0
+        return round(self.sent / self.duration, 2)
     
 # Utility function to create group and permissions
 def create_manager_group_and_permissions(*args, **options):
@@ -886,3 +1201,40 @@ class InvoiceBrandTurnover(models.Model):
     def __str__(self):
         return f"{self.invoice.invoice_number} | {self.brand.name} | {self.amount}"
 
+
+
+class MonthlyBrandTurnover(models.Model):
+    """
+    Monthly rollup of InvoiceBrandTurnover per client, brand and invoice type.
+
+    A derived table: each row is the sum of the brand turnovers of one client's
+    invoices (or credit notes) dated in one calendar month. It lets turnover
+    questions over whole months read a handful of rows instead of joining and
+    summing every invoice. The upload pipeline recomputes the cells it touches via
+    pa_bonus.services.turnover, and the rebuild_turnover_rollup command
+    regenerates the whole table.
+
+    Attributes:
+        client_number (str): The client's number in the accounting system.
+        brand (Brand): The brand the turnover is for.
+        month (Date): First day of the calendar month.
+        invoice_type (str): Standard invoice or credit note.
+        amount (Decimal): Total brand turnover of that month's documents.
+    """
+    client_number = models.CharField(max_length=20)
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='monthly_turnovers')
+    month = models.DateField()
+    invoice_type = models.CharField(max_length=15, choices=Invoice.INVOICE_TYPES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['client_number', 'month', 'brand', 'invoice_type'],
+                name='monthlybrandturnover_unique_cell',
+            ),
+        ]
+        ordering = ['-month', 'client_number']
+
+    def __str__(self):
+        return f"{self.client_number} | {self.month:%Y-%m} | {self.brand_id} | {self.invoice_type} | {self.amount}"
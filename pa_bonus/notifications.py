@@ -1,16 +1,35 @@
 from django.conf import settings
 from django.core.mail import send_mail
+from django.db import transaction as db_transaction
 from django.utils import timezone
 from django_q.tasks import async_task
-from pa_bonus.models import EmailNotification, User, PointsTransaction, RewardRequest
+from pa_bonus.models import EmailNotification, User, PointsBalance, PointsTransaction, RewardRequest
 import logging
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+POINTS_ADDED_SUBJECT = "Points added to your Bonus Program account"
+POINTS_CONFIRMED_SUBJECT = "Your bonus points have been confirmed!"
+
+# Clients whose notifications are created per query by the bulk helpers
+NOTIFICATION_BATCH_SIZE = 1000
+
+def debug_recipient():
+    """The admin's address, which gets every email if DEBUG=True; None otherwise."""
+    if settings.DEBUG:
+        return User.objects.filter(username='admin').first().email
+    return None
+
+def notification_recipient(user):
+    """The address to email a user at: theirs, or the admin's if DEBUG=True."""
+    return debug_recipient() or user.email
+
 def send_email_notification(user, subject, message):
     """
-    Send an email to a user and log it in the notifications table. If DEBUG=True, always sends it to the admin email.
+    Log an email to a user in the notifications table and have the batch
+    mailer send it once the current database transaction commits. If
+    DEBUG=True, it is sent to the admin email instead.
     """
     notification = EmailNotification.objects.create(
         user=user,
@@ -18,40 +37,24 @@ def send_email_notification(user, subject, message):
         message=message
     )
     logger.info(f"Created notification for user {user.username}")
-    
-    try:
-        # Get User email or, if in DEBUG, admin email
-        if settings.DEBUG:
-            email_to = User.objects.filter(username='admin').first().email
-        else:
-            email_to = user.email
-        
-        logger.info(f"Scheduling a task to send an email to {email_to}")
-
-        async_task(
-            'pa_bonus.tasks.send_email_task', 
-            notification_id=notification.id,
-            recipient_email=email_to,
-            subject=subject,
-            message=message
-        )
+    queue_notifications([notification])
+    return True
 
-        return True
-    except Exception as e:
-        notification.status = 'FAILED'
-        notification.save()
-        logger.error(f"Failed to send email to {email_to}: {str(e)}")
-        return False
-
-def notify_points_added(transaction):
+def queue_notifications(notifications):
     """
-    Notify user when points are added to their account
+    Send already created notifications in one background batch mailer job,
+    once the current database transaction commits.
     """
-    if transaction.value <= 0:
-        return
-    
-    subject = "Points added to your Bonus Program account"
-    message = f"""Hello {transaction.user.first_name},
+    notification_ids = [notification.id for notification in notifications]
+    if notification_ids:
+        db_transaction.on_commit(
+            lambda: async_task('pa_bonus.tasks.send_notifications_task', notification_ids)
+        )
+    return len(notification_ids)
+
+def points_added_message(transaction, balance):
+    """The body of the points-added email for a transaction."""
+    return f"""Hello {transaction.user.first_name},
 
 {transaction.value} points have been added to your Bonus Program account.
 Transaction details:
@@ -59,13 +62,147 @@ Transaction details:
 - Description: {transaction.description}
 - Brand: {transaction.brand.name if transaction.brand else 'Not specified'}
 
-Your current balance is {transaction.user.get_balance()} points.
+Your current balance is {balance} points.
+
+Thank you for your business!
+Bonus Program Team
+"""
+
+def create_points_added_notifications(transactions):
+    """
+    Bulk form of notify_points_added: create the notification rows for many
+    transactions with one balance query and one insert, without sending them.
+    Pass the result to queue_notifications.
+
+    Args:
+        transactions: Saved PointsTransactions; those adding no points are skipped.
+
+    Returns:
+        list[EmailNotification]: The created notifications.
+    """
+    transactions = [transaction for transaction in transactions if transaction.value > 0]
+    balances = dict(
+        PointsBalance.objects.filter(user_id__in={transaction.user_id for transaction in transactions})
+        .values_list('user_id', 'points')
+    )
+    return EmailNotification.objects.bulk_create([
+        EmailNotification(
+            user=transaction.user,
+            subject=POINTS_ADDED_SUBJECT,
+            message=points_added_message(transaction, balances.get(transaction.user_id, 0)),
+        )
+        for transaction in transactions
+    ])
+
+def points_summary_message(user, transactions, balance):
+    """The body of one email about several transactions adding points for a client."""
+    lines = "\n".join(
+        f"- {transaction.date}: {transaction.value} points, {transaction.description}"
+        for transaction in transactions
+    )
+    return f"""Hello {user.first_name},
+
+{sum(transaction.value for transaction in transactions)} points have been added to your Bonus Program account.
+Transactions:
+{lines}
+
+Your current balance is {balance} points.
 
 Thank you for your business!
 Bonus Program Team
 """
+
+def create_points_summary_notifications(transactions):
+    """
+    Like create_points_added_notifications, but one notification per client:
+    a client with several transactions gets one email listing them all.
+
+    Args:
+        transactions: Saved PointsTransactions with their user and brand loaded;
+            those adding no points are skipped.
+
+    Returns:
+        list[EmailNotification]: The created notifications.
+    """
+    by_user = {}
+    for transaction in transactions:
+        if transaction.value > 0:
+            by_user.setdefault(transaction.user_id, []).append(transaction)
+    balances = dict(PointsBalance.objects.filter(user_id__in=by_user).values_list('user_id', 'points'))
+
+    notifications = []
+    for user_id, user_transactions in by_user.items():
+        balance = balances.get(user_id, 0)
+        if len(user_transactions) == 1:
+            message = points_added_message(user_transactions[0], balance)
+        else:
+            message = points_summary_message(user_transactions[0].user, user_transactions, balance)
+        notifications.append(EmailNotification(
+            user=user_transactions[0].user,
+            subject=POINTS_ADDED_SUBJECT,
+            message=message,
+        ))
+    return EmailNotification.objects.bulk_create(notifications)
+
+def points_confirmed_message(user, month, total_points, balance):
+    """The body of the monthly approval email for a client."""
+    return f"""
+Dear {user.first_name} {user.last_name},
+
+We are pleased to inform you that your transactions for {month.strftime('%B %Y')} 
+have been confirmed, adding {total_points} points to your account.
+
+Your current point balance is now: {balance} points.
+
+You can log in to the Bonus Program portal to view these transactions and explore 
+available rewards.
+
+Thank you for your business!
+
+Best regards,
+The Bonus Program Team
+            """
+
+def create_points_confirmed_notifications(month, user_totals):
+    """
+    Create the monthly approval notifications, one per client, without
+    sending them. Users and their refreshed balances are read together, a
+    batch of clients per query. Pass the result to queue_notifications or
+    send them from a job.
+
+    Args:
+        month (date): Any day of the approved month.
+        user_totals (dict): user id -> points confirmed for the client.
+
+    Returns:
+        list[EmailNotification]: The created notifications.
+    """
+    user_ids = sorted(user_totals)
+    notifications = []
+    for start in range(0, len(user_ids), NOTIFICATION_BATCH_SIZE):
+        users = User.objects.filter(id__in=user_ids[start:start + NOTIFICATION_BATCH_SIZE]).select_related('points_balance')
+        notifications += EmailNotification.objects.bulk_create([
+            EmailNotification(
+                user=user,
+                subject=POINTS_CONFIRMED_SUBJECT,
+                message=points_confirmed_message(
+                    user, month, user_totals[user.id],
+                    user.points_balance.points if hasattr(user, 'points_balance') else 0,
+                ),
+            )
+            for user in users
+        ])
+    return notifications
+
+def notify_points_added(transaction):
+    """
+    Notify user when points are added to their account
+    """
+    if transaction.value <= 0:
+        return
     
-    return send_email_notification(transaction.user, subject, message)
+    message = points_added_message(transaction, transaction.user.get_balance())
+    return send_email_notification(transaction.user, POINTS_ADDED_SUBJECT, message)
 
 def notify_reward_status_change(reward_request):
     """
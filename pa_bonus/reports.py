@@ -3,7 +3,7 @@ Reports Framework for the Bonus System.
 
 This module provides a pluggable report generation system. Each report is a subclass
 of BaseReport that defines its own column headers and data-gathering logic. The framework
-handles all shared concerns: Excel file creation, header styling, column auto-sizing,
+handles all shared concerns: Excel file creation, header styling, column sizing,
 and HTTP response packaging.
 
 To add a new report:
@@ -14,25 +14,31 @@ To add a new report:
 
 Architecture Notes:
     - Reports are auto-registered via __init_subclass__, so there is no manual registry.
-    - All reports produce .xlsx files using openpyxl for consistency.
+    - All reports produce .xlsx files using openpyxl for consistency. Workbooks are
+      written in write-only (streaming) mode through a temporary file, so memory use
+      does not grow with the size of the report.
     - The get_rows() method should yield lists of values matching the header order.
+      It is consumed lazily, so a generator keeps even huge reports out of memory.
       This is a deliberate design choice over returning dicts, because it avoids the
       overhead of dict key lookups for every cell in potentially large exports.
 """
 
-import io
 import logging
+import tempfile
 from abc import abstractmethod
 from collections import defaultdict
-from datetime import date
+from datetime import date, timedelta
+from itertools import chain, islice
 
 from dateutil.relativedelta import relativedelta
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import FileResponse
 from django.utils import timezone
-from django.db.models import F, IntegerField, Sum, Q, Value, DecimalField
+from django.db.models import Sum, Q, Value, DecimalField
 from django.db.models.functions import Coalesce
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
@@ -55,6 +61,87 @@ def get_report_by_id(report_id: str) -> type["BaseReport"] | None:
     return _report_registry.get(report_id)
 
 
+# ---------------------------------------------------------------------------
+# Background Jobs
+# ---------------------------------------------------------------------------
+
+# A finished report younger than this is handed out again instead of regenerated
+REPORT_JOB_REUSE_SECONDS = getattr(settings, 'REPORT_JOB_REUSE_SECONDS', 15 * 60)
+# Seconds a worker may spend on one report; a job pending or running for longer is dead
+REPORT_TASK_TIMEOUT = getattr(settings, 'REPORT_TASK_TIMEOUT', 30 * 60)
+# A finished job is kept this much longer than it is reused, then deleted with its file
+REPORT_JOB_RETENTION_SECONDS = getattr(settings, 'REPORT_JOB_RETENTION_SECONDS', 24 * 60 * 60)
+
+
+def submit_report_job(report_id: str, user, parameters: dict | None = None):
+    """
+    Queue a report for background generation, or reuse an identical job.
+
+    A job for the same report and parameters that is still pending or running,
+    or that completed within REPORT_JOB_REUSE_SECONDS, is returned as is.
+    Otherwise a new ReportJob is created and pa_bonus.tasks.generate_report_task
+    is queued for it, with REPORT_TASK_TIMEOUT as its timeout.
+
+    A job still pending or running REPORT_TASK_TIMEOUT after it was requested or
+    started lost its worker (killed by the timeout, or the cluster went down);
+    it is marked FAILED first, so it is never handed out again. Old finished
+    jobs are purged as well, see purge_report_jobs.
+
+    Returns:
+        tuple[ReportJob, bool]: The job and whether it was reused.
+    """
+    from django_q.tasks import async_task
+    from pa_bonus.models import ReportJob
+
+    parameters = parameters or {}
+    now = timezone.now()
+    (
+        ReportJob.objects
+        .filter(status__in=['PENDING', 'RUNNING'])
+        .alias(active_since=Coalesce('started_at', 'requested_at'))
+        .filter(active_since__lt=now - timedelta(seconds=REPORT_TASK_TIMEOUT))
+        .update(status='FAILED', finished_at=now, error_message="The report did not finish in time.")
+    )
+    purge_report_jobs(now)
+
+    fresh_after = now - timedelta(seconds=REPORT_JOB_REUSE_SECONDS)
+    existing = (
+        ReportJob.objects
+        .filter(report_id=report_id, parameters=parameters)
+        .filter(Q(status__in=['PENDING', 'RUNNING']) | Q(status='COMPLETED', finished_at__gte=fresh_after))
+        .order_by('-requested_at')
+        .first()
+    )
+    if existing:
+        return existing, True
+
+    job = ReportJob.objects.create(report_id=report_id, parameters=parameters, requested_by=user)
+    async_task('pa_bonus.tasks.generate_report_task', job.id, timeout=REPORT_TASK_TIMEOUT)
+    return job, False
+
+
+def purge_report_jobs(now=None):
+    """
+    Delete the jobs that finished (completed, failed or given up on) more than
+    REPORT_JOB_REUSE_SECONDS + REPORT_JOB_RETENTION_SECONDS ago, and their files.
+
+    Returns:
+        int: Number of jobs deleted.
+    """
+    from pa_bonus.models import ReportJob
+
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=REPORT_JOB_REUSE_SECONDS + REPORT_JOB_RETENTION_SECONDS)
+    expired = list(ReportJob.objects.filter(status__in=['COMPLETED', 'FAILED'], finished_at__lt=cutoff))
+    for job in expired:
+        if job.file:
+            job.file.delete(save=False)
+    ReportJob.objects.filter(id__in=[job.id for job in expired]).delete()
+    if expired:
+        logger.info(f"Purged {len(expired)} expired report job(s)")
+    return len(expired)
+
+
 # ---------------------------------------------------------------------------
 # Shared Styles
 # ---------------------------------------------------------------------------
@@ -74,6 +161,9 @@ NUMBER_FORMAT_PERCENT = "0.00%"
 NUMBER_FORMAT_CURRENCY = '#,##0.00'
 NUMBER_FORMAT_INTEGER = '#,##0'
 
+# Rows buffered to estimate column widths before streaming the rest
+COLUMN_WIDTH_SAMPLE_ROWS = 500
+
 
 # ---------------------------------------------------------------------------
 # Base Report
@@ -147,100 +237,141 @@ class BaseReport:
 
     # -- Core generation logic (not intended to be overridden) --
 
-    def generate_workbook(self) -> Workbook:
+    def write_workbook(self, fileobj) -> int:
         """
-        Build and return a fully-populated openpyxl Workbook.
-
-        This is the workhorse method.  It:
-            1. Creates the workbook and active sheet
-            2. Writes styled headers
-            3. Writes all data rows
-            4. Applies number formats
-            5. Auto-sizes columns
+        Stream the report into an .xlsx file.
+
+        Uses an openpyxl write-only workbook, so rows go straight to the file as
+        they come out of get_rows() and memory stays flat however large the
+        report is. It:
+            1. Buffers the first COLUMN_WIDTH_SAMPLE_ROWS rows to size the columns
+            2. Writes styled, frozen headers
+            3. Streams every data row, applying number formats per column
+
+        Only cells with a number format get a style; the data font and
+        alignment are the workbook defaults.
+
+        Args:
+            fileobj: A writable binary file object.
+
+        Returns:
+            int: Number of data rows written.
         """
-        wb = Workbook()
-        ws = wb.active
-        ws.title = self.get_sheet_name()
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=self.get_sheet_name())
 
         headers = self.get_headers()
         column_formats = self.get_column_formats()
 
+        rows = iter(self.get_rows())
+        sample = list(islice(rows, COLUMN_WIDTH_SAMPLE_ROWS))
+
+        # -- Column widths must be set before the first row is written --
+        for col_idx, width in enumerate(self._estimate_column_widths(headers, sample), start=1):
+            ws.column_dimensions[get_column_letter(col_idx)].width = width
+
+        # Freeze the header row so it stays visible when scrolling
+        ws.freeze_panes = "A2"
+
         # -- Write header row --
-        for col_idx, header in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col_idx, value=header)
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
             cell.font = HEADER_FONT
             cell.fill = HEADER_FILL
             cell.alignment = HEADER_ALIGNMENT
             cell.border = HEADER_BORDER
-
-        # Freeze the header row so it stays visible when scrolling
-        ws.freeze_panes = "A2"
+            header_cells.append(cell)
+        ws.append(header_cells)
 
         # -- Write data rows --
-        for row_idx, row_data in enumerate(self.get_rows(), start=2):
-            for col_idx, value in enumerate(row_data, start=1):
-                cell = ws.cell(row=row_idx, column=col_idx, value=value)
-                cell.font = DATA_FONT
-                cell.alignment = DATA_ALIGNMENT
-
-                # Apply column-specific number format if defined
-                fmt = column_formats.get(col_idx - 1)
-                if fmt:
-                    cell.number_format = fmt
-
-        # -- Auto-size columns --
-        self._auto_size_columns(ws, headers)
-
-        return wb
-
-    def generate_response(self) -> HttpResponse:
+        formatted = sorted(column_formats.items())
+        row_count = 0
+        for row_data in chain(sample, rows):
+            if formatted:
+                row_data = list(row_data)
+                for col_idx, fmt in formatted:
+                    if col_idx < len(row_data):
+                        cell = WriteOnlyCell(ws, value=row_data[col_idx])
+                        cell.number_format = fmt
+                        row_data[col_idx] = cell
+            ws.append(row_data)
+            row_count += 1
+
+        wb.save(fileobj)
+        return row_count
+
+    def generate_response(self) -> FileResponse:
         """
-        Generate the workbook and wrap it in an HttpResponse with the correct
-        content type and Content-Disposition for browser download.
+        Write the report to a temporary file and stream it back as a browser
+        download, so neither the workbook nor the finished file is ever held in
+        memory. The file is removed once the response is closed.
         """
-        wb = self.generate_workbook()
-
-        buffer = io.BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
+        tmp = tempfile.TemporaryFile(suffix=".xlsx")
+        try:
+            self.write_workbook(tmp)
+        except Exception:
+            tmp.close()
+            raise
+        tmp.seek(0)
 
         timestamp = timezone.now().strftime("%Y%m%d_%H%M")
         filename = f"{self.filename_prefix}_{timestamp}.xlsx"
 
-        response = HttpResponse(
-            buffer.getvalue(),
+        return FileResponse(
+            tmp,
+            as_attachment=True,
+            filename=filename,
             content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
-        response["Content-Disposition"] = f'attachment; filename="{filename}"'
-        return response
 
     # -- Private helpers --
 
     @staticmethod
-    def _auto_size_columns(ws, headers: list[str]):
+    def _estimate_column_widths(headers: list[str], sample_rows: list) -> list[int]:
         """
-        Set each column width to the maximum of the header length and the
-        longest data value in that column, with a reasonable cap.
+        Width for each column: the maximum of the header length and the longest
+        value in the sampled rows, with a reasonable cap.
 
-        This is an approximation -- openpyxl does not support true auto-fit
-        because that is a client-side feature in Excel.  The heuristic here
-        works well for typical data.
+        This is an approximation -- Excel's auto-fit is a client-side feature,
+        and in a streamed file widths have to be known before the data is. The
+        first rows are representative for the reports here.
         """
         MIN_WIDTH = 10
         MAX_WIDTH = 50
 
-        for col_idx in range(1, len(headers) + 1):
-            col_letter = get_column_letter(col_idx)
-            max_length = len(str(headers[col_idx - 1]))
-
-            for row in ws.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx):
-                for cell in row:
-                    if cell.value is not None:
-                        max_length = max(max_length, len(str(cell.value)))
+        widths = []
+        for col_idx, header in enumerate(headers):
+            max_length = len(str(header))
+            for row in sample_rows:
+                if col_idx < len(row) and row[col_idx] is not None:
+                    max_length = max(max_length, len(str(row[col_idx])))
 
             # Apply width with padding, clamped to our bounds
-            adjusted = min(max(max_length + 3, MIN_WIDTH), MAX_WIDTH)
-            ws.column_dimensions[col_letter].width = adjusted
+            widths.append(min(max(max_length + 3, MIN_WIDTH), MAX_WIDTH))
+        return widths
+
+
+# ---------------------------------------------------------------------------
+# Bulk Lookups
+# ---------------------------------------------------------------------------
+
+
+def _primary_sales_reps() -> dict:
+    """
+    The primary Sales Rep of every region, in one query.
+
+    The bulk form of User.get_sales_rep(), for reports that list many clients.
+
+    Returns:
+        dict: region id -> Sales Rep User
+    """
+    from pa_bonus.models import RegionRep
+
+    reps = {}
+    for assignment in RegionRep.objects.filter(is_active=True, is_primary=True).select_related("user"):
+        reps.setdefault(assignment.region_id, assignment.user)
+    return reps
 
 
 # ---------------------------------------------------------------------------
@@ -297,16 +428,17 @@ class AllClientsReport(BaseReport):
         }
 
     def get_rows(self) -> list[list]:
-        from pa_bonus.models import User, UserContract, UserContractGoal, PointsTransaction
-        from pa_bonus.utilities import calculate_turnover_for_goal
+        from pa_bonus.models import User, UserContract, UserContractGoal
+        from pa_bonus.utilities import calculate_turnovers, turnover_spec
 
         today = timezone.now().date()
+        clients = Q(is_staff=False, is_superuser=False)
 
         # Fetch all non-staff users with annotated point balances in a single query.
         # This avoids N+1 queries -- one of the most common performance pitfalls.
         users = (
             User.objects
-            .filter(is_staff=False, is_superuser=False)
+            .filter(clients)
             .select_related("region")
             .annotate(
                 available_points=Coalesce(
@@ -323,43 +455,51 @@ class AllClientsReport(BaseReport):
             .order_by("last_name", "first_name")
         )
 
+        # Everything else is loaded for all clients at once and matched up in
+        # Python, so the query count does not grow with the number of clients.
+        # The model orderings decide which row wins where a user has several,
+        # exactly as .first() did per user.
+        contracts = {}
+        for contract in UserContract.objects.filter(is_active=True, user_id__in=User.objects.filter(clients)):
+            contracts.setdefault(contract.user_id_id, contract)
+
+        goals = {}
+        current_goals = (
+            UserContractGoal.objects
+            .filter(
+                user_contract__is_active=True,
+                user_contract__user_id__in=User.objects.filter(clients),
+                goal_period_from__lte=today,
+                goal_period_to__gte=today,
+            )
+            .select_related("user_contract__user_id")
+            .prefetch_related("brands")
+        )
+        for goal in current_goals:
+            goals.setdefault(goal.user_contract_id, goal)
+
+        specs = {
+            goal.id: turnover_spec(goal, goal.goal_period_from, min(today, goal.goal_period_to))
+            for goal in goals.values()
+        }
+        turnovers = calculate_turnovers(specs.values())
+        sales_reps = _primary_sales_reps()
+
         rows = []
         for user in users:
-            # Active contract
-            contract = (
-                UserContract.objects
-                .filter(user_id=user, is_active=True)
-                .first()
-            )
+            contract = contracts.get(user.id)
+            current_goal = goals.get(contract.id) if contract else None
 
-            # Current extra goal -- the one whose period covers today
-            current_goal = None
             goal_turnover = None
             goal_percentage = None
-            if contract:
-                current_goal = (
-                    UserContractGoal.objects
-                    .filter(
-                        user_contract=contract,
-                        goal_period_from__lte=today,
-                        goal_period_to__gte=today,
-                    )
-                    .prefetch_related("brands")
-                    .first()
+            if current_goal:
+                goal_turnover = float(turnovers[specs[current_goal.id]])
+                goal_percentage = (
+                    goal_turnover / current_goal.goal_value
+                    if current_goal.goal_value > 0 else 0
                 )
-                if current_goal:
-                    goal_turnover = float(calculate_turnover_for_goal(
-                        user,
-                        current_goal.brands.all(),
-                        current_goal.goal_period_from,
-                        min(today, current_goal.goal_period_to),
-                    ))
-                    goal_percentage = (
-                        goal_turnover / current_goal.goal_value
-                        if current_goal.goal_value > 0 else 0
-                    )
-
-            sales_rep = user.get_sales_rep()
+
+            sales_rep = sales_reps.get(user.region_id)
 
             rows.append([
                 user.user_number,
@@ -435,30 +575,31 @@ class ExtraGoalsReport(BaseReport):
 
     def get_rows(self) -> list[list]:
         from pa_bonus.models import UserContractGoal
-        from pa_bonus.utilities import calculate_turnover_for_goal
+        from pa_bonus.utilities import calculate_turnovers, turnover_spec
 
         today = timezone.now().date()
 
-        goals = (
+        goals = list(
             UserContractGoal.objects
             .filter(goal_period_from__lte=today, goal_period_to__gte=today)
             .select_related("user_contract__user_id__region")
             .prefetch_related("brands")
             .order_by("user_contract__user_id__last_name")
         )
+        specs = {
+            goal.id: turnover_spec(goal, goal.goal_period_from, min(today, goal.goal_period_to))
+            for goal in goals
+        }
+        turnovers = calculate_turnovers(specs.values())
+        sales_reps = _primary_sales_reps()
 
         rows = []
         for goal in goals:
             user = goal.user_contract.user_id
-            turnover = float(calculate_turnover_for_goal(
-                user,
-                goal.brands.all(),
-                goal.goal_period_from,
-                min(today, goal.goal_period_to),
-            ))
+            turnover = float(turnovers[specs[goal.id]])
             percentage = turnover / goal.goal_value if goal.goal_value > 0 else 0
             remaining = max(0, goal.goal_value - turnover)
-            sales_rep = user.get_sales_rep()
+            sales_rep = sales_reps.get(user.region_id)
 
             rows.append([
                 user.user_number,
@@ -542,9 +683,10 @@ class PointsReport(BaseReport):
             .order_by("last_name", "first_name")
         )
 
+        sales_reps = _primary_sales_reps()
         rows = []
         for user in users:
-            sales_rep = user.get_sales_rep()
+            sales_rep = sales_reps.get(user.region_id)
             rows.append([
                 user.user_number,
                 user.last_name,
@@ -607,10 +749,11 @@ class RewardRequestsReport(BaseReport):
             .order_by("-requested_at")
         )
 
+        sales_reps = _primary_sales_reps()
         rows = []
         for req in requests:
             user = req.user
-            sales_rep = user.get_sales_rep()
+            sales_rep = sales_reps.get(user.region_id)
             rows.append([
                 req.id,
                 user.user_number,
@@ -682,11 +825,12 @@ class ItemisedRewardsReport(BaseReport):
             .order_by("-reward_request__requested_at", "reward__abra_code")
         )
 
+        sales_reps = _primary_sales_reps()
         rows = []
         for item in items:
             req = item.reward_request
             user = req.user
-            sales_rep = user.get_sales_rep()
+            sales_rep = sales_reps.get(user.region_id)
 
             rows.append([
                 req.id,
@@ -707,6 +851,26 @@ class ItemisedRewardsReport(BaseReport):
         return rows
 
 
+def _expiring_by_month_end(users, month_ends):
+    """
+    {user_id -> {month_end -> points}} for credits expiring on one of the given
+    month-ends (consecutive, starting this month), from the shared expiring-points
+    engine. Overdue credits are left out: the reports look forward only.
+    """
+    from pa_bonus.services.points import expiring_points_by_user
+
+    today = timezone.now().date()
+    by_user = expiring_points_by_user(
+        users, as_of=today, horizon_months=len(month_ends), by_month=True,
+        include_overdue=False,
+    )
+    wanted = set(month_ends)
+    return {
+        user_id: {expires_at: points for expires_at, points in user_expiry.items() if expires_at in wanted}
+        for user_id, user_expiry in by_user.items()
+    }
+
+
 class PointExpirationSummaryReport(BaseReport):
     """
     Report 7: Point Expiration Summary.
@@ -751,26 +915,10 @@ class PointExpirationSummaryReport(BaseReport):
             .aggregate(total=Coalesce(Sum('value'), Value(0)))['total']
         )
 
-        credits = (
-            PointsTransaction.objects
-            .filter(
-                status='CONFIRMED',
-                value__gt=0,
-                expires_at__isnull=False,
-                expires_at__in=month_ends,
-            )
-            .annotate(
-                remaining_points=F('value') - Coalesce(
-                    Sum('allocations_out__amount'),
-                    Value(0, output_field=IntegerField()),
-                )
-            )
-            .filter(remaining_points__gt=0)
-        )
-
         by_month: dict = defaultdict(int)
-        for credit in credits:
-            by_month[credit.expires_at] += credit.remaining_points
+        for user_expiry in _expiring_by_month_end(None, month_ends).values():
+            for expires_at, points in user_expiry.items():
+                by_month[expires_at] += points
 
         rows = []
         running_balance = current_balance
@@ -822,7 +970,7 @@ class PointExpirationByClientReport(BaseReport):
         return {i: NUMBER_FORMAT_INTEGER for i in range(6, 18)}
 
     def get_rows(self) -> list[list]:
-        from pa_bonus.models import User, PointsTransaction
+        from pa_bonus.models import User
 
         month_ends = self._month_ends()
 
@@ -833,27 +981,8 @@ class PointExpirationByClientReport(BaseReport):
             .order_by('last_name', 'first_name')
         )
 
-        credits = (
-            PointsTransaction.objects
-            .filter(
-                status='CONFIRMED',
-                value__gt=0,
-                expires_at__isnull=False,
-                expires_at__in=month_ends,
-            )
-            .annotate(
-                remaining_points=F('value') - Coalesce(
-                    Sum('allocations_out__amount'),
-                    Value(0, output_field=IntegerField()),
-                )
-            )
-            .filter(remaining_points__gt=0)
-        )
-
         # {user_id -> {expires_at -> total_remaining}}
-        by_user: dict = defaultdict(lambda: defaultdict(int))
-        for credit in credits:
-            by_user[credit.user_id][credit.expires_at] += credit.remaining_points
+        by_user = _expiring_by_month_end(users, month_ends)
 
         rows = []
         for user in users:
@@ -935,12 +1064,12 @@ class PreviousExtraGoalsReport(BaseReport):
 
     def get_rows(self) -> list[list]:
         from pa_bonus.models import UserContractGoal, GoalEvaluation
-        from pa_bonus.utilities import calculate_turnover_for_goal
+        from pa_bonus.utilities import calculate_turnovers, turnover_spec
 
         today = timezone.now().date()
 
         # Completed goals: the period end date is strictly in the past.
-        goals = (
+        goals = list(
             UserContractGoal.objects
             .filter(goal_period_to__lt=today)
             .select_related("user_contract__user_id__region")
@@ -951,18 +1080,19 @@ class PreviousExtraGoalsReport(BaseReport):
             )
         )
 
+        # Full-period turnover.  Because the period has ended we use the
+        # actual goal_period_to rather than min(today, ...).
+        specs = {
+            goal.id: turnover_spec(goal, goal.goal_period_from, goal.goal_period_to)
+            for goal in goals
+        }
+        turnovers = calculate_turnovers(specs.values())
+
+        sales_reps = _primary_sales_reps()
         rows = []
         for goal in goals:
             user = goal.user_contract.user_id
-
-            # Full-period turnover.  Because the period has ended we use the
-            # actual goal_period_to rather than min(today, ...).
-            final_turnover = float(calculate_turnover_for_goal(
-                user,
-                goal.brands.all(),
-                goal.goal_period_from,
-                goal.goal_period_to,
-            ))
+            final_turnover = float(turnovers[specs[goal.id]])
 
             percentage = (
                 final_turnover / goal.goal_value if goal.goal_value > 0 else 0
@@ -994,7 +1124,7 @@ class PreviousExtraGoalsReport(BaseReport):
             else:
                 eval_status = "Partially Evaluated"
 
-            sales_rep = user.get_sales_rep()
+            sales_rep = sales_reps.get(user.region_id)
 
             rows.append([
                 user.user_number,
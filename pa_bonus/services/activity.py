@@ -0,0 +1,164 @@
+"""
+User activity recorder
+======================
+Counts authenticated page loads per user and day for UserActivity without
+touching the database on every request.
+
+UserActivityMiddleware hands each request to activity_recorder, which adds it
+to a per-process buffer of (user, date) -> visits and latest visit. The buffer
+is written behind, when USER_ACTIVITY_FLUSH_SECONDS have passed since the last
+write or it holds USER_ACTIVITY_MAX_PENDING user-days, and when the process
+exits. A write inserts the missing rows and adds the buffered visits with one
+UPDATE of visit_count = visit_count + n, so several processes flushing at once
+never lose visits. Requests under USER_ACTIVITY_SKIP_PREFIXES (static files
+and the pages polled by JavaScript) are not counted at all.
+
+The activity dashboard therefore lags by up to one flush interval, and a
+process that is killed loses its unwritten visits.
+
+Usage:
+    from pa_bonus.services.activity import activity_recorder
+
+    activity_recorder.record(request.user.pk)
+    activity_recorder.flush()
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from pa_bonus.models import User, UserActivity
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FLUSH_SECONDS = getattr(settings, 'USER_ACTIVITY_FLUSH_SECONDS', 60)
+ACTIVITY_MAX_PENDING = getattr(settings, 'USER_ACTIVITY_MAX_PENDING', 500)
+ACTIVITY_SKIP_PREFIXES = tuple(getattr(settings, 'USER_ACTIVITY_SKIP_PREFIXES', (
+    '/static/',
+    '/media/',
+    '/manager/check-invoices/',
+    '/manager/upload_history/progress/',
+    '/manager/reports/jobs/',
+    '/manager/transactions/approve/jobs/',
+)))
+
+# User-days written per UPDATE statement.
+ACTIVITY_BATCH_SIZE = 500
+
+
+def is_tracked(path):
+    """Whether requests to the path count as visits."""
+    return not path.startswith(ACTIVITY_SKIP_PREFIXES)
+
+
+def write_activity(visits):
+    """
+    Add buffered visits to UserActivity.
+
+    Rows missing for a user-day are inserted with no visits, then every
+    user-day's count is raised by its visits and its last activity moved
+    forward, all in one UPDATE per batch. Visits of deleted users are dropped.
+
+    Args:
+        visits (dict): (user_id, date) -> (visit count, latest visit time).
+
+    Returns:
+        int: Number of user-days written.
+    """
+    existing = set(User.objects.filter(id__in={user_id for user_id, _ in visits}).values_list('id', flat=True))
+    keys = [key for key in visits if key[0] in existing]
+
+    for start in range(0, len(keys), ACTIVITY_BATCH_SIZE):
+        batch = keys[start:start + ACTIVITY_BATCH_SIZE]
+        matches, counts, latest = Q(), [], []
+        for user_id, day in batch:
+            count, last_activity = visits[(user_id, day)]
+            match = Q(user_id=user_id, date=day)
+            matches |= match
+            counts.append(When(match, then=Value(count)))
+            latest.append(When(match, then=Value(last_activity)))
+
+        with transaction.atomic():
+            UserActivity.objects.bulk_create(
+                [
+                    UserActivity(user_id=user_id, date=day, last_activity=visits[(user_id, day)][1], visit_count=0)
+                    for user_id, day in batch
+                ],
+                ignore_conflicts=True,
+            )
+            UserActivity.objects.filter(matches).update(
+                visit_count=F('visit_count') + Case(*counts, default=Value(0), output_field=IntegerField()),
+                last_activity=Greatest(
+                    'last_activity', Case(*latest, default=F('last_activity'), output_field=DateTimeField()),
+                ),
+            )
+    return len(keys)
+
+
+class ActivityRecorder:
+    """
+    Per-process, thread-safe buffer of visits, written behind by flush().
+
+    Args:
+        flush_seconds (float | None): Write at most this long after the last
+            write; USER_ACTIVITY_FLUSH_SECONDS by default.
+        max_pending (int | None): Write once this many user-days are buffered;
+            USER_ACTIVITY_MAX_PENDING by default.
+        clock (callable): Monotonic time source, replaceable in tests.
+    """
+
+    def __init__(self, flush_seconds=None, max_pending=None, clock=time.monotonic):
+        self.flush_seconds = ACTIVITY_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.max_pending = max_pending or ACTIVITY_MAX_PENDING
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = clock()
+
+    def record(self, user_id, when=None):
+        """Count one visit, writing the buffer if it is due."""
+        when = when or timezone.now()
+        key = (user_id, when.date())
+        with self.lock:
+            count, last_activity = self.pending.get(key, (0, when))
+            self.pending[key] = (count + 1, max(last_activity, when))
+            due = (
+                len(self.pending) >= self.max_pending
+                or self.clock() - self.last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered visits. A failed write is logged and its visits
+        dropped, so tracking never breaks a request.
+
+        Returns:
+            int: Number of user-days written.
+        """
+        with self.lock:
+            visits, self.pending = self.pending, {}
+            self.last_flush = self.clock()
+        if not visits:
+            return 0
+        try:
+            return write_activity(visits)
+        except Exception as e:
+            logger.error(f"Error writing user activity for {len(visits)} user-day(s): {e}")
+            return 0
+
+    def clear(self):
+        """Drop the buffered visits without writing them."""
+        with self.lock:
+            self.pending = {}
+
+
+activity_recorder = ActivityRecorder()
+atexit.register(activity_recorder.flush)
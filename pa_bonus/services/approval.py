@@ -0,0 +1,132 @@
+"""
+Monthly transaction approval
+============================
+Confirms a month's pending points transactions set-based: one query locking
+the pending rows, one update per batch of their ids, the balances of exactly
+those clients refreshed and one notification per client created in bulk.
+
+The approval page only queues a TransactionApprovalJob with
+submit_approval_job and returns; pa_bonus.tasks.approve_transactions_task runs
+approve_month in the background and sends the notifications, recording its
+progress on the job.
+
+Usage:
+    from pa_bonus.services.approval import month_range, submit_approval_job
+
+    start_date, end_date = month_range(2025, 3)
+    job, reused = submit_approval_job(2025, 3, request.user)
+"""
+import logging
+from datetime import date, timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from pa_bonus.models import PointsTransaction, TransactionApprovalJob
+from pa_bonus.notifications import create_points_confirmed_notifications
+from pa_bonus.services.balances import refresh_balances
+
+logger = logging.getLogger(__name__)
+
+# Transactions confirmed per UPDATE statement.
+APPROVAL_BATCH_SIZE = 1000
+# Seconds a worker may spend on one approval; a job pending or running for longer is dead
+APPROVAL_TASK_TIMEOUT = getattr(settings, 'APPROVAL_TASK_TIMEOUT', 30 * 60)
+
+
+def month_range(year, month):
+    """First and last day of a calendar month."""
+    start_date = date(year, month, 1)
+    return start_date, start_date + relativedelta(day=31)
+
+
+def approve_month(year, month):
+    """
+    Confirm every pending transaction dated in the month, in one database
+    transaction, and create one notification per client about the points
+    confirmed for them. The notifications are not sent.
+
+    The pending rows are locked and read first; the totals, the update and the
+    balance refresh all use exactly those rows, so a transaction whose status
+    changes concurrently is either approved and counted or neither.
+
+    Returns:
+        dict: transaction_count, points_total, user_count and the
+            notification_ids to send.
+    """
+    start_date, end_date = month_range(year, month)
+    with transaction.atomic():
+        pending = list(
+            PointsTransaction.objects
+            .select_for_update()
+            .filter(status='PENDING', date__gte=start_date, date__lte=end_date)
+            .order_by('id')
+            .values_list('id', 'user_id', 'value')
+        )
+        user_totals = {}
+        for _, user_id, value in pending:
+            user_totals[user_id] = user_totals.get(user_id, 0) + value
+        user_totals = dict(sorted(user_totals.items()))
+
+        ids = [pk for pk, _, _ in pending]
+        for start in range(0, len(ids), APPROVAL_BATCH_SIZE):
+            PointsTransaction.objects.filter(id__in=ids[start:start + APPROVAL_BATCH_SIZE]).update(status='CONFIRMED')
+
+        refresh_balances(list(user_totals))
+        notifications = create_points_confirmed_notifications(start_date, user_totals)
+
+    result = {
+        'transaction_count': len(pending),
+        'points_total': sum(user_totals.values()),
+        'user_count': len(user_totals),
+        'notification_ids': [notification.id for notification in notifications],
+    }
+    logger.info(
+        f"Approved {result['transaction_count']} transactions of {year}-{month:02d} "
+        f"for {result['user_count']} clients"
+    )
+    return result
+
+
+def submit_approval_job(year, month, user):
+    """
+    Queue the approval of a month, or return the approval of the same month
+    that is still pending or running.
+
+    The job is handed to django-q once the current database transaction
+    commits, so the worker always finds it, with APPROVAL_TASK_TIMEOUT as its
+    timeout. A job still pending or running that long after it was requested or
+    started lost its worker; it is marked FAILED first and never reused. The
+    approval itself runs in one database transaction, so a killed run confirmed
+    nothing and the new job starts over.
+
+    Returns:
+        tuple[TransactionApprovalJob, bool]: The job and whether it was reused.
+    """
+    from django_q.tasks import async_task
+
+    now = timezone.now()
+    (
+        TransactionApprovalJob.objects
+        .filter(status__in=['PENDING', 'RUNNING'])
+        .alias(active_since=Coalesce('started_at', 'requested_at'))
+        .filter(active_since__lt=now - timedelta(seconds=APPROVAL_TASK_TIMEOUT))
+        .update(status='FAILED', finished_at=now, error_message="The approval did not finish in time.")
+    )
+
+    existing = (
+        TransactionApprovalJob.objects
+        .filter(year=year, month=month, status__in=['PENDING', 'RUNNING'])
+        .first()
+    )
+    if existing:
+        return existing, True
+
+    job = TransactionApprovalJob.objects.create(year=year, month=month, requested_by=user)
+    transaction.on_commit(
+        lambda: async_task('pa_bonus.tasks.approve_transactions_task', job.id, timeout=APPROVAL_TASK_TIMEOUT)
+    )
+    return job, False
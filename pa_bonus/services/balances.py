@@ -0,0 +1,172 @@
+"""
+Materialised points balances
+============================
+Keeps one PointsBalance row per user with their confirmed balance, pending
+points and the points expiring soon, so reading a balance is a single-row
+lookup instead of a SUM over the user's whole transaction history.
+
+A balance is never adjusted by deltas. Every write path that changes a user's
+transactions or allocations calls refresh_balances for the users it touched,
+inside its own database transaction, and the row is recomputed from the
+ledger. The post_save/post_delete signals cover single-row saves; bulk writes
+(bulk_create, queryset.update, the allocation engine) call it explicitly.
+The rebuild_balances command verifies every row and repairs any drift.
+
+Usage:
+    from pa_bonus.services.balances import get_points_balance, refresh_balances
+
+    balance = get_points_balance(user)      # balance.points, .pending_points
+    refresh_balances({txn.user_id for txn in new_transactions})
+"""
+import logging
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from pa_bonus.models import PointsTransaction, PointsBalance
+from pa_bonus.services.cache import invalidate_users
+
+logger = logging.getLogger(__name__)
+
+# "Expiring soon" means within this many months, as on the client dashboard.
+EXPIRING_SOON_MONTHS = 3
+
+# Users recomputed per query when refreshing or rebuilding many balances.
+BALANCE_BATCH_SIZE = 500
+
+BALANCE_FIELDS = ['points', 'pending_points', 'expiring_points']
+
+
+def calculate_balances(user_ids, as_of=None):
+    """
+    Compute balances for a set of users straight from the ledger.
+
+    Two grouped queries regardless of the number of users: one summing
+    transactions per (user, status), one summing the stored remaining_points of
+    credits expiring within EXPIRING_SOON_MONTHS of as_of (overdue, not yet
+    expired credits included, like expiring_points_total).
+
+    Args:
+        user_ids (iterable[int]): The users to compute.
+        as_of (date | None): Reference date for the expiring figure; defaults to today.
+
+    Returns:
+        dict: user_id -> {'points', 'pending_points', 'expiring_points'}.
+    """
+    as_of = as_of or timezone.now().date()
+    horizon = as_of + relativedelta(months=EXPIRING_SOON_MONTHS)
+    user_ids = list(user_ids)
+    balances = {user_id: dict.fromkeys(BALANCE_FIELDS, 0) for user_id in user_ids}
+
+    totals = (
+        PointsTransaction.objects
+        .filter(user_id__in=user_ids, status__in=['CONFIRMED', 'PENDING'])
+        .values('user_id', 'status')
+        .annotate(total=Sum('value'))
+        .order_by()
+    )
+    for row in totals:
+        field = 'points' if row['status'] == 'CONFIRMED' else 'pending_points'
+        balances[row['user_id']][field] = row['total'] or 0
+
+    expiring = (
+        PointsTransaction.objects
+        .filter(
+            user_id__in=user_ids, status='CONFIRMED', value__gt=0, remaining_points__gt=0,
+            expires_at__isnull=False, expires_at__lte=horizon,
+        )
+        .values('user_id')
+        .annotate(total=Sum('remaining_points'))
+        .order_by()
+    )
+    for row in expiring:
+        balances[row['user_id']]['expiring_points'] = row['total']
+
+    return balances
+
+
+def refresh_balances(user_ids, as_of=None):
+    """
+    Recompute and store the balances of the given users.
+
+    Call this inside the same database transaction as the write that changed the
+    users' transactions or allocations, so the balance commits (or rolls back)
+    together with it. Existing rows are locked first, so concurrent refreshes of
+    the same user are serialised.
+
+    The users' cached figures are invalidated as well.
+
+    Args:
+        user_ids (iterable[int]): Users whose ledger changed.
+        as_of (date | None): Reference date for the expiring figure; defaults to today.
+    """
+    user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+    _store_balances(user_ids, as_of or timezone.now().date())
+    invalidate_users(user_ids)
+
+
+def _store_balances(user_ids, as_of):
+    for start in range(0, len(user_ids), BALANCE_BATCH_SIZE):
+        batch = user_ids[start:start + BALANCE_BATCH_SIZE]
+        # The row lock needs a transaction; callers in autocommit (single-row
+        # signal saves, non-atomic views) get one per batch, the others a savepoint.
+        with transaction.atomic():
+            list(PointsBalance.objects.select_for_update().filter(user_id__in=batch).values_list('id'))
+            balances = calculate_balances(batch, as_of)
+            PointsBalance.objects.bulk_create(
+                [
+                    PointsBalance(user_id_id=user_id, date=as_of, **values)
+                    for user_id, values in balances.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['user_id'],
+                update_fields=['date', 'updated_at'] + BALANCE_FIELDS,
+            )
+
+
+def get_points_balance(user):
+    """
+    The materialised balance of a user: a single-row lookup.
+
+    points and pending_points do not depend on the date and are always current.
+    expiring_points is as of the row's date, the day of the last write to the
+    user's ledger; views that show it read expiring_points_total instead. A user
+    without a row has no transactions (migration 0040 filled the table, every
+    ledger write keeps it filled) and gets an unsaved zero balance.
+
+    Returns:
+        PointsBalance: The user's balance row, unsaved if they have none.
+    """
+    balance = PointsBalance.objects.filter(user_id=user).first()
+    if balance is None:
+        balance = PointsBalance(user_id_id=user.pk, date=timezone.now().date())
+    return balance
+
+
+def find_balance_drift(user_ids, as_of=None):
+    """
+    Compare stored balances with the ledger.
+
+    Users without a stored row count as drifted only if they have a non-zero balance.
+
+    Returns:
+        list[tuple[int, dict, dict | None]]: (user_id, expected, stored) for every
+            user whose stored row does not match.
+    """
+    as_of = as_of or timezone.now().date()
+    expected = calculate_balances(user_ids, as_of)
+    stored = {
+        row['user_id']: {field: row[field] for field in BALANCE_FIELDS}
+        for row in PointsBalance.objects.filter(user_id__in=list(expected)).values('user_id', *BALANCE_FIELDS)
+    }
+
+    drift = []
+    for user_id, values in expected.items():
+        current = stored.get(user_id)
+        if current is None and not any(values.values()):
+            continue
+        if current != values:
+            drift.append((user_id, values, current))
+    return drift
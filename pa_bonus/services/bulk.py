@@ -0,0 +1,111 @@
+"""
+Bulk points writes
+==================
+Saving a PointsTransaction fires per-row signals: the owner's balance is
+recomputed and, for confirmed points, a notification is created and queued.
+Code that writes many transactions row by row (credit notes, retroactive
+points, adjustments) wraps the loop in points_bulk_mode() instead. Inside it
+the signals only record what they would have done:
+
+    * the balances of every touched user are refreshed once, when the block
+      exits, still inside its database transaction;
+    * the clients are told about their added points once the transaction
+      commits, one email per client summing all their new transactions, sent
+      by one batch mailer job.
+
+Saved transactions are recorded by id, so saving one twice notifies once, and
+the notifications are built from the transactions as committed. Allocation
+bookkeeping on delete still runs per row. Balances read inside the block are
+stale until it exits.
+
+Usage:
+    from pa_bonus.services.bulk import points_bulk_mode
+
+    with points_bulk_mode():
+        for row in rows:
+            PointsTransaction.objects.create(...)
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+
+from pa_bonus.models import PointsTransaction
+from pa_bonus.notifications import create_points_summary_notifications, queue_notifications
+from pa_bonus.services.balances import refresh_balances
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('points_bulk_write', default=None)
+
+
+class PointsBulkWrite:
+    """What the signals deferred inside one points_bulk_mode block."""
+
+    def __init__(self):
+        self.user_ids = set()
+        self.added_ids = set()
+
+    def balance_changed(self, user_id):
+        self.user_ids.add(user_id)
+
+    def points_added(self, points_transaction):
+        self.added_ids.add(points_transaction.pk)
+
+
+def current_bulk_write():
+    """The PointsBulkWrite of the enclosing points_bulk_mode block, or None."""
+    return _current.get()
+
+
+@contextmanager
+def points_bulk_mode():
+    """
+    Defer the per-row balance and notification work of PointsTransaction
+    saves to the end of the block, in one atomic transaction. A nested block
+    joins the outer one, which does the flush.
+
+    Yields:
+        PointsBulkWrite: The deferred work collected so far.
+    """
+    outer = _current.get()
+    if outer is not None:
+        with transaction.atomic():
+            yield outer
+        return
+
+    bulk_write = PointsBulkWrite()
+    token = _current.set(bulk_write)
+    try:
+        with transaction.atomic():
+            yield bulk_write
+            _current.reset(token)
+            token = None
+            refresh_balances(bulk_write.user_ids)
+            if bulk_write.added_ids:
+                added_ids = list(bulk_write.added_ids)
+                transaction.on_commit(lambda: notify_points_added_in_bulk(added_ids))
+    finally:
+        if token is not None:
+            _current.reset(token)
+
+
+def notify_points_added_in_bulk(transaction_ids):
+    """
+    Create one points-added notification per client for the transactions and
+    queue them for the batch mailer. Transactions rolled back or no longer
+    confirmed are left out.
+
+    Returns:
+        int: Number of notifications queued.
+    """
+    transactions = (
+        PointsTransaction.objects
+        .filter(id__in=transaction_ids, status='CONFIRMED', value__gt=0)
+        .select_related('user', 'brand')
+        .order_by('user_id', 'date', 'id')
+    )
+    queued = queue_notifications(create_points_summary_notifications(transactions))
+    logger.info(f"Queued {queued} points notification(s) for {len(transaction_ids)} transaction(s)")
+    return queued
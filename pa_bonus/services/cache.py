@@ -0,0 +1,294 @@
+"""
+Domain cache
+============
+Caches the figures the dashboards recompute on every hit (balances, expiring
+totals, the reward catalogue, the manager and sales rep dashboard aggregates)
+in Django's default cache: Redis when REDIS_URL is set (always in
+production), nothing otherwise.
+
+Entries are never deleted. Every entry's key embeds the current version of
+each scope it depends on, a user, a region, a brand, the reward catalogue or
+the whole programme, and a write bumps the versions of the scopes it touched,
+so the next read misses and recomputes. Old entries simply expire.
+
+Invalidation is hooked into the write paths rather than into each view:
+
+    * refresh_balances, which every points and allocation write goes
+      through, invalidates the users, their regions and the programme;
+    * signals invalidate on contract, reward request, reward, brand and
+      client (region) changes;
+    * completing an upload and refreshing goal candidates invalidate the
+      programme.
+
+A write made in a transaction bumps the versions when the transaction
+commits, so other processes never cache its uncommitted figures under the new
+versions and a rolled-back write bumps nothing. Until then the transaction
+that wrote reads past the cache: what it would store could be rolled back.
+
+Every lookup counts a hit or a miss per cached value, in the cache itself so
+all processes add up; cache_stats() and the cache_stats command show them.
+
+Usage:
+    from pa_bonus.services.cache import cached, cached_balance, invalidate_users
+
+    balance = cached_balance(user)            # {'points', 'pending_points', 'expiring_points'}
+    stats = cached('manager_dashboard', [GLOBAL], compute_stats)
+    invalidate_users([user.id])
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from pa_bonus.models import Reward, User, UserContract
+
+CACHE_TIMEOUT = getattr(settings, 'PA_BONUS_CACHE_TIMEOUT', 300)
+KEY_PREFIX = 'pa_bonus'
+
+# Scopes an entry can depend on
+GLOBAL = ('global',)
+CATALOGUE = ('catalogue',)
+
+
+def user_scope(user_id):
+    return ('user', user_id)
+
+
+def region_scope(region_id):
+    return ('region', region_id)
+
+
+def brand_scope(brand_id):
+    return ('brand', brand_id)
+
+
+# Names of the cached values, for cache_stats
+CACHED_VALUES = [
+    'balance', 'expiring_total', 'user_brands', 'reward_catalogue', 'manager_dashboard', 'salesrep_dashboard',
+]
+
+
+def _version_key(scope):
+    return f"{KEY_PREFIX}:v:{':'.join(str(part) for part in scope)}"
+
+
+def _stats_key(name, outcome):
+    return f"{KEY_PREFIX}:stats:{name}:{outcome}"
+
+
+def _initial_version():
+    # Start from the clock, not 1: a version evicted from the cache must not
+    # come back as a number whose old entries may still be stored.
+    return int(time.time() * 1000)
+
+
+def scope_versions(scopes):
+    """The current version of each scope, creating the missing ones."""
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), timeout=None)
+
+
+def _uncommitted_invalidations():
+    """How many invalidations of the open transaction are waiting for its commit."""
+    if not connection.in_atomic_block:
+        # Outside a transaction whatever was waiting committed or rolled back
+        connection.pa_bonus_uncommitted_invalidations = 0
+    return getattr(connection, 'pa_bonus_uncommitted_invalidations', 0)
+
+
+def invalidate(scopes):
+    """
+    Make every entry depending on one of the scopes stale, now or, inside a
+    transaction, once it commits.
+    """
+    scopes = dict.fromkeys(scopes)
+    if not connection.in_atomic_block:
+        _bump(scopes)
+        return
+
+    def bump_on_commit():
+        connection.pa_bonus_uncommitted_invalidations = max(0, _uncommitted_invalidations() - 1)
+        _bump(scopes)
+
+    connection.pa_bonus_uncommitted_invalidations = _uncommitted_invalidations() + 1
+    transaction.on_commit(bump_on_commit)
+
+
+def invalidate_users(user_ids, region_ids=None):
+    """
+    Invalidate after the points, contracts or requests of some users changed:
+    the users, their regions and the programme-wide figures.
+
+    Args:
+        user_ids (iterable[int]): The users.
+        region_ids (iterable[int] | None): Their regions, if known; otherwise
+            they are looked up in one query.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    if region_ids is None:
+        region_ids = User.objects.filter(id__in=user_ids, region__isnull=False).values_list('region_id', flat=True)
+    invalidate(
+        [user_scope(user_id) for user_id in sorted(user_ids)]
+        + [region_scope(region_id) for region_id in sorted(set(region_ids)) if region_id is not None]
+        + [GLOBAL]
+    )
+
+
+def invalidate_programme():
+    """Invalidate the programme-wide figures, e.g. after an upload."""
+    invalidate([GLOBAL])
+
+
+def invalidate_catalogue(brand_ids=()):
+    """Invalidate the reward catalogue, after a reward or brand changed."""
+    invalidate([CATALOGUE] + [brand_scope(brand_id) for brand_id in brand_ids if brand_id is not None])
+
+
+def _count(name, outcome):
+    key = _stats_key(name, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cached(name, scopes, compute, *parts, timeout=None):
+    """
+    The cached value of compute(), keyed by name, the scope versions and parts.
+
+    Args:
+        name (str): Which value; one of CACHED_VALUES.
+        scopes (list[tuple]): The scopes the value depends on.
+        compute (callable): Computes the value on a miss; the value must be
+            picklable and not None.
+        *parts: Further key parts, e.g. a date.
+        timeout (int | None): Seconds to keep it; PA_BONUS_CACHE_TIMEOUT by default.
+    """
+    if _uncommitted_invalidations():
+        # Our own uncommitted writes: neither serve the figures from before
+        # them nor cache figures a rollback may undo
+        _count(name, 'misses')
+        return compute()
+
+    versions = scope_versions(scopes)
+    key = ':'.join(
+        [KEY_PREFIX, name]
+        + [f"{'.'.join(str(part) for part in scope)}@{version}" for scope, version in zip(scopes, versions)]
+        + [str(part) for part in parts]
+    )
+    value = cache.get(key)
+    if value is not None:
+        _count(name, 'hits')
+        return value
+
+    _count(name, 'misses')
+    value = compute()
+    cache.set(key, value, CACHE_TIMEOUT if timeout is None else timeout)
+    return value
+
+
+def cache_stats():
+    """
+    Hits and misses per cached value since the last reset_cache_stats().
+
+    Returns:
+        dict: name -> {'hits', 'misses', 'hit_rate'} with hit_rate in percent.
+    """
+    counts = cache.get_many([_stats_key(name, outcome) for name in CACHED_VALUES for outcome in ('hits', 'misses')])
+    stats = {}
+    for name in CACHED_VALUES:
+        hits = counts.get(_stats_key(name, 'hits'), 0)
+        misses = counts.get(_stats_key(name, 'misses'), 0)
+        total = hits + misses
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(100 * hits / total, 1) if total else 0,
+        }
+    return stats
+
+
+def reset_cache_stats():
+    cache.delete_many([_stats_key(name, outcome) for name in CACHED_VALUES for outcome in ('hits', 'misses')])
+
+
+# Helpers for the values the views read
+
+
+def cached_balance(user):
+    """
+    The user's materialised balance as a dict with points, pending_points and
+    expiring_points; the last is as of the day of the user's last ledger write,
+    cached_expiring_total gives today's figure.
+    """
+    from pa_bonus.services.balances import get_points_balance, BALANCE_FIELDS
+
+    def compute():
+        balance = get_points_balance(user)
+        return {field: getattr(balance, field) for field in BALANCE_FIELDS}
+
+    return cached('balance', [user_scope(user.pk)], compute)
+
+
+def cached_expiring_total(user, as_of=None, horizon_months=3):
+    """The points of the user expiring within the horizon, as expiring_points_total."""
+    from pa_bonus.services.points import expiring_points_total
+
+    as_of = as_of or timezone.now().date()
+    return cached(
+        'expiring_total', [user_scope(user.pk)],
+        lambda: expiring_points_total(user, as_of=as_of, horizon_months=horizon_months),
+        as_of, horizon_months,
+    )
+
+
+def cached_reward_catalogue(user):
+    """
+    The active rewards the user can order: those of the brands in their active
+    contracts and those of no brand, most expensive first.
+
+    The user's brands are cached per user; the listing per set of brands, so
+    clients with the same brands share it.
+
+    Returns:
+        list[Reward]
+    """
+    brand_ids = cached('user_brands', [user_scope(user.pk)], lambda: sorted(
+        UserContract.objects
+        .filter(user_id=user, is_active=True, brandbonuses__isnull=False)
+        .values_list('brandbonuses__brand_id', flat=True)
+        .distinct()
+    ))
+
+    def compute():
+        return list(
+            Reward.objects.filter(is_active=True)
+            .filter(Q(brand__in=brand_ids) | Q(brand__isnull=True))
+            .distinct()
+            .order_by('-point_cost')
+        )
+
+    return cached(
+        'reward_catalogue', [CATALOGUE] + [brand_scope(brand_id) for brand_id in brand_ids], compute,
+        *brand_ids,
+    )
@@ -0,0 +1,329 @@
+"""
+Goal evaluation candidates
+==========================
+Maintains GoalEvaluationCandidate, one row per evaluation period of every
+UserContractGoal with its status, net turnover and potential bonus points, so
+the manager dashboard and the goal evaluation page read the periods waiting
+for evaluation from one table instead of walking every goal's periods.
+
+Like the turnover rollup, a goal's rows are never adjusted in place: they are
+deleted and rebuilt from the goal, its evaluations and the turnover rollup.
+Signals refresh a goal when it, its brands or its evaluations change, and the
+upload pipeline refreshes the goals of the clients an upload touched. The
+rebuild_goal_candidates command regenerates the whole table.
+
+Usage:
+    from pa_bonus.services.goals import rebuild_goal_candidates, refresh_goal_candidates
+
+    refresh_goal_candidates([goal.id])
+    rebuild_goal_candidates({invoice.client_number for invoice in changed})
+
+The module also evaluates goal periods (GoalEvaluator) and awards their bonus
+points in bulk (award_goal_evaluations).
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from pa_bonus.models import (
+    GoalEvaluation, GoalEvaluationCandidate, PointsTransaction, UserContractGoal, extra_points_expiry,
+)
+from pa_bonus.notifications import create_points_added_notifications, queue_notifications
+from pa_bonus.services.balances import refresh_balances
+from pa_bonus.services.cache import invalidate_programme
+from pa_bonus.utilities import calculate_turnovers, turnover_spec
+
+# Goals rebuilt per transaction by rebuild_goal_candidates.
+GOAL_BATCH_SIZE = 500
+
+
+def potential_points(goal, start_date, end_date, actual_turnover):
+    """
+    Rough bonus estimate for one period: the bonus share of the turnover above
+    the period base, once the period target is exceeded.
+    """
+    targets = goal.get_period_targets(start_date, end_date)
+    if actual_turnover > targets['goal_value']:
+        return max(0, int((float(actual_turnover) - targets['goal_base']) * goal.bonus_percentage))
+    return 0
+
+
+def refresh_goal_candidates(goal_ids):
+    """
+    Rebuild the candidate rows of the given goals.
+
+    Every evaluation period of a goal gets a row, evaluated or not, with the
+    net turnover over the period; all turnovers are read in one go. Call it
+    inside the transaction that changed the goals, or let it open its own.
+
+    Args:
+        goal_ids (iterable[int]): The goals to rebuild. Ids of deleted goals
+            are ignored.
+
+    Returns:
+        int: Number of candidate rows written.
+    """
+    goal_ids = set(goal_ids)
+    if not goal_ids:
+        return 0
+
+    goals = (
+        UserContractGoal.objects
+        .filter(id__in=goal_ids)
+        .select_related('user_contract__user_id')
+        .prefetch_related('brands', 'evaluations')
+    )
+    periods = []
+    for goal in goals:
+        evaluated = {(evaluation.period_start, evaluation.period_end) for evaluation in goal.evaluations.all()}
+        for start_date, end_date, is_final in goal.get_evaluation_periods():
+            periods.append((goal, start_date, end_date, is_final, (start_date, end_date) in evaluated))
+
+    turnovers = calculate_turnovers(turnover_spec(goal, start, end) for goal, start, end, _, _ in periods)
+    candidates = []
+    for goal, start_date, end_date, is_final, is_evaluated in periods:
+        actual = turnovers[turnover_spec(goal, start_date, end_date)]
+        candidates.append(GoalEvaluationCandidate(
+            goal=goal,
+            period_start=start_date,
+            period_end=end_date,
+            is_final=is_final,
+            status='EVALUATED' if is_evaluated else 'PENDING',
+            actual_turnover=actual,
+            potential_points=potential_points(goal, start_date, end_date, actual),
+        ))
+
+    with transaction.atomic():
+        GoalEvaluationCandidate.objects.filter(goal_id__in=goal_ids).delete()
+        written = len(GoalEvaluationCandidate.objects.bulk_create(candidates))
+    invalidate_programme()
+    return written
+
+
+def rebuild_goal_candidates(client_numbers=None):
+    """
+    Regenerate the candidate table.
+
+    Args:
+        client_numbers (iterable[str] | None): Only rebuild the goals of these
+            clients; None rebuilds every goal.
+
+    Returns:
+        int: Number of candidate rows written.
+    """
+    goals = UserContractGoal.objects.order_by('id')
+    if client_numbers is not None:
+        goals = goals.filter(user_contract__user_id__user_number__in=list(client_numbers))
+    goal_ids = list(goals.values_list('id', flat=True))
+
+    written = 0
+    for start in range(0, len(goal_ids), GOAL_BATCH_SIZE):
+        written += refresh_goal_candidates(goal_ids[start:start + GOAL_BATCH_SIZE])
+    return written
+
+
+# Goal points are capped at 20,000 for 12 months, proportionally for other lengths
+POINTS_CAP_PER_MONTH = 1667
+DAYS_PER_MONTH = 30.44
+
+
+def points_cap(goal):
+    """The most points a goal may award over its whole period."""
+    total_days = (goal.goal_period_to - goal.goal_period_from).days
+    return int(total_days / DAYS_PER_MONTH * POINTS_CAP_PER_MONTH)
+
+
+class GoalEvaluator:
+    """
+    Evaluates goal periods in memory, for the goal evaluation page, its export
+    and the POST handler that awards the points.
+
+    The goals must come with 'brands' and 'evaluations' prefetched: the points
+    already awarded are summed from the prefetched evaluations, and every
+    period and full goal turnover is read in one go when the evaluator is
+    built, so evaluating any number of periods costs a fixed number of queries.
+    Awards made while evaluating are recorded with record(), so later periods
+    of the same goal see them in their cap and recovery figures.
+
+    Args:
+        periods (iterable[tuple]): (goal, period_start, period_end) to evaluate.
+        period_turnovers (dict | None): Period turnovers already known, e.g. from
+            the candidate index, keyed by (goal_id, period_start, period_end);
+            the others are calculated.
+
+    Usage:
+        evaluator = GoalEvaluator(periods)
+        result = evaluator.evaluate(goal, start_date, end_date)
+        evaluator.record(goal, start_date, end_date, result['bonus_points'])
+    """
+
+    def __init__(self, periods, period_turnovers=None):
+        periods = list(periods)
+        self.period_turnovers = dict(period_turnovers or {})
+
+        specs = []
+        for goal, start_date, end_date in periods:
+            specs.append(turnover_spec(goal, goal.goal_period_from, goal.goal_period_to))
+            if (goal.id, start_date, end_date) not in self.period_turnovers:
+                specs.append(turnover_spec(goal, start_date, end_date))
+        self.turnovers = calculate_turnovers(specs)
+
+        # goal id -> {(period_start, period_end): bonus points}
+        self.awarded = {}
+        for goal, _, _ in periods:
+            if goal.id not in self.awarded:
+                self.awarded[goal.id] = {
+                    (evaluation.period_start, evaluation.period_end): evaluation.bonus_points
+                    for evaluation in goal.evaluations.all()
+                }
+
+    def is_evaluated(self, goal, start_date, end_date):
+        return (start_date, end_date) in self.awarded[goal.id]
+
+    def already_awarded(self, goal):
+        return sum(self.awarded[goal.id].values())
+
+    def record(self, goal, start_date, end_date, bonus_points):
+        """Note an evaluation saved for the period."""
+        self.awarded[goal.id][(start_date, end_date)] = bonus_points
+
+    def actual_turnover(self, goal, start_date, end_date):
+        key = (goal.id, start_date, end_date)
+        if key in self.period_turnovers:
+            return self.period_turnovers[key]
+        return self.turnovers[turnover_spec(goal, start_date, end_date)]
+
+    def full_turnover(self, goal):
+        return self.turnovers[turnover_spec(goal, goal.goal_period_from, goal.goal_period_to)]
+
+    def _capped(self, points, cap, already_awarded):
+        """Points that can still be awarded under the cap."""
+        if already_awarded + points > cap:
+            return max(0, cap - already_awarded)
+        return points
+
+    def evaluate(self, goal, start_date, end_date):
+        """
+        Evaluate one period.
+
+        Business rules:
+        1. Milestone evaluations award points if the period target is met.
+        2. Final evaluations with recovery first evaluate the final period
+           normally, then check whether the full goal target is met; if so
+           the points for the whole goal, less those already awarded by
+           milestones, are awarded when that is more.
+        3. All points are subject to the proportional cap.
+
+        Returns:
+            dict: targets, actual_turnover, full_year_actual, already_awarded,
+                points_cap, is_final, evaluation_type, bonus_points, is_achieved.
+        """
+        targets = goal.get_period_targets(start_date, end_date)
+        actual = self.actual_turnover(goal, start_date, end_date)
+        full_actual = self.full_turnover(goal)
+        already_awarded = self.already_awarded(goal)
+        cap = points_cap(goal)
+        is_final = end_date == goal.goal_period_to
+        period_achieved = actual >= targets['goal_value']
+
+        if not is_final:
+            evaluation_type, bonus_points, is_achieved = 'MILESTONE', 0, period_achieved
+            if period_achieved:
+                # Half of the increase from base to goal
+                raw_points = int((targets['goal_value'] - targets['goal_base']) * goal.bonus_percentage)
+                bonus_points = self._capped(raw_points, cap, already_awarded)
+        else:
+            period_points = 0
+            if period_achieved:
+                raw_points = int((float(actual) - targets['goal_base']) * goal.bonus_percentage)
+                period_points = self._capped(raw_points, cap, already_awarded)
+            evaluation_type, bonus_points, is_achieved = 'FINAL', period_points, period_achieved
+
+            if goal.allow_full_period_recovery and full_actual >= goal.goal_value:
+                previous_milestone_points = sum(
+                    points for (_, period_end), points in self.awarded[goal.id].items() if period_end < end_date
+                )
+                year_points = min(int(float(full_actual - goal.goal_base) * goal.bonus_percentage), cap)
+                recovery_points = year_points - previous_milestone_points
+                if recovery_points > period_points:
+                    evaluation_type, bonus_points, is_achieved = 'RECOVERY', recovery_points, True
+
+        return {
+            'targets': targets,
+            'actual_turnover': actual,
+            'full_year_actual': full_actual,
+            'already_awarded': already_awarded,
+            'points_cap': cap,
+            'is_final': is_final,
+            'evaluation_type': evaluation_type,
+            'bonus_points': max(0, bonus_points),
+            'is_achieved': is_achieved,
+        }
+
+
+def award_goal_evaluations(periods, evaluated_by=None):
+    """
+    Evaluate goal periods and save the results in bulk: the evaluations, the
+    EXTRA_POINTS transactions for the awarded points, the balances and the
+    candidate rows of the goals, all in one database transaction.
+
+    Caps and recovery are checked in memory by a GoalEvaluator, earlier periods
+    of a goal first. The transactions are bulk-created, so the per-row signals
+    do not fire: their expiry is set here, the balances are refreshed once, and
+    the points-added emails are created together and sent by one background
+    job after commit. Periods already evaluated are skipped.
+
+    Args:
+        periods (iterable[tuple]): (goal, period_start, period_end); the goals
+            with 'brands', 'evaluations' and user_contract__user_id loaded.
+        evaluated_by (User | None): The manager awarding the points.
+
+    Returns:
+        list[GoalEvaluation]: The saved evaluations.
+    """
+    periods = sorted(periods, key=lambda period: (period[0].id, period[2]))
+    evaluator = GoalEvaluator(periods)
+    today = timezone.now().date()
+
+    evaluations, awards = [], []
+    for goal, start_date, end_date in periods:
+        if evaluator.is_evaluated(goal, start_date, end_date):
+            continue
+        result = evaluator.evaluate(goal, start_date, end_date)
+        evaluator.record(goal, start_date, end_date, result['bonus_points'])
+
+        evaluation = GoalEvaluation(
+            goal=goal,
+            evaluation_date=today,
+            period_start=start_date,
+            period_end=end_date,
+            actual_turnover=result['actual_turnover'],
+            target_turnover=result['targets']['goal_value'],
+            baseline_turnover=result['targets']['goal_base'],
+            is_achieved=result['is_achieved'],
+            bonus_points=result['bonus_points'],
+            evaluation_type=result['evaluation_type'],
+            evaluated_by=evaluated_by,
+        )
+        evaluations.append(evaluation)
+        if result['bonus_points'] > 0:
+            awards.append((evaluation, PointsTransaction(
+                user=goal.user_contract.user_id,
+                value=result['bonus_points'],
+                date=end_date,
+                description=f"Extra bonus za období od {start_date} do {end_date}",
+                type='EXTRA_POINTS',
+                status='CONFIRMED',
+                expires_at=extra_points_expiry(end_date),
+                remaining_points=result['bonus_points'],
+            )))
+
+    with transaction.atomic():
+        transactions = PointsTransaction.objects.bulk_create([points for _, points in awards])
+        for evaluation, points in awards:
+            evaluation.points_transaction = points
+        GoalEvaluation.objects.bulk_create(evaluations)
+
+        refresh_balances({points.user_id for points in transactions})
+        refresh_goal_candidates({evaluation.goal_id for evaluation in evaluations})
+        queue_notifications(create_points_added_notifications(transactions))
+    return evaluations
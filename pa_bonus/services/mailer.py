@@ -0,0 +1,231 @@
+"""
+Batch mailer
+============
+Sends PENDING EmailNotification rows in chunks, one SMTP connection per chunk,
+instead of one django-q task and one SMTP handshake per email.
+
+Each chunk is claimed in a short transaction: locked with SELECT ... FOR UPDATE
+SKIP LOCKED and marked SENDING, so several workers can drain the queue at once
+without sending an email twice. The emails are then sent outside the
+transaction; a chunk left SENDING by a worker that died is claimed again after
+EMAIL_CLAIM_TIMEOUT. Sending is paced to the configured rate; a transient SMTP error (a dropped connection, a
+4xx reply) reconnects and retries the email with exponential backoff, while a
+permanent one (a refused recipient, a 5xx reply) marks it FAILED straight
+away. Every chunk records its throughput as an EmailBatch row.
+
+Settings:
+    EMAIL_BATCH_SIZE      notifications per chunk and connection (100)
+    EMAIL_RATE_LIMIT      emails per second, 0 for no limit (0)
+    EMAIL_MAX_RETRIES     retries of an email after transient errors (3)
+    EMAIL_RETRY_BACKOFF   seconds before the first retry, doubled for each
+                          next one (2)
+    EMAIL_CLAIM_TIMEOUT   seconds after which a SENDING notification is
+                          claimed again (3600)
+
+Usage:
+    from pa_bonus.services.mailer import BatchMailer
+
+    BatchMailer().drain()                        # everything pending
+    BatchMailer().drain(notification_ids, progress=job_progress)
+"""
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from pa_bonus.models import EmailBatch, EmailNotification
+from pa_bonus.notifications import debug_recipient
+
+logger = logging.getLogger(__name__)
+
+EMAIL_BATCH_SIZE = getattr(settings, 'EMAIL_BATCH_SIZE', 100)
+EMAIL_RATE_LIMIT = getattr(settings, 'EMAIL_RATE_LIMIT', 0)
+EMAIL_MAX_RETRIES = getattr(settings, 'EMAIL_MAX_RETRIES', 3)
+EMAIL_RETRY_BACKOFF = getattr(settings, 'EMAIL_RETRY_BACKOFF', 2.0)
+EMAIL_CLAIM_TIMEOUT = getattr(settings, 'EMAIL_CLAIM_TIMEOUT', 3600)
+
+
+def is_transient(error):
+    """
+    Whether a send error is worth retrying: lost or refused connections,
+    timeouts and 4xx SMTP replies. Refused recipients and senders and 5xx
+    replies are permanent.
+    """
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart; rate 0 never waits."""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = self.clock()
+        if self.next_at is not None and now < self.next_at:
+            self.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+class BatchMailer:
+    """
+    Drains pending notifications chunk by chunk.
+
+    Args:
+        batch_size (int | None): Notifications per chunk; EMAIL_BATCH_SIZE by default.
+        rate_limit (float | None): Emails per second; EMAIL_RATE_LIMIT by default.
+        max_retries (int | None): Retries per email; EMAIL_MAX_RETRIES by default.
+        backoff (float | None): First retry delay; EMAIL_RETRY_BACKOFF by default.
+        connection_factory (callable): Returns a mail backend connection.
+        clock, sleep: Time sources, replaceable in tests.
+    """
+
+    def __init__(self, batch_size=None, rate_limit=None, max_retries=None, backoff=None,
+                 connection_factory=get_connection, clock=time.monotonic, sleep=time.sleep):
+        self.batch_size = batch_size or EMAIL_BATCH_SIZE
+        self.max_retries = EMAIL_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = EMAIL_RETRY_BACKOFF if backoff is None else backoff
+        self.connection_factory = connection_factory
+        self.clock = clock
+        self.sleep = sleep
+        self.limiter = RateLimiter(EMAIL_RATE_LIMIT if rate_limit is None else rate_limit, clock, sleep)
+
+    def drain(self, notification_ids=None, progress=None):
+        """
+        Send pending notifications until none are left.
+
+        Args:
+            notification_ids (iterable[int] | None): Only send these; None
+                sends every pending notification.
+            progress (callable | None): Called with the number sent so far
+                after each chunk.
+
+        Returns:
+            list[EmailBatch]: The metrics of the chunks sent.
+        """
+        notifications = EmailNotification.objects.all()
+        if notification_ids is not None:
+            notifications = notifications.filter(id__in=list(notification_ids))
+
+        batches, sent = [], 0
+        while True:
+            chunk = self.claim_chunk(notifications)
+            if not chunk:
+                break
+            batch = self.send_chunk(chunk)
+            batches.append(batch)
+            sent += batch.sent
+            if progress:
+                progress(sent)
+
+        if batches:
+            logger.info(
+                f"Sent {sent} email(s) in {len(batches)} batch(es), "
+                f"{sum(batch.failed for batch in batches)} failed"
+            )
+        return batches
+
+    @transaction.atomic
+    def claim_chunk(self, notifications):
+        """
+        Lock the next chunk of pending notifications, and SENDING ones whose
+        claim has timed out, and mark them SENDING.
+
+        Returns:
+            list[EmailNotification]: The claimed notifications, with their users.
+        """
+        now = timezone.now()
+        chunk = list(
+            notifications
+            .filter(Q(status='PENDING') | Q(status='SENDING', claimed_at__lt=now - timedelta(seconds=EMAIL_CLAIM_TIMEOUT)))
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('user')
+            .order_by('id')[:self.batch_size]
+        )
+        EmailNotification.objects.filter(id__in=[n.id for n in chunk]).update(status='SENDING', claimed_at=now)
+        return chunk
+
+    def send_chunk(self, notifications):
+        """Send claimed notifications over one connection and save their status."""
+        started_at = timezone.now()
+        started = self.clock()
+        batch = EmailBatch(started_at=started_at, size=len(notifications))
+        redirect_to = debug_recipient()
+
+        connection = self.connection_factory(fail_silently=False)
+        try:
+            for notification in notifications:
+                self.limiter.wait()
+                batch.retries += self.send_one(connection, notification, redirect_to)
+                if notification.status == 'SENT':
+                    batch.sent += 1
+                else:
+                    batch.failed += 1
+        finally:
+            connection.close()
+
+        EmailNotification.objects.bulk_update(notifications, ['status', 'sent_at', 'attempts', 'last_error'])
+        batch.duration = self.clock() - started
+        batch.finished_at = timezone.now()
+        batch.save()
+        logger.info(
+            f"Email batch {batch.id}: {batch.sent}/{batch.size} sent, {batch.failed} failed, "
+            f"{batch.retries} retries in {batch.duration:.2f}s ({batch.messages_per_second}/s)"
+        )
+        return batch
+
+    def send_one(self, connection, notification, redirect_to=None):
+        """
+        Send one notification, retrying transient errors with backoff. Sets
+        its status, sent_at, attempts and last_error without saving.
+
+        Args:
+            redirect_to (str | None): Send to this address instead of the
+                client's, as under DEBUG.
+
+        Returns:
+            int: Retries made.
+        """
+        message = EmailMessage(
+            subject=notification.subject,
+            body=notification.message,
+            to=[redirect_to or notification.user.email],
+            connection=connection,
+        )
+        retries = 0
+        while True:
+            notification.attempts += 1
+            try:
+                connection.open()
+                if not connection.send_messages([message]):
+                    raise ValueError("The notification has no recipient address")
+            except Exception as e:
+                notification.last_error = str(e)
+                if not is_transient(e) or retries >= self.max_retries:
+                    logger.error(f"Error sending notification {notification.id}: {e}")
+                    notification.status = 'FAILED'
+                    return retries
+                connection.close()
+                self.sleep(self.backoff * 2 ** retries)
+                retries += 1
+            else:
+                notification.status = 'SENT'
+                notification.sent_at = timezone.now()
+                notification.last_error = ''
+                return retries
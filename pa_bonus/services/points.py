@@ -9,9 +9,13 @@ transactions (credits) a debit draws its points from, recording each draw as a
 PointAllocation row. The rule is FIFO by soonest-to-expire: points closest to
 expiring are spent first, so customers lose as few points to expiry as possible.
 
-Because allocations are explicit rows, a credit's remaining balance is always
-derived (never an overwritten counter), and cancelling a debit simply deletes
-its allocations to restore the points it had drawn.
+Because allocations are explicit rows, every point can be traced. Each credit
+also stores its remaining_points, which this module updates in the same
+transaction as the allocations it writes, so the allocation loop reads only
+credits that still hold points instead of summing allocations per credit.
+Cancelling a debit deletes its allocations and hands the points back to their
+credits. find_remaining_drift verifies the stored figures against the
+allocations.
 
 Usage:
     from pa_bonus.services.points import allocate_debit, void_debit, expire_credits
@@ -28,22 +32,31 @@ from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from pa_bonus.models import PointsTransaction, PointAllocation
+from pa_bonus.services.balances import refresh_balances
 
 logger = logging.getLogger(__name__)
 
+# Users whose credits are expired together in one transaction.
+EXPIRY_BATCH_SIZE = 500
+
+
+# Spending order of a user's credits, see _candidate_credits
+CREDIT_ORDER = (F('expires_at').asc(nulls_last=True), 'date', 'id')
+
 
 def _candidate_credits(user, exclude_pk=None):
     """
     Confirmed, positive transactions for a user, ordered soonest-to-expire first.
 
-    Never-expiring credits (expires_at is null) sort last, so points with a
-    deadline are always spent before points that keep indefinitely. Ties break by
-    grant date then id for a stable, oldest-first order.
+    Only credits with points remaining are returned (the open-credits partial
+    index). Never-expiring credits (expires_at is null) sort last, so points with
+    a deadline are always spent before points that keep indefinitely. Ties break
+    by grant date then id for a stable, oldest-first order.
     """
     qs = (
         PointsTransaction.objects
-        .filter(user=user, status='CONFIRMED', value__gt=0)
-        .order_by(F('expires_at').asc(nulls_last=True), 'date', 'id')
+        .filter(user=user, status='CONFIRMED', value__gt=0, remaining_points__gt=0)
+        .order_by(*CREDIT_ORDER)
     )
     if exclude_pk is not None:
         qs = qs.exclude(pk=exclude_pk)
@@ -73,26 +86,28 @@ def allocate_debit(debit):
         raise ValueError("allocate_debit requires a negative (debit) transaction")
 
     # Clear any prior allocations so re-allocation starts from a clean slate.
-    debit.allocations_in.all().delete()
+    release_allocations(debit.allocations_in.all())
 
     need = -debit.value
     allocations = []
+    drawn = []
 
     # Lock the candidate credits so two concurrent debits can't double-spend a lot.
     credits = _candidate_credits(debit.user, exclude_pk=debit.pk).select_for_update()
     for credit in credits:
         if need <= 0:
             break
-        remaining = credit.remaining
-        if remaining <= 0:
-            continue
-        take = min(remaining, need)
+        take = min(credit.remaining_points, need)
         allocations.append(
             PointAllocation(credit=credit, debit=debit, amount=take)
         )
+        credit.remaining_points -= take
+        drawn.append(credit)
         need -= take
 
     PointAllocation.objects.bulk_create(allocations)
+    PointsTransaction.objects.bulk_update(drawn, ['remaining_points'])
+    refresh_balances([debit.user_id])
 
     allocated = (-debit.value) - need
     if need > 0:
@@ -104,25 +119,119 @@ def allocate_debit(debit):
     return allocated
 
 
+@transaction.atomic
+def allocate_debits(debits, refresh=True):
+    """
+    Allocate many new debits at once, e.g. the credit notes of an upload.
+
+    The same allocation as calling allocate_debit for each debit in order, but
+    the candidate credits of all the debits' users are locked and read in one
+    query and drawn from in memory, so the cost does not grow per debit. The
+    debits must not have any allocations yet.
+
+    Args:
+        debits (list[PointsTransaction]): Saved negative transactions, in the
+            order they draw points.
+        refresh (bool): Refresh the users' balances. Pass False when the caller
+            refreshes them anyway.
+
+    Returns:
+        int: The number of points actually allocated.
+    """
+    if any(debit.value >= 0 for debit in debits):
+        raise ValueError("allocate_debits requires negative (debit) transactions")
+    if not debits:
+        return 0
+    user_ids = {debit.user_id for debit in debits}
+
+    credits_by_user = {}
+    credits = (
+        PointsTransaction.objects
+        .filter(user_id__in=user_ids, status='CONFIRMED', value__gt=0, remaining_points__gt=0)
+        .order_by('user_id', *CREDIT_ORDER)
+        .select_for_update()
+    )
+    for credit in credits:
+        credits_by_user.setdefault(credit.user_id, []).append(credit)
+
+    allocations = []
+    drawn = {}
+    allocated = 0
+    for debit in debits:
+        need = -debit.value
+        for credit in credits_by_user.get(debit.user_id, []):
+            if need <= 0:
+                break
+            if credit.remaining_points <= 0:
+                continue
+            take = min(credit.remaining_points, need)
+            allocations.append(PointAllocation(credit=credit, debit=debit, amount=take))
+            credit.remaining_points -= take
+            drawn[credit.pk] = credit
+            need -= take
+        allocated += (-debit.value) - need
+        if need > 0:
+            logger.warning(
+                "Debit #%s for user %s under-allocated by %s points "
+                "(balance went negative).",
+                debit.pk, debit.user_id, need,
+            )
+
+    PointAllocation.objects.bulk_create(allocations)
+    PointsTransaction.objects.bulk_update(list(drawn.values()), ['remaining_points'])
+    if refresh:
+        refresh_balances(user_ids)
+    return allocated
+
+
+def release_allocations(allocations, delete=True):
+    """
+    Give the points of some allocations back to the credits they were drawn from.
+
+    One update per source credit, with F() so it is safe without holding the
+    credit's lock. Call inside the transaction that removes the allocations.
+
+    Args:
+        allocations (QuerySet[PointAllocation]): The allocations being removed.
+        delete (bool): Also delete them. Pass False when they are about to be
+            deleted anyway (e.g. by a cascade).
+    """
+    released = allocations.values('credit_id').annotate(total=Sum('amount')).order_by()
+    for row in released:
+        PointsTransaction.objects.filter(pk=row['credit_id']).update(
+            remaining_points=F('remaining_points') + row['total']
+        )
+    if delete:
+        allocations.delete()
+
+
 @transaction.atomic
 def void_debit(debit):
     """
     Cancel a debit and return the points it had drawn back to their credits.
 
-    Deleting the allocations restores each source credit's remaining balance
-    automatically. The debit row itself is kept (status CANCELLED) as an audit
-    trail of the event.
+    The allocations are deleted and their points added back to each source
+    credit's remaining_points. The debit row itself is kept (status CANCELLED) as
+    an audit trail of the event.
 
     Args:
         debit (PointsTransaction): The debit to cancel.
     """
-    debit.allocations_in.all().delete()
+    release_allocations(debit.allocations_in.all())
     if debit.status != 'CANCELLED':
         debit.status = 'CANCELLED'
         debit.save(update_fields=['status'])
+    refresh_balances([debit.user_id])
+
+
+def _due_credits(as_of):
+    """Confirmed credits past their expiry date that still hold points."""
+    return PointsTransaction.objects.filter(
+        status='CONFIRMED', value__gt=0, remaining_points__gt=0,
+        expires_at__isnull=False, expires_at__lte=as_of,
+    )
 
 
-@transaction.atomic
 def expire_credits(as_of=None, dry_run=False):
     """
     Expire the remaining points of every confirmed credit past its expiry date.
@@ -132,6 +241,11 @@ def expire_credits(as_of=None, dry_run=False):
     spent one. Credits with nothing left, or no expiry, are skipped. The operation
     is idempotent: running it twice does not double-expire anything.
 
+    The work is set-based and split by user: each batch of EXPIRY_BATCH_SIZE users
+    locks its due credits in one query, bulk-creates the debits and allocations and
+    commits on its own, so a run never holds locks on every expired credit at once
+    and an interrupted run simply continues where it stopped next time.
+
     Args:
         as_of (date | None): Treat credits as expired on or before this date.
             Defaults to today.
@@ -142,34 +256,58 @@ def expire_credits(as_of=None, dry_run=False):
             credit that expired (or would expire, under dry_run).
     """
     as_of = as_of or timezone.now().date()
+
+    if dry_run:
+        return [
+            (credit, credit.remaining_points)
+            for credit in _due_credits(as_of).select_related('user')
+        ]
+
+    user_ids = list(
+        _due_credits(as_of).order_by('user_id').values_list('user_id', flat=True).distinct()
+    )
     expired = []
+    for start in range(0, len(user_ids), EXPIRY_BATCH_SIZE):
+        expired.extend(_expire_batch(user_ids[start:start + EXPIRY_BATCH_SIZE], as_of))
 
-    credits = (
-        PointsTransaction.objects
-        .filter(
-            status='CONFIRMED', value__gt=0,
-            expires_at__isnull=False, expires_at__lte=as_of,
-        )
-        .select_for_update()
+    # Same order as the dry run (the model's default ordering)
+    expired.sort(key=lambda item: (item[0].date, item[0].created_at), reverse=True)
+    return expired
+
+
+@transaction.atomic
+def _expire_batch(user_ids, as_of):
+    """Expire the due credits of one batch of users. Returns (credit, points) pairs."""
+    credits = list(
+        _due_credits(as_of)
+        .filter(user_id__in=user_ids)
+        .select_related('user')
+        .select_for_update(of=('self',))
     )
-    for credit in credits:
-        remaining = credit.remaining
-        if remaining <= 0:
-            continue
-        expired.append((credit, remaining))
-        if dry_run:
-            continue
-        debit = PointsTransaction.objects.create(
-            user=credit.user,
-            value=-remaining,
+
+    debits = [
+        PointsTransaction(
+            user_id=credit.user_id,
+            value=-credit.remaining_points,
             date=credit.expires_at,
             description=f"Konec platnosti bodů (připsáno {credit.date})",
             type='EXPIRATION',
             status='CONFIRMED',
-            brand=credit.brand,
+            brand_id=credit.brand_id,
         )
-        PointAllocation.objects.create(credit=credit, debit=debit, amount=remaining)
-
+        for credit in credits
+    ]
+    PointsTransaction.objects.bulk_create(debits)
+    PointAllocation.objects.bulk_create([
+        PointAllocation(credit=credit, debit=debit, amount=credit.remaining_points)
+        for credit, debit in zip(credits, debits)
+    ])
+
+    expired = [(credit, credit.remaining_points) for credit in credits]
+    for credit in credits:
+        credit.remaining_points = 0
+    PointsTransaction.objects.bulk_update(credits, ['remaining_points'])
+    refresh_balances(user_ids)
     return expired
 
 
@@ -179,19 +317,15 @@ def credits_with_remaining(user):
     annotated with `remaining_points` and ordered soonest-to-expire first.
 
     This is the read side of the same model the allocation engine writes: a credit's
-    remaining is its value minus everything allocated away. Returns a queryset so
-    callers can aggregate or slice further.
+    remaining is its value minus everything allocated away, as stored by the
+    engine. Returns a queryset so callers can aggregate or slice further.
     """
     return (
         PointsTransaction.objects
-        .filter(user=user, status='CONFIRMED', value__gt=0, expires_at__isnull=False)
-        .annotate(
-            remaining_points=F('value') - Coalesce(
-                Sum('allocations_out__amount'),
-                Value(0, output_field=IntegerField()),
-            )
+        .filter(
+            user=user, status='CONFIRMED', value__gt=0,
+            expires_at__isnull=False, remaining_points__gt=0,
         )
-        .filter(remaining_points__gt=0)
         .select_related('brand')
         .order_by('expires_at', 'date')
     )
@@ -219,6 +353,53 @@ def expiration_schedule(user, as_of=None, horizon_months=None):
     return list(credits)
 
 
+def expiring_points_by_user(users=None, as_of=None, horizon_months=3, by_month=False,
+                            include_overdue=True):
+    """
+    Unspent points expiring within the next `horizon_months`, per user, from one
+    grouped query however many users are asked for.
+
+    This is the engine behind expiring_points_total, clients_expiring_summary and
+    the point expiration reports.
+
+    Args:
+        users (QuerySet[User] | iterable[User | int] | None): The users to total;
+            None means everyone. A queryset is used as a subquery.
+        as_of (date | None): Reference date for the horizon; defaults to today.
+        horizon_months (int): How far ahead to look.
+        by_month (bool): Bucket each user's total by expiry date. Expiry dates are
+            always month-ends, so each bucket is one month-end deadline.
+        include_overdue (bool): Count credits already past their expiry but not yet
+            processed by the expiration job (the client-facing figures do, so they
+            never understate what is at risk).
+
+    Returns:
+        dict: user_id -> int, or user_id -> {expires_at: int} when by_month.
+            Users with nothing expiring are left out.
+    """
+    as_of = as_of or timezone.now().date()
+    horizon = as_of + relativedelta(months=horizon_months)
+
+    credits = PointsTransaction.objects.filter(
+        status='CONFIRMED', value__gt=0, remaining_points__gt=0,
+        expires_at__isnull=False, expires_at__lte=horizon,
+    )
+    if users is not None:
+        credits = credits.filter(user__in=users)
+    if not include_overdue:
+        credits = credits.filter(expires_at__gte=as_of)
+
+    group_by = ['user_id', 'expires_at'] if by_month else ['user_id']
+    rows = credits.values(*group_by).annotate(total=Sum('remaining_points')).order_by()
+
+    if not by_month:
+        return {row['user_id']: row['total'] for row in rows}
+    totals = {}
+    for row in rows:
+        totals.setdefault(row['user_id'], {})[row['expires_at']] = row['total']
+    return totals
+
+
 def expiring_points_total(user, as_of=None, horizon_months=3):
     """
     How many still-unspent points will expire within the next `horizon_months`.
@@ -230,13 +411,8 @@ def expiring_points_total(user, as_of=None, horizon_months=3):
     Returns:
         int: Total points expiring within the horizon (0 if none).
     """
-    as_of = as_of or timezone.now().date()
-    horizon = as_of + relativedelta(months=horizon_months)
-    return sum(
-        credit.remaining_points
-        for credit in credits_with_remaining(user)
-        if credit.expires_at <= horizon
-    )
+    totals = expiring_points_by_user([user.pk], as_of=as_of, horizon_months=horizon_months)
+    return totals.get(user.pk, 0)
 
 
 def clients_expiring_summary(users, as_of=None, horizon_months=3):
@@ -252,11 +428,60 @@ def clients_expiring_summary(users, as_of=None, horizon_months=3):
     Returns:
         list[dict]: {'user': User, 'expiring_points': int}, highest first.
     """
-    as_of = as_of or timezone.now().date()
-    rows = []
-    for user in users:
-        total = expiring_points_total(user, as_of=as_of, horizon_months=horizon_months)
-        if total > 0:
-            rows.append({'user': user, 'expiring_points': total})
+    totals = expiring_points_by_user(users, as_of=as_of, horizon_months=horizon_months)
+    if not totals:
+        return []
+    rows = [
+        {'user': user, 'expiring_points': totals[user.pk]}
+        for user in users
+        if user.pk in totals
+    ]
     rows.sort(key=lambda row: row['expiring_points'], reverse=True)
     return rows
+
+
+def find_remaining_drift(user_ids=None):
+    """
+    Credits whose stored remaining_points disagrees with their allocations.
+
+    Debits must store 0 and credits value minus everything allocated away. One
+    grouped query over all transactions (or those of user_ids).
+
+    Args:
+        user_ids (iterable[int] | None): Restrict the check to these users.
+
+    Returns:
+        list[tuple[int, int, int]]: (transaction_id, stored, expected) per mismatch.
+    """
+    transactions = PointsTransaction.objects.all()
+    if user_ids is not None:
+        transactions = transactions.filter(user_id__in=list(user_ids))
+
+    rows = (
+        transactions
+        .annotate(allocated_points=Coalesce(
+            Sum('allocations_out__amount'),
+            Value(0, output_field=IntegerField()),
+        ))
+        .values_list('id', 'value', 'remaining_points', 'allocated_points')
+        .order_by('id')
+    )
+    drift = []
+    for pk, value, stored, allocated in rows:
+        expected = value - allocated if value > 0 else 0
+        if stored != expected:
+            drift.append((pk, stored, expected))
+    return drift
+
+
+@transaction.atomic
+def repair_remaining(drift):
+    """
+    Store the expected remaining_points for the mismatches find_remaining_drift
+    reported, and refresh the owners' balances.
+    """
+    transactions = PointsTransaction.objects.in_bulk([pk for pk, _, _ in drift])
+    for pk, _, expected in drift:
+        transactions[pk].remaining_points = expected
+    PointsTransaction.objects.bulk_update(transactions.values(), ['remaining_points'])
+    refresh_balances({points_transaction.user_id for points_transaction in transactions.values()})
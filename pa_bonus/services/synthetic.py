@@ -0,0 +1,434 @@
+"""
+Synthetic data
+==============
+Generates realistic, seed-reproducible volumes of bonus-program data for
+benchmarks and load tests: regions with their sales reps, clients with
+contracts, brand bonuses and extra goals, invoices and credit notes with their
+brand turnovers, the points those earned, reward requests whose claims are
+allocated against the credits, and the materialised balances and turnover
+rollup on top.
+
+Everything is written with bulk_create in batches of clients, so no signals
+fire (no notification e-mails) and millions of rows load in minutes. The
+allocations are computed in Python with the same soonest-to-expire-first order
+as allocate_debit, so remaining_points, PointsBalance and MonthlyBrandTurnover
+come out exactly as the live write paths would leave them.
+
+All generated usernames, client, invoice and reward numbers and brand names
+start with a prefix, so a dataset can be removed again with
+delete_synthetic_data.
+
+write_invoice_file writes an ABRA-style invoice or credit note export (CSV or
+XLSX) for the generated clients, to benchmark the upload pipeline.
+
+Usage:
+    from pa_bonus.services.synthetic import generate_synthetic_data
+
+    counts = generate_synthetic_data(clients=10000, seed=42)
+"""
+import csv
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.utils import timezone
+
+from pa_bonus.models import (
+    User, Region, RegionRep, Brand, BrandBonus, UserContract, UserContractGoal,
+    FileUpload, Invoice, InvoiceBrandTurnover, PointsTransaction, PointAllocation,
+    Reward, RewardRequest, RewardRequestItem,
+)
+from pa_bonus.services.balances import refresh_balances
+from pa_bonus.services.goals import refresh_goal_candidates
+from pa_bonus.services.turnover import rebuild_turnover_rollup
+
+DEFAULT_PREFIX = "SYN"
+
+# Clients generated (and committed) per transaction
+SYNTHETIC_BATCH_SIZE = 500
+
+FIRST_NAMES = [
+    "Jana", "Petra", "Lucie", "Eva", "Hana", "Kateřina", "Lenka", "Veronika", "Martina", "Tereza",
+    "Jan", "Petr", "Martin", "Tomáš", "Pavel", "Jiří", "Lukáš", "Michal", "David", "Jakub",
+]
+LAST_NAMES = [
+    "Nováková", "Svobodová", "Dvořáková", "Černá", "Procházková", "Kučerová", "Veselá", "Horáková",
+    "Novák", "Svoboda", "Dvořák", "Černý", "Procházka", "Kučera", "Veselý", "Horák",
+]
+REGION_NAMES = [
+    "Praha", "Středočeský", "Jihočeský", "Plzeňský", "Karlovarský", "Ústecký", "Liberecký",
+    "Královéhradecký", "Pardubický", "Vysočina", "Jihomoravský", "Olomoucký", "Zlínský", "Moravskoslezský",
+]
+
+
+def _client_number(prefix, n):
+    return f"{prefix}{n:07d}"
+
+
+def generate_synthetic_data(clients=1000, regions=5, brands=6, months=24, invoices_per_month=2,
+                            credit_note_ratio=0.05, reward_requests_per_client=2,
+                            prefix=DEFAULT_PREFIX, seed=0, batch_size=SYNTHETIC_BATCH_SIZE, progress=None):
+    """
+    Generate a synthetic dataset.
+
+    The same arguments and seed always produce the same data (dates are
+    relative to today).
+
+    Args:
+        clients (int): Number of client users.
+        regions (int): Number of regions, each with one primary sales rep.
+        brands (int): Number of brands, each with a brand bonus.
+        months (int): How far back the invoice history reaches.
+        invoices_per_month (int): Average invoices per client and month.
+        credit_note_ratio (float): Share of invoices followed by a credit note.
+        reward_requests_per_client (int): Reward requests (and claims) per client.
+        prefix (str): Prefix of every generated identifier.
+        seed (int): Random seed.
+        batch_size (int): Clients per transaction.
+        progress (callable | None): Called with (clients_done, clients) after
+            each batch.
+
+    Returns:
+        dict: Model name -> number of rows created.
+    """
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    counts = {}
+
+    def created(model, rows):
+        counts[model.__name__] = counts.get(model.__name__, 0) + len(rows)
+        return rows
+
+    with transaction.atomic():
+        setup = _create_setup(rng, regions, brands, prefix, created)
+
+    for start in range(0, clients, batch_size):
+        numbers = range(start, min(start + batch_size, clients))
+        with transaction.atomic():
+            _create_clients(
+                rng, numbers, setup, today, months, invoices_per_month, credit_note_ratio,
+                reward_requests_per_client, prefix, created,
+            )
+        if progress:
+            progress(numbers.stop, clients)
+
+    return counts
+
+
+def _create_setup(rng, regions, brands, prefix, created):
+    """Regions with their reps, brands with bonuses, rewards and the upload rows hang off."""
+    reps_group, _ = Group.objects.get_or_create(name="Sales Reps")
+    password = make_password(None)
+
+    region_rows = created(Region, Region.objects.bulk_create([
+        Region(name=f"{prefix} {REGION_NAMES[n % len(REGION_NAMES)]} {n + 1}", code=f"{prefix}{n + 1}")
+        for n in range(regions)
+    ]))
+    reps = created(User, User.objects.bulk_create([
+        User(
+            username=f"{prefix.lower()}-rep-{n + 1}", user_number=f"{prefix}R{n + 1:04d}", user_phone="",
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+            email=f"{prefix.lower()}-rep-{n + 1}@example.com", password=password,
+        )
+        for n in range(regions)
+    ]))
+    reps_group.user_set.add(*reps)
+    created(RegionRep, RegionRep.objects.bulk_create([
+        RegionRep(user=rep, region=region, is_primary=True, date_from=timezone.now().date() - timedelta(days=730))
+        for rep, region in zip(reps, region_rows)
+    ]))
+
+    brand_rows = created(Brand, Brand.objects.bulk_create([
+        Brand(name=f"{prefix} Brand {n + 1}", prefix=f"{prefix}{n + 1:02d}", points_validity_months=rng.choice([12, 24, None]))
+        for n in range(brands)
+    ]))
+    bonuses = created(BrandBonus, BrandBonus.objects.bulk_create([
+        BrandBonus(name=f"{brand.name} {ratio:.0%}", points_ratio=ratio, brand_id=brand)
+        for brand in brand_rows
+        for ratio in [rng.choice([0.02, 0.03, 0.05])]
+    ]))
+    rewards = created(Reward, Reward.objects.bulk_create([
+        Reward(
+            abra_code=f"{prefix}-R{n + 1:03d}", name=f"{prefix} reward {n + 1}", point_cost=cost,
+            description="Synthetic reward", brand=rng.choice(brand_rows),
+        )
+        for n, cost in enumerate(rng.choice([50, 100, 250, 500, 1000]) for _ in range(20))
+    ]))
+    upload = FileUpload.objects.create(file=f"uploads/{prefix.lower()}-synthetic.csv", status="COMPLETED", uploaded_by=reps[0])
+    created(FileUpload, [upload])
+
+    return {
+        "password": password,
+        "regions": region_rows,
+        "brands": brand_rows,
+        "bonuses": bonuses,
+        "rewards": rewards,
+        "upload": upload,
+    }
+
+
+def _create_clients(rng, numbers, setup, today, months, invoices_per_month, credit_note_ratio,
+                    reward_requests_per_client, prefix, created):
+    """Create one batch of clients with their whole history."""
+    from pa_bonus.tasks import FT_CREDIT_NOTE, FT_INVOICE, calculate_brand_points
+
+    brands, bonuses, rewards, upload = setup["brands"], setup["bonuses"], setup["rewards"], setup["upload"]
+    history_start = today - timedelta(days=30 * months)
+    current_month = today.replace(day=1)
+
+    users = created(User, User.objects.bulk_create([
+        User(
+            username=f"{prefix.lower()}-{n + 1:07d}", user_number=_client_number(prefix, n + 1),
+            user_phone=f"{rng.randrange(600000000, 800000000)}",
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+            email=f"{prefix.lower()}-{n + 1:07d}@example.com", password=setup["password"],
+            region=rng.choice(setup["regions"]), is_active=rng.random() > 0.03,
+        )
+        for n in numbers
+    ]))
+
+    # Contracts, their brand bonuses and a current extra goal for some clients
+    contracts = created(UserContract, UserContract.objects.bulk_create([
+        UserContract(
+            user_id=user, is_active=True,
+            contract_date_from=history_start - timedelta(days=rng.randrange(0, 365)),
+            contract_date_to=today + timedelta(days=rng.randrange(30, 730)),
+        )
+        for user in users
+    ]))
+    client_bonuses = {contract.user_id_id: rng.sample(bonuses, rng.randint(1, len(bonuses))) for contract in contracts}
+    UserContract.brandbonuses.through.objects.bulk_create([
+        UserContract.brandbonuses.through(usercontract_id=contract.id, brandbonus_id=bonus.id)
+        for contract in contracts
+        for bonus in client_bonuses[contract.user_id_id]
+    ])
+
+    goal_contracts = [contract for contract in contracts if rng.random() < 0.3]
+    goals = created(UserContractGoal, UserContractGoal.objects.bulk_create([
+        UserContractGoal(
+            user_contract=contract,
+            goal_period_from=(today - timedelta(days=rng.randrange(30, 300))).replace(day=1),
+            goal_period_to=today + timedelta(days=rng.randrange(60, 365)),
+            goal_value=goal_value, goal_base=int(goal_value * 0.8),
+            evaluation_frequency=rng.choice([3, 6, 12]),
+        )
+        for contract in goal_contracts
+        for goal_value in [rng.randrange(50, 500) * 1000]
+    ]))
+    UserContractGoal.brands.through.objects.bulk_create([
+        UserContractGoal.brands.through(usercontractgoal_id=goal.id, brand_id=bonus.brand_id_id)
+        for goal in goals
+        for bonus in client_bonuses[goal.user_contract.user_id_id][:2]
+    ])
+
+    # Invoices, credit notes and their brand turnovers
+    invoices, lines = [], []
+    for user in users:
+        count = max(1, int(rng.gauss(months * invoices_per_month, months * invoices_per_month / 4)))
+        for i in range(count):
+            invoice_date = history_start + timedelta(days=rng.randrange((today - history_start).days + 1))
+            invoice_lines = [(brand, Decimal(rng.randrange(500, 50000)) / 10) for brand in rng.sample(brands, rng.randint(1, 3))]
+            number = f"{prefix}F{user.user_number[len(prefix):]}{i:04d}"
+            invoices.append(Invoice(
+                invoice_number=number, client_number=user.user_number, invoice_date=invoice_date,
+                total_amount=sum(amount for _, amount in invoice_lines), invoice_type=FT_INVOICE, file_upload=upload,
+            ))
+            lines.append((user, invoice_lines))
+
+            if rng.random() < credit_note_ratio:
+                brand, amount = rng.choice(invoice_lines)
+                amount = (amount * Decimal(rng.choice(["0.1", "0.5", "1"]))).quantize(Decimal("0.01"))
+                invoices.append(Invoice(
+                    invoice_number=f"{prefix}D{number[len(prefix) + 1:]}", client_number=user.user_number,
+                    invoice_date=min(today, invoice_date + timedelta(days=rng.randrange(1, 30))),
+                    total_amount=amount, invoice_type=FT_CREDIT_NOTE, file_upload=upload,
+                ))
+                lines.append((user, [(brand, amount)]))
+
+    invoices = created(Invoice, Invoice.objects.bulk_create(invoices, batch_size=5000))
+    created(InvoiceBrandTurnover, InvoiceBrandTurnover.objects.bulk_create([
+        InvoiceBrandTurnover(invoice=invoice, brand=brand, amount=amount)
+        for invoice, (_, invoice_lines) in zip(invoices, lines)
+        for brand, amount in invoice_lines
+    ], batch_size=5000))
+
+    # The points those earned: invoices before this month are approved already
+    credits, debits = [], []
+    for invoice, (user, invoice_lines) in zip(invoices, lines):
+        bonus_by_brand = {bonus.brand_id_id: bonus for bonus in client_bonuses[user.id]}
+        for brand, amount in invoice_lines:
+            bonus = bonus_by_brand.get(brand.id)
+            if bonus is None:
+                continue
+            points, transaction_type, status = calculate_brand_points(amount, bonus, invoice.invoice_type)
+            if points == 0:
+                continue
+            if points > 0 and invoice.invoice_date < current_month:
+                status = "CONFIRMED"
+            row = PointsTransaction(
+                user=user, value=points, date=invoice.invoice_date, invoice=invoice, brand=brand,
+                description=f'{"Invoice" if invoice.invoice_type == FT_INVOICE else "Credit Note"} {invoice.invoice_number}',
+                type=transaction_type, status=status, file_upload=upload,
+                expires_at=brand.expiry_for(invoice.invoice_date) if points > 0 else None,
+                remaining_points=max(points, 0),
+            )
+            (credits if points > 0 else debits).append(row)
+
+    # Reward requests, each with its confirmed claim in the second half of the history
+    requests, items = [], []
+    for user in users:
+        for _ in range(reward_requests_per_client):
+            chosen = rng.sample(rewards, rng.randint(1, 2))
+            quantities = [1 for _ in chosen]
+            total = sum(reward.point_cost * quantity for reward, quantity in zip(chosen, quantities))
+            requests.append(RewardRequest(
+                user=user, description="Synthetic request", total_points=total,
+                status=rng.choice(["PENDING", "ACCEPTED", "SHIPPED", "FINISHED"]),
+            ))
+            items.append([
+                RewardRequestItem(reward=reward, quantity=quantity, point_cost=reward.point_cost)
+                for reward, quantity in zip(chosen, quantities)
+            ])
+    requests = created(RewardRequest, RewardRequest.objects.bulk_create(requests))
+    for request, request_items in zip(requests, items):
+        for item in request_items:
+            item.reward_request = request
+    created(RewardRequestItem, RewardRequestItem.objects.bulk_create([item for group in items for item in group]))
+    for request in requests:
+        debits.append(PointsTransaction(
+            user=request.user, value=-request.total_points, description=f"Reward request {request.id}",
+            date=today - timedelta(days=rng.randrange(0, 15 * months)), type="REWARD_CLAIM", status="CONFIRMED",
+            reward_request=request, remaining_points=0,
+        ))
+
+    # Allocating before the insert stores the final remaining_points right away;
+    # the allocations pick up the credit and debit ids once those are saved.
+    allocations = _allocate(credits, debits)
+    created(PointsTransaction, PointsTransaction.objects.bulk_create(credits + debits, batch_size=5000))
+    created(PointAllocation, PointAllocation.objects.bulk_create(allocations, batch_size=5000))
+
+    rebuild_turnover_rollup([user.user_number for user in users])
+    refresh_goal_candidates([goal.id for goal in goals])
+    refresh_balances([user.id for user in users])
+
+
+def _allocate(credits, debits):
+    """
+    Draw each confirmed debit from its user's confirmed credits, in date order.
+
+    Mirrors allocate_debit: soonest-to-expire first, never-expiring last, then
+    grant date and id (the rows are unsaved, so list order stands in for the id
+    they will get). A debit only draws from credits granted by its date and not
+    yet expired then; a shortfall stays unallocated, as it would live. Updates
+    the credits' remaining_points in place.
+
+    Returns:
+        list[PointAllocation]: Unsaved allocations.
+    """
+    by_user = {}
+    for credit in credits:
+        if credit.status == "CONFIRMED":
+            by_user.setdefault(credit.user_id, []).append(credit)
+    for user_credits in by_user.values():
+        user_credits.sort(key=lambda c: (c.expires_at is None, c.expires_at or c.date, c.date))
+
+    allocations = []
+    for debit in sorted(debits, key=lambda d: d.date):
+        need = -debit.value
+        for credit in by_user.get(debit.user_id, ()):
+            if need == 0:
+                break
+            if credit.remaining_points == 0 or credit.date > debit.date:
+                continue
+            if credit.expires_at is not None and credit.expires_at < debit.date:
+                continue
+            take = min(need, credit.remaining_points)
+            credit.remaining_points -= take
+            need -= take
+            allocations.append(PointAllocation(credit=credit, debit=debit, amount=take))
+    return allocations
+
+
+def delete_synthetic_data(prefix=DEFAULT_PREFIX):
+    """
+    Delete everything generate_synthetic_data created with this prefix.
+
+    Returns:
+        int: Number of rows deleted, including cascades.
+    """
+    deleted = 0
+    with transaction.atomic():
+        client_numbers = list(User.objects.filter(user_number__startswith=prefix).values_list('user_number', flat=True))
+        for queryset in [
+            Invoice.objects.filter(client_number__startswith=prefix),
+            User.objects.filter(user_number__startswith=prefix),
+            Region.objects.filter(code__startswith=prefix),
+            Brand.objects.filter(name__startswith=f"{prefix} Brand "),
+            Reward.objects.filter(abra_code__startswith=f"{prefix}-R"),
+        ]:
+            deleted += queryset.delete()[0]
+        rebuild_turnover_rollup(client_numbers)
+    return deleted
+
+
+def write_invoice_file(path, client_numbers, brand_prefixes, invoices=1000, lines_per_invoice=5,
+                       credit_notes=False, prefix=DEFAULT_PREFIX, seed=0, start=None, end=None):
+    """
+    Write an ABRA-style export of invoices (or credit notes) for upload benchmarks.
+
+    One row per invoice line with the columns the upload expects: Faktura (or
+    Dobropis), ZČ, Kód, Cena and Datum (DD.MM.YYYY). The format follows the
+    file extension: .csv or .xlsx.
+
+    Args:
+        path (str): Where to write the file.
+        client_numbers (list[str]): Clients the invoices are issued to.
+        brand_prefixes (list[str]): Brand prefixes product codes start with.
+        invoices (int): Number of invoices.
+        lines_per_invoice (int): Average lines per invoice.
+        credit_notes (bool): Write a credit note export instead.
+        prefix (str): Prefix of the generated invoice numbers.
+        seed (int): Random seed.
+        start, end (date | None): Date range of the invoices; the last 30 days
+            by default.
+
+    Returns:
+        int: Number of rows written.
+    """
+    rng = random.Random(seed)
+    end = end or timezone.now().date()
+    start = start or end - timedelta(days=30)
+    header = ["Dobropis" if credit_notes else "Faktura", "ZČ", "Kód", "Cena", "Datum"]
+    kind = "D" if credit_notes else "F"
+
+    def rows():
+        for n in range(invoices):
+            number = f"{prefix}{kind}U{seed:03d}{n:08d}"
+            client = rng.choice(client_numbers)
+            day = (start + timedelta(days=rng.randrange((end - start).days + 1))).strftime("%d.%m.%Y")
+            for _ in range(max(1, int(rng.expovariate(1 / lines_per_invoice)))):
+                code = f"{rng.choice(brand_prefixes)}{rng.randrange(1, 9999):04d}"
+                yield [number, client, code, round(rng.uniform(20, 3000), 2), day]
+
+    written = 0
+    if str(path).lower().endswith(".xlsx"):
+        import openpyxl
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(header)
+        for row in rows():
+            sheet.append(row)
+            written += 1
+        workbook.save(path)
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(header)
+            for row in rows():
+                writer.writerow(row)
+                written += 1
+    return written
@@ -0,0 +1,417 @@
+"""
+Turnover rollup
+===============
+Maintains MonthlyBrandTurnover, the per (client, brand, month, invoice type)
+sums of InvoiceBrandTurnover, and answers turnover questions from it.
+
+Like the points balances, a rollup cell is never adjusted by deltas: the upload
+pipeline tells refresh_turnover_rollup which (client, month) cells its chunk
+touched, including the cells an updated invoice moved away from, and those
+cells are recomputed from the raw invoices in the same transaction. The
+rebuild_turnover_rollup command regenerates the whole table.
+
+Usage:
+    from pa_bonus.services.turnover import net_turnover, refresh_turnover_rollup
+
+    net_turnover(user.user_number, goal.brands.all(), period_start, period_end)
+    refresh_turnover_rollup({(invoice.client_number, invoice.invoice_date) for invoice in changed})
+"""
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from pa_bonus.models import Brand, BrandBonus, InvoiceBrandTurnover, MonthlyBrandTurnover, PointsTransaction, UserContract
+
+# Clients regenerated per transaction by rebuild_turnover_rollup.
+ROLLUP_BATCH_SIZE = 500
+
+
+def month_start(day):
+    """First day of the month `day` falls in."""
+    return day.replace(day=1)
+
+
+def _rollup_rows(turnovers):
+    """Group brand turnovers into unsaved MonthlyBrandTurnover rows."""
+    rows = (
+        turnovers
+        .annotate(month=TruncMonth('invoice__invoice_date'))
+        .values('invoice__client_number', 'brand_id', 'month', 'invoice__invoice_type')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    return [
+        MonthlyBrandTurnover(
+            client_number=row['invoice__client_number'],
+            brand_id=row['brand_id'],
+            month=row['month'],
+            invoice_type=row['invoice__invoice_type'],
+            amount=row['total'],
+        )
+        for row in rows
+    ]
+
+
+def refresh_turnover_rollup(cells):
+    """
+    Recompute the rollup for the given (client_number, date) cells.
+
+    Each date stands for its whole month. Per month, the cells of every listed
+    client are deleted and rebuilt from InvoiceBrandTurnover with one grouped
+    query. Call it inside the transaction that changed the invoices.
+
+    Args:
+        cells (iterable[tuple[str, date]]): Clients and invoice dates whose month
+            changed.
+    """
+    clients_by_month = {}
+    for client_number, day in cells:
+        clients_by_month.setdefault(month_start(day), set()).add(client_number)
+
+    for month, client_numbers in sorted(clients_by_month.items()):
+        next_month = month + relativedelta(months=1)
+        MonthlyBrandTurnover.objects.filter(month=month, client_number__in=client_numbers).delete()
+        MonthlyBrandTurnover.objects.bulk_create(_rollup_rows(
+            InvoiceBrandTurnover.objects.filter(
+                invoice__client_number__in=client_numbers,
+                invoice__invoice_date__gte=month,
+                invoice__invoice_date__lt=next_month,
+            )
+        ))
+
+
+def rebuild_turnover_rollup(client_numbers=None):
+    """
+    Regenerate the rollup from the raw invoices.
+
+    Args:
+        client_numbers (iterable[str] | None): Only rebuild these clients; None
+            rebuilds everything, dropping cells of clients without invoices.
+
+    Returns:
+        int: Number of rollup rows written.
+    """
+    if client_numbers is None:
+        MonthlyBrandTurnover.objects.all().delete()
+        client_numbers = (
+            InvoiceBrandTurnover.objects
+            .values_list('invoice__client_number', flat=True)
+            .order_by()
+            .distinct()
+        )
+    client_numbers = sorted(set(client_numbers))
+
+    written = 0
+    for start in range(0, len(client_numbers), ROLLUP_BATCH_SIZE):
+        batch = client_numbers[start:start + ROLLUP_BATCH_SIZE]
+        with transaction.atomic():
+            MonthlyBrandTurnover.objects.filter(client_number__in=batch).delete()
+            rows = MonthlyBrandTurnover.objects.bulk_create(_rollup_rows(
+                InvoiceBrandTurnover.objects.filter(invoice__client_number__in=batch)
+            ))
+        written += len(rows)
+    return written
+
+
+def _net(queryset, type_field, amount_field):
+    """Invoices minus credit notes over a queryset, in one aggregate query."""
+    zero = Value(0, output_field=DecimalField())
+    totals = queryset.aggregate(
+        invoices=Coalesce(Sum(amount_field, filter=Q(**{type_field: 'INVOICE'})), zero),
+        credit_notes=Coalesce(Sum(amount_field, filter=Q(**{type_field: 'CREDIT_NOTE'})), zero),
+    )
+    return totals['invoices'] - totals['credit_notes']
+
+
+def _split_range(start_date, end_date):
+    """
+    Split [start_date, end_date) into the whole months the rollup answers and the
+    partial-month edges the invoices answer.
+
+    Returns:
+        tuple: ((first_full, last_full) or None, [(edge_start, edge_end), ...])
+    """
+    first_full = start_date if start_date.day == 1 else month_start(start_date) + relativedelta(months=1)
+    last_full = month_start(end_date)
+    if first_full >= last_full:
+        return None, [(start_date, end_date)] if start_date < end_date else []
+
+    edges = []
+    if start_date < first_full:
+        edges.append((start_date, first_full))
+    if last_full < end_date:
+        edges.append((last_full, end_date))
+    return (first_full, last_full), edges
+
+
+def net_turnover(client_number, brands, start_date, end_date):
+    """
+    Net turnover (invoices minus credit notes) of a client for some brands over
+    [start_date, end_date).
+
+    The whole calendar months inside the range are read from the rollup; only
+    the partial months at either edge fall back to the raw invoices.
+
+    Args:
+        client_number (str): The client's number in the accounting system.
+        brands (QuerySet[Brand] | iterable[Brand]): The brands to include.
+        start_date (date): First day of the range.
+        end_date (date): Day after the last day of the range.
+
+    Returns:
+        Decimal: Net turnover amount.
+    """
+    months, edges = _split_range(start_date, end_date)
+    raw = InvoiceBrandTurnover.objects.filter(invoice__client_number=client_number, brand__in=brands)
+
+    total = Decimal(0)
+    if months:
+        first_full, last_full = months
+        total += _net(
+            MonthlyBrandTurnover.objects.filter(
+                client_number=client_number, brand__in=brands,
+                month__gte=first_full, month__lt=last_full,
+            ),
+            'invoice_type', 'amount',
+        )
+    if edges:
+        in_edges = Q()
+        for edge_start, edge_end in edges:
+            in_edges |= Q(invoice__invoice_date__gte=edge_start, invoice__invoice_date__lt=edge_end)
+        total += _net(raw.filter(in_edges), 'invoice__invoice_type', 'amount')
+    return total
+
+
+def net_turnovers(specs):
+    """
+    Net turnover for many (client, brands, range) questions at once.
+
+    The bulk counterpart of net_turnover for screens that evaluate many goals or
+    clients: two queries in total, however many specs. One reads every rollup
+    row any spec could need, the other the invoice turnovers on the partial-month
+    edges grouped per (client, brand, day, type). Each spec is then summed in
+    Python from those rows.
+
+    Args:
+        specs (iterable[tuple]): (client_number, brand_ids, start_date, end_date)
+            tuples; brand_ids is any iterable of Brand ids and the range is
+            [start_date, end_date) as in net_turnover. Specs must be hashable, so
+            pass brand_ids as a tuple or frozenset.
+
+    Returns:
+        dict: spec -> Decimal net turnover.
+    """
+    specs = list(dict.fromkeys(specs))
+    if not specs:
+        return {}
+
+    plans = {}
+    client_numbers, brand_ids, month_ranges, edge_ranges = set(), set(), set(), set()
+    for spec in specs:
+        client_number, spec_brands, start_date, end_date = spec
+        spec_brands = frozenset(spec_brands)
+        months, edges = _split_range(start_date, end_date)
+        plans[spec] = (client_number, spec_brands, months, edges)
+        client_numbers.add(client_number)
+        brand_ids |= spec_brands
+        if months:
+            month_ranges.add(months)
+        edge_ranges.update(edges)
+
+    signed = {'INVOICE': 1, 'CREDIT_NOTE': -1}
+
+    monthly = {}
+    if month_ranges:
+        rows = MonthlyBrandTurnover.objects.filter(
+            client_number__in=client_numbers, brand_id__in=brand_ids,
+            month__gte=min(first for first, _ in month_ranges),
+            month__lt=max(last for _, last in month_ranges),
+        ).values_list('client_number', 'brand_id', 'month', 'invoice_type', 'amount')
+        for client_number, brand_id, month, invoice_type, amount in rows:
+            monthly.setdefault(client_number, []).append((brand_id, month, signed[invoice_type] * amount))
+
+    daily = {}
+    if edge_ranges:
+        in_edges = Q()
+        for edge_start, edge_end in edge_ranges:
+            in_edges |= Q(invoice__invoice_date__gte=edge_start, invoice__invoice_date__lt=edge_end)
+        rows = (
+            InvoiceBrandTurnover.objects
+            .filter(in_edges, invoice__client_number__in=client_numbers, brand_id__in=brand_ids)
+            .values_list('invoice__client_number', 'brand_id', 'invoice__invoice_date', 'invoice__invoice_type')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        for client_number, brand_id, day, invoice_type, total in rows:
+            daily.setdefault(client_number, []).append((brand_id, day, signed[invoice_type] * total))
+
+    results = {}
+    for spec, (client_number, spec_brands, months, edges) in plans.items():
+        total = Decimal(0)
+        if months:
+            first_full, last_full = months
+            total += sum(
+                (amount for brand_id, month, amount in monthly.get(client_number, ())
+                 if brand_id in spec_brands and first_full <= month < last_full),
+                Decimal(0),
+            )
+        for edge_start, edge_end in edges:
+            total += sum(
+                (amount for brand_id, day, amount in daily.get(client_number, ())
+                 if brand_id in spec_brands and edge_start <= day < edge_end),
+                Decimal(0),
+            )
+        results[spec] = total
+    return results
+
+
+def active_contract_id():
+    """
+    Subquery expression: id of the outer User's newest active contract.
+
+    Annotate a User queryset with it (as active_contract_id) before using
+    contract_brand_turnover or contract_brand_count.
+    """
+    return Subquery(
+        UserContract.objects
+        .filter(user_id=OuterRef('pk'), is_active=True)
+        .order_by('-contract_date_from')
+        .values('id')[:1]
+    )
+
+
+def contract_brand_count():
+    """Subquery expression: number of brand bonuses on the outer User's active contract."""
+    return Coalesce(
+        Subquery(
+            BrandBonus.objects
+            .filter(user_contract=OuterRef('active_contract_id'))
+            .order_by()
+            .values('user_contract')
+            .annotate(count=Count('id'))
+            .values('count')
+        ),
+        Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def contract_brand_turnover(first_month, last_month, invoice_type='INVOICE'):
+    """
+    Subquery expression: turnover of the outer User over the brands of their
+    active contract, for the whole months first_month..last_month (inclusive).
+
+    Read from the rollup with one grouped subquery keyed by client number, so a
+    client list can annotate, sort and paginate on it in the database instead
+    of aggregating invoices client by client. The outer queryset must be
+    annotated with active_contract_id.
+
+    Args:
+        first_month (date): Any day of the first month.
+        last_month (date): Any day of the last month.
+        invoice_type (str): 'INVOICE' or 'CREDIT_NOTE'.
+
+    Returns:
+        Expression: Decimal turnover, 0 without a contract or invoices.
+    """
+    contract_brands = (
+        BrandBonus.objects
+        .filter(user_contract=OuterRef(OuterRef('active_contract_id')))
+        .values('brand_id')
+    )
+    return Coalesce(
+        Subquery(
+            MonthlyBrandTurnover.objects
+            .filter(
+                client_number=OuterRef('user_number'),
+                month__gte=month_start(first_month),
+                month__lte=month_start(last_month),
+                invoice_type=invoice_type,
+                brand__in=contract_brands,
+            )
+            .order_by()
+            .values('client_number')
+            .annotate(total=Sum('amount'))
+            .values('total')
+        ),
+        Value(0),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def brand_turnover_matrix(client, date_from, date_to, contract_brands=()):
+    """
+    Per-brand invoice, credit note and net turnover and confirmed points of one
+    client over [date_from, date_to] (both inclusive), for the client detail
+    pages and exports.
+
+    Two grouped aggregates, however many brands there are: the turnovers with
+    one conditional sum per invoice type, and the points. The Brand rows of
+    the brands with activity are then fetched together.
+
+    Args:
+        client (User): The client.
+        date_from (date): First day of the period.
+        date_to (date): Last day of the period.
+        contract_brands (iterable[Brand]): Brands of the client's contract, to
+            flag with in_contract.
+
+    Returns:
+        list[dict]: One dict per brand with any non-zero turnover or points
+            (negative included, e.g. a brand with only credit notes) (brand,
+            invoice_turnover, credit_turnover, net_turnover, points,
+            in_contract), highest net turnover first.
+    """
+    zero = Value(0, output_field=DecimalField())
+    turnovers = (
+        InvoiceBrandTurnover.objects
+        .filter(
+            invoice__client_number=client.user_number,
+            invoice__invoice_date__gte=date_from,
+            invoice__invoice_date__lte=date_to,
+        )
+        .values('brand')
+        .annotate(
+            invoices=Coalesce(Sum('amount', filter=Q(invoice__invoice_type='INVOICE')), zero),
+            credit_notes=Coalesce(Sum('amount', filter=Q(invoice__invoice_type='CREDIT_NOTE')), zero),
+        )
+        .order_by()
+    )
+    points = (
+        PointsTransaction.objects
+        .filter(user=client, date__gte=date_from, date__lte=date_to, status='CONFIRMED', brand__isnull=False)
+        .values('brand')
+        .annotate(total=Sum('value'))
+        .order_by()
+    )
+
+    matrix = {}
+    for row in turnovers:
+        matrix[row['brand']] = [row['invoices'], row['credit_notes'], 0]
+    for row in points:
+        matrix.setdefault(row['brand'], [Decimal(0), Decimal(0), 0])[2] = row['total']
+
+    active = {
+        brand_id: values for brand_id, values in matrix.items()
+        if values[0] != 0 or values[1] != 0 or values[2] != 0
+    }
+    if not active:
+        return []
+
+    contract_brand_ids = {brand.id for brand in contract_brands}
+    rows = [
+        {
+            'brand': brand,
+            'invoice_turnover': active[brand.id][0],
+            'credit_turnover': active[brand.id][1],
+            'net_turnover': active[brand.id][0] - active[brand.id][1],
+            'points': active[brand.id][2],
+            'in_contract': brand.id in contract_brand_ids,
+        }
+        for brand in Brand.objects.filter(id__in=active)
+    ]
+    rows.sort(key=lambda row: row['net_turnover'], reverse=True)
+    return rows
@@ -1,16 +1,127 @@
-from django.db.models.signals import post_save
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from pa_bonus.models import PointsTransaction, RewardRequest
+from pa_bonus.models import (
+    Brand, GoalEvaluation, PointsTransaction, Region, Reward, RewardRequest, User, UserContract, UserContractGoal,
+)
 from pa_bonus.notifications import notify_points_added, notify_reward_status_change
+from pa_bonus.services.balances import refresh_balances
+from pa_bonus.services.bulk import current_bulk_write
+from pa_bonus.services.cache import invalidate_catalogue, invalidate_users
+from pa_bonus.services.goals import refresh_goal_candidates
+from pa_bonus.services.points import release_allocations
 
 @receiver(post_save, sender=PointsTransaction)
 def transaction_notification(sender, instance, created, **kwargs):
     """Send notification when a transaction is created or status changes to CONFIRMED"""
     if created and instance.status == 'CONFIRMED':
-        notify_points_added(instance)
+        bulk_write = current_bulk_write()
+        if bulk_write:
+            bulk_write.points_added(instance)
+        else:
+            notify_points_added(instance)
+
+@receiver(post_save, sender=PointsTransaction)
+def transaction_saved_balance(sender, instance, **kwargs):
+    """Recompute the owner's materialised balance in the same database transaction"""
+    bulk_write = current_bulk_write()
+    if bulk_write:
+        bulk_write.balance_changed(instance.user_id)
+    else:
+        refresh_balances([instance.user_id])
+
+@receiver(pre_delete, sender=PointsTransaction)
+def transaction_deleting_release(sender, instance, origin=None, **kwargs):
+    """Give a deleted debit's points back to its credits before the cascade removes its allocations"""
+    if isinstance(origin, User) or (isinstance(origin, QuerySet) and origin.model is User):
+        return
+    if instance.value < 0:
+        release_allocations(instance.allocations_in.all(), delete=False)
+
+@receiver(post_delete, sender=PointsTransaction)
+def transaction_deleted_balance(sender, instance, origin=None, **kwargs):
+    """Recompute the owner's balance, unless the owner is being deleted as well"""
+    if isinstance(origin, User) or (isinstance(origin, QuerySet) and origin.model is User):
+        return
+    bulk_write = current_bulk_write()
+    if bulk_write:
+        bulk_write.balance_changed(instance.user_id)
+    else:
+        refresh_balances([instance.user_id])
 
 @receiver(post_save, sender=RewardRequest)
 def reward_request_notification(sender, instance, **kwargs):
     """Send notification when reward request status changes, except for drafts"""
     if instance.status != 'DRAFT':
         notify_reward_status_change(instance)
+
+@receiver(post_save, sender=RewardRequest)
+def reward_request_saved_cache(sender, instance, **kwargs):
+    """The client's and the dashboards' request figures changed"""
+    invalidate_users([instance.user_id])
+
+@receiver(post_save, sender=UserContract)
+@receiver(post_delete, sender=UserContract)
+def contract_changed_cache(sender, instance, **kwargs):
+    """The client's brands, and so their reward catalogue, may have changed"""
+    invalidate_users([instance.user_id_id])
+
+@receiver(m2m_changed, sender=UserContract.brandbonuses.through)
+def contract_brandbonuses_changed_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate the clients whose contracts got or lost brand bonuses"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_users([instance.user_id_id])
+    elif pk_set:
+        invalidate_users(UserContract.objects.filter(id__in=pk_set).values_list('user_id', flat=True))
+
+@receiver(post_save, sender=User)
+def user_saved_cache(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Invalidate the client and the regions' dashboards. An updated client may
+    have moved from another region, so then every region is invalidated.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    if created:
+        invalidate_users([instance.id], [instance.region_id])
+    else:
+        invalidate_users([instance.id], Region.objects.values_list('id', flat=True))
+
+@receiver(post_save, sender=Reward)
+@receiver(post_delete, sender=Reward)
+def reward_changed_cache(sender, instance, **kwargs):
+    """Invalidate the reward catalogue"""
+    invalidate_catalogue([instance.brand_id])
+
+@receiver(post_save, sender=Brand)
+def brand_saved_cache(sender, instance, **kwargs):
+    """Invalidate the reward catalogue listings of the brand"""
+    invalidate_catalogue([instance.id])
+
+@receiver(post_save, sender=UserContractGoal)
+def goal_saved_candidates(sender, instance, **kwargs):
+    """Rebuild the goal's evaluation periods, its dates or targets may have changed"""
+    refresh_goal_candidates([instance.id])
+
+@receiver(m2m_changed, sender=UserContractGoal.brands.through)
+def goal_brands_changed_candidates(sender, instance, action, reverse, pk_set, **kwargs):
+    """Recompute the turnovers of goals whose brands changed"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_goal_candidates([instance.id])
+    elif pk_set:
+        refresh_goal_candidates(pk_set)
+
+@receiver(post_save, sender=GoalEvaluation)
+def evaluation_saved_candidates(sender, instance, **kwargs):
+    """Mark the evaluated period as no longer pending"""
+    refresh_goal_candidates([instance.goal_id])
+
+@receiver(post_delete, sender=GoalEvaluation)
+def evaluation_deleted_candidates(sender, instance, origin=None, **kwargs):
+    """Put the period back to pending, unless the goal is being deleted as well"""
+    if isinstance(origin, GoalEvaluation) or (isinstance(origin, QuerySet) and origin.model is GoalEvaluation):
+        refresh_goal_candidates([instance.goal_id])
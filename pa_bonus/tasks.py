@@ -1,8 +1,16 @@
+import codecs
 import os
+import pickle
+import tempfile
+import zlib
+from functools import lru_cache
+import openpyxl
 import pandas as pd
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
 from django.db.models import Q
+from django.core.files import File
 from django.core.mail import send_mail
 import logging
 from datetime import datetime
@@ -14,9 +22,15 @@ logger = logging.getLogger(__name__)
 from .models import (
     FileUpload, PointsTransaction, User, Brand,
     UserContract, BrandBonus, Invoice, InvoiceBrandTurnover,
-    EmailNotification, Reward,
+    EmailNotification, Reward, ReportJob, TransactionApprovalJob,
 )
-from .services.points import allocate_debit
+from .services.points import allocate_debit, allocate_debits
+from .services.balances import refresh_balances
+from .services.turnover import refresh_turnover_rollup
+from .services.goals import rebuild_goal_candidates
+from .services.bulk import points_bulk_mode
+from .services.cache import invalidate_programme
+from .services.mailer import BatchMailer
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -25,8 +39,16 @@ logger = logging.getLogger(__name__)
 FT_INVOICE = 'INVOICE'
 FT_CREDIT_NOTE = 'CREDIT_NOTE'
 
+# Number of invoices committed per chunk by the bulk import passes
+IMPORT_CHUNK_SIZE = getattr(settings, 'UPLOAD_CHUNK_SIZE', 2000)
+
 def process_uploaded_file(upload_id):
-    """Main function to process an uploaded file and create invoice records."""
+    """
+    Main function to process an uploaded file and create invoice records.
+
+    Both passes commit in chunks and record a checkpoint on the upload, so calling
+    this again for a failed upload continues where the failure stopped it.
+    """
     upload = FileUpload.objects.get(id=upload_id)
     logger.info(f"Starting to process upload {upload_id}, file: {upload.file.name}")
     
@@ -37,25 +59,35 @@ def process_uploaded_file(upload_id):
         logger.info(f"File path: {upload.file.path}")
         logger.info(f"File size: {upload.file.size} bytes")
         
-        df = read_file(upload.file.path)
-        logger.info(f"File read successfully. Shape: {df.shape}")
-        logger.info(f"Columns: {list(df.columns)}")
+        columns = read_columns(upload.file.path)
+        logger.info(f"Columns: {columns}")
         
-        filetype = validate_columns(df)
+        filetype = validate_columns(columns)
         logger.info(f"File type determined: {filetype}")
         
-        # Convert and validate dates
-        df = process_dates(df)
-        logger.info(f"Dates processed. Sample dates: {df['Datum'].head().tolist()}")
-        
         # First pass: create Invoice and InvoiceBrandTurnover records
-        successful_rows = process_invoice_data(df, upload, filetype)
+        # (already done if a failed upload is resumed in the points pass)
+        if upload.processing_stage == 'POINTS':
+            successful_rows = upload.processed_rows
+            logger.info(f"Resuming upload {upload_id} in the points pass at invoice {upload.checkpoint}")
+        else:
+            invoice_col = 'Faktura' if filetype == FT_INVOICE else 'Dobropis'
+            total_invoices, contiguous, number_format = scan_invoices(upload.file.path, invoice_col)
+            logger.info(f"Found {total_invoices} invoices in file, grouped by invoice: {contiguous}")
+            groups = iter_invoice_groups(upload.file.path, filetype, contiguous, total_invoices, number_format)
+            successful_rows = process_invoice_groups(groups, upload, filetype, total_invoices)
         logger.info(f"Invoice data processing completed. Successful rows: {successful_rows}")
         
         # Second pass: calculate and create points transactions
-        points_created = process_points_from_invoices(upload, filetype)
+        points_created = process_points_from_invoices_bulk(upload, filetype)
         logger.info(f"Points processing completed. Points transactions created: {points_created}")
         
+        # The turnovers of the upload's clients changed; so did their goals' evaluation periods
+        candidates = rebuild_goal_candidates(
+            Invoice.objects.filter(file_upload=upload).values_list('client_number', flat=True).distinct()
+        )
+        logger.info(f"Goal evaluation candidates refreshed: {candidates}")
+        
         complete_upload(upload, successful_rows)
         logger.info(f"Processing completed successfully. Successful rows: {successful_rows}, Points transactions: {points_created}")
         
@@ -68,51 +100,278 @@ def process_uploaded_file(upload_id):
 def mark_upload_as_processing(upload):
     """Mark the upload as being processed."""
     upload.status = 'PROCESSING'
+    upload.error_message = ''
+    upload.progress_at = timezone.now()
     upload.save()
 
 
-def read_file(file_path):
-    """Read the uploaded file and return a dataframe."""
-    logger.info(f"Reading file: {file_path}")
-    
+# STREAMING UPLOAD READER
+# Only these columns (plus the invoice number column) are read from an upload.
+REQUIRED_COLUMNS = ['ZČ', 'Cena', 'Kód', 'Datum']
+# Rows read from the file per chunk; bounds the memory used by the reader
+READ_CHUNK_ROWS = getattr(settings, 'UPLOAD_READ_CHUNK_ROWS', 50000)
+# Bytes of a CSV file sampled to detect its encoding
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+# Invoices per bucket when an upload not grouped by invoice is partitioned on disk
+SPILL_INVOICES_PER_BUCKET = getattr(settings, 'UPLOAD_SPILL_INVOICES_PER_BUCKET', 5000)
+
+
+@lru_cache(maxsize=32)
+def detect_encoding(file_path):
+    """
+    Detect the encoding of a CSV file from a sample of its first bytes.
+
+    Tries utf-8, latin-1 and cp1252 in that order, decoding the sample instead
+    of parsing the whole file once per candidate. Cached per path
+    (uploaded files are never rewritten), so the header read, the invoice scan and
+    the import itself all share one detection.
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(ENCODING_SAMPLE_BYTES)
+
+    for encoding in ['utf-8', 'latin-1', 'cp1252']:
+        try:
+            # Incremental decoder, so a multi-byte character cut off at the end of the sample is fine
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            logger.info(f"CSV file encoding detected: {encoding}")
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("Could not read CSV file with any supported encoding")
+
+
+def read_columns(file_path):
+    """Read just the header row of an uploaded file."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File does not exist: {file_path}")
+
+    if file_path.endswith('.csv'):
+        return list(pd.read_csv(file_path, encoding=detect_encoding(file_path), nrows=0).columns)
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
     try:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File does not exist: {file_path}")
-        
-        if file_path.endswith('.csv'):
-            # Try different encodings for CSV files
-            for encoding in ['utf-8', 'latin-1', 'cp1252']:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding, dtype={'ZČ': str})
-                    logger.info(f"CSV file read successfully with encoding: {encoding}")
-                    break
-                except UnicodeDecodeError:
-                    continue
-            else:
-                raise ValueError("Could not read CSV file with any supported encoding")
+        header = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        return [str(value) for value in header if value is not None]
+    finally:
+        workbook.close()
+
+
+def iter_file_chunks(file_path, columns):
+    """
+    Yield the given columns of an uploaded file in DataFrames of READ_CHUNK_ROWS rows.
+
+    CSV files are parsed in chunks, XLSX files are streamed with openpyxl's
+    read-only mode. Text columns are read as strings and 'Cena' as float64, so the
+    amounts sum exactly as they did when the whole file was loaded at once. Like
+    pandas.read_excel, empty worksheet rows are skipped and whole-number cells
+    read as integers ("12345", not "12345.0").
+    """
+    dtypes = {column: 'float64' if column == 'Cena' else str for column in columns}
+
+    if file_path.endswith('.csv'):
+        with pd.read_csv(file_path, encoding=detect_encoding(file_path), usecols=columns,
+                         dtype=dtypes, chunksize=READ_CHUNK_ROWS) as reader:
+            yield from reader
+        return
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(value) for value in next(rows, ())]
+        positions = [header.index(column) for column in columns]
+
+        buffer = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            buffer.append([row[position] if position < len(row) else None for position in positions])
+            if len(buffer) >= READ_CHUNK_ROWS:
+                yield _excel_chunk(buffer, columns, dtypes)
+                buffer = []
+        if buffer:
+            yield _excel_chunk(buffer, columns, dtypes)
+    finally:
+        workbook.close()
+
+
+def _excel_chunk(rows, columns, dtypes):
+    """Build a chunk DataFrame from raw worksheet values, matching the CSV dtypes."""
+    chunk = pd.DataFrame(rows, columns=columns, dtype=object)
+    for column, dtype in dtypes.items():
+        if column == 'Datum':
+            # Real date cells stay datetimes, process_dates parses the text ones
+            continue
+        if dtype is str:
+            chunk[column] = chunk[column].map(_excel_text)
         else:
-            df = pd.read_excel(file_path, dtype={'ZČ': str})
-            logger.info("Excel file read successfully")
-        
-        logger.info(f"File read successfully. Shape: {df.shape}")
-        logger.info(f"Columns: {list(df.columns)}")
-        
-        # Log sample data (first few rows, but be careful with sensitive data)
-        logger.debug(f"Sample data:\n{df.head()}")
-        
-        return df
-        
-    except Exception as e:
-        logger.error(f"Error reading file {file_path}: {str(e)}", exc_info=True)
-        raise
+            chunk[column] = pd.to_numeric(chunk[column]).astype(dtype)
+    return chunk
+
+
+def _excel_text(value):
+    """A worksheet value as text, whole-number floats as integers like pandas.read_excel."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+# How the original importer, which loaded the whole file with inferred dtypes,
+# turned the invoice numbers of a file into text
+NUMBERS_AS_TEXT = 'text'        # any non-numeric number: kept as read
+NUMBERS_AS_INTEGERS = 'int'     # all whole numbers: "00123" -> "123"
+NUMBERS_AS_FLOATS = 'float'     # a blank or a fraction among numbers: "123" -> "123.0"
+
+
+def normalise_invoice_numbers(numbers, number_format):
+    """
+    Format a Series of invoice numbers read as text the way the original
+    importer stored them, so re-uploading a file imported by it updates its
+    invoices instead of duplicating them. Blanks stay blank.
+    """
+    if number_format == NUMBERS_AS_TEXT:
+        return numbers
+    convert = int if number_format == NUMBERS_AS_INTEGERS else float
+    return pd.to_numeric(numbers).map(lambda number: None if pd.isna(number) else str(convert(number)))
+
+
+def scan_invoices(file_path, invoice_col):
+    """
+    Count the invoices in an upload, check that each invoice's rows are adjacent
+    and find how their numbers are formatted.
+
+    Only the invoice number column is read. ABRA exports list an invoice's lines
+    together, which lets iter_invoice_groups stream the file invoice by invoice.
+    The number format is the dtype pandas inferred for the whole column, see
+    normalise_invoice_numbers.
+
+    Returns:
+        tuple: (number of distinct invoices, True if every invoice is one contiguous
+            block, number format for normalise_invoice_numbers)
+    """
+    seen = set()
+    previous = None
+    contiguous = True
+    numeric = whole = True
+    blanks = False
+
+    for chunk in iter_file_chunks(file_path, [invoice_col]):
+        blanks = blanks or chunk[invoice_col].isna().any()
+        numbers = chunk[invoice_col].dropna()
+        if numeric:
+            parsed = pd.to_numeric(numbers, errors='coerce')
+            numeric = parsed.notna().all()
+            whole = whole and (parsed % 1 == 0).all()
+        # Only look at the first row of each run of equal invoice numbers
+        for number in numbers[numbers != numbers.shift()]:
+            if number == previous:
+                continue
+            if number in seen:
+                contiguous = False
+            seen.add(number)
+            previous = number
+
+    if not numeric:
+        number_format = NUMBERS_AS_TEXT
+    elif blanks or not whole:
+        number_format = NUMBERS_AS_FLOATS
+    else:
+        number_format = NUMBERS_AS_INTEGERS
+    return len(seen), contiguous, number_format
+
+
+def iter_invoice_groups(file_path, filetype, contiguous=True, total_invoices=None, number_format=None):
+    """
+    Yield DataFrames of complete invoices from an upload.
 
-def validate_columns(df):
-    """Validate that the dataframe contains all required columns."""
-    required_columns = ['ZČ', 'Cena', 'Kód', 'Datum']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    The rows of the last invoice in a chunk are carried over into the next one,
+    so an invoice is never split between two yielded frames and memory stays
+    bounded by the chunk size. A file whose invoices are not contiguous cannot be
+    streamed like that; it is partitioned by invoice into files on disk first
+    (see spill_invoice_groups). Rows with invalid dates are dropped as in
+    process_dates.
+
+    Args:
+        total_invoices (int | None): Invoices in the file, from scan_invoices;
+            sizes the partitions of a non-contiguous file.
+        number_format (str | None): How to format the invoice numbers, from
+            scan_invoices. The file is scanned if either is needed and not given.
+    """
+    invoice_col = 'Faktura' if filetype == FT_INVOICE else 'Dobropis'
+    columns = [invoice_col] + REQUIRED_COLUMNS
+    if number_format is None or (total_invoices is None and not contiguous):
+        total_invoices, _, number_format = scan_invoices(file_path, invoice_col)
+
+    def normalise(chunk):
+        chunk[invoice_col] = normalise_invoice_numbers(chunk[invoice_col], number_format)
+        return chunk
+
+    chunks = (
+        process_dates(normalise(chunk)).dropna(subset=[invoice_col])
+        for chunk in iter_file_chunks(file_path, columns)
+    )
+
+    if not contiguous:
+        buckets = max(1, -(-total_invoices // SPILL_INVOICES_PER_BUCKET))
+        logger.warning(f"Upload rows are not grouped by invoice, partitioning them into {buckets} file(s)")
+        yield from spill_invoice_groups(chunks, invoice_col, buckets)
+        return
+
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        if chunk.empty:
+            continue
+        last_invoice = chunk[invoice_col] == chunk[invoice_col].iloc[-1]
+        carry = chunk[last_invoice]
+        if not last_invoice.all():
+            yield chunk[~last_invoice]
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def spill_invoice_groups(chunks, invoice_col, buckets):
+    """
+    Yield the rows of chunks partitioned into buckets of complete invoices.
+
+    Every row is appended to one of buckets temporary files chosen by a stable
+    hash of its invoice number, then the files are read back one at a time. An
+    invoice's rows all land in the same bucket in file order, so each yielded
+    frame holds complete invoices whose first row is the one in the file. Memory
+    is bounded by one chunk while writing and one bucket (about
+    SPILL_INVOICES_PER_BUCKET invoices) while reading. The order is the same on
+    every run over the same file, so a resumed import skips the right invoices.
+    """
+    with tempfile.TemporaryDirectory(prefix='upload-spill-') as spill_dir:
+        paths = [os.path.join(spill_dir, f'{bucket}.pickle') for bucket in range(buckets)]
+        for chunk in chunks:
+            bucket_of = chunk[invoice_col].map(lambda number: zlib.crc32(str(number).encode()) % buckets)
+            for bucket, rows in chunk.groupby(bucket_of, sort=False):
+                with open(paths[bucket], 'ab') as f:
+                    pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            frames = []
+            with open(path, 'rb') as f:
+                while True:
+                    try:
+                        frames.append(pickle.load(f))
+                    except EOFError:
+                        break
+            yield pd.concat(frames)
+
+
+def validate_columns(columns):
+    """Validate that the file header contains all required columns."""
+    required_columns = REQUIRED_COLUMNS
+    missing_columns = [col for col in required_columns if col not in columns]
 
     filetype_columns = ['Faktura', 'Dobropis']
-    filetype_columns_checked = [col for col in filetype_columns if col in df.columns]
+    filetype_columns_checked = [col for col in filetype_columns if col in columns]
 
     if len(filetype_columns_checked) != 1:
         raise ValueError(f"Wrong columns for filetype (need either column 'Faktura' or 'Dobropis'), not both or none.")
@@ -149,7 +408,7 @@ def process_dates(df):
             
             # Log the problematic date values
             for idx in invalid_rows[:5]:  # Log first 5 problematic dates
-                original_value = df.iloc[idx]['Datum'] if 'Datum' in df.columns else 'N/A'
+                original_value = df.loc[idx, 'Datum'] if 'Datum' in df.columns else 'N/A'
                 logger.warning(f"Invalid date at row {idx}: '{original_value}'")
             
             # Filter out rows with invalid dates
@@ -164,167 +423,339 @@ def process_dates(df):
         raise ValueError(f"Failed to process dates: {str(e)}")
 
 
-@transaction.atomic
-def process_invoice_data(df, upload, filetype):
+def process_invoice_data_bulk(df, upload, filetype):
     """
-    First pass processing: Create Invoice and InvoiceBrandTurnover records.
-    
-    This function processes the raw data and creates Invoice records along with 
-    their associated InvoiceBrandTurnover records, irrespective of whether the client
-    is registered in the bonus program.
+    Vectorized first pass over a DataFrame holding the whole file.
+
+    See process_invoice_groups; this is the single-group case.
+    """
+    return process_invoice_groups([df], upload, filetype)
+
+
+def process_invoice_groups(groups, upload, filetype, total_invoices=0):
+    """
+    Vectorized first pass: Create Invoice and InvoiceBrandTurnover records in bulk.
+
+    Produces the same records as the original per-invoice importer (kept as the
+    reference in the import tests), but instead of re-filtering the DataFrame
+    once per invoice and once per brand it groups each frame by
+    (invoice, brand) in one go and upserts the results with bulk_create. Every
+    frame in groups must hold complete invoices (see iter_invoice_groups).
+
+    Invoices are committed IMPORT_CHUNK_SIZE at a time, each chunk together with
+    the upload's checkpoint and progress counters. If a chunk fails the error is
+    raised and everything before it stays committed; calling this again for the
+    same upload skips the invoices already imported.
+
+    Args:
+        groups (iterable): DataFrames with dates already processed.
+        upload (FileUpload): The upload the invoices belong to.
+        filetype (str): FT_INVOICE or FT_CREDIT_NOTE.
+        total_invoices (int): Number of invoices in the file, for progress reporting.
+
+    Returns:
+        int: Number of invoices imported (including earlier, resumed runs).
     """
-    successful_rows = 0
-    errors = []
-    
-    # Identify the invoice column based on filetype
     invoice_col = 'Faktura' if filetype == FT_INVOICE else 'Dobropis'
-    
-    # Determine the invoice type
     invoice_type = FT_INVOICE if filetype == FT_INVOICE else FT_CREDIT_NOTE
-    
-    # Get unique invoices from the file
-    unique_invoices = df[invoice_col].unique()
-    logger.info(f"Found {len(unique_invoices)} unique invoices in file")
-    
-    # Create a lookup for all brands in the system to use during processing
+
+    start = upload.checkpoint if upload.processing_stage == 'INVOICES' else 0
+    if start:
+        logger.info(f"Resuming upload {upload.id} after {start} already imported invoices")
+
+    upload.processing_stage = 'INVOICES'
+    upload.checkpoint = start
+    upload.processed_rows = start
+    upload.total_rows = total_invoices
+    save_progress(upload)
+
+    invoices_seen = 0
+    for df in groups:
+        # Rows without an invoice number never match anything in the per-invoice path either
+        df = df[df[invoice_col].notna()]
+
+        # Client number and date come from the first row of each invoice, exactly like iloc[0]
+        headers = df.drop_duplicates(subset=invoice_col, keep='first').set_index(invoice_col).to_dict('index')
+        invoice_numbers = list(headers)
+
+        # Invoices committed by an earlier, failed run are skipped without touching the database
+        skip = min(len(invoice_numbers), max(0, start - invoices_seen))
+        invoices_seen += len(invoice_numbers)
+        if skip == len(invoice_numbers):
+            continue
+
+        totals = _grouped_sum(df, [invoice_col]).to_dict()
+        turnovers_by_invoice = {}
+        for (invoice_number, brand_id), amount in aggregate_brand_turnovers(df, invoice_col).items():
+            turnovers_by_invoice.setdefault(invoice_number, []).append((brand_id, amount))
+
+        for chunk_start in range(skip, len(invoice_numbers), IMPORT_CHUNK_SIZE):
+            chunk = invoice_numbers[chunk_start:chunk_start + IMPORT_CHUNK_SIZE]
+            with transaction.atomic():
+                upsert_invoice_chunk(chunk, headers, totals, turnovers_by_invoice, upload, invoice_type)
+                upload.checkpoint = upload.processed_rows = upload.checkpoint + len(chunk)
+                save_progress(upload)
+            logger.info(f"Imported {upload.checkpoint} invoices")
+
+    # Invoices are done, the points pass starts from the beginning
+    upload.processing_stage = 'POINTS'
+    upload.checkpoint = 0
+    upload.total_rows = upload.processed_rows
+    save_progress(upload)
+
+    return upload.processed_rows
+
+
+def save_progress(upload):
+    """Persist only the processing progress fields of an upload, stamping progress_at."""
+    upload.progress_at = timezone.now()
+    upload.save(update_fields=['processing_stage', 'checkpoint', 'processed_rows', 'total_rows', 'progress_at'])
+
+
+def aggregate_brand_turnovers(df, invoice_col):
+    """
+    Sum line amounts per (invoice, brand) for the whole file at once.
+
+    Every distinct product code is matched against the brand prefixes only once;
+    the resulting code -> brand mapping is joined back onto the lines. A code that
+    starts with several prefixes counts towards each of those brands, the same as
+    a per-brand startswith filter on the lines. Sums of exactly
+    zero are dropped.
+
+    Returns:
+        Series: Decimal amounts indexed by (invoice number, brand id).
+    """
     brand_prefixes = {brand.prefix: brand for brand in Brand.objects.all()}
-    
-    # Process each unique invoice
-    for invoice_number in unique_invoices:
-        try:
-            # Get all rows for this invoice
-            invoice_data = df[df[invoice_col] == invoice_number]
-            
-            if invoice_data.empty:
-                continue
-                
-            # Get the client number and date from the first row
-            # (should be the same for all rows in this invoice)
-            client_number = invoice_data['ZČ'].iloc[0]
-            invoice_date = invoice_data['Datum'].iloc[0]
-            if hasattr(invoice_date, 'date'):
-                invoice_date = invoice_date.date()
-            
-            # Calculate total amount for the invoice
-            total_amount = Decimal(str(invoice_data['Cena'].sum()))
-            
-            # Create or update the Invoice record
-            invoice, created = Invoice.objects.update_or_create(
-                invoice_number=str(invoice_number),
-                defaults={
-                    'client_number': str(client_number),
-                    'invoice_date': invoice_date,
-                    'total_amount': total_amount,
-                    'invoice_type': invoice_type,
-                    'file_upload': upload,
-                }
-            )
-            
-            # Process brand turnovers for this invoice
-            turnover_created = process_brand_turnovers(invoice, invoice_data, brand_prefixes)
-            
-            successful_rows += 1
-            logger.info(f"Successfully processed invoice {invoice_number}")
-            
-        except Exception as e:
-            error_msg = f"Error processing invoice {invoice_number}: {str(e)}"
-            logger.error(error_msg, exc_info=True)
-            errors.append(error_msg)
-    
-    if errors:
-        upload.error_message = "\n".join(errors)
-    
-    upload.processed_rows = successful_rows
-    upload.save()
-    
-    return successful_rows
 
+    codes = df['Kód'].fillna('')
+    code_brands = [
+        (code, brand.id)
+        for code in codes.unique() if isinstance(code, str)
+        for prefix, brand in brand_prefixes.items() if code.startswith(prefix)
+    ]
+    mapping = pd.DataFrame(code_brands, columns=['Kód', 'brand_id'])
 
-def process_brand_turnovers(invoice, invoice_data, brand_prefixes):
+    lines = pd.DataFrame({invoice_col: df[invoice_col], 'Kód': codes, 'Cena': df['Cena']})
+    lines = lines.merge(mapping, on='Kód', how='inner')
+
+    amounts = _grouped_sum(lines, [invoice_col, 'brand_id'])
+    return amounts[amounts != 0]
+
+
+def _grouped_sum(df, keys):
     """
-    Process and create InvoiceBrandTurnover records for a specific invoice.
-    
-    This function analyzes the invoice data, identifies brands based on their
-    prefix codes, and creates corresponding InvoiceBrandTurnover records.
+    Sum 'Cena' per group and convert to Decimal the same way the per-invoice path does.
+
+    Each group is summed with Series.sum rather than groupby's compensated cython sum,
+    so the float result (and therefore the zero check and the stored amount) is
+    bit-for-bit the one the per-invoice importer computed.
     """
-    turnovers_created = 0
-    
-    for prefix, brand in brand_prefixes.items():
-        # Filter rows for this brand
-        brand_rows = invoice_data[invoice_data['Kód'].fillna('').str.startswith(prefix)]
-        
-        if brand_rows.empty:
-            continue
-        
-        # Sum up all values for this brand in this invoice
-        brand_amount = Decimal(str(brand_rows['Cena'].sum()))
-        
-        if brand_amount == 0:
-            continue
-        
-        # Create or update the InvoiceBrandTurnover record
-        turnover, created = InvoiceBrandTurnover.objects.update_or_create(
-            invoice=invoice,
-            brand=brand,
-            defaults={'amount': brand_amount}
-        )
-        
-        turnovers_created += 1
-    
-    logger.debug(f"Created {turnovers_created} brand turnover records for invoice {invoice.invoice_number}")
-    return turnovers_created
+    sums = df.groupby(keys, sort=False)['Cena'].agg(lambda values: values.sum())
+    return sums.map(lambda value: Decimal(str(value)))
 
 
-@transaction.atomic
-def process_points_from_invoices(upload, filetype):
+def upsert_invoice_chunk(invoice_numbers, headers, totals, turnovers_by_invoice, upload, invoice_type):
     """
-    Second pass processing: Create points transactions from invoice data.
-    
-    This function iterates through the Invoice records created in the first pass,
-    determines if the client is eligible for points, and creates the appropriate
-    PointsTransaction records.
+    Insert or update one chunk of invoices and their brand turnovers, and
+    recompute the monthly turnover rollup cells they touch.
     """
+    # Re-uploaded invoices may move to another client or month; their old cells change too
+    touched_cells = set(
+        Invoice.objects.filter(invoice_number__in=[str(number) for number in invoice_numbers])
+        .values_list('client_number', 'invoice_date')
+    )
+
+    invoices = []
+    for invoice_number in invoice_numbers:
+        header = headers[invoice_number]
+        invoice_date = header['Datum']
+        if hasattr(invoice_date, 'date'):
+            invoice_date = invoice_date.date()
+        invoices.append(Invoice(
+            invoice_number=str(invoice_number),
+            client_number=str(header['ZČ']),
+            invoice_date=invoice_date,
+            total_amount=totals[invoice_number],
+            invoice_type=invoice_type,
+            file_upload=upload,
+        ))
+
+    Invoice.objects.bulk_create(
+        invoices,
+        update_conflicts=True,
+        unique_fields=['invoice_number'],
+        update_fields=['client_number', 'invoice_date', 'total_amount', 'invoice_type', 'file_upload'],
+    )
+
+    invoice_ids = dict(
+        Invoice.objects.filter(invoice_number__in=[invoice.invoice_number for invoice in invoices])
+        .values_list('invoice_number', 'id')
+    )
+
+    turnovers = [
+        InvoiceBrandTurnover(invoice_id=invoice_ids[str(invoice_number)], brand_id=brand_id, amount=amount)
+        for invoice_number in invoice_numbers
+        for brand_id, amount in turnovers_by_invoice.get(invoice_number, [])
+    ]
+    InvoiceBrandTurnover.objects.bulk_create(
+        turnovers,
+        update_conflicts=True,
+        unique_fields=['invoice', 'brand'],
+        update_fields=['amount'],
+    )
+
+    touched_cells.update((invoice.client_number, invoice.invoice_date) for invoice in invoices)
+    refresh_turnover_rollup(touched_cells)
+
+
+def process_points_from_invoices_bulk(upload, filetype):
+    """
+    Batched second pass: Create points transactions for an upload in chunks.
+
+    Creates the same transactions as the original per-invoice pass, but per chunk
+    of IMPORT_CHUNK_SIZE invoices it resolves users, contracts, brand bonuses and
+    already existing transactions in a handful of queries and inserts the new
+    rows with bulk_create. Each chunk commits together with the upload's
+    checkpoint, so a failed run resumes after the last committed chunk.
+    """
+    # Meta ordering (date, number) is total, so chunk boundaries are stable across resumes
+    invoice_ids = list(Invoice.objects.filter(file_upload=upload).values_list('id', flat=True))
+    logger.info(f"Processing points for {len(invoice_ids)} invoices")
+
+    start = upload.checkpoint if upload.processing_stage == 'POINTS' else 0
+    upload.processing_stage = 'POINTS'
+    upload.checkpoint = start
+    save_progress(upload)
+
     points_created = 0
-    
-    # Process only invoices from the current upload
-    invoices = Invoice.objects.filter(file_upload=upload)
-    logger.info(f"Processing points for {invoices.count()} invoices")
-    
+    for chunk_start in range(start, len(invoice_ids), IMPORT_CHUNK_SIZE):
+        chunk_ids = invoice_ids[chunk_start:chunk_start + IMPORT_CHUNK_SIZE]
+        with transaction.atomic():
+            points_created += create_points_for_invoices(chunk_ids, upload, filetype)
+            upload.checkpoint = chunk_start + len(chunk_ids)
+            save_progress(upload)
+
+    return points_created
+
+
+def create_points_for_invoices(invoice_ids, upload, filetype):
+    """
+    Create the points transactions for one chunk of an upload's invoices.
+
+    Expiry and remaining_points are stamped here, since bulk_create skips
+    PointsTransaction.save. Credit note debits are then allocated together and
+    the balances of the chunk's users refreshed once.
+
+    Returns:
+        int: Number of transactions created.
+    """
+    invoices = list(
+        Invoice.objects.filter(id__in=invoice_ids)
+        .prefetch_related('brand_turnovers__brand')
+    )
+
+    users = {
+        user.user_number: user
+        for user in User.objects.filter(user_number__in={invoice.client_number for invoice in invoices})
+    }
+
+    contracts_by_user = {}
+    contracts = (
+        UserContract.objects
+        .filter(user_id__in=users.values(), is_active=True)
+        .prefetch_related('brandbonuses')
+        .order_by('contract_date_from')
+    )
+    for contract in contracts:
+        contracts_by_user.setdefault(contract.user_id_id, []).append(contract)
+
+    existing = set(
+        PointsTransaction.objects
+        .filter(invoice_id__in=invoice_ids)
+        .values_list('user_id', 'invoice_id', 'brand_id', 'type', 'date')
+    )
+
+    new_transactions = []
     for invoice in invoices:
-        try:
-            # Check if client exists in our system
-            try:
-                user = User.objects.get(user_number=invoice.client_number)
-            except User.DoesNotExist:
-                logger.debug(f"No user found for client number {invoice.client_number} - skipping points")
+        user = users.get(invoice.client_number)
+        if user is None:
+            logger.debug(f"No user found for client number {invoice.client_number} - skipping points")
+            continue
+
+        contract = find_active_contract(contracts_by_user.get(user.id, []), invoice.invoice_date)
+        if not contract:
+            logger.debug(f"No active contract for user {user.user_number} on date {invoice.invoice_date}")
+            continue
+
+        # First bonus per brand wins, like the brand_bonuses scan in process_brand_points
+        bonuses = {}
+        for bonus in contract.brandbonuses.all():
+            bonuses.setdefault(bonus.brand_id_id, bonus)
+        if not bonuses:
+            logger.debug(f"No brand bonuses for user {user.user_number} - skipping")
+            continue
+
+        for turnover in invoice.brand_turnovers.all():
+            bonus = bonuses.get(turnover.brand_id)
+            if not bonus:
                 continue
-            
-            # Check if user had an active contract on the invoice date
-            contract = get_active_contract(user, invoice.invoice_date)
-            if not contract:
-                logger.debug(f"No active contract for user {user.user_number} on date {invoice.invoice_date}")
+
+            points, transaction_type, status = calculate_brand_points(turnover.amount, bonus, filetype)
+            if points == 0:
                 continue
-            
-            # Get user's brand bonuses for this contract
-            brand_bonuses = contract.brandbonuses.all()
-            if not brand_bonuses:
-                logger.debug(f"No brand bonuses for user {user.user_number} - skipping")
+
+            key = (user.id, invoice.id, turnover.brand_id, transaction_type, invoice.invoice_date)
+            if key in existing:
+                logger.info(f"Skipping duplicate transaction for invoice {invoice.invoice_number}, brand {turnover.brand.name}")
                 continue
-            
-            # Process each brand turnover for this invoice
-            for turnover in invoice.brand_turnovers.all():
-                transactions_created = process_brand_points(
-                    user, invoice, turnover, brand_bonuses, filetype
-                )
-                points_created += transactions_created
-                
-        except Exception as e:
-            logger.error(f"Error processing points for invoice {invoice.invoice_number}: {str(e)}", exc_info=True)
-    
-    return points_created
+            existing.add(key)
+
+            new_transactions.append(PointsTransaction(
+                user=user,
+                value=points,
+                date=invoice.invoice_date,
+                description=f'{"Invoice" if invoice.invoice_type == FT_INVOICE else "Credit Note"} {invoice.invoice_number}',
+                invoice=invoice,
+                type=transaction_type,
+                status=status,
+                brand=turnover.brand,
+                file_upload=upload,
+                expires_at=turnover.brand.expiry_for(invoice.invoice_date) if points > 0 else None,
+                remaining_points=max(points, 0),
+            ))
 
+    PointsTransaction.objects.bulk_create(new_transactions)
 
-@transaction.atomic
+    # Credit notes are debits: allocate them in invoice order, so each debit sees
+    # the allocations of the ones before it exactly as in the per-row path.
+    allocate_debits(
+        [points_transaction for points_transaction in new_transactions if points_transaction.value < 0],
+        refresh=False,
+    )
+    # bulk_create skips the post_save signal that keeps balances current
+    refresh_balances({points_transaction.user_id for points_transaction in new_transactions})
+
+    return len(new_transactions)
+
+
+def find_active_contract(contracts, date):
+    """
+    Pick the contract covering date from a user's preloaded active contracts.
+
+    Mirrors get_active_contract: exactly one match is required, overlapping
+    contracts are an error for that invoice and no points are created.
+    """
+    matches = [
+        contract for contract in contracts
+        if contract.contract_date_from <= date <= contract.contract_date_to
+    ]
+    if len(matches) > 1:
+        logger.error(f"Multiple active contracts for user {matches[0].user_id_id} on date {date}")
+        return None
+    return matches[0] if matches else None
+
+
+@points_bulk_mode()
 def recalculate_points_for_user(user, date_from=None, date_to=None):
     """
     Fill in missing points transactions for a client's existing invoices.
@@ -333,7 +764,7 @@ def recalculate_points_for_user(user, date_from=None, date_to=None):
     existing client. For each invoice in range, resolves whichever contract was
     active on that invoice's date and reuses process_brand_points, so this is
     idempotent: it only fills gaps and never duplicates or alters transactions
-    that already exist.
+    that already exist. Runs in one transaction in points bulk mode.
 
     Args:
         user (User): The client to recalculate points for.
@@ -400,21 +831,11 @@ def process_brand_points(user, invoice, turnover, brand_bonuses, filetype):
     if not bonus:
         return 0
     
-    # Calculate points based on the bonus ratio
-    points = int(float(amount) * bonus.points_ratio)
+    points, transaction_type, status = calculate_brand_points(amount, bonus, filetype)
     
     if points == 0:
         return 0
     
-    # Determine points sign based on invoice type
-    if filetype == FT_CREDIT_NOTE:
-        points = -points
-        transaction_type = 'CREDIT_NOTE_ADJUST'
-        status = 'CONFIRMED'
-    else:
-        transaction_type = 'STANDARD_POINTS'
-        status = 'PENDING'
-    
     # Create transaction with robust idempotency check
     existing = check_existing_transaction(user, invoice, brand, transaction_type)
     
@@ -446,6 +867,25 @@ def process_brand_points(user, invoice, turnover, brand_bonuses, filetype):
     return 1
 
 
+def calculate_brand_points(amount, bonus, filetype):
+    """
+    Calculate the points, transaction type and status for one brand turnover.
+
+    Invoices earn PENDING standard points; credit notes deduct CONFIRMED points.
+
+    Returns:
+        tuple: (points, transaction_type, status). Points are 0 when the turnover
+            is too small to earn anything.
+    """
+    # Calculate points based on the bonus ratio
+    points = int(float(amount) * bonus.points_ratio)
+
+    # Determine points sign based on invoice type
+    if filetype == FT_CREDIT_NOTE:
+        return -points, 'CREDIT_NOTE_ADJUST', 'CONFIRMED'
+    return points, 'STANDARD_POINTS', 'PENDING'
+
+
 def check_existing_transaction(user, invoice, brand, transaction_type):
     """
     Check if a transaction already exists for this invoice and brand.
@@ -468,9 +908,13 @@ def check_existing_transaction(user, invoice, brand, transaction_type):
 def complete_upload(upload, successful_rows):
     """Mark the upload as completed and update statistics."""
     upload.status = 'COMPLETED'
+    upload.processing_stage = ''
+    upload.checkpoint = 0
     upload.processed_at = timezone.now()
     upload.rows_processed = successful_rows
     upload.save()
+    # Turnover and goal figures changed; balances were invalidated as points were written
+    invalidate_programme()
 
 
 def handle_processing_error(upload, exception):
@@ -483,12 +927,66 @@ def handle_processing_error(upload, exception):
     upload.save()
 
 
+# REPORT ASYNC TASKS
+def generate_report_task(job_id):
+    """
+    Background task that generates one ReportJob's Excel file.
+
+    The workbook is streamed to a temporary file, then stored under MEDIA as
+    the job's file. Failures are recorded on the job rather than raised, so the
+    Reports Hub can show them.
+
+    A job marked FAILED by submit_report_job because it ran out of time stays
+    failed: a worker that picks it up late does nothing, one that finishes
+    late discards its file.
+    """
+    from .reports import get_report_by_id
+
+    job = ReportJob.objects.get(id=job_id)
+    job.status = 'RUNNING'
+    job.started_at = timezone.now()
+    if not ReportJob.objects.filter(id=job.id, status='PENDING').update(status='RUNNING', started_at=job.started_at):
+        logger.warning(f"Report job {job.id} is no longer pending, not generating it")
+        return
+
+    try:
+        report_class = get_report_by_id(job.report_id)
+        if report_class is None:
+            raise ValueError(f"Unknown report: {job.report_id}")
+        report = report_class(**job.parameters)
+
+        with tempfile.TemporaryFile(suffix='.xlsx') as tmp:
+            job.row_count = report.write_workbook(tmp)
+            tmp.seek(0)
+            timestamp = timezone.now().strftime('%Y%m%d_%H%M')
+            job.file.save(f'{report.filename_prefix}_{timestamp}.xlsx', File(tmp), save=False)
+
+        job.status = 'COMPLETED'
+        logger.info(f"Report job {job.id} ({job.report_id}) wrote {job.row_count} rows")
+    except Exception as e:
+        logger.error(f"Error generating report job {job.id} ({job.report_id}): {e}", exc_info=True)
+        job.status = 'FAILED'
+        job.error_message = str(e)
+
+    job.finished_at = timezone.now()
+    finished = ReportJob.objects.filter(id=job.id, status='RUNNING').update(
+        status=job.status, finished_at=job.finished_at, row_count=job.row_count,
+        file=job.file.name, error_message=job.error_message,
+    )
+    if not finished:
+        logger.warning(f"Report job {job.id} was given up on while it ran, discarding its file")
+        if job.file:
+            job.file.delete(save=False)
+
+
 # EMAIL ASYNC TASKS
 def send_email_task(notification_id, recipient_email, subject, message):
     """
     Background task to send an email and update the notification record.
     
-    This function will be called asynchronously by Django-Q2.
+    This function will be called asynchronously by Django-Q2. Notifications
+    are now sent by the batch mailer; this task is kept for the ones queued
+    before it.
     """
     try:
         # Get the notification object
@@ -530,6 +1028,78 @@ def send_email_task(notification_id, recipient_email, subject, message):
         # Re-raise the exception so Django-Q2 can log it
         raise 
 
+def send_notifications(notification_ids, progress=None):
+    """
+    Send many already created notifications with the batch mailer.
+
+    Notifications that are no longer pending are skipped, so sending the same
+    ids twice does not send twice. A failed email is marked FAILED and the rest
+    are still sent.
+
+    Args:
+        notification_ids (list[int]): The notifications to send.
+        progress (callable | None): Called with the number sent so far after
+            each batch.
+
+    Returns:
+        int: Number of emails sent.
+    """
+    batches = BatchMailer().drain(notification_ids, progress=progress)
+    return sum(batch.sent for batch in batches)
+
+
+def send_notifications_task(notification_ids):
+    """
+    Background task to send many notifications in one job, instead of one
+    send_email_task per email.
+    """
+    return send_notifications(notification_ids)
+
+
+def send_pending_notifications_task():
+    """
+    Background task that drains every pending notification, e.g. on a django-q
+    schedule, to pick up any that were not queued or whose job was lost.
+    """
+    batches = BatchMailer().drain()
+    return sum(batch.sent for batch in batches)
+
+
+def approve_transactions_task(job_id):
+    """
+    Background task that runs one TransactionApprovalJob: confirms the month's
+    pending transactions, then sends the clients' notifications, recording the
+    counts and the emails sent on the job as it goes. Failures are recorded on
+    the job rather than raised, so the approval page can show them.
+    """
+    from .services.approval import approve_month
+
+    job = TransactionApprovalJob.objects.get(id=job_id)
+    job.status = 'RUNNING'
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    def record_progress(sent):
+        job.notifications_sent = sent
+        job.save(update_fields=['notifications_sent'])
+
+    try:
+        result = approve_month(job.year, job.month)
+        job.transaction_count = result['transaction_count']
+        job.points_total = result['points_total']
+        job.user_count = result['user_count']
+        job.save(update_fields=['transaction_count', 'points_total', 'user_count'])
+
+        send_notifications(result['notification_ids'], progress=record_progress)
+        job.status = 'COMPLETED'
+    except Exception as e:
+        logger.error(f"Error running approval job {job.id} ({job.year}-{job.month:02d}): {e}", exc_info=True)
+        job.status = 'FAILED'
+        job.error_message = str(e)
+
+    job.finished_at = timezone.now()
+    job.save()
+
 def process_stock_file(upload_id):
     """Process stock data file and update reward availability."""
     upload = FileUpload.objects.get(id=upload_id)
@@ -0,0 +1,25 @@
+import pytest
+from django.core.cache import cache
+
+from pa_bonus.services.activity import activity_recorder
+
+
+@pytest.fixture(autouse=True)
+def clear_activity_buffer():
+    """Visits buffered by one test must not be written into the next one's database."""
+    activity_recorder.clear()
+    yield
+    activity_recorder.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(settings):
+    """
+    Cache in process memory, whatever the settings say, and start every test
+    empty: figures cached by one test must not be served to the next one,
+    whose ids may repeat.
+    """
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+    cache.clear()
+    yield
+    cache.clear()
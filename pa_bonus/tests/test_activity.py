@@ -0,0 +1,93 @@
+"""
+Tests for pa_bonus.services.activity: visits are buffered per user and day
+and written behind in bulk, adding to the stored counts.
+"""
+import pytest
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from pa_bonus.models import User, UserActivity
+from pa_bonus.services.activity import ActivityRecorder, activity_recorder, is_tracked
+
+
+def at(day, hour):
+    return datetime(2025, 3, day, hour, tzinfo=dt_timezone.utc)
+
+
+@pytest.mark.django_db
+class TestActivityRecorder:
+    def setup_method(self):
+        self.alice = User.objects.create(username="alice", user_number="C1", user_phone="1")
+        self.bob = User.objects.create(username="bob", user_number="C2", user_phone="2")
+
+    def rows(self):
+        return {
+            (row.user_id, row.date.day): (row.visit_count, row.last_activity)
+            for row in UserActivity.objects.all()
+        }
+
+    def test_flush_adds_buffered_visits(self):
+        recorder = ActivityRecorder(flush_seconds=3600)
+        for hour in (8, 9, 10):
+            recorder.record(self.alice.id, at(1, hour))
+        recorder.record(self.alice.id, at(2, 8))
+        recorder.record(self.bob.id, at(1, 12))
+        assert not UserActivity.objects.exists()
+
+        with CaptureQueriesContext(connection) as queries:
+            assert recorder.flush() == 3
+        assert len(queries.captured_queries) <= 5  # users, savepoint, insert, update, release
+        assert self.rows() == {
+            (self.alice.id, 1): (3, at(1, 10)),
+            (self.alice.id, 2): (1, at(2, 8)),
+            (self.bob.id, 1): (1, at(1, 12)),
+        }
+
+        # Later flushes add to the stored counts and keep the latest visit
+        recorder.record(self.alice.id, at(1, 9))
+        recorder.record(self.alice.id, at(1, 9))
+        recorder.flush()
+        assert self.rows()[(self.alice.id, 1)] == (5, at(1, 10))
+        assert recorder.flush() == 0
+
+    def test_flushes_when_due(self):
+        now = [0.0]
+        recorder = ActivityRecorder(flush_seconds=60, max_pending=3, clock=lambda: now[0])
+        recorder.record(self.alice.id, at(1, 8))
+        assert not UserActivity.objects.exists()
+
+        now[0] = 61
+        recorder.record(self.alice.id, at(1, 9))
+        assert self.rows() == {(self.alice.id, 1): (2, at(1, 9))}
+
+        for day in (2, 3, 4):
+            recorder.record(self.bob.id, at(day, 8))
+        assert UserActivity.objects.filter(user=self.bob).count() == 3
+
+    def test_visits_of_deleted_users_are_dropped(self):
+        recorder = ActivityRecorder(flush_seconds=3600)
+        recorder.record(self.alice.id, at(1, 8))
+        recorder.record(self.bob.id, at(1, 8))
+        self.bob.delete()
+        assert recorder.flush() == 1
+        assert list(UserActivity.objects.values_list('user_id', flat=True)) == [self.alice.id]
+
+    def test_middleware_buffers_visits_and_skips_polled_paths(self):
+        http = Client()
+        http.force_login(self.alice)
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                http.get(reverse('dashboard'))
+        assert not any('pa_bonus_useractivity' in query['sql'] for query in queries.captured_queries)
+
+        assert not is_tracked(reverse('report_job_status', args=[1]))
+        assert not is_tracked(reverse('upload_progress', args=[1]))
+        assert not is_tracked('/static/css/style.css')
+        assert is_tracked(reverse('dashboard'))
+
+        activity_recorder.flush()
+        assert UserActivity.objects.get(user=self.alice).visit_count == 3
@@ -0,0 +1,139 @@
+"""
+Tests for the monthly transaction approval: the approval page queues a
+TransactionApprovalJob, and the background job confirms the month's pending
+transactions set-based, creates one notification per client and sends them,
+recording its progress.
+"""
+import pytest
+from datetime import date, timedelta
+
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from pa_bonus.models import User, Brand, PointsTransaction, EmailNotification, TransactionApprovalJob
+from pa_bonus.services.approval import APPROVAL_TASK_TIMEOUT, approve_month, month_range
+
+
+@pytest.mark.django_db
+class TestTransactionApproval:
+    def setup_method(self):
+        self.manager = User.objects.create(username="manager", user_number="M1", user_phone="1")
+        self.manager.groups.add(Group.objects.create(name="Managers"))
+        self.brand = Brand.objects.create(name="Primavera", prefix="PA")
+        self.http = Client()
+        self.http.force_login(self.manager)
+        self.count = 0
+
+    def add_client(self, values, day=date(2025, 3, 10)):
+        """A client with one pending transaction per value in the month."""
+        self.count += 1
+        number = f"C{self.count}"
+        user = User.objects.create(
+            username=number, user_number=number, user_phone=number, first_name="Client", last_name=number,
+            email=f"{number}@example.com",
+        )
+        PointsTransaction.objects.bulk_create([
+            PointsTransaction(
+                user=user, value=value, date=day, description="Points", type="STANDARD_POINTS",
+                status="PENDING", brand=self.brand,
+            )
+            for value in values
+        ])
+        return user
+
+    def approve(self, django_capture_on_commit_callbacks, year=2025, month=3):
+        with django_capture_on_commit_callbacks(execute=True):
+            return self.http.post(reverse('transaction_approval'), {'year': year, 'month': month})
+
+    def test_month_range(self):
+        assert month_range(2025, 2) == (date(2025, 2, 1), date(2025, 2, 28))
+        assert month_range(2024, 12) == (date(2024, 12, 1), date(2024, 12, 31))
+
+    def test_job_confirms_month_and_notifies_each_client(self, django_capture_on_commit_callbacks, mailoutbox):
+        first = self.add_client([100, 50])
+        second = self.add_client([30])
+        later = self.add_client([70], day=date(2025, 4, 1))
+
+        response = self.approve(django_capture_on_commit_callbacks)
+        assert response.status_code == 302
+
+        job = TransactionApprovalJob.objects.get()
+        assert (job.status, job.transaction_count, job.points_total, job.user_count) == ('COMPLETED', 3, 180, 2)
+        assert job.notifications_sent == 2 and job.progress == 100
+        assert job.requested_by == self.manager and job.finished_at is not None
+
+        assert first.get_balance() == 150 and second.get_balance() == 30
+        assert later.pointstransaction_set.get().status == 'PENDING'
+
+        assert sorted(message.to[0] for message in mailoutbox) == ["C1@example.com", "C2@example.com"]
+        body = next(message.body for message in mailoutbox if message.to == ["C1@example.com"])
+        assert "adding 150 points" in body and "balance is now: 150 points" in body
+        assert set(EmailNotification.objects.values_list('status', flat=True)) == {'SENT'}
+
+    def test_second_run_finds_nothing_to_confirm(self, django_capture_on_commit_callbacks, mailoutbox):
+        self.add_client([100])
+        self.approve(django_capture_on_commit_callbacks)
+        self.approve(django_capture_on_commit_callbacks)
+
+        assert list(TransactionApprovalJob.objects.values_list('transaction_count', flat=True)) == [0, 1]
+        assert len(mailoutbox) == 1
+
+    def test_running_job_is_reused(self, django_capture_on_commit_callbacks):
+        running = TransactionApprovalJob.objects.create(year=2025, month=3, status='RUNNING', requested_by=self.manager)
+        self.approve(django_capture_on_commit_callbacks)
+        assert list(TransactionApprovalJob.objects.all()) == [running]
+
+    def test_dead_job_is_failed_not_reused(self, django_capture_on_commit_callbacks):
+        self.add_client([100])
+        dead = TransactionApprovalJob.objects.create(year=2025, month=3, status='RUNNING', requested_by=self.manager)
+        TransactionApprovalJob.objects.filter(id=dead.id).update(
+            started_at=timezone.now() - timedelta(seconds=APPROVAL_TASK_TIMEOUT + 1)
+        )
+        self.approve(django_capture_on_commit_callbacks)
+
+        dead.refresh_from_db()
+        assert dead.status == 'FAILED'
+        job = TransactionApprovalJob.objects.exclude(id=dead.id).get()
+        assert (job.status, job.transaction_count) == ('COMPLETED', 1)
+
+    def test_post_query_count_does_not_grow_with_clients(self, django_capture_on_commit_callbacks):
+        self.add_client([100])
+        self.http.get(reverse('transaction_approval'))  # the first visit records the user's activity
+        with CaptureQueriesContext(connection) as few:
+            self.http.post(reverse('transaction_approval'), {'year': 2025, 'month': 3})
+
+        TransactionApprovalJob.objects.all().delete()
+        for _ in range(10):
+            self.add_client([10, 20])
+        with CaptureQueriesContext(connection) as many:
+            self.http.post(reverse('transaction_approval'), {'year': 2025, 'month': 3})
+        assert len(many.captured_queries) == len(few.captured_queries)
+
+    def test_approve_month_query_count_does_not_grow_with_clients(self):
+        self.add_client([100])
+        with CaptureQueriesContext(connection) as few:
+            approve_month(2025, 3)
+
+        for _ in range(10):
+            self.add_client([10, 20])
+        with CaptureQueriesContext(connection) as many:
+            result = approve_month(2025, 3)
+        assert result['user_count'] == 10 and len(result['notification_ids']) == 10
+        assert len(many.captured_queries) == len(few.captured_queries)
+
+    def test_status_and_page(self, django_capture_on_commit_callbacks):
+        self.add_client([100])
+        self.approve(django_capture_on_commit_callbacks)
+        job = TransactionApprovalJob.objects.get()
+
+        status = self.http.get(reverse('transaction_approval_job_status', args=[job.id])).json()
+        assert status == {
+            'id': job.id, 'status': 'COMPLETED', 'transaction_count': 1, 'points_total': 100,
+            'user_count': 1, 'notifications_sent': 1, 'progress': 100, 'error': '',
+        }
+        page = self.http.get(reverse('transaction_approval') + "?year=2025&month=3")
+        assert list(page.context['approval_jobs']) == [job]
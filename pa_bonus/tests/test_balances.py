@@ -0,0 +1,168 @@
+"""
+Tests for the materialised PointsBalance rows.
+
+The balance row must always equal what the ledger says: after single saves,
+after bulk status changes, after allocations and expiry, and the
+rebuild_balances command must find and repair any row that drifted.
+"""
+import pytest
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from pa_bonus.admin import confirm_transactions
+from pa_bonus.models import User, PointsTransaction, PointsBalance
+from pa_bonus.services.balances import (
+    calculate_balances, refresh_balances, get_points_balance, find_balance_drift,
+)
+from pa_bonus.services.points import allocate_debit, void_debit, expire_credits
+
+
+def make_user(number="100"):
+    return User.objects.create(
+        username=f"user{number}", user_number=number, user_phone="123456789"
+    )
+
+
+def txn(user, value, *, status="CONFIRMED", day=date(2025, 1, 1), expires=None,
+        ttype="STANDARD_POINTS"):
+    return PointsTransaction.objects.create(
+        user=user, value=value, date=day, expires_at=expires,
+        description="t", type=ttype, status=status,
+    )
+
+
+def stored(user):
+    return PointsBalance.objects.get(user_id=user)
+
+
+@pytest.mark.django_db
+class TestBalanceMaintenance:
+    def test_single_saves_update_the_row(self):
+        user = make_user()
+        txn(user, 100)
+        txn(user, 40, status="PENDING")
+        balance = stored(user)
+        assert (balance.points, balance.pending_points) == (100, 40)
+        assert user.get_balance() == 100
+
+    def test_bulk_status_change_with_refresh(self):
+        user = make_user()
+        txn(user, 100, status="PENDING")
+        PointsTransaction.objects.filter(user=user).update(status="CONFIRMED")
+        assert stored(user).points == 0  # update() bypasses signals...
+        refresh_balances([user.pk])
+        assert stored(user).points == 100  # ...so writers refresh explicitly
+
+    def test_delete_updates_the_row(self):
+        user = make_user()
+        keep = txn(user, 100)
+        txn(user, 50).delete()
+        assert stored(user).points == keep.value
+
+    def test_allocation_and_void_keep_expiring_current(self):
+        user = make_user()
+        soon = timezone.now().date()
+        txn(user, 100, expires=soon)
+        claim = txn(user, -30, ttype="REWARD_CLAIM")
+        allocate_debit(claim)
+        balance = stored(user)
+        assert (balance.points, balance.expiring_points) == (70, 70)
+
+        void_debit(claim)
+        balance = stored(user)
+        assert (balance.points, balance.expiring_points) == (100, 100)
+
+    def test_expiry_refreshes_balance(self):
+        user = make_user()
+        txn(user, 100, expires=date(2025, 1, 31))
+        expire_credits(as_of=date(2025, 2, 1))
+        assert stored(user).points == 0
+
+    def test_deleting_a_user_cascades_cleanly(self):
+        user = make_user()
+        txn(user, 100)
+        user.delete()
+        assert not PointsBalance.objects.exists()
+
+    def test_admin_status_action_on_a_status_filtered_changelist(self):
+        user = make_user()
+        pending = txn(user, 100, status="PENDING")
+        assert (stored(user).points, stored(user).pending_points) == (0, 100)
+
+        # As the changelist passes it with "status = Pending" selected
+        confirm_transactions(None, None, PointsTransaction.objects.filter(status="PENDING", pk=pending.pk))
+        assert (stored(user).points, stored(user).pending_points) == (100, 0)
+        assert user.get_balance() == 100
+
+    def test_get_points_balance_is_one_read_of_the_stored_row(self, django_assert_num_queries):
+        user = make_user()
+        txn(user, 100)
+        PointsBalance.objects.filter(user_id=user).update(date=date(2000, 1, 1))
+        with django_assert_num_queries(1):
+            assert get_points_balance(user).points == 100
+        with django_assert_num_queries(1):
+            assert user.get_balance() == 100
+        assert stored(user).date == date(2000, 1, 1)
+
+        other = make_user("101")
+        assert get_points_balance(other).points == 0
+        assert not PointsBalance.objects.filter(user_id=other).exists()
+
+    def test_calculate_matches_unmaterialised_sum(self):
+        users = [make_user(str(n)) for n in range(3)]
+        for n, user in enumerate(users):
+            txn(user, 10 * (n + 1))
+            txn(user, -n)
+        result = calculate_balances([u.pk for u in users])
+        assert [result[u.pk]["points"] for u in users] == [10, 19, 28]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBalanceLocking:
+    """
+    Outside a test transaction, so writes run in autocommit as in the views;
+    SQLite ignores the row lock, so the test asserts it runs in a transaction.
+    """
+
+    @pytest.fixture(autouse=True)
+    def lock_needs_transaction(self, monkeypatch):
+        from django.db import connection
+        from django.db.models import QuerySet
+
+        select_for_update = QuerySet.select_for_update
+
+        def checked(queryset, *args, **kwargs):
+            assert connection.in_atomic_block, "select_for_update() outside a transaction"
+            return select_for_update(queryset, *args, **kwargs)
+
+        monkeypatch.setattr(QuerySet, 'select_for_update', checked)
+
+    def test_autocommit_writes_and_reads_lock_inside_a_transaction(self):
+        user = make_user()
+        txn(user, 100)
+        claim = txn(user, -30, ttype="REWARD_CLAIM")
+        allocate_debit(claim)
+        txn(user, 20).delete()
+        assert user.get_balance() == 70
+        assert stored(user).points == 70
+
+
+@pytest.mark.django_db
+class TestRebuildBalances:
+    def test_drift_is_reported_and_repaired(self):
+        user = make_user()
+        txn(user, 100)
+        PointsBalance.objects.filter(user_id=user).update(points=1)
+        assert [d[0] for d in find_balance_drift([user.pk])] == [user.pk]
+
+        out = StringIO()
+        call_command("rebuild_balances", "--check", stdout=out)
+        assert "1 balance(s) out of date" in out.getvalue()
+        assert stored(user).points == 1
+
+        call_command("rebuild_balances", stdout=StringIO())
+        assert stored(user).points == 100
+        assert find_balance_drift([user.pk]) == []
@@ -0,0 +1,109 @@
+"""
+Tests for pa_bonus.services.bulk: inside points_bulk_mode the per-row
+balance and notification signals are deferred, balances are refreshed once
+when the block exits and each client gets one email about their added points
+after commit.
+"""
+import pytest
+from datetime import date
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from pa_bonus.models import User, Brand, PointsTransaction, PointsBalance, EmailNotification
+from pa_bonus.services.bulk import current_bulk_write, points_bulk_mode
+
+
+def app_callbacks(callbacks):
+    """The on_commit callbacks other than the cache's version bumps."""
+    return [callback for callback in callbacks if callback.__module__ != 'pa_bonus.services.cache']
+
+
+@pytest.mark.django_db
+class TestPointsBulkMode:
+    def setup_method(self):
+        self.brand = Brand.objects.create(name="Primavera", prefix="PA")
+        self.alice = User.objects.create(username="alice", user_number="C1", user_phone="1", first_name="Alice",
+                                         email="alice@example.com")
+        self.bob = User.objects.create(username="bob", user_number="C2", user_phone="2", first_name="Bob",
+                                       email="bob@example.com")
+
+    def add(self, user, value, status='CONFIRMED'):
+        return PointsTransaction.objects.create(
+            user=user, value=value, date=date(2025, 3, 1), description=f"Adjustment {value}",
+            type='ADJUSTMENT', status=status, brand=self.brand,
+        )
+
+    def balance(self, user):
+        return PointsBalance.objects.get(user_id=user).points
+
+    def test_one_email_per_client_after_commit(self, django_capture_on_commit_callbacks, mailoutbox):
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with points_bulk_mode():
+                self.add(self.alice, 100)
+                self.add(self.alice, 50)
+                self.add(self.bob, 30)
+                self.add(self.bob, -10)
+                self.add(self.bob, 20, status='PENDING')
+                assert not EmailNotification.objects.exists()
+                assert not PointsBalance.objects.exists()
+            assert (self.balance(self.alice), self.balance(self.bob)) == (150, 20)
+
+        assert len(app_callbacks(callbacks)) == 2  # the notifications, then the mailer job
+        notifications = {n.user_id: n for n in EmailNotification.objects.all()}
+        assert set(notifications) == {self.alice.id, self.bob.id}
+        assert "150 points have been added" in notifications[self.alice.id].message
+        assert "- 2025-03-01: 50 points, Adjustment 50" in notifications[self.alice.id].message
+        assert "Your current balance is 150 points." in notifications[self.alice.id].message
+        assert "30 points have been added" in notifications[self.bob.id].message
+        assert sorted(message.to[0] for message in mailoutbox) == ["alice@example.com", "bob@example.com"]
+
+    def test_rows_cost_one_query_each(self):
+        with points_bulk_mode():
+            with CaptureQueriesContext(connection) as one:
+                self.add(self.alice, 10)
+            with CaptureQueriesContext(connection) as ten:
+                for _ in range(10):
+                    self.add(self.alice, 10)
+        assert len(ten.captured_queries) - len(one.captured_queries) == 9
+        assert len(one.captured_queries) == 1
+
+    def test_saving_twice_notifies_once_and_deletes_refresh_balances(self, django_capture_on_commit_callbacks):
+        keep = self.add(self.alice, 40)
+        with django_capture_on_commit_callbacks(execute=True):
+            with points_bulk_mode():
+                added = self.add(self.bob, 70)
+                added.description = "Corrected"
+                added.save()
+                keep.delete()
+        assert self.balance(self.alice) == 0 and self.balance(self.bob) == 70
+        assert list(EmailNotification.objects.filter(user=self.bob).values_list('subject', flat=True)) == [
+            "Points added to your Bonus Program account"
+        ]
+
+    def test_failed_block_rolls_back_and_queues_nothing(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with pytest.raises(ValueError):
+                with points_bulk_mode():
+                    self.add(self.alice, 100)
+                    raise ValueError("import failed")
+        assert not PointsTransaction.objects.exists()
+        assert callbacks == [] and current_bulk_write() is None
+
+    def test_nested_blocks_flush_once(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with points_bulk_mode() as outer:
+                self.add(self.alice, 10)
+                with points_bulk_mode() as inner:
+                    self.add(self.alice, 20)
+                assert inner is outer
+                assert not PointsBalance.objects.exists()
+        assert self.balance(self.alice) == 30
+        assert EmailNotification.objects.count() == 1 and len(app_callbacks(callbacks)) == 2
+
+    def test_outside_bulk_mode_rows_still_notify(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            self.add(self.alice, 10)
+            self.add(self.alice, 15)
+        assert self.balance(self.alice) == 25
+        assert EmailNotification.objects.count() == 2
@@ -0,0 +1,169 @@
+"""
+Tests for pa_bonus.services.cache: values are cached under versioned keys,
+writes bump the versions of the users, regions and brands they touch once they
+commit, and hits and misses are counted.
+"""
+import pytest
+from datetime import date
+from io import StringIO
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from pa_bonus.admin import approve_requests
+from pa_bonus.models import (
+    Brand, BrandBonus, PointsTransaction, Region, RegionRep, Reward, RewardRequest, User, UserContract,
+)
+from pa_bonus.services.cache import (
+    GLOBAL, cache_stats, cached, cached_balance, cached_reward_catalogue, invalidate_users, region_scope,
+    scope_versions, user_scope,
+)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestDomainCache:
+    def setup_method(self):
+        self.north = Region.objects.create(name="North", code="N")
+        self.south = Region.objects.create(name="South", code="S")
+        self.brand = Brand.objects.create(name="Primavera", prefix="PA")
+        self.alice = User.objects.create(username="alice", user_number="C1", user_phone="1", region=self.north)
+        self.bob = User.objects.create(username="bob", user_number="C2", user_phone="2", region=self.south)
+
+    def add(self, user, value):
+        return PointsTransaction.objects.create(
+            user=user, value=value, date=date(2025, 3, 1), description=f"Adjustment {value}",
+            type='ADJUSTMENT', status='CONFIRMED', brand=self.brand,
+        )
+
+    def test_hits_and_misses_are_counted(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'total': 10}
+
+        for _ in range(3):
+            assert cached('manager_dashboard', [GLOBAL], compute, 'a') == {'total': 10}
+        assert len(calls) == 1
+        assert cache_stats()['manager_dashboard'] == {'hits': 2, 'misses': 1, 'hit_rate': 66.7}
+
+    def test_writes_bump_the_users_their_regions_and_the_programme(self):
+        before = scope_versions([user_scope(self.alice.id), user_scope(self.bob.id),
+                                 region_scope(self.north.id), region_scope(self.south.id), GLOBAL])
+        invalidate_users([self.alice.id])
+        after = scope_versions([user_scope(self.alice.id), user_scope(self.bob.id),
+                                region_scope(self.north.id), region_scope(self.south.id), GLOBAL])
+        changed = [old != new for old, new in zip(before, after)]
+        assert changed == [True, False, True, False, True]
+
+    def test_invalidation_waits_for_the_commit(self):
+        self.add(self.alice, 100)
+        assert cached_balance(self.alice)['points'] == 100
+
+        # A rolled-back write bumps nothing, and the writer reads past the
+        # cache without storing its uncommitted figures
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                self.add(self.alice, 50)
+                assert cached_balance(self.alice)['points'] == 150
+                raise RuntimeError
+        assert cached_balance(self.alice)['points'] == 100
+        assert cache_stats()['balance'] == {'hits': 1, 'misses': 2, 'hit_rate': 33.3}
+
+        # A committed one is seen by the next read
+        with transaction.atomic():
+            self.add(self.alice, 50)
+            assert cached_balance(self.alice)['points'] == 150
+        assert cached_balance(self.alice)['points'] == 150
+        assert cached_balance(self.alice)['points'] == 150
+        assert cache_stats()['balance'] == {'hits': 2, 'misses': 4, 'hit_rate': 33.3}
+
+    def test_admin_request_actions_invalidate_the_clients(self):
+        RewardRequest.objects.create(user=self.alice, status='PENDING', description="Mug", total_points=100)
+        scopes = [user_scope(self.alice.id), region_scope(self.north.id), user_scope(self.bob.id)]
+        before = scope_versions(scopes)
+
+        approve_requests(None, None, RewardRequest.objects.filter(status='PENDING'))
+
+        assert RewardRequest.objects.get().status == 'ACCEPTED'
+        assert [old != new for old, new in zip(before, scope_versions(scopes))] == [True, True, False]
+
+    def test_balance_is_refreshed_after_a_points_write(self):
+        self.add(self.alice, 100)
+        assert cached_balance(self.alice)['points'] == 100
+        with CaptureQueriesContext(connection) as queries:
+            assert cached_balance(self.alice)['points'] == 100
+        assert len(queries.captured_queries) == 0
+
+        self.add(self.alice, 50)
+        assert cached_balance(self.alice)['points'] == 150
+        assert cache_stats()['balance'] == {'hits': 1, 'misses': 2, 'hit_rate': 33.3}
+
+    def test_catalogue_is_shared_by_brand_and_invalidated_by_reward_writes(self):
+        bonus = BrandBonus.objects.create(name="PA 1:1", points_ratio=1, brand_id=self.brand)
+        for user in (self.alice, self.bob):
+            contract = UserContract.objects.create(
+                user_id=user, contract_date_from=date(2025, 1, 1), contract_date_to=date(2026, 12, 31),
+            )
+            contract.brandbonuses.add(bonus)
+        other = Brand.objects.create(name="Other", prefix="OT")
+        Reward.objects.create(abra_code="R1", name="Mug", point_cost=100, description="", brand=self.brand)
+        Reward.objects.create(abra_code="R2", name="Pen", point_cost=50, description="")
+        Reward.objects.create(abra_code="R3", name="Cap", point_cost=80, description="", brand=other)
+
+        assert [reward.abra_code for reward in cached_reward_catalogue(self.alice)] == ["R1", "R2"]
+        assert [reward.abra_code for reward in cached_reward_catalogue(self.bob)] == ["R1", "R2"]
+        assert cache_stats()['reward_catalogue'] == {'hits': 1, 'misses': 1, 'hit_rate': 50.0}
+
+        Reward.objects.create(abra_code="R4", name="Bag", point_cost=300, description="", brand=self.brand)
+        assert [reward.abra_code for reward in cached_reward_catalogue(self.alice)] == ["R4", "R1", "R2"]
+
+        # A client with no contract sees only the unbranded rewards
+        carol = User.objects.create(username="carol", user_number="C3", user_phone="3")
+        assert [reward.abra_code for reward in cached_reward_catalogue(carol)] == ["R2"]
+        contract = UserContract.objects.create(
+            user_id=carol, contract_date_from=date(2025, 1, 1), contract_date_to=date(2026, 12, 31),
+        )
+        contract.brandbonuses.add(bonus)
+        assert [reward.abra_code for reward in cached_reward_catalogue(carol)] == ["R4", "R1", "R2"]
+
+    def test_dashboards_are_served_from_the_cache(self):
+        manager = User.objects.create(username="manager", user_number="M1", user_phone="M1", is_staff=True)
+        manager.groups.add(Group.objects.get_or_create(name="Managers")[0])
+        rep = User.objects.create(username="rep", user_number="R1", user_phone="R1", is_staff=True)
+        rep.groups.add(Group.objects.get_or_create(name="Sales Reps")[0])
+        RegionRep.objects.create(user=rep, region=self.north, date_from=date(2024, 1, 1))
+        self.add(self.alice, 100)
+        self.add(self.bob, 70)
+
+        for user, url in ((manager, reverse('manager_dashboard')), (rep, reverse('salesrep_dashboard'))):
+            http = Client()
+            http.force_login(user)
+            with CaptureQueriesContext(connection) as first:
+                http.get(url)
+            with CaptureQueriesContext(connection) as second:
+                response = http.get(url)
+            assert len(second.captured_queries) < len(first.captured_queries)
+            assert [client.username for client in response.context['top_clients']][0] == "alice"
+
+        # A write in the rep's region invalidates their dashboard, one elsewhere does not
+        http.get(url)
+        self.add(self.bob, 10)
+        http.get(url)
+        assert cache_stats()['salesrep_dashboard']['misses'] == 1
+        self.add(self.alice, 10)
+        response = http.get(url)
+        assert cache_stats()['salesrep_dashboard']['misses'] == 2
+        assert response.context['total_confirmed_points'] == 110
+
+    def test_cache_stats_command(self):
+        cached_balance(self.alice)
+        cached_balance(self.alice)
+        out = StringIO()
+        call_command('cache_stats', '--reset', stdout=out)
+        assert "balance" in out.getvalue() and "1 hit(s), 1 miss(es) in total." in out.getvalue()
+        assert cache_stats()['balance'] == {'hits': 0, 'misses': 0, 'hit_rate': 0}
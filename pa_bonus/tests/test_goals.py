@@ -0,0 +1,237 @@
+"""
+Tests for pa_bonus.services.goals: the goal evaluation candidate index and
+the in-memory goal evaluator.
+
+The index must list the same periods, turnovers and potential points as
+walking every goal's evaluation periods, stay current when goals, their brands
+and their evaluations change, and let the dashboard count pending evaluations
+in a fixed number of queries. The evaluator must apply the milestone, recovery
+and cap rules across the periods of a goal awarded in one request.
+"""
+import pytest
+from datetime import date
+
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from pa_bonus.models import (
+    User, Brand, FileUpload, Invoice, InvoiceBrandTurnover, UserContract, UserContractGoal,
+    GoalEvaluation, GoalEvaluationCandidate, PointsTransaction, EmailNotification, extra_points_expiry,
+)
+from pa_bonus.services.cache import invalidate_programme
+from pa_bonus.services.goals import points_cap, potential_points, rebuild_goal_candidates
+from pa_bonus.services.turnover import rebuild_turnover_rollup
+from pa_bonus.utilities import calculate_turnover_for_goal
+
+
+class GoalData:
+    def setup_method(self):
+        self.manager = User.objects.create(username="manager", user_number="M1", user_phone="1")
+        self.manager.groups.add(Group.objects.create(name="Managers"))
+        self.pa = Brand.objects.create(name="Primavera", prefix="PA")
+        self.kb = Brand.objects.create(name="Kosmetika", prefix="KB")
+        self.upload = FileUpload.objects.create(file="test.csv", status="COMPLETED", uploaded_by=self.manager)
+        self.count = 0
+
+    def add_client(self, amounts):
+        """A client with a 2025 goal in PA, evaluated half-yearly, and one invoice per (date, amount)."""
+        self.count += 1
+        number = f"C{self.count}"
+        user = User.objects.create(
+            username=number, user_number=number, user_phone=number, last_name=number, email=f"{number}@example.com",
+        )
+        contract = UserContract.objects.create(
+            user_id=user, contract_date_from=date(2025, 1, 1), contract_date_to=date(2026, 12, 31),
+        )
+        goal = UserContractGoal.objects.create(
+            user_contract=contract, goal_value=1000, goal_base=600,
+            goal_period_from=date(2025, 1, 1), goal_period_to=date(2026, 1, 1),
+        )
+        goal.brands.add(self.pa)
+        for n, (invoice_date, amount) in enumerate(amounts):
+            invoice = Invoice.objects.create(
+                invoice_number=f"F{number}-{n}", client_number=number, file_upload=self.upload,
+                invoice_type="INVOICE", invoice_date=invoice_date, total_amount=amount,
+            )
+            InvoiceBrandTurnover.objects.create(invoice=invoice, brand=self.pa, amount=amount)
+        rebuild_turnover_rollup([number])
+        rebuild_goal_candidates([number])
+        return goal
+
+    def candidates(self, goal):
+        return list(goal.evaluation_candidates.order_by('period_end'))
+
+
+@pytest.mark.django_db
+class TestGoalEvaluationCandidates(GoalData):
+    def test_rows_match_goal_periods(self):
+        goal = self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])
+        rows = self.candidates(goal)
+
+        assert [(row.period_start, row.period_end, row.is_final) for row in rows] == goal.get_evaluation_periods()
+        for row in rows:
+            actual = calculate_turnover_for_goal(goal.user_contract.user_id, [self.pa], row.period_start, row.period_end)
+            assert row.actual_turnover == actual
+            assert row.potential_points == potential_points(goal, row.period_start, row.period_end, actual)
+            assert row.status == 'PENDING'
+        assert rows[0].potential_points > 0 and rows[1].potential_points == 0
+
+    def test_follows_goal_brand_and_evaluation_changes(self):
+        goal = self.add_client([(date(2025, 3, 1), 900)])
+
+        goal.evaluation_frequency = 3
+        goal.save()
+        assert len(self.candidates(goal)) == 4
+
+        goal.brands.set([self.kb])
+        assert all(row.actual_turnover == 0 for row in self.candidates(goal))
+        goal.brands.set([self.pa])
+
+        first = self.candidates(goal)[0]
+        evaluation = GoalEvaluation.objects.create(
+            goal=goal, evaluation_date=date(2025, 4, 2), period_start=first.period_start, period_end=first.period_end,
+            actual_turnover=first.actual_turnover, target_turnover=250, baseline_turnover=150,
+            evaluation_type='MILESTONE',
+        )
+        assert [row.status for row in self.candidates(goal)] == ['EVALUATED', 'PENDING', 'PENDING', 'PENDING']
+
+        evaluation.delete()
+        assert all(row.status == 'PENDING' for row in self.candidates(goal))
+
+        goal.user_contract.user_id.delete()
+        assert not GoalEvaluationCandidate.objects.exists()
+
+    def test_dashboard_reads_the_index_in_constant_queries(self):
+        http = Client()
+        http.force_login(self.manager)
+        self.add_client([(date(2025, 3, 1), 900)])
+        http.get(reverse('manager_dashboard'))  # the first visit records the user's activity
+
+        invalidate_programme()  # measure the figures being computed, not read from the cache
+        with CaptureQueriesContext(connection) as few:
+            response = http.get(reverse('manager_dashboard'))
+        assert response.context['goal_stats']['pending_evaluations'] == 2
+        expected = GoalEvaluationCandidate.objects.get(period_end=date(2025, 7, 1))
+        assert response.context['goal_stats']['potential_points'] == expected.potential_points > 0
+
+        for _ in range(5):
+            self.add_client([(date(2025, 9, 1), 2000)])
+        with CaptureQueriesContext(connection) as many:
+            response = http.get(reverse('manager_dashboard'))
+        assert response.context['goal_stats']['pending_evaluations'] == 12
+        assert len(many.captured_queries) == len(few.captured_queries)
+
+    def test_evaluation_page_lists_pending_periods(self):
+        http = Client()
+        http.force_login(self.manager)
+        goal = self.add_client([(date(2025, 3, 1), 900)])
+        first = self.candidates(goal)[0]
+        GoalEvaluation.objects.create(
+            goal=goal, evaluation_date=date(2025, 7, 2), period_start=first.period_start, period_end=first.period_end,
+            actual_turnover=first.actual_turnover, target_turnover=500, baseline_turnover=300,
+            evaluation_type='MILESTONE',
+        )
+
+        pending = http.get(reverse('goal_evaluation')).context['evaluations']
+        assert [(row['period_start'], row['actual_turnover']) for row in pending] == [(date(2025, 7, 1), 0)]
+
+        evaluated = http.get(reverse('goal_evaluation') + "?type=evaluated").context['evaluations']
+        assert [row['existing_evaluation'] for row in evaluated] == [goal.evaluations.get()]
+
+
+@pytest.mark.django_db
+class TestGoalEvaluator(GoalData):
+    """Half-yearly 2025 goal of 1000 over a base of 600: 900 in March meets the
+    first milestone, 200 in September misses the second but the year is met."""
+
+    def setup_method(self):
+        super().setup_method()
+        self.http = Client()
+        self.http.force_login(self.manager)
+
+    def post(self, goals):
+        keys = [
+            f"{goal.id}:{start:%Y-%m-%d}:{end:%Y-%m-%d}"
+            for goal in goals
+            for start, end, _ in goal.get_evaluation_periods()
+        ]
+        return self.http.post(reverse('goal_evaluation'), {'evaluate': list(reversed(keys))})
+
+    def test_page_shows_milestone_and_recovery(self):
+        self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])
+        rows = self.http.get(reverse('goal_evaluation')).context['evaluations']
+
+        assert [(row['evaluation_type'], row['bonus_points'], row['is_achieved']) for row in rows] == [
+            ('MILESTONE', 99, True),    # (495 - 297) / 2
+            ('RECOVERY', 250, True),    # (1100 - 600) / 2, nothing awarded yet
+        ]
+        assert rows[1]['full_year_actual'] == 1100 and rows[1]['full_year_met']
+
+    def test_post_awards_periods_in_order(self):
+        goal = self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])
+        self.post([goal])
+
+        evaluations = list(goal.evaluations.order_by('period_end'))
+        assert [(e.evaluation_type, e.bonus_points) for e in evaluations] == [('MILESTONE', 99), ('RECOVERY', 151)]
+        assert sorted(PointsTransaction.objects.filter(type='EXTRA_POINTS').values_list('value', flat=True)) == [99, 151]
+        assert all(row.status == 'EVALUATED' for row in goal.evaluation_candidates.all())
+
+        # Evaluated periods are skipped when posted again
+        self.post([goal])
+        assert goal.evaluations.count() == 2
+
+    def test_awards_stop_at_the_cap(self):
+        goal = self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])
+        UserContractGoal.objects.filter(id=goal.id).update(bonus_percentage=100)
+        self.post([goal])
+
+        assert sum(goal.evaluations.values_list('bonus_points', flat=True)) == points_cap(goal)
+
+    def test_page_query_count_does_not_grow_with_goals(self):
+        self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])
+        self.http.get(reverse('goal_evaluation'))  # the first visit records the user's activity
+
+        with CaptureQueriesContext(connection) as few:
+            self.http.get(reverse('goal_evaluation'))
+        for _ in range(5):
+            self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])
+        with CaptureQueriesContext(connection) as many:
+            response = self.http.get(reverse('goal_evaluation') + "?export=preview")
+
+        assert response.status_code == 200
+        assert len(many.captured_queries) <= len(few.captured_queries)
+
+    def test_bulk_award_writes_expiry_balances_and_one_email_job(self, django_capture_on_commit_callbacks, mailoutbox):
+        goal = self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            self.post([goal])
+
+        transactions = PointsTransaction.objects.filter(type='EXTRA_POINTS').order_by('date')
+        for points in transactions:
+            assert points.expires_at == extra_points_expiry(points.date)
+            assert points.remaining_points == points.value
+        assert goal.user_contract.user_id.get_balance() == 250
+        assert [evaluation.points_transaction for evaluation in goal.evaluations.order_by('period_end')] == list(transactions)
+
+        # One mailer job; the others are the cache's version bumps
+        assert len([callback for callback in callbacks if callback.__module__ != 'pa_bonus.services.cache']) == 1
+        assert len(mailoutbox) == 2 and mailoutbox[0].to == ["C1@example.com"]
+        assert "Your current balance is 250 points." in mailoutbox[0].body
+        assert set(EmailNotification.objects.values_list('status', flat=True)) == {'SENT'}
+
+    def test_post_query_count_does_not_grow_with_goals(self):
+        goals = [self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)])]
+        self.post([])  # the first visit records the user's activity
+        with CaptureQueriesContext(connection) as few:
+            self.post(goals)
+
+        GoalEvaluation.objects.all().delete()
+        goals += [self.add_client([(date(2025, 3, 1), 900), (date(2025, 9, 1), 200)]) for _ in range(5)]
+        with CaptureQueriesContext(connection) as many:
+            self.post(goals)
+
+        assert GoalEvaluation.objects.count() == 12
+        assert len(many.captured_queries) == len(few.captured_queries)
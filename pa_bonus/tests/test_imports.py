@@ -0,0 +1,608 @@
+"""
+Tests for the invoice import pipeline in pa_bonus.tasks.
+
+The bulk import paths must produce exactly the records the original
+per-invoice implementation does, so most tests here run both against the
+same input and compare the resulting rows. The original implementation is
+kept below as the reference; it is not used by the application.
+"""
+import pytest
+import openpyxl
+import pandas as pd
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import Group
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from pa_bonus.models import (
+    User, Brand, BrandBonus, UserContract, FileUpload, Invoice, InvoiceBrandTurnover,
+    PointsTransaction, PointAllocation,
+)
+from pa_bonus.tasks import (
+    FT_INVOICE, FT_CREDIT_NOTE,
+    process_invoice_data_bulk, process_points_from_invoices_bulk,
+    get_active_contract, process_brand_points,
+    process_uploaded_file, process_dates, detect_encoding,
+    scan_invoices, iter_invoice_groups,
+)
+from pa_bonus.services.bulk import points_bulk_mode
+import pa_bonus.tasks as tasks
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def make_upload():
+    manager = User.objects.create(username="manager", user_number="M1", user_phone="1")
+    return FileUpload.objects.create(file="test.csv", status="PROCESSING", uploaded_by=manager)
+
+
+def make_frame(invoice_col, rows):
+    """Build an upload DataFrame the way process_dates leaves it."""
+    df = pd.DataFrame(rows, columns=[invoice_col, 'ZČ', 'Kód', 'Cena', 'Datum'])
+    df['Datum'] = pd.to_datetime(df['Datum'], format='%d.%m.%Y')
+    return df
+
+
+def snapshot():
+    """All imported rows in a comparable, id-independent form."""
+    invoices = sorted(
+        Invoice.objects.values_list(
+            'invoice_number', 'client_number', 'invoice_date', 'total_amount', 'invoice_type'
+        )
+    )
+    turnovers = sorted(
+        InvoiceBrandTurnover.objects.values_list('invoice__invoice_number', 'brand__prefix', 'amount')
+    )
+    return invoices, turnovers
+
+
+def run_both(df, filetype, setup=None):
+    """Run the legacy and the bulk import on the same data and return both snapshots."""
+    results = []
+    for importer in (process_invoice_data, process_invoice_data_bulk):
+        Invoice.objects.all().delete()
+        upload = make_upload()
+        if setup:
+            setup(upload)
+        processed = importer(df.copy(), upload, filetype)
+        results.append((processed, snapshot()))
+        User.objects.filter(username="manager").delete()
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Reference implementation: the original row-by-row importer
+# ---------------------------------------------------------------------------
+@transaction.atomic
+def process_invoice_data(df, upload, filetype):
+    """First pass: one Invoice and its InvoiceBrandTurnover rows per invoice."""
+    invoice_col = 'Faktura' if filetype == FT_INVOICE else 'Dobropis'
+    invoice_type = FT_INVOICE if filetype == FT_INVOICE else FT_CREDIT_NOTE
+    brand_prefixes = {brand.prefix: brand for brand in Brand.objects.all()}
+
+    successful_rows = 0
+    for invoice_number in df[invoice_col].unique():
+        invoice_data = df[df[invoice_col] == invoice_number]
+        if invoice_data.empty:
+            continue
+        invoice_date = invoice_data['Datum'].iloc[0]
+        if hasattr(invoice_date, 'date'):
+            invoice_date = invoice_date.date()
+        invoice, _ = Invoice.objects.update_or_create(
+            invoice_number=str(invoice_number),
+            defaults={
+                'client_number': str(invoice_data['ZČ'].iloc[0]),
+                'invoice_date': invoice_date,
+                'total_amount': Decimal(str(invoice_data['Cena'].sum())),
+                'invoice_type': invoice_type,
+                'file_upload': upload,
+            }
+        )
+        for prefix, brand in brand_prefixes.items():
+            brand_rows = invoice_data[invoice_data['Kód'].fillna('').str.startswith(prefix)]
+            if brand_rows.empty:
+                continue
+            brand_amount = Decimal(str(brand_rows['Cena'].sum()))
+            if brand_amount == 0:
+                continue
+            InvoiceBrandTurnover.objects.update_or_create(
+                invoice=invoice, brand=brand, defaults={'amount': brand_amount}
+            )
+        successful_rows += 1
+
+    upload.processed_rows = successful_rows
+    upload.save()
+    return successful_rows
+
+
+@points_bulk_mode()
+def process_points_from_invoices(upload, filetype):
+    """Second pass: the points transactions of an upload, invoice by invoice."""
+    points_created = 0
+    for invoice in Invoice.objects.filter(file_upload=upload):
+        user = User.objects.filter(user_number=invoice.client_number).first()
+        if user is None:
+            continue
+        contract = get_active_contract(user, invoice.invoice_date)
+        if not contract:
+            continue
+        brand_bonuses = contract.brandbonuses.all()
+        if not brand_bonuses:
+            continue
+        for turnover in invoice.brand_turnovers.all():
+            points_created += process_brand_points(user, invoice, turnover, brand_bonuses, filetype)
+    return points_created
+
+
+INVOICE_ROWS = [
+    ('F001', '100', 'PA123', 100.10, '05.01.2025'),
+    ('F001', '100', 'PA124', 0.20, '05.01.2025'),
+    ('F001', '100', 'PAX1', 50.00, '05.01.2025'),   # matches both PA and PAX
+    ('F001', '100', 'ZZ999', 10.00, '05.01.2025'),  # no brand
+    ('F002', '200', 'PAX2', 0.10, '06.01.2025'),
+    ('F002', '200', 'PAX3', 0.20, '06.01.2025'),
+    ('F002', '200', 'PAX4', -0.30, '06.01.2025'),   # floating point "almost zero" brand sum
+    ('F003', '300', None, 5.00, '07.01.2025'),      # missing product code
+    ('F003', '300', 'KB1', 12.50, '07.01.2025'),
+    ('F003', '300', 'KB1', -12.50, '07.01.2025'),   # exact zero brand sum is skipped
+    ('F004', '400', 'KB2', 1.00, '08.01.2025'),
+]
+
+
+# ---------------------------------------------------------------------------
+# Parity with the per-invoice import
+# ---------------------------------------------------------------------------
+@pytest.mark.django_db
+class TestBulkInvoiceImportParity:
+    def setup_method(self):
+        Brand.objects.create(name="Primavera", prefix="PA")
+        Brand.objects.create(name="Primavera X", prefix="PAX")
+        Brand.objects.create(name="Kosmetika", prefix="KB")
+
+    def test_invoices_match_legacy_import(self):
+        df = make_frame('Faktura', INVOICE_ROWS)
+        (legacy_count, legacy), (bulk_count, bulk) = run_both(df, FT_INVOICE)
+
+        assert bulk_count == legacy_count == 4
+        assert bulk == legacy
+        assert len(legacy[1]) > 0
+
+    def test_credit_notes_match_legacy_import(self):
+        df = make_frame('Dobropis', [(f"D{row[0]}",) + row[1:] for row in INVOICE_ROWS])
+        (legacy_count, legacy), (bulk_count, bulk) = run_both(df, FT_CREDIT_NOTE)
+
+        assert bulk_count == legacy_count
+        assert bulk == legacy
+        assert {row[4] for row in bulk[0]} == {FT_CREDIT_NOTE}
+
+    def test_existing_invoices_are_updated_the_same_way(self):
+        def setup(upload):
+            brand = Brand.objects.get(prefix="KB")
+            invoice = Invoice.objects.create(
+                invoice_number="F004", client_number="999", invoice_date="2024-12-31",
+                total_amount=5, invoice_type=FT_INVOICE, file_upload=upload,
+            )
+            InvoiceBrandTurnover.objects.create(invoice=invoice, brand=brand, amount=5)
+
+        df = make_frame('Faktura', INVOICE_ROWS)
+        (_, legacy), (_, bulk) = run_both(df, FT_INVOICE, setup=setup)
+
+        assert bulk == legacy
+        assert ('F004', 'KB', 1) in [(n, p, int(a)) for n, p, a in bulk[1]]
+
+    def test_bulk_import_is_idempotent(self):
+        df = make_frame('Faktura', INVOICE_ROWS)
+        upload = make_upload()
+        process_invoice_data_bulk(df.copy(), upload, FT_INVOICE)
+        first = snapshot()
+        process_invoice_data_bulk(df.copy(), upload, FT_INVOICE)
+
+        assert snapshot() == first
+
+    def test_chunking_does_not_change_the_result(self, monkeypatch):
+        df = make_frame('Faktura', INVOICE_ROWS)
+        upload = make_upload()
+        process_invoice_data_bulk(df.copy(), upload, FT_INVOICE)
+        expected = snapshot()
+
+        Invoice.objects.all().delete()
+        monkeypatch.setattr('pa_bonus.tasks.IMPORT_CHUNK_SIZE', 1)
+        assert process_invoice_data_bulk(df.copy(), upload, FT_INVOICE) == 4
+        assert snapshot() == expected
+
+
+# ---------------------------------------------------------------------------
+# Parity of the batched points pass
+# ---------------------------------------------------------------------------
+def points_snapshot():
+    transactions = sorted(
+        PointsTransaction.objects.values_list(
+            'user__user_number', 'invoice__invoice_number', 'brand__prefix', 'value', 'date',
+            'type', 'status', 'description', 'expires_at', 'file_upload_id', 'remaining_points',
+        ),
+        key=repr,
+    )
+    allocations = sorted(
+        PointAllocation.objects.values_list('credit__description', 'debit__description', 'amount'),
+        key=repr,
+    )
+    return transactions, allocations
+
+
+@pytest.mark.django_db
+class TestBulkPointsParity:
+    def setup_method(self):
+        self.pa = Brand.objects.create(name="Primavera", prefix="PA", points_validity_months=12)
+        self.kb = Brand.objects.create(name="Kosmetika", prefix="KB")
+        pa_bonus = BrandBonus.objects.create(name="PA 1:1", points_ratio=1, brand_id=self.pa)
+        kb_bonus = BrandBonus.objects.create(name="KB 1:2", points_ratio=0.5, brand_id=self.kb)
+
+        for number, date_from, date_to in [
+            ('100', date(2025, 1, 1), date(2025, 12, 31)),
+            ('200', date(2025, 1, 6), date(2025, 12, 31)),  # contract starts on the invoice date
+            ('300', date(2024, 1, 1), date(2024, 12, 31)),  # contract expired before the invoice
+        ]:
+            user = User.objects.create(username=f"user{number}", user_number=number, user_phone="1")
+            contract = UserContract.objects.create(
+                user_id=user, contract_date_from=date_from, contract_date_to=date_to,
+            )
+            contract.brandbonuses.set([pa_bonus, kb_bonus])
+
+        # Client 400 has no contract, client 500 is not registered at all
+        User.objects.create(username="user400", user_number="400", user_phone="1")
+
+        # Existing credit that credit notes can draw from
+        PointsTransaction.objects.create(
+            user=User.objects.get(user_number='100'), value=60, date=date(2024, 12, 1),
+            expires_at=date(2025, 12, 31), description="older credit",
+            type="STANDARD_POINTS", status="CONFIRMED",
+        )
+
+    ROWS = [
+        ('X1', '100', 'PA1', 100.60, '05.01.2025'),
+        ('X1', '100', 'KB1', 41.00, '05.01.2025'),
+        ('X2', '100', 'PA2', 30.00, '05.02.2025'),
+        ('X3', '200', 'PA1', 10.00, '06.01.2025'),
+        ('X3', '200', 'KB1', 1.00, '06.01.2025'),    # rounds down to 0 points
+        ('X4', '300', 'PA1', 10.00, '06.01.2025'),
+        ('X5', '400', 'PA1', 10.00, '06.01.2025'),
+        ('X6', '500', 'PA1', 10.00, '06.01.2025'),
+    ]
+
+    def run_both(self, invoice_col, filetype, prefix):
+        df = make_frame(invoice_col, [(prefix + row[0],) + row[1:] for row in self.ROWS])
+        upload = make_upload()
+        process_invoice_data_bulk(df, upload, filetype)
+
+        results = []
+        for points_pass in (process_points_from_invoices, process_points_from_invoices_bulk):
+            PointsTransaction.objects.filter(file_upload=upload).delete()
+            created = points_pass(upload, filetype)
+            results.append((created, points_snapshot()))
+        return upload, results
+
+    def test_invoice_points_match_legacy_pass(self):
+        _, ((legacy_count, legacy), (bulk_count, bulk)) = self.run_both('Faktura', FT_INVOICE, 'F')
+
+        assert bulk_count == legacy_count == 4
+        assert bulk == legacy
+
+    def test_bulk_pass_stamps_brand_expiry(self):
+        self.run_both('Faktura', FT_INVOICE, 'F')
+
+        txn = PointsTransaction.objects.get(invoice__invoice_number='FX1', brand=self.pa)
+        assert txn.value == 100
+        assert txn.expires_at == self.pa.expiry_for(date(2025, 1, 5))
+        assert PointsTransaction.objects.get(invoice__invoice_number='FX1', brand=self.kb).expires_at is None
+
+    def test_credit_notes_match_legacy_pass_including_allocations(self):
+        _, ((legacy_count, legacy), (bulk_count, bulk)) = self.run_both('Dobropis', FT_CREDIT_NOTE, 'D')
+
+        assert bulk_count == legacy_count
+        assert bulk == legacy
+        # 100 + 20 + 30 points of credit notes drawn from a 60 point credit
+        assert sum(amount for _, _, amount in bulk[1]) == 60
+
+    def test_bulk_pass_skips_existing_transactions(self):
+        upload, _ = self.run_both('Faktura', FT_INVOICE, 'F')
+        before = points_snapshot()
+        upload.processing_stage = ''
+
+        assert process_points_from_invoices_bulk(upload, FT_INVOICE) == 0
+        assert points_snapshot() == before
+
+
+# ---------------------------------------------------------------------------
+# Chunked, resumable processing of an uploaded file
+# ---------------------------------------------------------------------------
+CSV_CONTENT = (
+    "Faktura,ZČ,Kód,Cena,Datum\n"
+    "F1,100,PA1,100,05.01.2025\n"
+    "F2,100,PA1,200,06.01.2025\n"
+    "F3,100,PA2,300,07.01.2025\n"
+).encode('utf-8')
+
+
+def spy(monkeypatch, name, fail_on=None):
+    """Record the calls to tasks.<name>, optionally raising on the fail_on-th call."""
+    original = getattr(tasks, name)
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == fail_on:
+            raise RuntimeError("database went away")
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(tasks, name, wrapper)
+    return calls
+
+
+@pytest.mark.django_db
+class TestResumableUpload:
+    @pytest.fixture(autouse=True)
+    def setup(self, settings, tmp_path, monkeypatch):
+        settings.MEDIA_ROOT = str(tmp_path)
+        monkeypatch.setattr(tasks, 'IMPORT_CHUNK_SIZE', 1)
+
+        brand = Brand.objects.create(name="Primavera", prefix="PA")
+        bonus = BrandBonus.objects.create(name="PA", points_ratio=1, brand_id=brand)
+        client = User.objects.create(username="client", user_number="100", user_phone="1")
+        contract = UserContract.objects.create(
+            user_id=client, contract_date_from=date(2025, 1, 1), contract_date_to=date(2025, 12, 31),
+        )
+        contract.brandbonuses.add(bonus)
+
+        self.manager = User.objects.create(username="manager", user_number="M1", user_phone="1")
+        self.upload = FileUpload.objects.create(
+            file=SimpleUploadedFile("invoices.csv", CSV_CONTENT), uploaded_by=self.manager,
+        )
+
+    def test_progress_is_recorded(self):
+        process_uploaded_file(self.upload.id)
+
+        self.upload.refresh_from_db()
+        assert self.upload.status == 'COMPLETED'
+        assert (self.upload.processed_rows, self.upload.total_rows) == (3, 3)
+        assert self.upload.progress_percent == 100
+        assert PointsTransaction.objects.filter(file_upload=self.upload).count() == 3
+
+    def test_failed_invoice_pass_resumes_from_last_chunk(self, monkeypatch):
+        spy(monkeypatch, 'upsert_invoice_chunk', fail_on=2)
+        with pytest.raises(RuntimeError):
+            process_uploaded_file(self.upload.id)
+
+        self.upload.refresh_from_db()
+        assert self.upload.status == 'FAILED'
+        assert self.upload.can_resume
+        assert (self.upload.processing_stage, self.upload.checkpoint) == ('INVOICES', 1)
+        assert self.upload.processed_rows == 1
+        assert Invoice.objects.count() == 1
+
+        monkeypatch.undo()
+        monkeypatch.setattr(tasks, 'IMPORT_CHUNK_SIZE', 1)
+        calls = spy(monkeypatch, 'upsert_invoice_chunk')
+        process_uploaded_file(self.upload.id)
+
+        self.upload.refresh_from_db()
+        assert self.upload.status == 'COMPLETED'
+        assert [args[0] for args in calls] == [['F2'], ['F3']]
+        assert Invoice.objects.count() == 3
+        assert PointsTransaction.objects.count() == 3
+
+    def test_failed_points_pass_skips_invoice_import_on_resume(self, monkeypatch):
+        spy(monkeypatch, 'create_points_for_invoices', fail_on=2)
+        with pytest.raises(RuntimeError):
+            process_uploaded_file(self.upload.id)
+
+        self.upload.refresh_from_db()
+        assert (self.upload.processing_stage, self.upload.checkpoint) == ('POINTS', 1)
+        assert PointsTransaction.objects.count() == 1
+
+        monkeypatch.undo()
+        monkeypatch.setattr(tasks, 'IMPORT_CHUNK_SIZE', 1)
+        invoice_calls = spy(monkeypatch, 'upsert_invoice_chunk')
+        process_uploaded_file(self.upload.id)
+
+        self.upload.refresh_from_db()
+        assert self.upload.status == 'COMPLETED'
+        assert invoice_calls == []
+        assert PointsTransaction.objects.count() == 3
+
+    def test_stalled_upload_can_be_resumed(self, monkeypatch):
+        spy(monkeypatch, 'upsert_invoice_chunk', fail_on=2)
+        with pytest.raises(RuntimeError):
+            process_uploaded_file(self.upload.id)
+        monkeypatch.undo()
+        monkeypatch.setattr(tasks, 'IMPORT_CHUNK_SIZE', 1)
+
+        # A worker killed by the task timeout leaves the upload PROCESSING
+        FileUpload.objects.filter(id=self.upload.id).update(status='PROCESSING', error_message='')
+        self.upload.refresh_from_db()
+        assert self.upload.progress_at is not None
+        assert not self.upload.can_resume
+
+        FileUpload.objects.filter(id=self.upload.id).update(progress_at=timezone.now() - timedelta(minutes=16))
+        self.upload.refresh_from_db()
+        assert self.upload.is_stalled and self.upload.can_resume
+
+        self.manager.groups.add(Group.objects.create(name='Managers'))
+        http = Client()
+        http.force_login(self.manager)
+        http.post(reverse('upload_resume', args=[self.upload.id]))
+
+        self.upload.refresh_from_db()
+        assert self.upload.status == 'COMPLETED'
+        assert Invoice.objects.count() == 3
+
+    def test_progress_endpoint(self):
+        self.manager.groups.add(Group.objects.create(name='Managers'))
+        FileUpload.objects.filter(id=self.upload.id).update(
+            status='PROCESSING', processing_stage='POINTS', checkpoint=1, processed_rows=4, total_rows=4,
+        )
+        http = Client()
+        http.force_login(self.manager)
+
+        data = http.get(reverse('upload_progress', args=[self.upload.id])).json()
+
+        assert data['status'] == 'PROCESSING'
+        assert data['stage'] == 'POINTS'
+        assert data['progress'] == 62
+        assert data['can_resume'] is False
+
+
+# ---------------------------------------------------------------------------
+# Streaming reader
+# ---------------------------------------------------------------------------
+STREAM_ROWS = [
+    ('F1', '100', 'PA1', 10.10, '05.01.2025'),
+    ('F1', '100', 'PA2', 0.20, '05.01.2025'),
+    ('F1', '100', 'KB1', 3.00, '05.01.2025'),
+    ('F2', '200', 'PA1', 7.00, '06.01.2025'),
+    ('F3', '300', 'KB1', 1.00, 'not a date'),
+    ('F3', '300', 'KB2', 2.00, '07.01.2025'),
+    ('F4', '100', 'PA1', 4.00, '08.01.2025'),
+    ('F4', '100', 'PA1', 5.00, '08.01.2025'),
+]
+
+# Invoice numbers the original importer read as numbers
+NUMERIC_ROWS = [
+    ('0012345', '100', 'PA1', 10.00, '05.01.2025'),
+    ('0012345', '100', 'KB1', 3.00, '05.01.2025'),
+    ('12346', '200', 'PA1', 7.00, '06.01.2025'),
+]
+
+
+def write_csv(path, rows, encoding='utf-8'):
+    lines = ["Faktura,ZČ,Název,Kód,Cena,Datum"]
+    lines += [f"{number or ''},{client},Item,{code},{price},{day}" for number, client, code, price, day in rows]
+    path.write_bytes(("\n".join(lines) + "\n").encode(encoding))
+    return str(path)
+
+
+def write_xlsx(path, rows):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["Faktura", "ZČ", "Název", "Kód", "Cena", "Datum"])
+    for number, client, code, price, day in rows:
+        try:
+            day = datetime.strptime(day, '%d.%m.%Y')  # a real date cell
+        except ValueError:
+            pass
+        if number and number.isdigit():
+            number = int(number)  # a number cell
+        sheet.append([number, int(client), "Item", code, price, day])
+    workbook.save(path)
+    return str(path)
+
+
+@pytest.mark.django_db
+class TestStreamingReader:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch):
+        monkeypatch.setattr(tasks, 'READ_CHUNK_ROWS', 2)
+        monkeypatch.setattr(tasks, 'SPILL_INVOICES_PER_BUCKET', 2)
+        Brand.objects.create(name="Primavera", prefix="PA")
+        Brand.objects.create(name="Kosmetika", prefix="KB")
+
+    def legacy_snapshot(self, path):
+        Invoice.objects.all().delete()
+        if path.endswith('.csv'):
+            df = pd.read_csv(path, dtype={'ZČ': str})
+        else:
+            df = pd.read_excel(path, dtype={'ZČ': str})
+        df = process_dates(df)
+        process_invoice_data(df, make_upload(), FT_INVOICE)
+        result = snapshot()
+        User.objects.filter(username="manager").delete()
+        return result
+
+    def streamed_snapshot(self, path):
+        Invoice.objects.all().delete()
+        total, contiguous, number_format = scan_invoices(path, 'Faktura')
+        tasks.process_invoice_groups(
+            iter_invoice_groups(path, FT_INVOICE, contiguous, total, number_format), make_upload(), FT_INVOICE, total,
+        )
+        result = snapshot()
+        User.objects.filter(username="manager").delete()
+        return result
+
+    def test_groups_never_split_an_invoice(self, tmp_path):
+        path = write_csv(tmp_path / "invoices.csv", STREAM_ROWS)
+
+        groups = list(iter_invoice_groups(path, FT_INVOICE))
+        numbers = [list(group['Faktura'].unique()) for group in groups]
+
+        assert sum(numbers, []) == ['F1', 'F2', 'F3', 'F4']
+        assert all(len(group) <= 3 for group in groups)
+        assert set(groups[0].columns) == {'Faktura', 'ZČ', 'Kód', 'Cena', 'Datum'}
+
+    def test_unsorted_file_is_partitioned_on_disk(self, tmp_path):
+        rows = STREAM_ROWS[3:] + STREAM_ROWS[:3] + STREAM_ROWS[6:]
+        path = write_csv(tmp_path / "unsorted.csv", rows)
+
+        groups = list(iter_invoice_groups(path, FT_INVOICE, contiguous=False))
+        invoices = [number for group in groups for number in group['Faktura'].unique()]
+
+        assert sorted(invoices) == ['F1', 'F2', 'F3', 'F4']  # each invoice in one frame only
+        assert len(groups) > 1
+        assert [list(group['Faktura']) for group in groups] == [
+            list(group['Faktura']) for group in iter_invoice_groups(path, FT_INVOICE, contiguous=False)
+        ]
+
+    def test_scan_counts_invoices_and_detects_ordering(self, tmp_path):
+        sorted_path = write_csv(tmp_path / "sorted.csv", STREAM_ROWS)
+        unsorted_path = write_csv(tmp_path / "unsorted.csv", STREAM_ROWS + [STREAM_ROWS[0]])
+
+        assert scan_invoices(sorted_path, 'Faktura') == (4, True, 'text')
+        assert scan_invoices(unsorted_path, 'Faktura') == (4, False, 'text')
+
+    @pytest.mark.parametrize('rows', [STREAM_ROWS, STREAM_ROWS[3:] + STREAM_ROWS[:3] + STREAM_ROWS[4:5]])
+    def test_csv_matches_full_load(self, tmp_path, rows):
+        path = write_csv(tmp_path / "invoices.csv", rows)
+
+        streamed = self.streamed_snapshot(path)
+        assert streamed == self.legacy_snapshot(path)
+        assert len(streamed[0]) == 4
+
+    def test_xlsx_matches_full_load(self, tmp_path):
+        path = write_xlsx(tmp_path / "invoices.xlsx", STREAM_ROWS)
+
+        streamed = self.streamed_snapshot(path)
+        assert streamed == self.legacy_snapshot(path)
+        assert [row[0] for row in streamed[0]] == ['F1', 'F2', 'F3', 'F4']
+
+    @pytest.mark.parametrize('writer', [write_csv, write_xlsx])
+    @pytest.mark.parametrize('rows, number_format', [
+        (NUMERIC_ROWS, 'int'),
+        (NUMERIC_ROWS + [(None, '100', 'PA1', 1.00, '09.01.2025')], 'float'),
+        (NUMERIC_ROWS + [('F9', '100', 'PA1', 1.00, '09.01.2025')], 'text'),
+    ])
+    def test_reupload_of_a_file_with_numeric_invoice_numbers(self, tmp_path, writer, rows, number_format):
+        path = writer(tmp_path / f"numeric.{'csv' if writer is write_csv else 'xlsx'}", rows)
+        assert scan_invoices(path, 'Faktura')[2] == number_format
+
+        # Imported before the streaming reader, then uploaded again
+        legacy = self.legacy_snapshot(path)
+        total, contiguous, number_format = scan_invoices(path, 'Faktura')
+        tasks.process_invoice_groups(
+            iter_invoice_groups(path, FT_INVOICE, contiguous, total, number_format), make_upload(), FT_INVOICE, total,
+        )
+
+        assert snapshot() == legacy
+        assert Invoice.objects.count() == len(legacy[0])
+
+    def test_encoding_is_detected_from_a_sample(self, tmp_path):
+        utf8 = tmp_path / "utf8.csv"
+        utf8.write_bytes("ZČ\n".encode('utf-8'))
+        latin = tmp_path / "latin.csv"
+        latin.write_bytes("Zé\n".encode('latin-1'))
+
+        assert detect_encoding(str(utf8)) == 'utf-8'
+        assert detect_encoding(str(latin)) == 'latin-1'
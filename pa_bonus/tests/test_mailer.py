@@ -0,0 +1,175 @@
+"""
+Tests for pa_bonus.services.mailer: pending notifications are sent in chunks
+over one connection each, paced to the rate limit, with transient errors
+retried with backoff and every chunk's throughput recorded.
+"""
+import smtplib
+from datetime import timedelta
+
+import pytest
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from pa_bonus.models import User, EmailNotification, EmailBatch
+from pa_bonus.notifications import send_email_notification
+from pa_bonus.services.mailer import BatchMailer, RateLimiter, is_transient
+
+
+class ScriptedBackend(EmailBackend):
+    """The locmem backend, raising the scripted errors for some recipients
+    and counting the connections made."""
+    opened = 0
+    on_send = None
+
+    def __init__(self, errors, **kwargs):
+        super().__init__(**kwargs)
+        self.errors = errors
+        self.is_open = False
+
+    def open(self):
+        if not self.is_open:
+            self.is_open = True
+            ScriptedBackend.opened += 1
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        if self.on_send:
+            self.on_send(messages[0])
+        script = self.errors.get(messages[0].to[0])
+        if script:
+            raise script.pop(0)
+        return super().send_messages(messages)
+
+
+@pytest.mark.django_db
+class TestBatchMailer:
+    def setup_method(self):
+        ScriptedBackend.opened = 0
+        ScriptedBackend.on_send = None
+        self.errors = {}
+        self.sleeps = []
+
+    def notify(self, count):
+        notifications = []
+        start = EmailNotification.objects.count()
+        for n in range(start, start + count):
+            user = User.objects.create(username=f"u{n}", user_number=f"C{n}", user_phone=f"{n}", email=f"u{n}@example.com")
+            notifications.append(EmailNotification.objects.create(user=user, subject="Hello", message=f"Message {n}"))
+        return notifications
+
+    def mailer(self, **kwargs):
+        kwargs.setdefault('rate_limit', 0)
+        return BatchMailer(
+            connection_factory=lambda **options: ScriptedBackend(self.errors, **options),
+            sleep=self.sleeps.append, backoff=1, **kwargs,
+        )
+
+    def test_drains_in_chunks_over_one_connection_each(self, mailoutbox):
+        self.notify(5)
+        batches = self.mailer(batch_size=2).drain()
+
+        assert [(batch.size, batch.sent, batch.failed) for batch in batches] == [(2, 2, 0), (2, 2, 0), (1, 1, 0)]
+        assert ScriptedBackend.opened == 3
+        assert len(mailoutbox) == 5 and mailoutbox[0].to == ["u0@example.com"]
+        assert set(EmailNotification.objects.values_list('status', 'attempts')) == {('SENT', 1)}
+        assert EmailBatch.objects.count() == 3
+        assert all(batch.finished_at >= batch.started_at for batch in EmailBatch.objects.all())
+
+    def test_only_given_notifications_are_sent(self, mailoutbox):
+        first, second = self.notify(2)
+        self.mailer().drain([second.id])
+        assert [message.to for message in mailoutbox] == [["u1@example.com"]]
+        first.refresh_from_db()
+        assert first.status == 'PENDING'
+
+        # Sent notifications are not sent again
+        self.mailer().drain([second.id])
+        assert len(mailoutbox) == 1
+
+    def test_transient_errors_are_retried_with_backoff(self, mailoutbox):
+        flaky, refused, down = self.notify(3)
+        self.errors = {
+            "u0@example.com": [smtplib.SMTPServerDisconnected("lost"), smtplib.SMTPResponseException(421, b"busy")],
+            "u1@example.com": [smtplib.SMTPRecipientsRefused({"u1@example.com": (550, b"no such user")})],
+            "u2@example.com": [OSError("timed out")] * 3,
+        }
+        batch, = self.mailer(max_retries=2).drain()
+
+        for notification in (flaky, refused, down):
+            notification.refresh_from_db()
+        assert (flaky.status, flaky.attempts, flaky.last_error) == ('SENT', 3, '')
+        assert (refused.status, refused.attempts) == ('FAILED', 1)
+        assert (down.status, down.attempts, down.last_error) == ('FAILED', 3, 'timed out')
+        assert self.sleeps == [1, 2, 1, 2]
+        assert (batch.sent, batch.failed, batch.retries) == (1, 2, 4)
+        assert [message.to for message in mailoutbox] == [["u0@example.com"]]
+
+    def test_emails_are_sent_after_the_claim_commits(self, mailoutbox):
+        notifications = self.notify(2)
+        savepoints = len(connection.savepoint_ids)
+        seen = []
+
+        def on_send(message):
+            # The claim's transaction is closed and its SENDING status saved
+            seen.append((len(connection.savepoint_ids), sorted(
+                EmailNotification.objects.filter(id__in=[n.id for n in notifications]).values_list('status', flat=True)
+            )))
+
+        ScriptedBackend.on_send = staticmethod(on_send)
+        self.mailer().drain()
+        assert seen == [(savepoints, ['SENDING', 'SENDING']), (savepoints, ['SENDING', 'SENDING'])]
+        assert set(EmailNotification.objects.values_list('status', flat=True)) == {'SENT'}
+
+    def test_only_timed_out_claims_are_sent_again(self, mailoutbox):
+        stale, fresh = self.notify(2)
+        EmailNotification.objects.filter(id=stale.id).update(status='SENDING', claimed_at=timezone.now() - timedelta(hours=2))
+        EmailNotification.objects.filter(id=fresh.id).update(status='SENDING', claimed_at=timezone.now())
+
+        self.mailer().drain()
+        assert [message.to for message in mailoutbox] == [["u0@example.com"]]
+        assert dict(EmailNotification.objects.values_list('id', 'status')) == {stale.id: 'SENT', fresh.id: 'SENDING'}
+
+    def test_debug_recipient_is_looked_up_once_per_batch(self, settings, mailoutbox):
+        settings.DEBUG = True
+        User.objects.create(username="admin", user_number="A", user_phone="0", email="admin@example.com")
+        self.notify(3)
+        with CaptureQueriesContext(connection) as queries:
+            self.mailer().drain()
+        assert sum("'admin'" in query['sql'] for query in queries.captured_queries) == 1
+        assert [message.to for message in mailoutbox] == [["admin@example.com"]] * 3
+
+    def test_rate_limit_spaces_the_emails(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        now[0] += 1
+        limiter.wait()
+        assert sleeps == [0.25, 0.25]
+        assert RateLimiter(0).interval == 0
+
+    def test_is_transient(self):
+        assert is_transient(smtplib.SMTPResponseException(451, b"try later"))
+        assert not is_transient(smtplib.SMTPResponseException(554, b"rejected"))
+        assert not is_transient(smtplib.SMTPSenderRefused(550, b"no", "a@example.com"))
+        assert not is_transient(ValueError("no recipient"))
+
+    def test_single_notifications_are_sent_by_the_mailer_after_commit(self, django_capture_on_commit_callbacks):
+        user = User.objects.create(username="client", user_number="C1", user_phone="1", email="client@example.com")
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            send_email_notification(user, "Hello", "Body")
+        assert len(callbacks) == 1
+        assert [message.to for message in mail.outbox] == [["client@example.com"]]
+        assert EmailNotification.objects.get().status == 'SENT'
+        assert EmailBatch.objects.get().sent == 1
@@ -9,13 +9,19 @@ only touches genuinely-expired, still-unspent points.
 """
 import pytest
 from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from pa_bonus.models import (
     User, Brand, PointsTransaction, PointAllocation, extra_points_expiry,
 )
 from pa_bonus.services.points import (
-    allocate_debit, void_debit, expire_credits,
+    allocate_debit, allocate_debits, void_debit, expire_credits, find_remaining_drift, repair_remaining,
     expiration_schedule, expiring_points_total, clients_expiring_summary,
+    expiring_points_by_user,
 )
 
 
@@ -37,6 +43,12 @@ def credit(user, value, *, grant=date(2025, 1, 1), expires=None,
     )
 
 
+def fresh(txn):
+    """Reload a transaction after the allocation engine updated it in the database."""
+    txn.refresh_from_db()
+    return txn
+
+
 def debit(user, value, *, day=date(2025, 6, 1), ttype="REWARD_CLAIM",
           status="CONFIRMED"):
     """Create a negative transaction (value passed as a positive magnitude)."""
@@ -136,8 +148,8 @@ class TestAllocation:
         allocated = allocate_debit(d)
 
         assert allocated == 60
-        assert short_lived.remaining == 40
-        assert long_lived.remaining == 100
+        assert fresh(short_lived).remaining == 40
+        assert fresh(long_lived).remaining == 100
 
     def test_never_expiring_credit_is_used_last(self):
         user = make_user()
@@ -147,8 +159,8 @@ class TestAllocation:
         d = debit(user, 100)
         allocate_debit(d)
 
-        assert expiring.remaining == 0
-        assert forever.remaining == 100
+        assert fresh(expiring).remaining == 0
+        assert fresh(forever).remaining == 100
 
     def test_allocation_spans_multiple_credits(self):
         user = make_user()
@@ -158,8 +170,8 @@ class TestAllocation:
         d = debit(user, 70)
         allocate_debit(d)
 
-        assert c1.remaining == 0
-        assert c2.remaining == 30
+        assert fresh(c1).remaining == 0
+        assert fresh(c2).remaining == 30
         # The debit is fully allocated across both credits.
         assert sum(a.amount for a in d.allocations_in.all()) == 70
 
@@ -171,8 +183,8 @@ class TestAllocation:
         d = debit(user, 80)
         allocate_debit(d)
 
-        assert pending.remaining == 100  # untouched
-        assert confirmed.remaining == 20
+        assert fresh(pending).remaining == 100  # untouched
+        assert fresh(confirmed).remaining == 20
 
     def test_balance_reconciles_with_remaining(self):
         user = make_user()
@@ -189,6 +201,43 @@ class TestAllocation:
         assert user.get_balance() == 80
         assert remaining_total == 80
 
+    def ledger(self, number, debits_per_user):
+        """Two clients with the same credits and debits; the debits are returned unallocated."""
+        debits = []
+        for suffix in ("a", "b"):
+            user = make_user(f"{number}{suffix}")
+            credit(user, 50, expires=date(2026, 2, 1))
+            credit(user, 30, expires=date(2026, 1, 1))
+            credit(user, 40, expires=None)
+            debits += [debit(user, 25 * (n + 1)) for n in range(debits_per_user)]
+        return debits
+
+    @staticmethod
+    def allocations(debits):
+        return [
+            [(fresh(a.credit).expires_at, a.amount) for a in d.allocations_in.order_by('id')]
+            for d in debits
+        ]
+
+    def test_allocate_debits_matches_one_at_a_time(self):
+        one_by_one = self.ledger("1", 3)
+        for d in one_by_one:
+            allocate_debit(d)
+        together = self.ledger("2", 3)
+
+        assert allocate_debits(together) == 120 + 120  # 150 asked per client, 120 available
+        assert self.allocations(together) == self.allocations(one_by_one)
+        assert [u.get_balance() for u in User.objects.filter(user_number__startswith="2")] == [-30, -30]
+
+    def test_allocate_debits_query_count_does_not_grow_with_debits(self):
+        few = self.ledger("1", 1)
+        many = self.ledger("2", 6)
+        with CaptureQueriesContext(connection) as one_each:
+            allocate_debits(few)
+        with CaptureQueriesContext(connection) as six_each:
+            allocate_debits(many)
+        assert len(six_each.captured_queries) == len(one_each.captured_queries)
+
 
 # ---------------------------------------------------------------------------
 # Credit-note over-draw goes negative
@@ -205,7 +254,7 @@ class TestOverdraw:
 
         # Only 100 could be allocated; the rest is left uncovered on purpose.
         assert allocated == 100
-        assert c.remaining == 0
+        assert fresh(c).remaining == 0
         assert sum(a.amount for a in note.allocations_in.all()) == 100
         # Balance reflects the full -150, so it goes negative -> visible.
         assert user.get_balance() == -50
@@ -221,13 +270,13 @@ class TestVoidAndReallocate:
         c = credit(user, 100, expires=date(2026, 1, 1))
         d = debit(user, 60)
         allocate_debit(d)
-        assert c.remaining == 40
+        assert fresh(c).remaining == 40
 
         void_debit(d)
 
         d.refresh_from_db()
         assert d.status == "CANCELLED"
-        assert c.remaining == 100
+        assert fresh(c).remaining == 100
         assert PointAllocation.objects.filter(debit=d).count() == 0
         assert user.get_balance() == 100
 
@@ -237,15 +286,15 @@ class TestVoidAndReallocate:
         c2 = credit(user, 100, expires=date(2026, 2, 1))
         d = debit(user, 50)
         allocate_debit(d)
-        assert c1.remaining == 50
+        assert fresh(c1).remaining == 50
 
         # Simulate the request total growing; allocate again.
         d.value = -150
         d.save(update_fields=["value"])
         allocate_debit(d)
 
-        assert c1.remaining == 0
-        assert c2.remaining == 50
+        assert fresh(c1).remaining == 0
+        assert fresh(c2).remaining == 50
         assert sum(a.amount for a in d.allocations_in.all()) == 150
 
     def test_reactivated_claim_draws_from_currently_available_credits(self):
@@ -253,11 +302,11 @@ class TestVoidAndReallocate:
         c_old = credit(user, 100, expires=date(2026, 1, 1))
         d = debit(user, 100)
         allocate_debit(d)
-        assert c_old.remaining == 0
+        assert fresh(c_old).remaining == 0
 
         # Claim cancelled -> points returned.
         void_debit(d)
-        assert c_old.remaining == 100
+        assert fresh(c_old).remaining == 100
 
         # A newer credit arrives, then the claim is reactivated.
         c_new = credit(user, 100, grant=date(2025, 4, 1), expires=date(2025, 12, 1))
@@ -266,8 +315,8 @@ class TestVoidAndReallocate:
         allocate_debit(d)
 
         # Soonest-to-expire is c_new now, so it should be drawn first.
-        assert c_new.remaining == 0
-        assert c_old.remaining == 100
+        assert fresh(c_new).remaining == 0
+        assert fresh(c_old).remaining == 100
 
 
 # ---------------------------------------------------------------------------
@@ -286,8 +335,8 @@ class TestExpiration:
         assert result[0][0].id == expired_credit.id
         assert result[0][1] == 100
         # An EXPIRATION debit was created and drew the remaining 100.
-        assert expired_credit.remaining == 0
-        assert future_credit.remaining == 100
+        assert fresh(expired_credit).remaining == 0
+        assert fresh(future_credit).remaining == 100
         assert user.get_balance() == 100
         exp = PointsTransaction.objects.get(user=user, type="EXPIRATION")
         assert exp.value == -100
@@ -299,11 +348,11 @@ class TestExpiration:
         # 70 already spent before expiry.
         spend = debit(user, 70, day=date(2025, 1, 10))
         allocate_debit(spend)
-        assert c.remaining == 30
+        assert fresh(c).remaining == 30
 
         expire_credits(as_of=date(2025, 6, 1))
 
-        assert c.remaining == 0
+        assert fresh(c).remaining == 0
         exp = PointsTransaction.objects.get(user=user, type="EXPIRATION")
         assert exp.value == -30
         assert user.get_balance() == 0
@@ -326,15 +375,60 @@ class TestExpiration:
         result = expire_credits(as_of=date(2025, 6, 1), dry_run=True)
 
         assert len(result) == 1
-        assert c.remaining == 100  # untouched
+        assert fresh(c).remaining == 100  # untouched
         assert PointsTransaction.objects.filter(user=user, type="EXPIRATION").count() == 0
 
+    def test_users_are_expired_in_batches(self, monkeypatch):
+        monkeypatch.setattr("pa_bonus.services.points.EXPIRY_BATCH_SIZE", 2)
+        users = [make_user(str(400 + n)) for n in range(5)]
+        for user in users:
+            credit(user, 100, expires=date(2025, 1, 31))
+            credit(user, 50, expires=date(2025, 3, 31))
+
+        result = expire_credits(as_of=date(2025, 6, 1))
+
+        assert len(result) == 10
+        assert sum(points for _, points in result) == 750
+        assert PointAllocation.objects.count() == 10
+        assert all(user.get_balance() == 0 for user in users)
+        assert find_remaining_drift() == []
+
+    def test_query_count_does_not_grow_with_credits(self):
+        def expiry_queries(credits_per_user):
+            PointsTransaction.objects.all().delete()
+            for n in range(3):
+                user, _ = User.objects.get_or_create(
+                    username=f"exp{n}", user_number=f"5{n}", user_phone="123456789"
+                )
+                for _ in range(credits_per_user):
+                    credit(user, 10, expires=date(2025, 1, 31))
+            with CaptureQueriesContext(connection) as ctx:
+                expire_credits(as_of=date(2025, 6, 1))
+            return len(ctx.captured_queries)
+
+        assert expiry_queries(2) == expiry_queries(15)
+
+    def test_dry_run_report(self):
+        user = make_user("600")
+        credit(user, 100, expires=date(2025, 1, 31))
+        credit(user, 20, expires=date(2025, 2, 28))
+
+        out = StringIO()
+        call_command("expire_points", "--dry-run", "--as-of", "2025-06-01", stdout=out)
+
+        assert out.getvalue().splitlines() == [
+            "Would expire 120 points across 2 credits for 1 users:",
+            "  600: 120 points from 2 credit(s)",
+            "Would expire 120 points. (dry run, nothing written)",
+        ]
+        assert not PointsTransaction.objects.filter(type="EXPIRATION").exists()
+
     def test_never_expiring_credit_is_left_alone(self):
         user = make_user()
         c = credit(user, 100, expires=None)
         result = expire_credits(as_of=date(2099, 1, 1))
         assert result == []
-        assert c.remaining == 100
+        assert fresh(c).remaining == 100
 
 
 # ---------------------------------------------------------------------------
@@ -357,7 +451,7 @@ class TestExpirationReadModel:
         c = credit(user, 100, expires=date(2025, 3, 1))
         d = debit(user, 40, day=date(2025, 1, 5))
         allocate_debit(d)
-        assert c.remaining == 60
+        assert fresh(c).remaining == 60
 
         total = expiring_points_total(user, as_of=date(2025, 1, 1), horizon_months=3)
         assert total == 60
@@ -426,3 +520,103 @@ class TestClientsExpiringSummary:
         u = make_user("210")
         credit(u, 100, expires=None)  # never expires
         assert clients_expiring_summary([u], as_of=as_of) == []
+
+
+@pytest.mark.django_db
+class TestStoredRemaining:
+    def test_allocation_queries_do_not_grow_with_spent_credits(self):
+        def allocation_queries(spent_credits):
+            user = make_user(f"3{spent_credits}")
+            for _ in range(spent_credits):
+                credit(user, 10, expires=date(2025, 2, 1))
+            allocate_debit(debit(user, 10 * spent_credits))
+            credit(user, 100, expires=date(2026, 1, 1))
+            claim = debit(user, 30)
+            with CaptureQueriesContext(connection) as ctx:
+                allocate_debit(claim)
+            return len(ctx.captured_queries)
+
+        assert allocation_queries(2) == allocation_queries(20)
+
+    def test_deleting_a_debit_gives_points_back(self):
+        user = make_user()
+        c = credit(user, 100, expires=date(2026, 1, 1))
+        d = debit(user, 70)
+        allocate_debit(d)
+        d.delete()
+        assert fresh(c).remaining == 100
+
+    def test_editing_a_credit_value_keeps_remaining_consistent(self):
+        user = make_user()
+        c = credit(user, 100, expires=date(2026, 1, 1))
+        allocate_debit(debit(user, 30))
+        c.refresh_from_db()
+        c.value = 50
+        c.save()
+        assert fresh(c).remaining == 20
+        assert find_remaining_drift([user.pk]) == []
+
+    def test_remaining_reads_the_column_and_saves_do_not_aggregate(self):
+        user = make_user()
+        c = credit(user, 100, expires=date(2026, 1, 1))
+        allocate_debit(debit(user, 30))
+        c.refresh_from_db()
+        with CaptureQueriesContext(connection) as reads:
+            assert (c.remaining, c.allocated) == (70, 30)
+        assert reads.captured_queries == []
+
+        # A stale copy of the remainder is not written back by a full save
+        c.remaining_points = 100
+        c.description = "renamed"
+        with CaptureQueriesContext(connection) as saves:
+            c.save()
+        assert not any('pa_bonus_pointallocation' in query['sql'] for query in saves.captured_queries)
+        assert c.remaining == 70
+        assert find_remaining_drift([user.pk]) == []
+
+    def test_drift_is_found_and_repaired(self):
+        user = make_user()
+        c = credit(user, 100, expires=date(2026, 1, 1))
+        d = debit(user, 40)
+        allocate_debit(d)
+        PointsTransaction.objects.filter(pk=c.pk).update(remaining_points=100)
+        PointsTransaction.objects.filter(pk=d.pk).update(remaining_points=5)
+
+        drift = find_remaining_drift()
+        assert drift == [(c.pk, 100, 60), (d.pk, 5, 0)]
+
+        repair_remaining(drift)
+        assert find_remaining_drift() == []
+        assert fresh(c).remaining == 60
+
+    def test_one_query_for_many_clients(self):
+        as_of = date(2025, 1, 1)
+        for n in range(10):
+            credit(make_user(str(220 + n)), 10 + n, expires=date(2025, 2, 28))
+
+        users = User.objects.order_by('user_number')
+        with CaptureQueriesContext(connection) as ctx:
+            summary = clients_expiring_summary(users, as_of=as_of)
+        assert len(summary) == 10
+        assert len(ctx.captured_queries) == 2  # the totals, then the users
+
+
+@pytest.mark.django_db
+class TestExpiringPointsByUser:
+    def test_totals_and_month_buckets(self):
+        as_of = date(2025, 1, 15)
+        u1 = make_user("701")
+        u2 = make_user("702")
+        credit(u1, 5, expires=date(2024, 12, 31))  # overdue, not yet expired
+        credit(u1, 40, expires=date(2025, 1, 31))
+        credit(u1, 60, expires=date(2025, 3, 31))
+        credit(u2, 30, expires=date(2025, 3, 31))
+        credit(u2, 99, expires=date(2025, 9, 30))  # beyond the horizon
+
+        assert expiring_points_by_user(as_of=as_of) == {u1.pk: 105, u2.pk: 30}
+        assert expiring_points_by_user([u2], as_of=as_of) == {u2.pk: 30}
+        assert expiring_points_by_user(as_of=as_of, by_month=True, include_overdue=False) == {
+            u1.pk: {date(2025, 1, 31): 40, date(2025, 3, 31): 60},
+            u2.pk: {date(2025, 3, 31): 30},
+        }
+        assert expiring_points_total(u1, as_of=as_of) == 105
@@ -0,0 +1,148 @@
+"""
+Tests for background report jobs (ReportJob and generate_report_task).
+
+django-q runs synchronously in the test settings, so queuing a job from the
+Reports Hub produces its file before the request returns.
+"""
+import pytest
+import openpyxl
+from datetime import timedelta
+
+from django.contrib.auth.models import Group
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from pa_bonus.models import ReportJob, User
+from pa_bonus.reports import (
+    REPORT_JOB_RETENTION_SECONDS, REPORT_JOB_REUSE_SECONDS, REPORT_TASK_TIMEOUT, get_report_by_id, submit_report_job,
+)
+from pa_bonus.tasks import generate_report_task
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+@pytest.mark.django_db
+class TestReportJobs:
+    def setup_method(self):
+        self.manager = User.objects.create(username="manager", user_number="M1", user_phone="1")
+        User.objects.create(username="client", user_number="100", user_phone="2")
+
+    def test_job_completes_with_file(self):
+        job, reused = submit_report_job("all_clients", self.manager)
+        job.refresh_from_db()
+
+        assert not reused
+        assert job.status == "COMPLETED"
+        assert job.started_at <= job.finished_at
+        assert job.row_count >= 1
+        with job.file.open("rb") as handle:
+            ws = openpyxl.load_workbook(handle).active
+        assert ws.max_row == job.row_count + 1
+
+    def test_recent_job_is_reused(self):
+        first, _ = submit_report_job("all_clients", self.manager)
+        again, reused = submit_report_job("all_clients", self.manager)
+        assert reused and again.id == first.id
+
+        ReportJob.objects.filter(id=first.id).update(
+            finished_at=timezone.now() - timedelta(seconds=REPORT_JOB_REUSE_SECONDS + 1)
+        )
+        fresh, reused = submit_report_job("all_clients", self.manager)
+        assert not reused and fresh.id != first.id
+
+    def test_running_job_is_reused(self):
+        running = ReportJob.objects.create(report_id="all_clients", requested_by=self.manager, status="RUNNING")
+        job, reused = submit_report_job("all_clients", self.manager)
+        assert reused and job.id == running.id
+
+    def test_dead_job_is_failed_not_reused(self):
+        running = ReportJob.objects.create(report_id="all_clients", requested_by=self.manager, status="RUNNING")
+        ReportJob.objects.filter(id=running.id).update(
+            started_at=timezone.now() - timedelta(seconds=REPORT_TASK_TIMEOUT + 1)
+        )
+        job, reused = submit_report_job("all_clients", self.manager)
+
+        assert not reused and job.id != running.id
+        running.refresh_from_db()
+        assert running.status == "FAILED" and running.finished_at is not None
+        assert submit_report_job("all_clients", self.manager) == (job, True)
+
+    def test_old_jobs_are_purged_with_their_files(self, tmp_path):
+        old, _ = submit_report_job("all_clients", self.manager)
+        failed = ReportJob.objects.create(report_id="missing", requested_by=self.manager, status="FAILED")
+        expired = timezone.now() - timedelta(seconds=REPORT_JOB_REUSE_SECONDS + REPORT_JOB_RETENTION_SECONDS + 1)
+        ReportJob.objects.filter(id__in=[old.id, failed.id]).update(finished_at=expired)
+        recent = ReportJob.objects.create(
+            report_id="missing", requested_by=self.manager, status="FAILED", finished_at=timezone.now(),
+        )
+
+        job, _ = submit_report_job("all_clients", self.manager)
+
+        job.refresh_from_db()
+        assert set(ReportJob.objects.values_list('id', flat=True)) == {recent.id, job.id}
+        assert list(tmp_path.rglob("*.xlsx")) == [tmp_path / job.file.name]
+
+    def test_late_worker_does_not_revive_a_failed_job(self, monkeypatch, tmp_path):
+        report_class = get_report_by_id("all_clients")
+        write_workbook = report_class.write_workbook
+
+        def give_up_meanwhile(report, output):
+            # submit_report_job declares the job dead while the worker is still writing
+            ReportJob.objects.filter(id=job.id).update(status="FAILED")
+            return write_workbook(report, output)
+
+        monkeypatch.setattr(report_class, "write_workbook", give_up_meanwhile)
+        job = ReportJob.objects.create(report_id="all_clients", requested_by=self.manager)
+        generate_report_task(job.id)
+        job.refresh_from_db()
+
+        assert job.status == "FAILED" and not job.file
+        assert not list(tmp_path.rglob("*.xlsx"))
+
+        # A worker that only picks up the dead job now leaves it alone
+        started_at = job.started_at
+        generate_report_task(job.id)
+        job.refresh_from_db()
+        assert job.status == "FAILED" and job.started_at == started_at
+
+    def test_unknown_report_fails(self):
+        job = ReportJob.objects.create(report_id="missing", requested_by=self.manager)
+        generate_report_task(job.id)
+        job.refresh_from_db()
+
+        assert job.status == "FAILED"
+        assert "Unknown report" in job.error_message
+        assert not job.file
+
+    def test_hub_queues_and_serves_the_file(self):
+        self.manager.groups.add(Group.objects.create(name="Managers"))
+        http = Client()
+        http.force_login(self.manager)
+
+        response = http.post(reverse("report_download"), {"report_id": "all_clients"})
+        assert response.status_code == 302
+        job = ReportJob.objects.get()
+        assert job.requested_by == self.manager
+
+        status = http.get(reverse("report_job_status", args=[job.id])).json()
+        assert status["status"] == "COMPLETED"
+        assert status["row_count"] == job.row_count
+
+        hub = http.get(reverse("reports_hub"))
+        assert reverse("report_job_file", args=[job.id]) in hub.content.decode()
+
+        download = http.get(reverse("report_job_file", args=[job.id]))
+        assert download.status_code == 200
+        assert download["Content-Disposition"].startswith("attachment")
+        download.close()
+
+    def test_unfinished_job_cannot_be_downloaded(self):
+        self.manager.groups.add(Group.objects.create(name="Managers"))
+        job = ReportJob.objects.create(report_id="all_clients", requested_by=self.manager)
+        http = Client()
+        http.force_login(self.manager)
+        assert http.get(reverse("report_job_file", args=[job.id])).status_code == 404
@@ -0,0 +1,162 @@
+"""
+Tests for the report framework in pa_bonus.reports.
+
+Reports are streamed through a write-only workbook, so these check that what
+comes out is still a proper sheet: styled, frozen headers, every row in
+order, number formats on the declared columns and sensible column widths.
+"""
+import pytest
+import openpyxl
+from datetime import date, timedelta
+from io import BytesIO
+
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from pa_bonus.models import (
+    User, Brand, FileUpload, Region, RegionRep, UserContract, UserContractGoal, Invoice, InvoiceBrandTurnover,
+)
+from pa_bonus.reports import (
+    AllClientsReport, BaseReport, get_all_reports, NUMBER_FORMAT_CURRENCY, COLUMN_WIDTH_SAMPLE_ROWS,
+)
+from pa_bonus.services.turnover import rebuild_turnover_rollup
+from pa_bonus.utilities import calculate_turnover_for_goal
+
+
+class GeneratedReport(BaseReport):
+    """Not registered (no report_id); rows come from a generator."""
+    title = "Generated"
+    filename_prefix = "generated"
+
+    def __init__(self, row_count):
+        self.row_count = row_count
+
+    def get_headers(self):
+        return ["Name", "Amount", "Note"]
+
+    def get_column_formats(self):
+        return {1: NUMBER_FORMAT_CURRENCY}
+
+    def get_rows(self):
+        for n in range(self.row_count):
+            yield [f"client {n}", n * 1.5, None]
+
+
+def load(report):
+    buffer = BytesIO()
+    report.write_workbook(buffer)
+    buffer.seek(0)
+    return openpyxl.load_workbook(buffer).active
+
+
+class TestStreamingWorkbook:
+    def test_rows_headers_and_formats(self):
+        ws = load(GeneratedReport(COLUMN_WIDTH_SAMPLE_ROWS + 50))
+
+        assert ws.title == "Generated"
+        assert ws.freeze_panes == "A2"
+        assert [cell.value for cell in ws[1]] == ["Name", "Amount", "Note"]
+        assert ws["A1"].font.bold
+
+        assert ws.max_row == COLUMN_WIDTH_SAMPLE_ROWS + 51
+        last = ws.max_row
+        assert ws[f"A{last}"].value == f"client {COLUMN_WIDTH_SAMPLE_ROWS + 49}"
+        assert ws[f"B{last}"].value == (COLUMN_WIDTH_SAMPLE_ROWS + 49) * 1.5
+        assert ws[f"B{last}"].number_format == NUMBER_FORMAT_CURRENCY
+        assert ws[f"C{last}"].value is None
+
+    def test_column_widths_come_from_the_sample(self):
+        ws = load(GeneratedReport(20))
+        assert ws.column_dimensions["A"].width == len("client 19") + 3
+        assert ws.column_dimensions["C"].width == 10  # header only, minimum width
+
+    @pytest.mark.django_db  # closing a response fires request_finished
+    def test_response_streams_a_file(self):
+        response = GeneratedReport(3).generate_response()
+        content = b"".join(response.streaming_content)
+        response.close()
+
+        assert response["Content-Disposition"].startswith('attachment; filename="generated_')
+        ws = openpyxl.load_workbook(BytesIO(content)).active
+        assert ws.max_row == 4
+
+
+@pytest.mark.django_db
+class TestRegisteredReports:
+    @pytest.mark.parametrize("report_class", get_all_reports(), ids=lambda cls: cls.report_id)
+    def test_every_report_generates(self, report_class):
+        report = report_class()
+        ws = load(report)
+        assert [cell.value for cell in ws[1]] == report.get_headers()
+
+
+@pytest.mark.django_db
+class TestAllClientsReport:
+    def setup_method(self):
+        self.today = timezone.now().date()
+        self.brand = Brand.objects.create(name="Primavera", prefix="PA")
+        self.region = Region.objects.create(name="North", code="N")
+        rep = User.objects.create(username="rep", user_number="R1", user_phone="0", first_name="Rita", last_name="Rep")
+        rep.groups.add(Group.objects.create(name="Sales Reps"))
+        RegionRep.objects.create(user=rep, region=self.region, date_from=date(2024, 1, 1))
+        self.upload = FileUpload.objects.create(file="test.csv", status="COMPLETED", uploaded_by=rep)
+        self.count = 0
+
+    def add_clients(self, n):
+        for _ in range(n):
+            self.count += 1
+            number = f"C{self.count}"
+            user = User.objects.create(username=number, user_number=number, user_phone=number, region=self.region)
+            UserContract.objects.create(
+                user_id=user, is_active=False,
+                contract_date_from=date(2020, 1, 1), contract_date_to=date(2020, 12, 31),
+            )
+            contract = UserContract.objects.create(
+                user_id=user, contract_date_from=date(2024, 1, 1), contract_date_to=date(2030, 12, 31),
+            )
+            goal = UserContractGoal.objects.create(
+                user_contract=contract, goal_value=1000, goal_base=500,
+                goal_period_from=self.today - timedelta(days=60), goal_period_to=self.today + timedelta(days=300),
+            )
+            goal.brands.add(self.brand)
+            invoice = Invoice.objects.create(
+                invoice_number=f"F{self.count}", client_number=number, file_upload=self.upload, invoice_type="INVOICE",
+                invoice_date=self.today - timedelta(days=10), total_amount=100 * self.count,
+            )
+            InvoiceBrandTurnover.objects.create(invoice=invoice, brand=self.brand, amount=100 * self.count)
+        rebuild_turnover_rollup()
+
+    def run_report(self):
+        with CaptureQueriesContext(connection) as ctx:
+            rows = AllClientsReport().get_rows()
+        return rows, len(ctx.captured_queries)
+
+    def test_rows_match_per_client_lookups(self):
+        self.add_clients(3)
+        rows, _ = self.run_report()
+        by_number = {row[0]: row for row in rows}
+
+        for user in User.objects.filter(user_number__startswith="C"):
+            row = by_number[user.user_number]
+            contract = UserContract.objects.filter(user_id=user, is_active=True).first()
+            goal = contract.extra_goals.first()
+            turnover = float(calculate_turnover_for_goal(
+                user, goal.brands.all(), goal.goal_period_from, min(self.today, goal.goal_period_to),
+            ))
+            assert row[5] == user.get_sales_rep().get_full_name()
+            assert row[8] == contract.contract_date_from
+            assert row[17] == "Primavera"
+            assert row[18] == turnover
+            assert row[19] == turnover / goal.goal_value
+
+    def test_query_count_does_not_grow_with_clients(self):
+        self.add_clients(3)
+        _, few = self.run_report()
+        self.add_clients(20)
+        rows, many = self.run_report()
+
+        assert len(rows) == 24  # the clients and the rep
+        assert few == many
+        assert many <= 8
@@ -0,0 +1,96 @@
+"""
+Tests for the synthetic data generator (pa_bonus.services.synthetic).
+
+The generator bulk-inserts around the live write paths, so these check that
+what it leaves behind is exactly what those paths would: credit remainders,
+balances and the turnover rollup all pass their own consistency checks. The
+invoice files it writes must go through the real upload pipeline.
+"""
+import pytest
+from io import StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+
+from pa_bonus.models import (
+    User, Brand, FileUpload, Invoice, MonthlyBrandTurnover, PointAllocation, PointsTransaction, RewardRequest,
+)
+from pa_bonus.services.balances import find_balance_drift
+from pa_bonus.services.points import find_remaining_drift
+from pa_bonus.services.synthetic import delete_synthetic_data, generate_synthetic_data, write_invoice_file
+from pa_bonus.tasks import process_uploaded_file
+
+SMALL = dict(clients=25, regions=3, brands=4, months=8, batch_size=10)
+
+
+def dataset_snapshot():
+    return (
+        sorted(User.objects.values_list('user_number', 'first_name', 'last_name', 'region__code')),
+        sorted(Invoice.objects.values_list('invoice_number', 'client_number', 'invoice_date', 'total_amount')),
+        sorted(PointsTransaction.objects.values_list('user__user_number', 'value', 'date', 'type', 'status', 'remaining_points')),
+    )
+
+
+@pytest.mark.django_db
+class TestSyntheticData:
+    def test_generates_every_kind_of_row(self):
+        counts = generate_synthetic_data(**SMALL)
+
+        assert User.objects.filter(user_number__startswith="SYN0").count() == 25
+        assert counts["Invoice"] == Invoice.objects.count() > 25
+        assert Invoice.objects.filter(invoice_type="CREDIT_NOTE").exists()
+        assert RewardRequest.objects.count() == 50
+        assert PointAllocation.objects.exists()
+        assert PointsTransaction.objects.filter(status="PENDING").exists()
+
+    def test_same_seed_same_data(self):
+        generate_synthetic_data(seed=7, **SMALL)
+        first = dataset_snapshot()
+        delete_synthetic_data()
+        assert not User.objects.exists() and not Invoice.objects.exists()
+        assert not MonthlyBrandTurnover.objects.exists()
+
+        generate_synthetic_data(seed=7, **SMALL)
+        assert dataset_snapshot() == first
+
+    def test_derived_data_is_consistent(self):
+        generate_synthetic_data(**SMALL)
+
+        assert find_remaining_drift() == []
+        assert find_balance_drift(User.objects.values_list('id', flat=True)) == []
+
+        rollup = sorted(MonthlyBrandTurnover.objects.values_list('client_number', 'brand_id', 'month', 'invoice_type', 'amount'))
+        call_command("rebuild_turnover_rollup", stdout=StringIO())
+        assert rollup == sorted(MonthlyBrandTurnover.objects.values_list('client_number', 'brand_id', 'month', 'invoice_type', 'amount'))
+
+    @pytest.mark.parametrize("suffix", ["csv", "xlsx"])
+    def test_invoice_file_uploads(self, suffix, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        generate_synthetic_data(**SMALL)
+        existing = Invoice.objects.count()
+
+        clients = list(User.objects.filter(user_number__startswith="SYN0").values_list('user_number', flat=True))
+        prefixes = list(Brand.objects.values_list('prefix', flat=True))
+        path = tmp_path / f"invoices.{suffix}"
+        assert write_invoice_file(path, clients, prefixes, invoices=40) >= 40
+
+        upload = FileUpload.objects.create(
+            file=SimpleUploadedFile(path.name, path.read_bytes()), uploaded_by=User.objects.first(),
+        )
+        process_uploaded_file(upload.id)
+        upload.refresh_from_db()
+
+        assert upload.status == "COMPLETED", upload.error_message
+        assert Invoice.objects.count() == existing + 40
+        assert PointsTransaction.objects.filter(file_upload=upload).exists()
+
+    def test_command_refuses_to_generate_twice(self):
+        out = StringIO()
+        call_command("generate_synthetic_data", "--clients", "5", "--months", "3", stdout=out)
+        assert "Generated" in out.getvalue()
+
+        with pytest.raises(Exception, match="already exists"):
+            call_command("generate_synthetic_data", "--clients", "5", stdout=StringIO())
+
+        call_command("generate_synthetic_data", "--delete", stdout=StringIO())
+        assert not User.objects.exists()
@@ -0,0 +1,350 @@
+"""
+Tests for the monthly turnover rollup (MonthlyBrandTurnover).
+
+The rollup is a cache of InvoiceBrandTurnover, so the tests compare every
+answer against the raw invoices: after uploads, after a re-upload moves an
+invoice to another month, and after a rebuild.
+"""
+import pytest
+import pandas as pd
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from pa_bonus.admin import export_turnover_action
+from pa_bonus.models import (
+    User, Brand, BrandBonus, FileUpload, Invoice, InvoiceBrandTurnover, MonthlyBrandTurnover, PointsTransaction,
+    UserContract,
+)
+from pa_bonus.services.turnover import (
+    active_contract_id, brand_turnover_matrix, contract_brand_count, contract_brand_turnover,
+    net_turnover, net_turnovers, refresh_turnover_rollup,
+)
+from pa_bonus.views.views_managers import ClientListView
+from pa_bonus.tasks import FT_INVOICE, FT_CREDIT_NOTE, process_invoice_data_bulk
+
+
+def upload_rows(invoice_col, filetype, rows):
+    manager, _ = User.objects.get_or_create(username="manager", user_number="M1", user_phone="1")
+    upload = FileUpload.objects.create(file="test.csv", status="PROCESSING", uploaded_by=manager)
+    df = pd.DataFrame(rows, columns=[invoice_col, 'ZČ', 'Kód', 'Cena', 'Datum'])
+    df['Datum'] = pd.to_datetime(df['Datum'], format='%d.%m.%Y')
+    process_invoice_data_bulk(df, upload, filetype)
+    return upload
+
+
+def raw_net(client_number, brands, start_date, end_date):
+    """The original two-query implementation, as the reference."""
+    totals = {}
+    for invoice_type in ('INVOICE', 'CREDIT_NOTE'):
+        totals[invoice_type] = InvoiceBrandTurnover.objects.filter(
+            invoice__client_number=client_number,
+            invoice__invoice_date__gte=start_date,
+            invoice__invoice_date__lt=end_date,
+            invoice__invoice_type=invoice_type,
+            brand__in=brands,
+        ).aggregate(total=Sum('amount'))['total'] or Decimal(0)
+    return totals['INVOICE'] - totals['CREDIT_NOTE']
+
+
+def rollup_snapshot():
+    return sorted(
+        MonthlyBrandTurnover.objects.values_list('client_number', 'brand_id', 'month', 'invoice_type', 'amount')
+    )
+
+
+def assert_rollup_current():
+    """The maintained rollup must equal one regenerated from scratch."""
+    maintained = rollup_snapshot()
+    call_command("rebuild_turnover_rollup", stdout=StringIO())
+    assert maintained == rollup_snapshot()
+
+
+RANGES = [
+    (date(2025, 1, 1), date(2025, 4, 1)),    # whole months only
+    (date(2025, 1, 15), date(2025, 3, 10)),  # partial edges on both sides
+    (date(2025, 2, 3), date(2025, 2, 20)),   # inside a single month
+    (date(2024, 12, 1), date(2025, 2, 15)),  # across a year end
+    (date(2025, 1, 31), date(2025, 2, 1)),   # a single day
+]
+
+
+@pytest.mark.django_db
+class TestTurnoverRollup:
+    def setup_method(self):
+        self.pa = Brand.objects.create(name="Primavera", prefix="PA")
+        self.kb = Brand.objects.create(name="Kosmetika", prefix="KB")
+        upload_rows('Faktura', FT_INVOICE, [
+            ('F1', '100', 'PA1', 100.10, '05.12.2024'),
+            ('F2', '100', 'PA1', 20.00, '15.01.2025'),
+            ('F2', '100', 'KB1', 7.25, '15.01.2025'),
+            ('F3', '100', 'PA2', 33.30, '31.01.2025'),
+            ('F4', '100', 'PA1', 12.00, '03.02.2025'),
+            ('F5', '100', 'KB2', 40.00, '20.02.2025'),
+            ('F6', '100', 'PA1', 5.55, '09.03.2025'),
+            ('F7', '200', 'PA1', 999.00, '15.01.2025'),
+        ])
+        upload_rows('Dobropis', FT_CREDIT_NOTE, [
+            ('D1', '100', 'PA1', 3.30, '16.01.2025'),
+            ('D2', '100', 'KB1', 1.00, '28.02.2025'),
+        ])
+
+    def test_upload_maintains_rollup(self):
+        assert_rollup_current()
+        assert MonthlyBrandTurnover.objects.count() == 9
+
+    @pytest.mark.parametrize("start_date,end_date", RANGES)
+    def test_matches_raw_invoices(self, start_date, end_date):
+        for brands in ([self.pa], [self.pa, self.kb], Brand.objects.all()):
+            assert net_turnover("100", brands, start_date, end_date) == raw_net("100", brands, start_date, end_date)
+
+    def test_whole_months_do_not_touch_invoices(self):
+        with CaptureQueriesContext(connection) as ctx:
+            net_turnover("100", [self.pa], date(2025, 1, 1), date(2025, 3, 1))
+        assert len(ctx.captured_queries) == 1
+        assert "invoicebrandturnover" not in ctx.captured_queries[0]['sql'].lower()
+
+    def test_reupload_moving_an_invoice_updates_both_months(self):
+        upload_rows('Faktura', FT_INVOICE, [('F4', '100', 'PA1', 12.00, '03.03.2025')])
+
+        assert_rollup_current()
+        for start_date, end_date in RANGES + [(date(2025, 1, 1), date(2025, 5, 1))]:
+            assert net_turnover("100", [self.pa], start_date, end_date) == raw_net("100", [self.pa], start_date, end_date)
+
+    def test_refresh_after_manual_delete(self):
+        invoice = Invoice.objects.get(invoice_number="F5")
+        cell = (invoice.client_number, invoice.invoice_date)
+        invoice.delete()
+        refresh_turnover_rollup([cell])
+        assert not MonthlyBrandTurnover.objects.filter(brand=self.kb, month=date(2025, 2, 1), invoice_type='INVOICE').exists()
+        assert_rollup_current()
+
+    def admin_client(self):
+        admin_user = User.objects.create_superuser(
+            username="admin", password="x", user_number="A1", user_phone="1", email="admin@example.com",
+        )
+        http = Client()
+        http.force_login(admin_user)
+        return http
+
+    def test_admin_invoice_edit_refreshes_both_months(self):
+        invoice = Invoice.objects.get(invoice_number="F4")
+        line = invoice.brand_turnovers.get()
+        http = self.admin_client()
+
+        response = http.post(reverse('admin:pa_bonus_invoice_change', args=[invoice.id]), {
+            'invoice_number': 'F4', 'client_number': '100', 'invoice_date': '2025-03-03',
+            'total_amount': '50.00', 'invoice_type': 'INVOICE', 'file_upload': invoice.file_upload_id,
+            'brand_turnovers-TOTAL_FORMS': '1', 'brand_turnovers-INITIAL_FORMS': '1',
+            'brand_turnovers-MIN_NUM_FORMS': '0', 'brand_turnovers-MAX_NUM_FORMS': '1000',
+            'brand_turnovers-0-id': line.id, 'brand_turnovers-0-invoice': invoice.id,
+            'brand_turnovers-0-brand': self.pa.id, 'brand_turnovers-0-amount': '50.00',
+        })
+        assert response.status_code == 302
+
+        pa_months = dict(
+            MonthlyBrandTurnover.objects.filter(client_number='100', brand=self.pa, invoice_type='INVOICE')
+            .values_list('month', 'amount')
+        )
+        assert date(2025, 2, 1) not in pa_months
+        assert pa_months[date(2025, 3, 1)] == Decimal('55.55')
+        assert_rollup_current()
+
+    def test_admin_deletes_refresh_rollup(self):
+        http = self.admin_client()
+        invoice = Invoice.objects.get(invoice_number="F5")
+        http.post(reverse('admin:pa_bonus_invoice_delete', args=[invoice.id]), {'post': 'yes'})
+        assert not Invoice.objects.filter(invoice_number="F5").exists()
+        assert_rollup_current()
+
+        credit_notes = Invoice.objects.get(invoice_number="D1").file_upload
+        http.post(reverse('admin:pa_bonus_fileupload_changelist'), {
+            'action': 'delete_selected', '_selected_action': [credit_notes.id], 'post': 'yes',
+        })
+        assert not Invoice.objects.filter(invoice_type='CREDIT_NOTE').exists()
+        assert not MonthlyBrandTurnover.objects.filter(invoice_type='CREDIT_NOTE').exists()
+        assert_rollup_current()
+
+    def test_bulk_matches_single_queries(self):
+        brand_sets = [(self.pa.id,), (self.pa.id, self.kb.id), (self.kb.id,)]
+        specs = [
+            (client_number, brand_ids, start_date, end_date)
+            for client_number in ("100", "200", "999")
+            for brand_ids in brand_sets
+            for start_date, end_date in RANGES
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            results = net_turnovers(specs)
+        assert len(ctx.captured_queries) == 2
+
+        assert set(results) == set(specs)
+        for client_number, brand_ids, start_date, end_date in specs:
+            brands = Brand.objects.filter(id__in=brand_ids)
+            assert results[(client_number, brand_ids, start_date, end_date)] == raw_net(
+                client_number, brands, start_date, end_date
+            )
+
+    def test_bulk_with_no_specs(self):
+        with CaptureQueriesContext(connection) as ctx:
+            assert net_turnovers([]) == {}
+        assert not ctx.captured_queries
+
+
+@pytest.mark.django_db
+class TestContractBrandTurnover:
+    def setup_method(self):
+        self.pa = Brand.objects.create(name="Primavera", prefix="PA")
+        self.kb = Brand.objects.create(name="Kosmetika", prefix="KB")
+        for number in ("100", "200", "300"):
+            user = User.objects.create(username=f"client{number}", user_number=number, user_phone=number)
+            old = UserContract.objects.create(
+                user_id=user, contract_date_from=date(2023, 1, 1), contract_date_to=date(2030, 12, 31),
+            )
+            old.brandbonuses.add(BrandBonus.objects.create(name="KB", points_ratio=0.1, brand_id=self.kb))
+        newest = UserContract.objects.create(
+            user_id=User.objects.get(user_number="100"),
+            contract_date_from=date(2024, 6, 1), contract_date_to=date(2030, 12, 31),
+        )
+        newest.brandbonuses.add(BrandBonus.objects.create(name="PA", points_ratio=0.1, brand_id=self.pa))
+        UserContract.objects.filter(user_id__user_number="300").update(is_active=False)
+
+        upload_rows('Faktura', FT_INVOICE, [
+            ('F1', '100', 'PA1', 100.00, '05.01.2025'),
+            ('F1', '100', 'KB1', 50.00, '05.01.2025'),
+            ('F2', '100', 'PA1', 10.00, '05.03.2025'),
+            ('F3', '200', 'KB1', 70.00, '15.02.2025'),
+            ('F4', '200', 'PA1', 99.00, '15.02.2025'),
+            ('F5', '300', 'KB1', 30.00, '15.02.2025'),
+            ('F6', '200', 'KB1', 5.00, '15.12.2024'),
+        ])
+        upload_rows('Dobropis', FT_CREDIT_NOTE, [('D1', '200', 'KB1', 20.00, '20.02.2025')])
+
+    def test_matches_active_contract_brands(self):
+        clients = User.objects.filter(user_number__in=["100", "200", "300"]).annotate(
+            active_contract_id=active_contract_id(),
+        ).annotate(
+            turnover=contract_brand_turnover(date(2025, 1, 1), date(2025, 2, 28)),
+            brand_count=contract_brand_count(),
+        )
+        result = {client.user_number: (client.turnover, client.brand_count) for client in clients}
+
+        # 100: newest contract has PA only; 200: KB invoices only; 300: no active contract
+        assert result == {
+            "100": (Decimal("100.00"), 1),
+            "200": (Decimal("70.00"), 1),
+            "300": (Decimal("0"), 0),
+        }
+
+    def test_client_list_sorts_and_paginates_in_constant_queries(self, monkeypatch):
+        manager = User.objects.get(username="manager")  # created by upload_rows
+        manager.groups.add(Group.objects.create(name="Managers"))
+        http = Client()
+        http.force_login(manager)
+        monkeypatch.setattr(ClientListView, 'paginate_by', 2)
+        url = reverse('manager_clients') + "?year_from=2025&month_from=1&year_to=2025&month_to=2&sort=-turnover"
+
+        with CaptureQueriesContext(connection) as few:
+            response = http.get(url)
+        assert [entry['user'].user_number for entry in response.context['clients']] == ["100", "200"]
+        assert response.context['page_obj'].paginator.count == 4
+
+        response = http.get(url + "&page=2")
+        assert [entry['user'].user_number for entry in response.context['clients']] == ["300", "M1"]
+
+        for n in range(10):
+            User.objects.create(username=f"extra{n}", user_number=f"X{n}", user_phone="1")
+        with CaptureQueriesContext(connection) as many:
+            http.get(url)
+        assert len(many.captured_queries) == len(few.captured_queries)
+
+
+@pytest.mark.django_db
+class TestBrandTurnoverMatrix:
+    def setup_method(self):
+        self.pa = Brand.objects.create(name="Primavera", prefix="PA")
+        self.kb = Brand.objects.create(name="Kosmetika", prefix="KB")
+        self.idle = Brand.objects.create(name="Idle", prefix="ID")
+        self.user = User.objects.create(username="client100", user_number="100", user_phone="100")
+
+        upload_rows('Faktura', FT_INVOICE, [
+            ('F1', '100', 'PA1', 100.00, '05.01.2025'),
+            ('F1', '100', 'KB1', 50.00, '05.01.2025'),
+            ('F2', '100', 'PA1', 10.00, '31.03.2025'),
+            ('F3', '100', 'KB1', 70.00, '01.04.2025'),
+            ('F4', '200', 'KB1', 99.00, '15.02.2025'),
+        ])
+        upload_rows('Dobropis', FT_CREDIT_NOTE, [('D1', '100', 'KB1', 20.00, '20.02.2025')])
+        for value, day, status, brand in (
+            (10, date(2025, 1, 5), 'CONFIRMED', self.pa),
+            (5, date(2025, 1, 5), 'CONFIRMED', self.kb),
+            (7, date(2025, 1, 5), 'PENDING', self.kb),
+            (3, date(2025, 5, 1), 'CONFIRMED', self.idle),
+        ):
+            PointsTransaction.objects.create(
+                user=self.user, value=value, date=day, description="Points", type='STANDARD_POINTS',
+                status=status, brand=brand,
+            )
+
+    def reference(self, brand, date_from, date_to):
+        """The per-brand aggregates the client detail pages used to run."""
+        turnovers = InvoiceBrandTurnover.objects.filter(
+            invoice__client_number="100", invoice__invoice_date__gte=date_from,
+            invoice__invoice_date__lte=date_to, brand=brand,
+        )
+        invoices = turnovers.filter(invoice__invoice_type='INVOICE').aggregate(total=Sum('amount'))['total'] or 0
+        credit_notes = turnovers.filter(invoice__invoice_type='CREDIT_NOTE').aggregate(total=Sum('amount'))['total'] or 0
+        points = PointsTransaction.objects.filter(
+            user=self.user, date__gte=date_from, date__lte=date_to, brand=brand, status='CONFIRMED',
+        ).aggregate(total=Sum('value'))['total'] or 0
+        return invoices, credit_notes, points
+
+    def test_matches_per_brand_aggregates(self):
+        date_from, date_to = date(2025, 1, 1), date(2025, 3, 31)
+        rows = brand_turnover_matrix(self.user, date_from, date_to, [self.kb])
+
+        assert [row['brand'] for row in rows] == [self.pa, self.kb]
+        for row in rows:
+            invoices, credit_notes, points = self.reference(row['brand'], date_from, date_to)
+            assert row['invoice_turnover'] == invoices
+            assert row['credit_turnover'] == credit_notes
+            assert row['net_turnover'] == invoices - credit_notes
+            assert row['points'] == points
+            assert row['in_contract'] == (row['brand'] == self.kb)
+        assert rows[1]['net_turnover'] == Decimal("30.00")
+
+    def test_query_count_does_not_grow_with_brands(self):
+        with CaptureQueriesContext(connection) as few:
+            brand_turnover_matrix(self.user, date(2025, 1, 1), date(2025, 12, 31))
+        for n in range(10):
+            Brand.objects.create(name=f"Extra {n}", prefix=f"X{n}")
+        with CaptureQueriesContext(connection) as many:
+            brand_turnover_matrix(self.user, date(2025, 1, 1), date(2025, 12, 31))
+
+        assert len(many.captured_queries) == len(few.captured_queries) == 3
+
+    def test_no_activity(self):
+        assert brand_turnover_matrix(self.user, date(2020, 1, 1), date(2020, 12, 31)) == []
+
+    def test_export_keeps_a_brand_with_only_credit_notes(self):
+        returns = Brand.objects.create(name="Returns", prefix="RT")
+        upload_rows('Dobropis', FT_CREDIT_NOTE, [('D2', '100', 'RT1', -40.00, '10.02.2025')])
+        bonus = BrandBonus.objects.create(name="RT 1:1", points_ratio=1, brand_id=returns)
+        contract = UserContract.objects.create(
+            user_id=self.user, contract_date_from=date(2025, 1, 1), contract_date_to=date(2026, 12, 31),
+        )
+        contract.brandbonuses.add(bonus)
+
+        rows = brand_turnover_matrix(self.user, date(2025, 1, 1), date(2025, 12, 31), [returns])
+        assert [row['net_turnover'] for row in rows if row['brand'] == returns] == [Decimal("40.00")]
+
+        response = export_turnover_action(None, None, User.objects.filter(pk=self.user.pk))
+        invoices, credit_notes, _ = self.reference(returns, date(2025, 1, 1), date.today())
+        assert response.content.decode().splitlines()[1].split(',')[3] == f'{invoices - credit_notes:.2f}' == '40.00'
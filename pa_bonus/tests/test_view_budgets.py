@@ -0,0 +1,278 @@
+"""
+Query-count and latency budgets for the manager and sales rep views and the
+reports.
+
+Each entry in BUDGETS is requested with the test client against a synthetic
+dataset, and the queries it runs and its wall time are recorded. A test fails
+when a view:
+
+    * runs more queries than its declared budget, fixed + per_client x clients.
+      Views that should not grow with the number of clients declare
+      per_client=0; the rest state how many queries each client costs them;
+    * runs more queries than the stored baseline in view_budgets.json, when the
+      dataset is at the baseline's scale (so a new N+1 shows up even while the
+      declared budget still has headroom);
+    * takes longer than its time budget, scaled by the dataset size.
+
+Environment variables:
+
+    VIEW_BUDGET_SCALE=5            seed five times the default dataset
+    VIEW_BUDGET_UPDATE_BASELINE=1  rewrite view_budgets.json from this run
+    VIEW_BUDGET_TIME_FACTOR=3      loosen the time budgets on slow machines
+
+A summary table is printed at the end of the module (pytest -s to see it).
+"""
+import json
+import os
+import time
+from datetime import date, timedelta
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from pa_bonus.models import (
+    User, Brand, Region, RegionRep, UserContract, UserContractGoal, BrandBonus,
+    FileUpload, Invoice, InvoiceBrandTurnover, PointsTransaction,
+    Reward, RewardRequest, RewardRequestItem,
+)
+from pa_bonus.reports import get_all_reports
+from pa_bonus.services.balances import refresh_balances
+from pa_bonus.services.goals import rebuild_goal_candidates
+from pa_bonus.services.points import allocate_debit
+from pa_bonus.services.turnover import rebuild_turnover_rollup
+
+BASELINE_FILE = Path(__file__).with_name("view_budgets.json")
+
+SCALE = int(os.environ.get("VIEW_BUDGET_SCALE", "1"))
+UPDATE_BASELINE = os.environ.get("VIEW_BUDGET_UPDATE_BASELINE") == "1"
+TIME_FACTOR = float(os.environ.get("VIEW_BUDGET_TIME_FACTOR", "1"))
+
+# Dataset size at scale 1
+CLIENTS_PER_SCALE = 20
+BRANDS = 4
+INVOICES_PER_CLIENT = 6
+TRANSACTIONS_PER_CLIENT = 6
+
+
+class Budget:
+    """
+    The declared cost of one view or report.
+
+    Args:
+        name (str): Key in the baseline file.
+        target (str): URL name, or "report:<report_id>".
+        role (str): "manager" or "salesrep", who requests the view.
+        fixed (int): Queries the view may run regardless of the data.
+        per_client (int): Extra queries allowed per client in the dataset.
+        seconds (float): Wall time allowed at scale 1.
+        args (callable): Builds the URL args from the dataset dict.
+    """
+
+    def __init__(self, name, target, role="manager", fixed=20, per_client=0, seconds=2.0, args=None):
+        self.name = name
+        self.target = target
+        self.role = role
+        self.fixed = fixed
+        self.per_client = per_client
+        self.seconds = seconds
+        self.args = args
+
+    def max_queries(self, clients):
+        return self.fixed + self.per_client * clients
+
+    def __repr__(self):
+        return self.name
+
+
+# Views that still loop over their clients declare what each client costs them;
+# lower per_client as they are made set-based.
+BUDGETS = [
+    # Manager views
+    Budget("manager_dashboard", "manager_dashboard", fixed=25),
+    Budget("manager_clients", "manager_clients", fixed=15),
+    Budget("manager_client_detail", "manager_client_detail", fixed=50, args=lambda data: [data["client"].pk]),
+    Budget("upload_history", "upload_history", fixed=15),
+    Budget("manager_reward_requests", "manager_reward_requests", fixed=15),
+    Budget("transaction_approval", "transaction_approval", fixed=15),
+    Budget("user_activity_dashboard", "user_activity_dashboard", fixed=20),
+    Budget("goal_evaluation", "goal_evaluation", fixed=20),
+    Budget("goals_overview", "goals_overview", fixed=20, per_client=2),
+    Budget("reports_hub", "reports_hub", fixed=15),
+    # Sales rep views
+    Budget("salesrep_dashboard", "salesrep_dashboard", role="salesrep", fixed=30),
+    Budget("salesrep_clients", "salesrep_clients", role="salesrep", fixed=20, per_client=7),
+    Budget("salesrep_client_detail", "salesrep_client_detail", role="salesrep", fixed=35,
+           args=lambda data: [data["client"].pk]),
+    Budget("salesrep_point_expirations", "salesrep_point_expirations", role="salesrep", fixed=15),
+    Budget("salesrep_reward_requests", "salesrep_reward_requests", role="salesrep", fixed=15, per_client=1),
+] + [
+    Budget(f"report:{report.report_id}", f"report:{report.report_id}", fixed=10, seconds=3.0)
+    for report in get_all_reports()
+]
+
+# name -> (queries, seconds, max_queries), filled in as the tests run
+RESULTS = {}
+
+
+def seed(scale=SCALE):
+    """
+    Build the synthetic dataset: one region with a sales rep, a manager, and
+    CLIENTS_PER_SCALE x scale clients, each with an active contract, a current
+    goal, invoices spread over the last year, confirmed, pending and spent
+    points, and a reward request.
+
+    Returns:
+        dict: The manager, the sales rep, a sample client and the client count.
+    """
+    today = timezone.now().date()
+    clients = CLIENTS_PER_SCALE * scale
+
+    manager = User.objects.create(username="manager", user_number="M1", user_phone="M1")
+    manager.groups.add(Group.objects.get_or_create(name="Managers")[0])
+    rep = User.objects.create(username="rep", user_number="R1", user_phone="R1", first_name="Rita", last_name="Rep")
+    rep.groups.add(Group.objects.get_or_create(name="Sales Reps")[0])
+    region = Region.objects.create(name="North", code="N")
+    RegionRep.objects.create(user=rep, region=region, date_from=date(2024, 1, 1))
+
+    brands = [Brand.objects.create(name=f"Brand {n}", prefix=f"B{n}") for n in range(BRANDS)]
+    bonuses = [BrandBonus.objects.create(name=f"{brand.name} 5%", points_ratio=0.05, brand_id=brand) for brand in brands]
+    reward = Reward.objects.create(abra_code="R-1", name="Mug", point_cost=10, description="A mug")
+    upload = FileUpload.objects.create(file="seed.csv", status="COMPLETED", uploaded_by=manager)
+
+    users = User.objects.bulk_create([
+        User(username=f"client{n}", user_number=f"C{n:05d}", user_phone=f"C{n}",
+             first_name="Client", last_name=f"{n:05d}", email=f"client{n}@example.com", region=region)
+        for n in range(clients)
+    ])
+
+    invoices, turnovers, transactions = [], [], []
+    for n, user in enumerate(users):
+        contract = UserContract.objects.create(
+            user_id=user, contract_date_from=today - timedelta(days=400), contract_date_to=today + timedelta(days=400),
+        )
+        contract.brandbonuses.set(bonuses[:1 + n % BRANDS])
+        goal = UserContractGoal.objects.create(
+            user_contract=contract, goal_value=10000, goal_base=8000,
+            goal_period_from=today - timedelta(days=90), goal_period_to=today + timedelta(days=275),
+        )
+        goal.brands.set(brands[:2])
+
+        for i in range(INVOICES_PER_CLIENT):
+            invoice = Invoice(
+                invoice_number=f"F{n:05d}{i:03d}", client_number=user.user_number, file_upload=upload,
+                invoice_type="INVOICE", invoice_date=today - timedelta(days=30 + 55 * i), total_amount=1000 + i,
+            )
+            invoices.append(invoice)
+            turnovers.append((invoice, brands[i % BRANDS], 1000 + i))
+
+        for i in range(TRANSACTIONS_PER_CLIENT):
+            day = today - timedelta(days=20 * i)
+            brand = brands[i % BRANDS]
+            transactions.append(PointsTransaction(
+                user=user, value=50 + i, date=day, description="Seed points",
+                type="STANDARD_POINTS", status="CONFIRMED" if i % 3 else "PENDING", brand=brand,
+                expires_at=brand.expiry_for(day), remaining_points=50 + i,
+            ))
+
+    # Bulk inserts skip the notification signals, which would dominate the seeding time
+    Invoice.objects.bulk_create(invoices)
+    InvoiceBrandTurnover.objects.bulk_create([
+        InvoiceBrandTurnover(invoice=invoice, brand=brand, amount=amount) for invoice, brand, amount in turnovers
+    ])
+    rebuild_turnover_rollup()
+    rebuild_goal_candidates()
+    PointsTransaction.objects.bulk_create(transactions)
+
+    requests = RewardRequest.objects.bulk_create([
+        RewardRequest(user=user, status="PENDING", description="Seed request", total_points=10) for user in users
+    ])
+    RewardRequestItem.objects.bulk_create([
+        RewardRequestItem(reward_request=request, reward=reward, quantity=1, point_cost=10) for request in requests
+    ])
+    debits = PointsTransaction.objects.bulk_create([
+        PointsTransaction(
+            user=request.user, value=-10, date=today, description="Seed claim",
+            type="REWARD_CLAIM", status="CONFIRMED", reward_request=request,
+        )
+        for request in requests
+    ])
+    for debit in debits:
+        allocate_debit(debit)
+    refresh_balances([user.id for user in users])
+
+    return {"manager": manager, "rep": rep, "client": users[0], "clients": clients}
+
+
+def measure(budget, data):
+    """Run one budget's view or report; returns (queries, seconds)."""
+    if budget.target.startswith("report:"):
+        report_class = next(r for r in get_all_reports() if f"report:{r.report_id}" == budget.target)
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            report_class().write_workbook(BytesIO())
+            elapsed = time.perf_counter() - started
+        return len(ctx.captured_queries), elapsed
+
+    http = Client()
+    http.force_login(data["manager"] if budget.role == "manager" else data["rep"])
+    url = reverse(budget.target, args=budget.args(data) if budget.args else None)
+    with CaptureQueriesContext(connection) as ctx:
+        started = time.perf_counter()
+        response = http.get(url)
+        elapsed = time.perf_counter() - started
+    assert response.status_code == 200, f"{budget.name} returned {response.status_code}"
+    return len(ctx.captured_queries), elapsed
+
+
+def load_baseline():
+    if BASELINE_FILE.exists():
+        return json.loads(BASELINE_FILE.read_text())
+    return {"scale": SCALE, "queries": {}}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def summary():
+    """Print the recorded costs, and rewrite the baseline when asked to."""
+    yield
+    if not RESULTS:
+        return
+    print(f"\nView budgets at scale {SCALE} ({CLIENTS_PER_SCALE * SCALE} clients)")
+    print(f"{'view':40} {'queries':>8} {'budget':>8} {'seconds':>8}")
+    for name, (queries, seconds, max_queries) in RESULTS.items():
+        print(f"{name:40} {queries:8} {max_queries:8} {seconds:8.3f}")
+
+    if UPDATE_BASELINE:
+        baseline = {"scale": SCALE, "queries": {name: result[0] for name, result in sorted(RESULTS.items())}}
+        BASELINE_FILE.write_text(json.dumps(baseline, indent=2) + "\n")
+
+
+@pytest.mark.django_db
+class TestViewBudgets:
+    @pytest.mark.parametrize("budget", BUDGETS, ids=repr)
+    def test_within_budget(self, budget):
+        data = seed()
+        queries, seconds = measure(budget, data)
+        max_queries = budget.max_queries(data["clients"])
+        RESULTS[budget.name] = (queries, seconds, max_queries)
+
+        assert queries <= max_queries, (
+            f"{budget.name} ran {queries} queries, its budget is {max_queries} "
+            f"({budget.fixed} + {budget.per_client} per client)"
+        )
+
+        baseline = load_baseline()
+        if not UPDATE_BASELINE and baseline["scale"] == SCALE and budget.name in baseline["queries"]:
+            assert queries <= baseline["queries"][budget.name], (
+                f"{budget.name} ran {queries} queries, up from {baseline['queries'][budget.name]} in "
+                f"{BASELINE_FILE.name}; fix the regression or rerun with VIEW_BUDGET_UPDATE_BASELINE=1"
+            )
+
+        allowed = budget.seconds * SCALE * TIME_FACTOR
+        assert seconds <= allowed, f"{budget.name} took {seconds:.2f}s, its budget is {allowed:.2f}s"
@@ -13,9 +13,7 @@ class SalesRepRequiredMixin(UserPassesTestMixin):
         return self.request.user.groups.filter(name='Sales Reps').exists()
     
 
-from django.db.models import Sum, Value, DecimalField
-from django.db.models.functions import Coalesce
-from pa_bonus.models import InvoiceBrandTurnover
+from pa_bonus.services.turnover import net_turnover, net_turnovers
 
 def calculate_turnover_for_goal(user, brands, start_date, end_date):
     """
@@ -23,37 +21,47 @@ def calculate_turnover_for_goal(user, brands, start_date, end_date):
     
     This is a utility function used by multiple views to calculate
     the total net turnover (invoices minus credit notes) for a specific
-    user, set of brands, and date range.
+    user, set of brands, and date range. Whole months are read from the
+    monthly turnover rollup, partial months from the invoices.
     
     Args:
         user: User object
         brands: QuerySet or list of Brand objects
         start_date: Start date for calculation
-        end_date: End date for calculation
+        end_date: End date for calculation (exclusive)
         
     Returns:
         Decimal: Net turnover amount
     """
-    # Get invoice turnover
-    invoice_turnover = InvoiceBrandTurnover.objects.filter(
-        invoice__client_number=user.user_number,
-        invoice__invoice_date__gte=start_date,
-        invoice__invoice_date__lt=end_date,
-        invoice__invoice_type='INVOICE',
-        brand__in=brands
-    ).aggregate(
-        total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField()))
-    )['total']
-    
-    # Get credit note turnover
-    credit_turnover = InvoiceBrandTurnover.objects.filter(
-        invoice__client_number=user.user_number,
-        invoice__invoice_date__gte=start_date,
-        invoice__invoice_date__lt=end_date,
-        invoice__invoice_type='CREDIT_NOTE',
-        brand__in=brands
-    ).aggregate(
-        total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField()))
-    )['total']
-    
-    return invoice_turnover - credit_turnover
\ No newline at end of file
+    return net_turnover(user.user_number, brands, start_date, end_date)
+
+
+def turnover_spec(goal, start_date, end_date):
+    """
+    The calculate_turnovers key for a goal's turnover over a date range.
+
+    Uses goal.brands.all(), so prefetch 'brands' when building many specs.
+    """
+    return (
+        goal.user_contract.user_id.user_number,
+        tuple(sorted(brand.id for brand in goal.brands.all())),
+        start_date,
+        end_date,
+    )
+
+
+def calculate_turnovers(specs):
+    """
+    Calculate many turnovers at once, in a fixed number of queries.
+
+    The bulk form of calculate_turnover_for_goal for views and reports that
+    evaluate many goals or clients.
+
+    Args:
+        specs: Iterable of (user_number, brand_ids, start_date, end_date) tuples,
+            e.g. built with turnover_spec
+
+    Returns:
+        dict: spec -> Decimal net turnover
+    """
+    return net_turnovers(specs)
@@ -4,24 +4,36 @@ from django.contrib import messages
 from django.views.generic import ListView, View
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
 from django.core.paginator import Paginator
+from django.conf import settings
 from django.utils import timezone
 from django.db.models import Sum, Count, Q, F, Case, When, IntegerField
 from django.db import transaction
 from django.urls import reverse
+from django_q.tasks import async_task
 import logging
 from pa_bonus.forms import (FileUploadForm, ClientCreationForm, ClientProfileEditForm,
                             ContractAddForm, ContractBrandsEditForm)
-from pa_bonus.tasks import process_uploaded_file, process_stock_file
+from pa_bonus.tasks import process_stock_file
 from pa_bonus.models import (FileUpload, Reward, RewardRequest, RewardRequestItem, AbraSubmission,
-                             PointsTransaction, EmailNotification, User, Region, UserContract,
-                             InvoiceBrandTurnover, Brand, UserActivity, UserContractGoal, GoalEvaluation)
-from pa_bonus.utilities import ManagerGroupRequiredMixin, calculate_turnover_for_goal
+                             PointsTransaction, User, Region, UserContract,
+                             InvoiceBrandTurnover, Brand, UserActivity, UserContractGoal, GoalEvaluation,
+                             GoalEvaluationCandidate, TransactionApprovalJob)
+from pa_bonus.utilities import (
+    ManagerGroupRequiredMixin, calculate_turnover_for_goal,
+)
+from pa_bonus.services.approval import month_range, submit_approval_job
+from pa_bonus.services.cache import GLOBAL, cached
 from pa_bonus.services.points import allocate_debit, void_debit
+from pa_bonus.services.goals import GoalEvaluator, award_goal_evaluations
+from pa_bonus.services.turnover import (
+    active_contract_id, brand_turnover_matrix, contract_brand_count, contract_brand_turnover,
+)
 
 from pa_bonus.exports import generate_telemarketing_export
 
 from datetime import datetime, timedelta, date
 from dateutil.relativedelta import relativedelta
+from urllib.parse import urlencode
 
 import openpyxl
 from openpyxl.styles import Font, PatternFill
@@ -48,6 +60,12 @@ class ManagerDashboardView(ManagerGroupRequiredMixin, View):
     template_name = 'manager/dashboard.html'
     
     def get(self, request):
+        today_date = timezone.now().date()
+        context = cached('manager_dashboard', [GLOBAL], lambda: self.get_stats(today_date), today_date)
+        return render(request, self.template_name, context)
+
+    def get_stats(self, today_date):
+        """The dashboard figures, cached programme-wide by get()."""
         # System-wide points statistics
         from django.db.models import Sum, Count, Q, F, Value
         from django.db.models.functions import Coalesce
@@ -69,7 +87,6 @@ class ManagerDashboardView(ManagerGroupRequiredMixin, View):
             
         # 2. Reward requests statistics
         import calendar
-        today_date = timezone.now().date()
         end_of_month = today_date.replace(
             day=calendar.monthrange(today_date.year, today_date.month)[1]
         )
@@ -173,37 +190,15 @@ class ManagerDashboardView(ManagerGroupRequiredMixin, View):
         ).filter(
             available_points__gt=0
         ).order_by('-available_points')[:10]
-
-        # NEW: Add goal evaluation statistics
-        today = timezone.now().date()
-        
-        # Count pending goal evaluations
-        pending_evaluations = 0
-        total_potential_points = 0
-        
-        # Get all active goals
-        active_goals = UserContractGoal.objects.filter(
-            goal_period_from__lte=today
-        ).select_related('user_contract__user_id')
-        
-        for goal in active_goals:
-            periods = goal.get_evaluation_periods()
-            for start, end, is_final in periods:
-                if end < today:  # Period has ended
-                    # Check if already evaluated
-                    if not goal.evaluations.filter(period_start=start, period_end=end).exists():
-                        pending_evaluations += 1
-                        
-                        # Calculate potential points (rough estimate)
-                        targets = goal.get_period_targets(start, end)
-                        actual = calculate_turnover_for_goal(
-                            goal.user_contract.user_id,
-                            goal.brands.all(),
-                            start, end
-                        )
-                        if actual > targets['goal_value']:
-                            potential_points = int((float(actual) - targets['goal_base']) * goal.bonus_percentage)
-                            total_potential_points += max(0, potential_points)
+        top_clients = list(top_clients)
+
+        # Ended goal evaluation periods that have not been evaluated yet
+        goal_stats = GoalEvaluationCandidate.objects.filter(
+            status='PENDING', period_end__lt=today_date,
+        ).aggregate(
+            pending_evaluations=Count('id'),
+            potential_points=Coalesce(Sum('potential_points'), Value(0)),
+        )
         
         context = {
             'points_data': points_data,
@@ -214,13 +209,10 @@ class ManagerDashboardView(ManagerGroupRequiredMixin, View):
             'trend_granted': trend_granted,
             'trend_requested': trend_requested,
             'top_clients': top_clients,
-            'goal_stats': {
-                'pending_evaluations': pending_evaluations,
-                'potential_points': total_potential_points
-                }
+            'goal_stats': goal_stats,
         }
         
-        return render(request, self.template_name, context)
+        return context
     
     
 @permission_required('pa_bonus.add_fileupload', raise_exception=True)
@@ -244,9 +236,9 @@ def upload_file(request):
             upload.uploaded_by = request.user
             upload.save()
 
-            # Process the uploaded file
+            # Process the uploaded file in the background; progress shows in the upload history
             try:
-                process_uploaded_file(upload.id)
+                async_task('pa_bonus.tasks.process_uploaded_file', upload.id, timeout=settings.UPLOAD_TASK_TIMEOUT)
                 messages.success(
                     request, 
                     'File uploaded successfully and is being processed'
@@ -321,6 +313,51 @@ class UploadHistoryView(ManagerGroupRequiredMixin, View):
         }
         return render(request, 'manager/upload_history.html', context)
 
+
+class UploadProgressView(ManagerGroupRequiredMixin, View):
+    """
+    (Managers Only) Lightweight JSON progress of one upload, polled by the upload history page.
+    """
+
+    def get(self, request, upload_id):
+        upload = get_object_or_404(
+            FileUpload.objects.only(
+                'id', 'status', 'processing_stage', 'checkpoint',
+                'processed_rows', 'total_rows', 'error_message',
+            ),
+            id=upload_id,
+        )
+        return JsonResponse({
+            'id': upload.id,
+            'status': upload.status,
+            'stage': upload.processing_stage,
+            'checkpoint': upload.checkpoint,
+            'processed_rows': upload.processed_rows,
+            'total_rows': upload.total_rows,
+            'progress': upload.progress_percent,
+            'can_resume': upload.can_resume,
+            'error': upload.error_message,
+        })
+
+
+class UploadResumeView(ManagerGroupRequiredMixin, View):
+    """
+    (Managers Only) Re-queues a failed or stalled upload, which continues from its last
+    committed chunk.
+    """
+
+    def post(self, request, upload_id):
+        upload = get_object_or_404(FileUpload, id=upload_id)
+        if not upload.can_resume:
+            messages.error(request, f'Upload {upload.id} cannot be resumed.')
+            return redirect('upload_history')
+
+        upload.status = 'PENDING'
+        upload.save(update_fields=['status'])
+        async_task('pa_bonus.tasks.process_uploaded_file', upload.id, timeout=settings.UPLOAD_TASK_TIMEOUT)
+        messages.success(request, f'Upload {upload.id} is being resumed.')
+        return redirect('upload_history')
+
 class ManagerRewardRequestListView(ManagerGroupRequiredMixin, ListView):
     """
     (Managers Only) Lists the current reward requests in the system.
@@ -656,11 +693,7 @@ class TransactionApprovalView(ManagerGroupRequiredMixin, View):
         available_years = range(today.year - 2, today.year + 1)
         
         # Get month range for filtering
-        start_date = date(selected_year, selected_month, 1)
-        if selected_month == 12:
-            end_date = date(selected_year + 1, 1, 1) - timedelta(days=1)
-        else:
-            end_date = date(selected_year, selected_month + 1, 1) - timedelta(days=1)
+        start_date, end_date = month_range(selected_year, selected_month)
         
         # Get pending transactions for the selected month
         pending_transactions = PointsTransaction.objects.filter(
@@ -696,6 +729,7 @@ class TransactionApprovalView(ManagerGroupRequiredMixin, View):
             'is_approval_month': is_approval_month,
             'start_date': start_date,
             'end_date': end_date,
+            'approval_jobs': TransactionApprovalJob.objects.select_related('requested_by')[:10],
         }
         
         return render(request, self.template_name, context)
@@ -708,87 +742,43 @@ class TransactionApprovalView(ManagerGroupRequiredMixin, View):
         selected_year = int(request.POST.get('year'))
         selected_month = int(request.POST.get('month'))
         
-        # Get month range for filtering
-        start_date = date(selected_year, selected_month, 1)
-        if selected_month == 12:
-            end_date = date(selected_year + 1, 1, 1) - timedelta(days=1)
+        # The transactions are confirmed and the clients notified by a
+        # background job, so the request does not grow with the month
+        job, reused = submit_approval_job(selected_year, selected_month, request.user)
+        if reused:
+            messages.info(
+                request,
+                f"The approval of {selected_month:02d}/{selected_year} is already in progress.",
+            )
         else:
-            end_date = date(selected_year, selected_month + 1, 1) - timedelta(days=1)
-        
-        # Update pending transactions to confirmed
-        pending_transactions = PointsTransaction.objects.filter(
-            status='PENDING',
-            date__gte=start_date,
-            date__lte=end_date
-        )
-        
-        # Count before updating for the message
-        transaction_count = pending_transactions.count()
-        points_total = pending_transactions.aggregate(total=Sum('value'))['total'] or 0
-        
-        # Update the transactions
-        pending_transactions.update(status='CONFIRMED')
-        
-        # Schedule email notifications for each user with confirmed transactions
-        self.schedule_email_notifications(pending_transactions)
-        
-        # Success message
-        messages.success(
-            request, 
-            f"Successfully approved {transaction_count} transactions totaling {points_total} points."
-        )
+            logger.info(f"User {request.user.username} queued approval job {job.id} for {selected_year}-{selected_month:02d}")
+            messages.success(
+                request,
+                f"The approval of {selected_month:02d}/{selected_year} has been queued. "
+                f"Its progress is shown below.",
+            )
         
         # Redirect back to the form
-        return redirect('transaction_approval')
-    
-    def schedule_email_notifications(self, transactions):
-        """
-        Schedule email notifications for users whose transactions were approved.
-        
-        Creates EmailNotification records for each user who had transactions approved.
-        These will be processed by a separate task/process.
-        
-        Args:
-            transactions: QuerySet of approved transactions
-        """
-        # Get unique users who had transactions approved
-        user_ids = transactions.values_list('user_id', flat=True).distinct()
-        
-        # For each user, create a notification
-        for user_id in user_ids:
-            # Get the user's transactions that were just approved
-            user_transactions = transactions.filter(user_id=user_id)
-            user = user_transactions.first().user
-            
-            # Calculate total points
-            total_points = user_transactions.aggregate(total=Sum('value'))['total'] or 0
-            
-            # Create notification message
-            subject = "Your bonus points have been confirmed!"
-            message = f"""
-Dear {user.first_name} {user.last_name},
-
-We are pleased to inform you that your transactions for {user_transactions.first().date.strftime('%B %Y')} 
-have been confirmed, adding {total_points} points to your account.
+        return redirect(f"{reverse('transaction_approval')}?year={selected_year}&month={selected_month}")
 
-Your current point balance is now: {user.get_balance()} points.
 
-You can log in to the Bonus Program portal to view these transactions and explore 
-available rewards.
-
-Thank you for your business!
+class TransactionApprovalJobStatusView(ManagerGroupRequiredMixin, View):
+    """
+    Lightweight JSON status of one approval job, polled by the approval page.
+    """
 
-Best regards,
-The Bonus Program Team
-            """
-            
-            # Create the notification record
-            EmailNotification.objects.create(
-                user=user,
-                subject=subject,
-                message=message,
-                status='PENDING'
-            )
+    def get(self, request, job_id):
+        job = get_object_or_404(TransactionApprovalJob, id=job_id)
+        return JsonResponse({
+            'id': job.id,
+            'status': job.status,
+            'transaction_count': job.transaction_count,
+            'points_total': job.points_total,
+            'user_count': job.user_count,
+            'notifications_sent': job.notifications_sent,
+            'progress': job.progress,
+            'error': job.error_message,
+        })
 
 
 class SMSExportView(ManagerGroupRequiredMixin, View):
@@ -907,6 +897,19 @@ class ClientListView(ManagerGroupRequiredMixin, View):
     on client turnover and points across their contract brands.
     """
     template_name = 'manager/client_list.html'
+    paginate_by = 50
+    
+    # ?sort= values and their ordering; a leading '-' sorts descending
+    SORT_FIELDS = {
+        'name': ('last_name', 'first_name', 'id'),
+        '-name': ('-last_name', '-first_name', '-id'),
+        'turnover': ('turnover', 'id'),
+        '-turnover': ('-turnover', 'id'),
+        'points': ('confirmed_points', 'id'),
+        '-points': ('-confirmed_points', 'id'),
+        'available': ('available_points', 'id'),
+        '-available': ('-available_points', 'id'),
+    }
     
     def get(self, request):
         from django.db.models import Sum, Count, F, Q, Value, DecimalField
@@ -939,13 +942,17 @@ class ClientListView(ManagerGroupRequiredMixin, View):
             date_to = date(year_to, month_to + 1, 1) - timedelta(days=1)
         
         # Base query - get all active users that are not staff
-        clients = User.objects.filter(is_active=True, is_staff=False)
+        clients = User.objects.filter(is_active=True, is_staff=False).select_related('region')
         
         # Apply region filter if specified
         if region_id and region_id != 'all':
             clients = clients.filter(region_id=region_id)
         
-        # Annotate with point data for the period
+        # Annotate with point data for the period, and with the period turnover
+        # across the brands of each client's active contract. The turnover is one
+        # grouped subquery over the monthly rollup (the period is whole months),
+        # so sorting and paginating happen in the database and a page costs the
+        # same however many clients there are.
         clients = clients.annotate(
             confirmed_points=Coalesce(
                 Sum('pointstransaction__value', 
@@ -969,54 +976,42 @@ class ClientListView(ManagerGroupRequiredMixin, View):
                 Sum('pointstransaction__value', 
                     filter=Q(pointstransaction__status='CONFIRMED')),
                 Value(0)
-            )
+            ),
+            active_contract_id=active_contract_id(),
+        ).annotate(
+            turnover=contract_brand_turnover(date_from, date_to),
+            brand_count=contract_brand_count(),
         )
         
+        sort_by = request.GET.get('sort', 'name')
+        if sort_by not in self.SORT_FIELDS:
+            sort_by = 'name'
+        clients = clients.order_by(*self.SORT_FIELDS[sort_by])
+        
         # Get all regions for the filter dropdown
         regions = Region.objects.filter(is_active=True).order_by('name')
         
-        # For each client, get their contract brands turnover
-        client_data = []
-        for client in clients:
-            # Get active contract for further reference. filter().first() rather than
-            # get(), since managers can now add a second contract to an existing
-            # client - this degrades gracefully instead of raising MultipleObjectsReturned
-            # if a client ever ends up with more than one active contract.
-            active_contract = UserContract.objects.filter(
-                user_id=client,
-                is_active=True
-            ).order_by('-contract_date_from').first()
-
-            if active_contract:
-                # Get all brands in this contract
-                contract_brands = [bb.brand_id for bb in active_contract.brandbonuses.all()]
-
-                # Calculate total turnover for the period across contract brands
-                total_turnover = InvoiceBrandTurnover.objects.filter(
-                    invoice__client_number=client.user_number,
-                    invoice__invoice_date__gte=date_from,
-                    invoice__invoice_date__lte=date_to,
-                    invoice__invoice_type='INVOICE',
-                    brand__in=contract_brands
-                ).aggregate(
-                    total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField()))
-                )['total']
-
-                # Append to results with the contract and turnover info
-                client_data.append({
-                    'user': client,
-                    'contract': active_contract,
-                    'turnover': total_turnover,
-                    'brand_count': len(contract_brands)
-                })
-            else:
-                # Client has no active contract
-                client_data.append({
-                    'user': client,
-                    'contract': None,
-                    'turnover': 0,
-                    'brand_count': 0
-                })
+        paginator = Paginator(clients, self.paginate_by)
+        page_obj = paginator.get_page(request.GET.get('page', 1))
+        
+        client_data = [
+            {
+                'user': client,
+                'contract': client.active_contract_id,
+                'turnover': client.turnover,
+                'brand_count': client.brand_count,
+            }
+            for client in page_obj
+        ]
+        
+        # Filters to carry over in the sorting and pagination links
+        filter_query = urlencode({
+            'region': region_id,
+            'year_from': year_from,
+            'month_from': month_from,
+            'year_to': year_to,
+            'month_to': month_to,
+        })
         
         # Calculate date ranges for quick filter buttons
         current_year = datetime.now().year
@@ -1028,6 +1023,9 @@ class ClientListView(ManagerGroupRequiredMixin, View):
         # Prepare context
         context = {
             'clients': client_data,
+            'page_obj': page_obj,
+            'sort_by': sort_by,
+            'filter_query': filter_query,
             'regions': regions,
             'selected_region': region_id,
             'year_from': year_from,
@@ -1107,60 +1105,8 @@ class ClientDetailView(ManagerGroupRequiredMixin, View):
             user_id=client
         ).order_by('-contract_date_from')
 
-        # Get all brands turnover for the selected period
-        all_brands = Brand.objects.all()
-        brand_turnovers = []
-
-        for brand in all_brands:
-            # Get invoice turnover for this brand
-            invoice_turnover = InvoiceBrandTurnover.objects.filter(
-                invoice__client_number=client.user_number,
-                invoice__invoice_date__gte=date_from,
-                invoice__invoice_date__lte=date_to,
-                invoice__invoice_type='INVOICE',
-                brand=brand
-            ).aggregate(
-                total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField()))
-            )['total']
-
-            # Get credit note turnover for this brand (negative)
-            credit_turnover = InvoiceBrandTurnover.objects.filter(
-                invoice__client_number=client.user_number,
-                invoice__invoice_date__gte=date_from,
-                invoice__invoice_date__lte=date_to,
-                invoice__invoice_type='CREDIT_NOTE',
-                brand=brand
-            ).aggregate(
-                total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField()))
-            )['total']
-
-            # Calculate points for this brand in the period
-            points = PointsTransaction.objects.filter(
-                user=client,
-                date__gte=date_from,
-                date__lte=date_to,
-                brand=brand,
-                status='CONFIRMED'
-            ).aggregate(
-                total=Coalesce(Sum('value'), Value(0))
-            )['total']
-
-            # Only include brands with some activity
-            if invoice_turnover > 0 or credit_turnover > 0 or points != 0:
-                # Check if this brand is in the client's contract
-                in_contract = brand in contract_brands
-
-                brand_turnovers.append({
-                    'brand': brand,
-                    'invoice_turnover': invoice_turnover,
-                    'credit_turnover': credit_turnover,
-                    'net_turnover': invoice_turnover - credit_turnover,
-                    'points': points,
-                    'in_contract': in_contract
-                })
-
-        # Sort by net turnover
-        brand_turnovers.sort(key=lambda x: x['net_turnover'], reverse=True)
+        # Turnover and points per brand for the selected period
+        brand_turnovers = brand_turnover_matrix(client, date_from, date_to, contract_brands)
 
         # Get point totals
         point_totals = {
@@ -1408,163 +1354,6 @@ class GoalEvaluationView(ManagerGroupRequiredMixin, View):
     """
     template_name = 'manager/goal_evaluation.html'
     
-    def _calculate_points_cap(self, goal):
-        """
-        Calculate the maximum points cap for the contract period.
-        Base: 20,000 points for 12 months, proportional for other lengths.
-        
-        Args:
-            goal: UserContractGoal instance
-            
-        Returns:
-            int: Maximum points allowed for the contract period
-        """
-        total_days = (goal.goal_period_to - goal.goal_period_from).days
-        # Approximate months (30.44 days per month on average)
-        total_months = total_days / 30.44
-        # 20,000 points for 12 months = ~1,667 points per month
-        return int(total_months * 1667)
-
-    def _get_total_awarded_points(self, goal, exclude_evaluation=None):
-        """
-        Get total points already awarded for this goal across all evaluations.
-        
-        Args:
-            goal: UserContractGoal instance
-            exclude_evaluation: Optional evaluation to exclude from the sum
-            
-        Returns:
-            int: Total points already awarded
-        """
-        from django.db.models import Sum
-        
-        evaluations = goal.evaluations.all()
-        if exclude_evaluation:
-            evaluations = evaluations.exclude(id=exclude_evaluation.id)
-        
-        return evaluations.aggregate(
-            total=Sum('bonus_points')
-        )['total'] or 0
-
-    def _apply_points_cap(self, points, goal, existing_points=0):
-        """
-        Apply the points cap, considering already awarded points.
-        
-        Args:
-            points: Points to be awarded
-            goal: UserContractGoal instance
-            existing_points: Points already awarded
-            
-        Returns:
-            int: The capped points amount that can be awarded
-        """
-        cap = self._calculate_points_cap(goal)
-        total_with_new = existing_points + points
-        
-        if total_with_new > cap:
-            # Can only award up to the cap
-            return max(0, cap - existing_points)
-        return points
-
-    def _determine_evaluation_result(self, goal, start_date, end_date, actual_turnover, targets, is_final):
-        """
-        Determine evaluation type, bonus points, and achievement status.
-        Implements the business logic for different evaluation scenarios with point caps.
-        
-        Business Rules:
-        1. Milestone evaluations: Award points if period target is met
-        2. Final evaluations with recovery: 
-        - First evaluate the final period normally
-        - Then check if full year target is met
-        - If yes, calculate total year points and subtract already awarded
-        3. All points are subject to the proportional annual cap
-        
-        Args:
-            goal: UserContractGoal instance
-            start_date: Period start date
-            end_date: Period end date
-            actual_turnover: Actual turnover achieved
-            targets: Dict with 'goal_value' and 'goal_base' for the period
-            is_final: Whether this is the final evaluation period
-            
-        Returns:
-            tuple: (evaluation_type, bonus_points, is_achieved)
-        """
-        # Get total points already awarded for this goal
-        already_awarded = self._get_total_awarded_points(goal)
-        
-        # Check if this period's target was achieved
-        period_achieved = actual_turnover >= targets['goal_value']
-        
-        if not is_final:
-            # Standard milestone evaluation
-            if period_achieved:
-                # Calculate points: half of the increase from base to goal
-                raw_points = int((targets['goal_value'] - targets['goal_base']) * goal.bonus_percentage)
-                # Apply cap considering already awarded points
-                bonus_points = self._apply_points_cap(raw_points, goal, already_awarded)
-                return 'MILESTONE', max(0, bonus_points), True
-            else:
-                return 'MILESTONE', 0, False
-        
-        # For final evaluation, check recovery scenarios
-        if goal.allow_full_period_recovery:
-            # First, evaluate the final period as a milestone
-            period_points = 0
-            if period_achieved:
-                raw_points = int((float(actual_turnover) - targets['goal_base']) * goal.bonus_percentage)
-                period_points = self._apply_points_cap(raw_points, goal, already_awarded)
-            
-            # Get all previous evaluations to calculate total milestone points
-            previous_evals = goal.evaluations.filter(
-                period_end__lt=end_date
-            ).order_by('period_end')
-            
-            # Calculate total points from all previous milestones
-            previous_milestone_points = previous_evals.aggregate(
-                total=Sum('bonus_points')
-            )['total'] or 0
-            
-            # Check if we should attempt recovery
-            # Get full period actual turnover
-            full_actual = calculate_turnover_for_goal(
-                goal.user_contract.user_id,
-                goal.brands.all(),
-                goal.goal_period_from,
-                goal.goal_period_to
-            )
-            
-            if full_actual >= goal.goal_value:
-                # Recovery scenario - calculate total points for the year
-                # Points = half of (actual turnover - base)
-                total_year_points = int(float((full_actual - goal.goal_base)) * goal.bonus_percentage)
-                
-                # Apply the annual cap
-                capped_year_points = min(total_year_points, self._calculate_points_cap(goal))
-                
-                # Calculate how many points we need to add (recovery points)
-                # This is the difference between what they should get for the year 
-                # and what they already got from milestones
-                recovery_points = capped_year_points - previous_milestone_points
-                
-                if recovery_points > period_points:
-                    # Recovery gives more points than just the final period
-                    return 'RECOVERY', max(0, recovery_points), True
-                else:
-                    # Final period evaluation gives more or equal points
-                    return 'FINAL', max(0, period_points), period_achieved
-            else:
-                # No recovery possible, just evaluate the final period
-                return 'FINAL', max(0, period_points), period_achieved
-        else:
-            # Simple evaluation without recovery option
-            if period_achieved:
-                raw_points = int((float(actual_turnover) - targets['goal_base']) * goal.bonus_percentage)
-                bonus_points = self._apply_points_cap(raw_points, goal, already_awarded)
-                return 'FINAL', max(0, bonus_points), True
-            else:
-                return 'FINAL', 0, False
-
     def get(self, request):
         """
         Display pending evaluations or handle export request.
@@ -1577,91 +1366,71 @@ class GoalEvaluationView(ManagerGroupRequiredMixin, View):
         evaluation_type = request.GET.get('type', 'pending')
         region_id = request.GET.get('region', '')
         
-        # Base query - get goals with evaluation periods that have ended
-        goals_query = UserContractGoal.objects.filter(
-            goal_period_from__lte=today
-        ).select_related('user_contract__user_id')
+        # Ended evaluation periods, from the candidate index
+        candidates = GoalEvaluationCandidate.objects.filter(
+            period_end__lte=today
+        ).select_related('goal__user_contract__user_id')
+        
+        if evaluation_type == 'pending':
+            candidates = candidates.filter(status='PENDING')
+        elif evaluation_type == 'evaluated':
+            candidates = candidates.filter(status='EVALUATED')
         
         # Apply region filter if specified
         if region_id and region_id != 'all':
-            goals_query = goals_query.filter(
-                user_contract__user_id__region_id=region_id
+            candidates = candidates.filter(
+                goal__user_contract__user_id__region_id=region_id
             )
         
-        # Process each goal to find pending evaluations
+        candidates = list(candidates.prefetch_related('goal__brands', 'goal__evaluations'))
+        
+        # Evaluate every period in memory; the index already has the period turnovers
+        evaluator = GoalEvaluator(
+            [(candidate.goal, candidate.period_start, candidate.period_end) for candidate in candidates],
+            period_turnovers={
+                (candidate.goal_id, candidate.period_start, candidate.period_end): candidate.actual_turnover
+                for candidate in candidates
+            },
+        )
+        
         pending_evaluations = []
         
-        for goal in goals_query:
-            periods = goal.get_evaluation_periods()
+        for candidate in candidates:
+            goal = candidate.goal
+            start_date, end_date = candidate.period_start, candidate.period_end
+            existing_evaluation = next(
+                (
+                    evaluation for evaluation in goal.evaluations.all()
+                    if (evaluation.period_start, evaluation.period_end) == (start_date, end_date)
+                ),
+                None,
+            )
+            result = evaluator.evaluate(goal, start_date, end_date)
             
-            for start_date, end_date, is_final in periods:
-                # Skip future periods
-                if end_date > today:
-                    continue
-                
-                # Check if already evaluated
-                existing_evaluation = goal.evaluations.filter(
-                    period_start=start_date,
-                    period_end=end_date
-                ).first()
-                
-                if evaluation_type == 'pending' and existing_evaluation:
-                    continue
-                elif evaluation_type == 'evaluated' and not existing_evaluation:
-                    continue
-                
-                # Calculate turnover and targets
-                targets = goal.get_period_targets(start_date, end_date)
-                actual_turnover = calculate_turnover_for_goal(
-                    goal.user_contract.user_id,
-                    goal.brands.all(),
-                    start_date,
-                    end_date
-                )
-                
-                # Calculate full year turnover for diagnostics
-                full_year_actual = calculate_turnover_for_goal(
-                    goal.user_contract.user_id,
-                    goal.brands.all(),
-                    goal.goal_period_from,
-                    goal.goal_period_to
-                )
-                
-                # Get already awarded points
-                already_awarded = self._get_total_awarded_points(goal)
-                
-                # Calculate points cap
-                points_cap = self._calculate_points_cap(goal)
-                
-                # Determine evaluation type and potential bonus
-                eval_type, bonus_points, is_achieved = self._determine_evaluation_result(
-                    goal, start_date, end_date, actual_turnover, targets, is_final
-                )
-                
-                pending_evaluations.append({
-                    'goal': goal,
-                    'user': goal.user_contract.user_id,
-                    'period_start': start_date,
-                    'period_end': end_date,
-                    'is_final': is_final,
-                    'actual_turnover': actual_turnover,
-                    'target_turnover': targets['goal_value'],
-                    'baseline_turnover': targets['goal_base'],
-                    'evaluation_type': eval_type,
-                    'bonus_points': bonus_points,
-                    'is_achieved': is_achieved,
-                    'existing_evaluation': existing_evaluation,
-                    'brands': list(goal.brands.all()),
-                    # Additional diagnostic fields for export
-                    'full_year_actual': full_year_actual,
-                    'full_year_goal': goal.goal_value,
-                    'full_year_base': goal.goal_base,
-                    'full_year_met': full_year_actual >= goal.goal_value,
-                    'points_cap': points_cap,
-                    'already_awarded': already_awarded,
-                    'goal_period_from': goal.goal_period_from,
-                    'goal_period_to': goal.goal_period_to,
-                })
+            pending_evaluations.append({
+                'goal': goal,
+                'user': goal.user_contract.user_id,
+                'period_start': start_date,
+                'period_end': end_date,
+                'is_final': result['is_final'],
+                'actual_turnover': result['actual_turnover'],
+                'target_turnover': result['targets']['goal_value'],
+                'baseline_turnover': result['targets']['goal_base'],
+                'evaluation_type': result['evaluation_type'],
+                'bonus_points': result['bonus_points'],
+                'is_achieved': result['is_achieved'],
+                'existing_evaluation': existing_evaluation,
+                'brands': list(goal.brands.all()),
+                # Additional diagnostic fields for export
+                'full_year_actual': result['full_year_actual'],
+                'full_year_goal': goal.goal_value,
+                'full_year_base': goal.goal_base,
+                'full_year_met': result['full_year_actual'] >= goal.goal_value,
+                'points_cap': result['points_cap'],
+                'already_awarded': result['already_awarded'],
+                'goal_period_from': goal.goal_period_from,
+                'goal_period_to': goal.goal_period_to,
+            })
         
         # Check if this is an export request
         if request.GET.get('export') == 'preview':
@@ -1812,68 +1581,29 @@ class GoalEvaluationView(ManagerGroupRequiredMixin, View):
         """Process selected goal evaluations and create bonus transactions."""
         evaluations_to_process = request.POST.getlist('evaluate')
         
-        success_count = 0
-        total_points = 0
-        
+        # Parse the evaluation keys (format: "goal_id:start_date:end_date")
+        selected = []
         for eval_key in evaluations_to_process:
-            # Parse the evaluation key (format: "goal_id:start_date:end_date")
             try:
                 goal_id, start_str, end_str = eval_key.split(':')
-                goal = UserContractGoal.objects.get(id=goal_id)
-                start_date = datetime.strptime(start_str, '%Y-%m-%d').date()
-                end_date = datetime.strptime(end_str, '%Y-%m-%d').date()
-            except (ValueError, UserContractGoal.DoesNotExist):
-                continue
-            
-            # Check if already evaluated
-            if goal.evaluations.filter(period_start=start_date, period_end=end_date).exists():
+                selected.append((
+                    int(goal_id),
+                    datetime.strptime(start_str, '%Y-%m-%d').date(),
+                    datetime.strptime(end_str, '%Y-%m-%d').date(),
+                ))
+            except ValueError:
                 continue
-            
-            # Calculate evaluation details
-            targets = goal.get_period_targets(start_date, end_date)
-            actual_turnover = calculate_turnover_for_goal(
-                goal.user_contract.user_id,
-                goal.brands.all(),
-                start_date,
-                end_date
-            )
-            
-            eval_type, bonus_points, is_achieved = self._determine_evaluation_result(
-                goal, start_date, end_date, actual_turnover, targets, 
-                end_date == goal.goal_period_to
-            )
-            
-            # Create evaluation record
-            evaluation = GoalEvaluation.objects.create(
-                goal=goal,
-                evaluation_date=timezone.now().date(),
-                period_start=start_date,
-                period_end=end_date,
-                actual_turnover=actual_turnover,
-                target_turnover=targets['goal_value'],
-                baseline_turnover=targets['goal_base'],
-                is_achieved=is_achieved,
-                bonus_points=bonus_points,
-                evaluation_type=eval_type,
-                evaluated_by=request.user
-            )
-            
-            # Create points transaction if bonus points awarded
-            if bonus_points > 0:
-                transaction = PointsTransaction.objects.create(
-                    user=goal.user_contract.user_id,
-                    value=bonus_points,
-                    date=end_date,
-                    description=f"Extra bonus za období od {start_date} do {end_date}",
-                    type='EXTRA_POINTS',
-                    status='CONFIRMED'
-                )
-                evaluation.points_transaction = transaction
-                evaluation.save()
-                
-                total_points += bonus_points
-            
-            success_count += 1
+        
+        goals = UserContractGoal.objects.select_related('user_contract__user_id').prefetch_related(
+            'brands', 'evaluations'
+        ).in_bulk({goal_id for goal_id, _, _ in selected})
+        
+        evaluations = award_goal_evaluations(
+            [(goals[goal_id], start_date, end_date) for goal_id, start_date, end_date in selected if goal_id in goals],
+            evaluated_by=request.user,
+        )
+        success_count = len(evaluations)
+        total_points = sum(evaluation.bonus_points for evaluation in evaluations)
         
         messages.success(
             request,
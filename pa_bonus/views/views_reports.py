@@ -1,25 +1,36 @@
 """
 Views for the Reports Hub.
 
-This module provides two views:
-    1. ReportsHubView -- renders the hub page listing all available reports.
-    2. ReportDownloadView -- handles the actual report generation and file download.
+This module provides these views:
+    1. ReportsHubView -- renders the hub page listing all available reports and
+       the recent report jobs.
+    2. ReportDownloadView -- queues a report for background generation.
+    3. ReportJobStatusView -- JSON status of one job, polled by the hub page.
+    4. ReportJobFileView -- downloads a finished job's file.
 
 The design keeps the views thin. All data-gathering and Excel logic lives in
-pa_bonus/reports.py, so the views are purely about HTTP request/response handling.
+pa_bonus/reports.py and the generation itself runs in a django-q task
+(pa_bonus.tasks.generate_report_task), so the views are purely about HTTP
+request/response handling.
 """
 
 import logging
+import os
 
-from django.shortcuts import render, redirect
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.views import View
 
+from pa_bonus.models import ReportJob
 from pa_bonus.utilities import ManagerGroupRequiredMixin
-from pa_bonus.reports import get_all_reports, get_report_by_id
+from pa_bonus.reports import get_all_reports, get_report_by_id, submit_report_job
 
 logger = logging.getLogger(__name__)
 
+# Number of recent jobs listed on the hub page
+RECENT_JOBS = 20
+
 
 class ReportsHubView(ManagerGroupRequiredMixin, View):
     """
@@ -35,6 +46,11 @@ class ReportsHubView(ManagerGroupRequiredMixin, View):
 
     def get(self, request):
         reports = get_all_reports()
+        titles = {report.report_id: report.title for report in reports}
+
+        jobs = list(ReportJob.objects.select_related("requested_by")[:RECENT_JOBS])
+        for job in jobs:
+            job.title = titles.get(job.report_id, job.report_id)
 
         context = {
             "reports": [
@@ -45,6 +61,7 @@ class ReportsHubView(ManagerGroupRequiredMixin, View):
                 }
                 for report in reports
             ],
+            "jobs": jobs,
         }
 
         return render(request, self.template_name, context)
@@ -52,12 +69,14 @@ class ReportsHubView(ManagerGroupRequiredMixin, View):
 
 class ReportDownloadView(ManagerGroupRequiredMixin, View):
     """
-    Generates and streams a report as an Excel file download.
+    Queues a report for generation in the background.
 
     Expects a POST request with a ``report_id`` parameter.  We use POST
-    rather than GET to avoid accidental re-downloads on browser refresh
+    rather than GET to avoid accidental re-queuing on browser refresh
     and because report generation can be an expensive operation that
-    should not be triggered by crawlers or prefetch.
+    should not be triggered by crawlers or prefetch.  The file is built by
+    a django-q task, outside the request, and appears on the hub page when
+    ready; an identical recent request reuses the existing job.
     """
 
     def post(self, request):
@@ -68,17 +87,57 @@ class ReportDownloadView(ManagerGroupRequiredMixin, View):
             messages.error(request, f"Unknown report: {report_id}")
             return redirect("reports_hub")
 
-        try:
-            report = report_class()
+        job, reused = submit_report_job(report_id, request.user)
+        if reused:
+            logger.info(
+                "User %s reusing report job %s: %s", request.user.username, job.id, report_id
+            )
+            if job.status == "COMPLETED":
+                messages.info(request, f"{report_class.title} was generated recently and is ready below.")
+            else:
+                messages.info(request, f"{report_class.title} is already being generated.")
+        else:
             logger.info(
-                "User %s generating report: %s", request.user.username, report_id
+                "User %s queued report job %s: %s", request.user.username, job.id, report_id
             )
-            return report.generate_response()
-        except Exception:
-            logger.exception("Error generating report %s", report_id)
-            messages.error(
+            messages.success(
                 request,
-                "An error occurred while generating the report. "
-                "Please try again or contact the administrator.",
+                f"{report_class.title} is being generated. It will appear below when it is ready.",
             )
-            return redirect("reports_hub")
+        return redirect("reports_hub")
+
+
+class ReportJobStatusView(ManagerGroupRequiredMixin, View):
+    """
+    Lightweight JSON status of one report job, polled by the hub page.
+    """
+
+    def get(self, request, job_id):
+        job = get_object_or_404(ReportJob, id=job_id)
+        return JsonResponse({
+            "id": job.id,
+            "status": job.status,
+            "row_count": job.row_count,
+            "error": job.error_message,
+        })
+
+
+class ReportJobFileView(ManagerGroupRequiredMixin, View):
+    """
+    Downloads the file of a completed report job.
+    """
+
+    def get(self, request, job_id):
+        job = get_object_or_404(ReportJob, id=job_id, status="COMPLETED")
+        if not job.file:
+            raise Http404("Report file not found")
+        try:
+            handle = job.file.open("rb")
+        except FileNotFoundError:
+            raise Http404("Report file not found")
+        return FileResponse(
+            handle,
+            as_attachment=True,
+            filename=os.path.basename(job.file.name),
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
@@ -25,9 +25,11 @@ from pa_bonus.models import (
     Reward, RewardRequest, RewardRequestItem,
 )
 from pa_bonus.utilities import SalesRepRequiredMixin
+from pa_bonus.services.cache import cached, region_scope
 from pa_bonus.services.points import (
     allocate_debit, expiration_schedule, clients_expiring_summary,
 )
+from pa_bonus.services.turnover import brand_turnover_matrix
 
 from datetime import date, timedelta, datetime
 
@@ -72,8 +74,18 @@ class SalesRepDashboardView(SalesRepRequiredMixin, View):
     template_name = 'sales_rep/dashboard.html'
 
     def get(self, request):
-        regions = get_rep_regions(request.user)
-        clients = get_rep_clients(request.user)
+        regions = list(get_rep_regions(request.user))
+        # The figures depend on the regions only, so reps of the same regions share them
+        context = cached(
+            'salesrep_dashboard', [region_scope(region_id) for region_id in sorted(region.id for region in regions)],
+            lambda: self.get_stats(request.user),
+        )
+        context['regions'] = regions
+        return render(request, self.template_name, context)
+
+    def get_stats(self, user):
+        """The figures of the rep's regions, cached by get()."""
+        clients = get_rep_clients(user)
 
         total_clients = clients.count()
 
@@ -101,15 +113,13 @@ class SalesRepDashboardView(SalesRepRequiredMixin, View):
             ),
         ).filter(available_points__gt=0).order_by('-available_points')[:10]
 
-        context = {
-            'regions': regions,
+        return {
             'total_clients': total_clients,
             'clients_with_contracts': clients_with_contracts,
             'total_confirmed_points': total_confirmed_points,
             'pending_requests': pending_requests,
-            'top_clients': top_clients,
+            'top_clients': list(top_clients),
         }
-        return render(request, self.template_name, context)
 
 
 # ---------------------------------------------------------------------------
@@ -230,41 +240,7 @@ class SalesRepClientDetailView(SalesRepRequiredMixin, View):
             active_contract = None
             contract_brands = []
 
-        all_brands = Brand.objects.all()
-        brand_turnovers = []
-        for brand in all_brands:
-            inv = InvoiceBrandTurnover.objects.filter(
-                invoice__client_number=client.user_number,
-                invoice__invoice_date__gte=date_from,
-                invoice__invoice_date__lte=date_to,
-                invoice__invoice_type='INVOICE',
-                brand=brand,
-            ).aggregate(total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField())))['total']
-
-            cn = InvoiceBrandTurnover.objects.filter(
-                invoice__client_number=client.user_number,
-                invoice__invoice_date__gte=date_from,
-                invoice__invoice_date__lte=date_to,
-                invoice__invoice_type='CREDIT_NOTE',
-                brand=brand,
-            ).aggregate(total=Coalesce(Sum('amount'), Value(0, output_field=DecimalField())))['total']
-
-            pts = PointsTransaction.objects.filter(
-                user=client, date__gte=date_from, date__lte=date_to,
-                brand=brand, status='CONFIRMED',
-            ).aggregate(total=Coalesce(Sum('value'), Value(0), output_field=DecimalField()))['total']
-
-            if inv > 0 or cn > 0 or pts != 0:
-                brand_turnovers.append({
-                    'brand': brand,
-                    'invoice_turnover': inv,
-                    'credit_turnover': cn,
-                    'net_turnover': inv - cn,
-                    'points': pts,
-                    'in_contract': brand in contract_brands,
-                })
-
-        brand_turnovers.sort(key=lambda x: x['net_turnover'], reverse=True)
+        brand_turnovers = brand_turnover_matrix(client, date_from, date_to, contract_brands)
 
         point_totals = {
             'available': client.get_balance(),
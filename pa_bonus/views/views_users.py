@@ -2,13 +2,13 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.views.generic import TemplateView, ListView, DetailView, View
-from django.db.models import Q
 from django.db import transaction
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from pa_bonus.models import (PointsTransaction, UserContract, Reward, RewardRequest, RewardRequestItem,
                              UserContractGoal, InvoiceBrandTurnover)
-from pa_bonus.services.points import allocate_debit, expiration_schedule, expiring_points_total
+from pa_bonus.services.points import allocate_debit, expiration_schedule
+from pa_bonus.services.cache import cached_balance, cached_expiring_total, cached_reward_catalogue
 from pa_bonus.utilities import calculate_turnover_for_goal
 import datetime
 
@@ -81,13 +81,11 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             context['brand_bonuses'] = []
             context['active_goal'] = None
         
-        # Calculate current point total
-        total_points = user.get_balance()
-        context['total_points'] = total_points
-
-        # Points at risk of expiring within the next 3 months (for the dashboard
-        # warning and the link to the full expiration overview).
-        context['expiring_points'] = expiring_points_total(user, as_of=today)
+        # Current point total, from the cached materialised balance, and the
+        # points at risk of expiring within the next 3 months as of today (for
+        # the dashboard warning and the link to the full expiration overview).
+        context['total_points'] = cached_balance(user)['points']
+        context['expiring_points'] = cached_expiring_total(user, as_of=today)
 
         return context
 
@@ -146,7 +144,7 @@ class PointExpirationView(LoginRequiredMixin, TemplateView):
         today = timezone.now().date()
 
         context['schedule'] = expiration_schedule(user)
-        context['expiring_points'] = expiring_points_total(user, as_of=today)
+        context['expiring_points'] = cached_expiring_total(user, as_of=today)
         return context
 
 class RewardsView(LoginRequiredMixin, View):
@@ -166,18 +164,13 @@ class RewardsView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         user = request.user
 
-        # Get user's brands
-        user_contracts = UserContract.objects.filter(user_id = user, is_active = True)
-        user_brands = set()
-        for contract in user_contracts:
-            for bonus in contract.brandbonuses.all():
-                user_brands.add(bonus.brand_id)
+        # Rewards of the user's brands and of no brand; shared with the other
+        # clients of the same brands
+        available_rewards = cached_reward_catalogue(user)
 
-        # Get available rewards
-        available_rewards = Reward.objects.filter(is_active=True).filter(Q(brand__in=user_brands) | Q(brand__isnull=True)).distinct().order_by('-point_cost')
-        
-        # Get user's point balance
-        total_points = user.get_balance()
+        # Get user's point balance (the order itself is checked against the
+        # stored balance in post())
+        total_points = cached_balance(user)['points']
 
         context = {
             'rewards': available_rewards,